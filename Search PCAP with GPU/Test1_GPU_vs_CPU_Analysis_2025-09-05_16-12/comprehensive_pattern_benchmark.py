@@ -25,6 +25,7 @@ from pathlib import Path
 from typing import List, Tuple, Optional, Dict, Any
 from dataclasses import dataclass, asdict
 from colorama import init, Fore, Style
+import numpy as np
 import pandas as pd
 
 # Initialize colorama
@@ -34,8 +35,9 @@ init(autoreset=True)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import our modules
-from pcap_gpu_scanner import PCAPScanner, TCPReassembler, FlowKey
-from scapy.all import rdpcap, IP, TCP, UDP
+from pcap_gpu_scanner import PCAPScanner
+from aho_corasick import AhoCorasickDFA
+from payload_extraction import PayloadBatch, extract_payloads
 
 # Configure logging
 logging.basicConfig(
@@ -51,7 +53,7 @@ logger = logging.getLogger(__name__)
 # Global timeout flag
 timeout_reached = False
 
-def run_gpu_with_timeout(gpu_scanner, payloads, flow_ids, timeout_seconds=180):
+def run_gpu_with_timeout(gpu_scanner, payloads, timeout_seconds=180):
     """Run GPU processing with a timeout using threading"""
     global timeout_reached
     
@@ -59,7 +61,7 @@ def run_gpu_with_timeout(gpu_scanner, payloads, flow_ids, timeout_seconds=180):
     
     def gpu_worker():
         try:
-            matches = gpu_scanner.gpu_scanner.scan_payloads(payloads, flow_ids)
+            matches = gpu_scanner.gpu_scanner.scan_payloads(payloads)
             result_container['matches'] = matches
             result_container['completed'] = True
         except Exception as e:
@@ -186,54 +188,39 @@ class ComprehensivePatternBenchmark:
         
         return scenarios
     
-    def _extract_payloads_unified(self, pcap_file: str) -> Tuple[List[bytes], List[str], int, int, int]:
-        """Extract payloads using unified TCP reassembly (same for both CPU and GPU)"""
-        print(f"{Fore.BLUE}📖 Reading PCAP file: {Path(pcap_file).name}{Style.RESET_ALL}")
+    def _extract_payloads_unified(self, pcap_file: str) -> Tuple[Optional[PayloadBatch], int, int, int]:
+        """Extract payloads using unified TCP reassembly (same for both CPU and GPU)
+        
+        Payloads are reassembled stream chunks; the first carry_lengths[i] bytes of
+        chunk i repeat the end of its flow's previous chunk. The carry-over is sized
+        for the longest pattern of any scenario, so one extraction serves them all.
+        Headers are decoded from the raw capture bytes, without scapy.
+        """
+        print(f"{Fore.BLUE}📖 Reading PCAP file and performing TCP reassembly: {Path(pcap_file).name}{Style.RESET_ALL}")
         start_time = time.time()
         
         try:
-            packets = rdpcap(pcap_file)
-            read_time = time.time() - start_time
-            
-            print(f"{Fore.BLUE}🔧 Performing TCP reassembly...{Style.RESET_ALL}")
-            reassembly_start = time.time()
-            
             # Use unified TCP reassembly logic
-            reassembler = TCPReassembler()
-            payloads = []
-            flow_ids = []
-            total_bytes = 0
-            packet_count = 0
-            
-            for packet in packets:
-                if packet.haslayer(IP) and packet.haslayer(TCP):
-                    packet_count += 1
-                    
-                    # Add packet to reassembler
-                    result = reassembler.add_packet(packet)
-                    if result:
-                        flow_key, reassembled_payload, timestamp = result
-                        payloads.append(reassembled_payload)
-                        flow_ids.append(f"{flow_key.src_ip}:{flow_key.src_port}-{flow_key.dst_ip}:{flow_key.dst_port}")
-                        total_bytes += len(reassembled_payload)
-            
-            reassembly_time = time.time() - reassembly_start
+            max_pattern_len = max(len(p.encode()) for scenario in self.test_scenarios for p in scenario['patterns'])
+            payloads = extract_payloads(pcap_file, max_pattern_len, include_udp=False)
+            total_bytes = payloads.scanned_bytes
+            reassembly_time = time.time() - start_time
             
             # Calculate average packet size
-            avg_packet_size = total_bytes // len(payloads) if payloads else 0
+            avg_packet_size = total_bytes // len(payloads) if len(payloads) else 0
             
             print(f"✓ Extracted {len(payloads):,} payloads ({total_bytes:,} bytes)")
-            print(f"✓ Packet count: {packet_count:,}, Avg packet size: {avg_packet_size:,} bytes")
-            print(f"✓ Read time: {read_time:.3f}s, Reassembly time: {reassembly_time:.3f}s")
+            print(f"✓ Packet count: {payloads.packet_count:,}, Avg packet size: {avg_packet_size:,} bytes")
+            print(f"✓ Read + reassembly time: {reassembly_time:.3f}s")
             
-            return payloads, flow_ids, total_bytes, len(payloads), avg_packet_size
+            return payloads, total_bytes, len(payloads), avg_packet_size
             
         except Exception as e:
             print(f"{Fore.RED}❌ Error reading PCAP: {e}{Style.RESET_ALL}")
-            return [], [], 0, 0, 0
+            return None, 0, 0, 0
     
-    def _run_cpu_benchmark(self, payloads: List[bytes], patterns: List[str]) -> Tuple[int, float, str]:
-        """Run CPU-only pattern matching benchmark"""
+    def _run_cpu_benchmark(self, payloads: PayloadBatch, patterns: List[str]) -> Tuple[int, float, str]:
+        """Run CPU-only pattern matching benchmark; matches inside a chunk's carry-over are skipped"""
         print(f"{Fore.GREEN}🖥️  Running CPU benchmark...{Style.RESET_ALL}")
         
         start_time = time.time()
@@ -246,19 +233,20 @@ class ComprehensivePatternBenchmark:
             pattern = pattern_bytes[0]
             bad_char_table = self._build_bad_char_table(pattern)
             
-            for payload in payloads:
-                if self._boyer_moore_horspool_search(payload, pattern, bad_char_table):
+            for payload, carry_len in zip(payloads[:], payloads.carry_lengths.tolist()):
+                # A new match must end past the carry-over
+                if self._boyer_moore_horspool_search(payload, pattern, bad_char_table,
+                                                     max(0, carry_len - len(pattern) + 1)):
                     matches += 1
             
             algorithm = "Boyer-Moore-Horspool"
         else:
-            # Multiple patterns: Use Aho-Corasick
-            matches = 0
-            aho_corasick = self._build_aho_corasick_automaton(pattern_bytes)
-            
-            for payload in payloads:
-                payload_matches = self._aho_corasick_search(payload, aho_corasick)
-                matches += len(payload_matches)
+            # Multiple patterns: dense Aho-Corasick DFA, all payloads scanned in one batch
+            automaton = AhoCorasickDFA(pattern_bytes)
+            packet_ids, match_offsets, pattern_ids = automaton.scan(payloads.buffer, payloads.offsets,
+                                                                   payloads.lengths.astype(np.int64))
+            carry = payloads.carry_lengths.astype(np.int64)
+            matches = int(np.count_nonzero(match_offsets + automaton.pattern_lengths[pattern_ids] > carry[packet_ids]))
             
             algorithm = "Aho-Corasick"
         
@@ -277,8 +265,9 @@ class ComprehensivePatternBenchmark:
         
         return table
     
-    def _boyer_moore_horspool_search(self, text: bytes, pattern: bytes, bad_char_table: Dict[int, int]) -> bool:
-        """Boyer-Moore-Horspool string search"""
+    def _boyer_moore_horspool_search(self, text: bytes, pattern: bytes, bad_char_table: Dict[int, int],
+                                     start: int = 0) -> bool:
+        """Boyer-Moore-Horspool string search for a match at or after `start`"""
         text_len = len(text)
         pattern_len = len(pattern)
         
@@ -287,7 +276,7 @@ class ComprehensivePatternBenchmark:
         if pattern_len > text_len:
             return False
         
-        i = 0
+        i = start
         while i <= text_len - pattern_len:
             j = pattern_len - 1
             
@@ -305,76 +294,7 @@ class ComprehensivePatternBenchmark:
         
         return False
     
-    def _build_aho_corasick_automaton(self, patterns: List[bytes]) -> Tuple[Dict[int, Dict[int, int]], Dict[int, List[int]], Dict[int, int]]:
-        """Build Aho-Corasick automaton"""
-        # Build trie
-        trie = {0: {}}  # state -> {char -> next_state}
-        output = {0: []}  # state -> [pattern_indices]
-        state_count = 1
-        
-        # Add patterns to trie
-        for pattern_idx, pattern in enumerate(patterns):
-            current_state = 0
-            for char in pattern:
-                if char not in trie[current_state]:
-                    trie[current_state][char] = state_count
-                    trie[state_count] = {}
-                    output[state_count] = []
-                    state_count += 1
-                current_state = trie[current_state][char]
-            output[current_state].append(pattern_idx)
-        
-        # Build failure links using BFS
-        failure = {0: 0}  # state -> failure_state
-        queue = []
-        
-        # Initialize queue with children of root
-        for char, next_state in trie[0].items():
-            failure[next_state] = 0
-            queue.append(next_state)
-        
-        # Process queue
-        while queue:
-            current_state = queue.pop(0)
-            for char, next_state in trie[current_state].items():
-                queue.append(next_state)
-                
-                # Find failure state
-                fail_state = failure[current_state]
-                while fail_state != 0 and char not in trie[fail_state]:
-                    fail_state = failure[fail_state]
-                
-                failure[next_state] = trie[fail_state].get(char, 0) if fail_state != 0 else 0
-                
-                # Merge outputs
-                output[next_state].extend(output[failure[next_state]])
-        
-        return trie, output, failure
-    
-    def _aho_corasick_search(self, text: bytes, automaton: Tuple[Dict[int, Dict[int, int]], Dict[int, List[int]], Dict[int, int]]) -> List[int]:
-        """Search using Aho-Corasick automaton"""
-        trie, output, failure = automaton
-        matches = []
-        current_state = 0
-        
-        for i, char in enumerate(text):
-            # Follow failure links until we find a valid transition
-            while current_state != 0 and char not in trie[current_state]:
-                current_state = failure[current_state]
-            
-            # Move to next state
-            if char in trie[current_state]:
-                current_state = trie[current_state][char]
-            else:
-                current_state = 0
-            
-            # Collect matches
-            for pattern_idx in output[current_state]:
-                matches.append(i)
-        
-        return matches
-    
-    def _run_gpu_benchmark(self, payloads: List[bytes], flow_ids: List[str], patterns: List[str]) -> Tuple[int, float, str, int, int]:
+    def _run_gpu_benchmark(self, payloads: PayloadBatch, patterns: List[str]) -> Tuple[int, float, str, int, int]:
         """Run GPU-accelerated pattern matching benchmark"""
         print(f"{Fore.MAGENTA}🚀 Running GPU benchmark...{Style.RESET_ALL}")
         
@@ -383,7 +303,7 @@ class ComprehensivePatternBenchmark:
             gpu_scanner = PCAPScanner(patterns, use_regex=False)
             
             # Run GPU processing with timeout using multiprocessing
-            gpu_matches, gpu_time, status = run_gpu_with_timeout(gpu_scanner, payloads, flow_ids, timeout_seconds=180)
+            gpu_matches, gpu_time, status = run_gpu_with_timeout(gpu_scanner, payloads, timeout_seconds=180)
             
             # Determine algorithm used based on pattern count
             if len(patterns) == 1:
@@ -431,9 +351,9 @@ class ComprehensivePatternBenchmark:
             print(f"   Patterns: {scenario['pattern_count']} ({', '.join(scenario['patterns'])})")
             
             # Extract payloads once
-            payloads, flow_ids, total_bytes, payload_count, avg_packet_size = self._extract_payloads_unified(scenario['pcap_file'])
+            payloads, total_bytes, payload_count, avg_packet_size = self._extract_payloads_unified(scenario['pcap_file'])
             
-            if not payloads:
+            if not payload_count:
                 print(f"{Fore.RED}❌ No payloads extracted{Style.RESET_ALL}")
                 return None
             
@@ -444,7 +364,7 @@ class ComprehensivePatternBenchmark:
             
             # Run GPU benchmark
             gpu_matches, gpu_time, gpu_algorithm, batch_count, kernel_launches = self._run_gpu_benchmark(
-                payloads, flow_ids, scenario['patterns']
+                payloads, scenario['patterns']
             )
             
             # Calculate metrics
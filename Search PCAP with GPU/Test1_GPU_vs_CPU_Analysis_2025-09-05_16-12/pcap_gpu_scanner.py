@@ -7,31 +7,38 @@ for pattern matching. It performs TCP stream reassembly on CPU and then uses GPU
 for massively parallel string/regex search.
 
 Key Features:
+- Vectorized header decoding from the raw capture bytes (no per-packet scapy objects)
 - TCP stream reassembly for cross-packet pattern detection
 - GPU-accelerated multi-pattern matching using CuPy
 - Efficient batching and memory management
 - Performance monitoring and benchmarking
-- Support for both exact string and regex patterns
+- Support for both exact string and regex patterns (regexes are prefiltered by their
+  required literal factors, see regex_search.py)
 """
 
 import os
+import re
 import sys
 import time
 import argparse
 import logging
-from collections import defaultdict, deque
-from typing import List, Dict, Tuple, Optional, Set, Any
+from typing import List
 from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from scapy.all import rdpcap, IP, TCP, UDP
 from tqdm import tqdm
 import psutil
 import matplotlib.pyplot as plt
 from colorama import init, Fore, Style
 
+# Shared match store and payload extraction live in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from match_store import MatchStore
+from payload_extraction import PayloadBatch, extract_payloads
+from regex_search import RegexSet, stream_matches
+
 # Initialize colorama for colored output
 init(autoreset=True)
 
@@ -89,38 +96,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class FlowKey:
-    """Represents a network flow (5-tuple)"""
-    src_ip: str
-    dst_ip: str
-    src_port: int
-    dst_port: int
-    protocol: str
-    
-    def __hash__(self):
-        return hash((self.src_ip, self.dst_ip, self.src_port, self.dst_port, self.protocol))
-    
-    def __eq__(self, other):
-        return (self.src_ip == other.src_ip and 
-                self.dst_ip == other.dst_ip and
-                self.src_port == other.src_port and
-                self.dst_port == other.dst_port and
-                self.protocol == other.protocol)
-
-
-@dataclass
-class MatchResult:
-    """Represents a pattern match found in the PCAP"""
-    flow_id: str
-    pattern: str
-    offset: int
-    packet_timestamp: float
-    flow_start: int
-    flow_end: int
-    match_context: str  # Surrounding bytes for context
-
-
 @dataclass
 class PerformanceStats:
     """Performance statistics for the scanner"""
@@ -136,71 +111,6 @@ class PerformanceStats:
     patterns_found: int
 
 
-class TCPReassembler:
-    """Handles TCP stream reassembly for cross-packet pattern detection"""
-    
-    def __init__(self):
-        self.flows: Dict[FlowKey, Dict] = defaultdict(lambda: {
-            'packets': deque(),
-            'reassembled_data': bytearray(),
-            'next_seq': 0,
-            'base_seq': None
-        })
-    
-    def add_packet(self, packet) -> Optional[Tuple[FlowKey, bytes, float]]:
-        """Add a TCP packet to the reassembler"""
-        if not packet.haslayer(TCP):
-            return None
-            
-        ip_layer = packet[IP]
-        tcp_layer = packet[TCP]
-        
-        # Create flow key
-        flow_key = FlowKey(
-            src_ip=ip_layer.src,
-            dst_ip=ip_layer.dst,
-            src_port=tcp_layer.sport,
-            dst_port=tcp_layer.dport,
-            protocol='TCP'
-        )
-        
-        # Get payload
-        payload = bytes(tcp_layer.payload) if tcp_layer.payload else b''
-        if not payload:
-            return None
-            
-        # Store packet info
-        flow_data = self.flows[flow_key]
-        flow_data['packets'].append({
-            'seq': tcp_layer.seq,
-            'payload': payload,
-            'timestamp': packet.time
-        })
-        
-        # Try to reassemble
-        return self._try_reassemble(flow_key)
-    
-    def _try_reassemble(self, flow_key: FlowKey) -> Optional[Tuple[FlowKey, bytes, float]]:
-        """Attempt to reassemble TCP stream - FIXED to process every packet immediately"""
-        flow_data = self.flows[flow_key]
-        packets = flow_data['packets']
-        
-        # FIXED: Process every packet immediately, don't wait for multiple packets
-        if len(packets) == 0:
-            return None
-            
-        # Get the most recent packet
-        latest_packet = packets[-1]
-        
-        # Return the payload immediately (same logic as CPU scanner)
-        if len(latest_packet['payload']) > 0:
-            # Clear processed packets to avoid duplicates
-            flow_data['packets'].clear()
-            return (flow_key, latest_packet['payload'], latest_packet['timestamp'])
-        
-        return None
-
-
 class GPUPayloadScanner:
     """GPU-accelerated payload scanner using CuPy and advanced kernels"""
     
@@ -209,6 +119,14 @@ class GPUPayloadScanner:
         self.use_regex = use_regex
         self.pattern_lengths = [len(p.encode()) for p in patterns]
         self.max_pattern_length = max(self.pattern_lengths) if self.pattern_lengths else 0
+        self.regex_set = None
+        if use_regex:
+            try:
+                self.regex_set = RegexSet([p.encode() for p in patterns])
+            except re.error as e:
+                raise ValueError(f"Invalid regex pattern: {e}")
+            self.max_pattern_length = self.regex_set.max_match_len
+            logger.info(f"Regex mode: {self.regex_set.describe()}")
         
         if not GPU_AVAILABLE:
             raise RuntimeError("GPU acceleration is required for this scanner. Please fix GPU issues and try again.")
@@ -248,13 +166,30 @@ class GPUPayloadScanner:
         
         logger.info(f"Initialized GPU scanner with {len(patterns)} patterns")
     
-    def scan_payloads(self, payloads: List[bytes], flow_ids: List[str]) -> List[MatchResult]:
-        """Scan multiple payloads for patterns using GPU acceleration"""
+    def scan_payloads(self, payloads: PayloadBatch) -> MatchStore:
+        """Scan multiple payloads for patterns using GPU acceleration
+        
+        Matches are returned as a MatchStore: packet_id is the payload index and
+        flow_id indexes self.flow_names. Context bytes are not stored; pass
+        payloads.__getitem__ to MatchStore.context/to_records when reporting.
+        Matches that end inside a payload's reassembly carry-over
+        (payloads.carry_lengths) are dropped, as they were found in the previous chunk;
+        so are regex matches that start inside it before the end of a match found there.
+        In regex mode the literal factors are matched over the whole batch at once and
+        `re` confirms only the payloads they hit.
+        """
+        self.flow_names = payloads.flow_names
+        carry_lengths = payloads.carry_lengths.tolist()
+        matches = MatchStore([p.encode() for p in self.patterns], payloads.flow_index)
         if not payloads:
-            return []
+            return matches
         
         start_time = time.time()
-        matches = []
+        
+        if self.regex_set is not None:
+            self._scan_regex(payloads, matches)
+            logger.info(f"Regex scanning completed in {time.time() - start_time:.2f}s, found {len(matches)} matches")
+            return matches
         
         # Process payloads in batches for better GPU utilization
         # Dynamic batch sizing based on dataset size
@@ -287,11 +222,7 @@ class GPUPayloadScanner:
                 start_idx = batch_idx * batch_size
                 end_idx = min(start_idx + batch_size, len(payloads))
                 
-                batch_payloads = payloads[start_idx:end_idx]
-                batch_flow_ids = flow_ids[start_idx:end_idx]
-                
-                batch_matches = self._scan_batch(batch_payloads, batch_flow_ids)
-                matches.extend(batch_matches)
+                self._scan_batch(payloads[start_idx:end_idx], carry_lengths[start_idx:end_idx], start_idx, matches)
         except Exception as e:
             logger.error(f"GPU batch processing failed: {e}")
             if "nvrtc64" in str(e):
@@ -311,68 +242,37 @@ class GPUPayloadScanner:
         
         return matches
     
-    def _scan_batch(self, payloads: List[bytes], flow_ids: List[str]) -> List[MatchResult]:
+    def _scan_batch(self, payloads: List[memoryview], carry_lengths: List[int], first_payload: int, matches: MatchStore):
         """Scan a batch of payloads using GPU"""
-        matches = []
-        
-        for i, (payload, flow_id) in enumerate(zip(payloads, flow_ids)):
-            payload_matches = self._scan_single_payload(payload, flow_id)
-            matches.extend(payload_matches)
-        
-        return matches
+        for i, (payload, carry_len) in enumerate(zip(payloads, carry_lengths)):
+            self._scan_single_payload(payload, carry_len, first_payload + i, matches)
     
-    def _scan_single_payload(self, payload: bytes, flow_id: str) -> List[MatchResult]:
+    def _scan_single_payload(self, payload: memoryview, carry_len: int, payload_id: int, matches: MatchStore):
         """Scan a single payload for all patterns using advanced GPU kernels"""
-        matches = []
-        
         # Use advanced kernels for maximum performance
         if len(self.patterns) > 1:
             # Use vectorized multi-pattern search for better performance
             pattern_bytes = [p.encode() for p in self.patterns]
             pattern_matches = self.advanced_kernels.vectorized_multi_search(payload, pattern_bytes)
-            
-            # Convert matches to results
-            for pattern_idx, pattern in enumerate(self.patterns):
-                for match_offset in pattern_matches[pattern_idx]:
-                    # Get context around the match
-                    start = max(0, match_offset - 20)
-                    end = min(len(payload), match_offset + len(pattern_bytes[pattern_idx]) + 20)
-                    context = payload[start:end]
-                    
-                    match_result = MatchResult(
-                        flow_id=flow_id,
-                        pattern=pattern,
-                        offset=match_offset,
-                        packet_timestamp=time.time(),
-                        flow_start=start,
-                        flow_end=end,
-                        match_context=context.hex()
-                    )
-                    matches.append(match_result)
         else:
             # Use Boyer-Moore for single pattern
-            pattern_bytes = self.patterns[0].encode()
-            pattern_matches = self.advanced_kernels.boyer_moore_search(payload, pattern_bytes)
-            
-            # Convert matches to results
-            for match_offset in pattern_matches:
-                # Get context around the match
-                start = max(0, match_offset - 20)
-                end = min(len(payload), match_offset + len(pattern_bytes) + 20)
-                context = payload[start:end]
-                
-                match_result = MatchResult(
-                    flow_id=flow_id,
-                    pattern=self.patterns[0],
-                    offset=match_offset,
-                    packet_timestamp=time.time(),
-                    flow_start=start,
-                    flow_end=end,
-                    match_context=context.hex()
-                )
-                matches.append(match_result)
-        
-        return matches
+            pattern_matches = [self.advanced_kernels.boyer_moore_search(payload, self.patterns[0].encode())]
+        
+        for pattern_idx, offsets in enumerate(pattern_matches):
+            offsets = np.asarray(offsets, dtype=np.int64)
+            if carry_len:
+                offsets = offsets[offsets + self.pattern_lengths[pattern_idx] > carry_len]
+            if len(offsets):
+                matches.write(np.full(len(offsets), payload_id, dtype=np.int64), np.asarray(offsets, dtype=np.uint32),
+                              np.full(len(offsets), pattern_idx, dtype=np.uint16))
+    
+    def _scan_regex(self, payloads: PayloadBatch, matches: MatchStore):
+        """Scan all payloads with the regex set (literal factors first, then `re` on the hits)"""
+        found = self.regex_set.scan(payloads.buffer, payloads.offsets, payloads.lengths)
+        packet_ids, starts, _, pattern_ids = found
+        keep = stream_matches(found, payloads.carry_lengths, payloads.stream_offsets, payloads.flow_index)
+        if keep.any():
+            matches.write(packet_ids[keep], starts[keep].astype(np.uint32), pattern_ids[keep].astype(np.uint16))
     
     # Basic GPU string search removed - advanced kernels required for maximum performance
 
@@ -383,7 +283,6 @@ class PCAPScanner:
     def __init__(self, patterns: List[str], use_regex: bool = False):
         self.patterns = patterns
         self.use_regex = use_regex
-        self.reassembler = TCPReassembler()
         
         # GPU is required for this scanner
         if not GPU_AVAILABLE:
@@ -393,6 +292,8 @@ class PCAPScanner:
             self.gpu_scanner = GPUPayloadScanner(patterns, use_regex)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize GPU scanner: {e}")
+        # Reassembly overlap: the longest literal, or the longest possible regex match
+        self.max_pattern_len = self.gpu_scanner.max_pattern_length
         
         self.stats = PerformanceStats(
             total_packets=0,
@@ -407,27 +308,29 @@ class PCAPScanner:
             patterns_found=0
         )
     
-    def scan_pcap(self, pcap_file: str) -> List[MatchResult]:
-        """Scan a PCAP file for patterns"""
+    def scan_pcap(self, pcap_file: str) -> MatchStore:
+        """Scan a PCAP file for patterns
+        
+        The scanned payloads and their timestamps stay on self.payloads and
+        self.timestamps so reports can fetch match context lazily.
+        """
         logger.info(f"Starting PCAP scan: {pcap_file}")
         start_time = time.time()
         
-        # Read PCAP file
-        logger.info("Reading PCAP file...")
-        packets = rdpcap(pcap_file)
-        self.stats.total_packets = len(packets)
-        
-        # Extract payloads and perform TCP reassembly
-        logger.info("Performing TCP reassembly...")
+        # Decode headers and perform TCP reassembly straight from the memory-mapped capture
+        logger.info("Extracting payloads and performing TCP reassembly...")
         reassembly_start = time.time()
-        payloads, flow_ids, timestamps = self._extract_payloads(packets)
+        payloads = extract_payloads(pcap_file, self.max_pattern_len)
+        self.payloads, self.timestamps = payloads, payloads.timestamps
+        self.stats.total_packets = payloads.packet_count
+        self.stats.total_bytes = payloads.scanned_bytes
         self.stats.reassembly_time = time.time() - reassembly_start
         
         # Scan payloads using GPU
         logger.info("Scanning payloads for patterns using GPU acceleration...")
         gpu_start = time.time()
         try:
-            matches = self.gpu_scanner.scan_payloads(payloads, flow_ids)
+            matches = self.gpu_scanner.scan_payloads(payloads)
             self.stats.gpu_processing_time = time.time() - gpu_start
         except Exception as e:
             logger.error(f"GPU scanning failed: {e}")
@@ -457,47 +360,6 @@ class PCAPScanner:
         
         return matches
     
-    def _extract_payloads(self, packets) -> Tuple[List[bytes], List[str], List[float]]:
-        """Extract payloads from packets with TCP reassembly - optimized version"""
-        # Pre-allocate lists for better performance
-        payloads = []
-        flow_ids = []
-        timestamps = []
-        
-        # Process packets without progress bar for speed
-        for packet in packets:
-            if packet.haslayer(IP):
-                ip_layer = packet[IP]
-                
-                # Handle TCP packets with reassembly
-                if packet.haslayer(TCP):
-                    result = self.reassembler.add_packet(packet)
-                    if result:
-                        flow_key, payload, timestamp = result
-                        payloads.append(payload)
-                        flow_ids.append(f"{flow_key.src_ip}:{flow_key.src_port}-{flow_key.dst_ip}:{flow_key.dst_port}")
-                        timestamps.append(timestamp)
-                        self.stats.total_bytes += len(payload)
-                
-                # Handle UDP packets (no reassembly needed)
-                elif packet.haslayer(UDP):
-                    udp_layer = packet[UDP]
-                    payload = bytes(udp_layer.payload) if udp_layer.payload else b''
-                    if payload:
-                        flow_key = FlowKey(
-                            src_ip=ip_layer.src,
-                            dst_ip=ip_layer.dst,
-                            src_port=udp_layer.sport,
-                            dst_port=udp_layer.dport,
-                            protocol='UDP'
-                        )
-                        payloads.append(payload)
-                        flow_ids.append(f"{flow_key.src_ip}:{flow_key.src_port}-{flow_key.dst_ip}:{flow_key.dst_port}")
-                        timestamps.append(packet.time)
-                        self.stats.total_bytes += len(payload)
-        
-        return payloads, flow_ids, timestamps
-    
     # CPU fallback method removed - GPU is required for this scanner
     
     def print_stats(self):
@@ -561,16 +423,17 @@ def main():
         matches = scanner.scan_pcap(args.pcap_file)
         
         # Save results
-        if matches:
+        if len(matches):
+            # Context bytes are sliced from the payloads only now, for the rows being written
             df = pd.DataFrame([
                 {
-                    'flow_id': m.flow_id,
-                    'pattern': m.pattern,
-                    'offset': m.offset,
-                    'timestamp': m.packet_timestamp,
-                    'context': m.match_context
+                    'flow_id': m['flow_id'],
+                    'pattern': m['pattern'],
+                    'offset': m['offset'],
+                    'timestamp': float(scanner.timestamps[m['packet_id']]),
+                    'context': m['context']
                 }
-                for m in matches
+                for m in matches.to_records(scanner.payloads.__getitem__, scanner.gpu_scanner.flow_names)
             ])
             df.to_csv(args.output, index=False)
             print(f"{Fore.GREEN}✓ Found {len(matches)} matches, saved to {args.output}{Style.RESET_ALL}")
@@ -1,23 +1,35 @@
 #!/usr/bin/env python3
 """
 CUDA PCAP Scanner Benchmark Script
-Tests the CUDA-based Boyer-Moore-Horspool scanner against different pattern counts
+Tests the CUDA-based Boyer-Moore-Horspool scanner against different pattern counts.
+The scenario loop, timing and result store are the shared benchmark harness
+(../benchmark_harness.py): the scanner runs as its `command:<exe>` plugin, so an
+interrupted benchmark resumes where it stopped. Each test repeats until the median
+time is known to +-5% (or its run budget is spent), and can be compared against a
+saved baseline.
 """
 
-import subprocess
-import time
 import os
 import sys
-import csv
-import json
 from pathlib import Path
 import argparse
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark_harness import (BackendSpec, BenchmarkMatrix, BenchmarkRunner, CommandBackend, PatternSet,
+                               ResultStore, STATUS_OK, compare, print_summary, DEFAULT_REPEATS,
+                               DEFAULT_MAX_REPEATS, DEFAULT_REGRESSION_THRESHOLD)
+from benchmark_report import write_report
+
 class CUDABenchmark:
-    def __init__(self, scanner_path="gpupcapgrep.exe", results_dir="results"):
+    def __init__(self, scanner_path="gpupcapgrep.exe", results_dir="results", warmup=0, repeats=DEFAULT_REPEATS,
+                 max_repeats=DEFAULT_MAX_REPEATS, resume=True):
         self.scanner_path = scanner_path
         self.results_dir = Path(results_dir)
         self.results_dir.mkdir(exist_ok=True)
+        self.warmup = warmup
+        self.repeats = repeats
+        self.max_repeats = max_repeats
+        self.resume = resume
         
         # Test PCAP files
         self.pcap_files = [
@@ -34,8 +46,10 @@ class CUDABenchmark:
             14: "test_patterns_14.txt"
         }
         
-        # Results storage
-        self.results = []
+        # Results storage: every timed run, kept across invocations
+        self.store = ResultStore(str(self.results_dir / "cuda_scanner_benchmark.sqlite"))
+        self.runner = None
+        self.stats = []
         
     def check_scanner_exists(self):
         """Check if the CUDA scanner executable exists"""
@@ -47,89 +61,12 @@ class CUDABenchmark:
         
     def load_patterns(self, pattern_file):
         """Load patterns from file"""
-        patterns = []
         try:
-            with open(pattern_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        patterns.append(line)
+            return PatternSet.from_file(pattern_file)
         except FileNotFoundError:
             print(f"ERROR: Pattern file '{pattern_file}' not found!")
-            return []
-        return patterns
-        
-    def get_pcap_info(self, pcap_file):
-        """Get basic info about PCAP file"""
-        try:
-            # Use a simple approach to get file size
-            size_bytes = os.path.getsize(pcap_file)
-            size_mb = size_bytes / (1024 * 1024)
-            return {
-                'file': pcap_file,
-                'size_bytes': size_bytes,
-                'size_mb': round(size_mb, 2)
-            }
-        except FileNotFoundError:
             return None
             
-    def run_scanner(self, pcap_file, patterns, timeout=300):
-        """Run the CUDA scanner with given patterns"""
-        if not patterns:
-            return None
-            
-        # Build command
-        cmd = [self.scanner_path, pcap_file]
-        for pattern in patterns:
-            cmd.extend(["-s", pattern])
-            
-        print(f"Running: {' '.join(cmd[:3])}... (with {len(patterns)} patterns)")
-        
-        try:
-            start_time = time.time()
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
-            end_time = time.time()
-            
-            execution_time = end_time - start_time
-            
-            # Count matches from output
-            match_count = len([line for line in result.stdout.split('\n') if line.strip()])
-            
-            return {
-                'success': result.returncode == 0,
-                'execution_time': execution_time,
-                'match_count': match_count,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
-            print(f"TIMEOUT: Scanner took longer than {timeout} seconds")
-            return {
-                'success': False,
-                'execution_time': timeout,
-                'match_count': 0,
-                'stdout': '',
-                'stderr': f'Timeout after {timeout} seconds',
-                'returncode': -1
-            }
-        except Exception as e:
-            print(f"ERROR running scanner: {e}")
-            return {
-                'success': False,
-                'execution_time': 0,
-                'match_count': 0,
-                'stdout': '',
-                'stderr': str(e),
-                'returncode': -1
-            }
-            
     def run_benchmark(self):
         """Run complete benchmark suite"""
         print("CUDA PCAP Scanner Benchmark")
@@ -138,125 +75,56 @@ class CUDABenchmark:
         if not self.check_scanner_exists():
             return False
             
-        total_tests = len(self.pcap_files) * len(self.pattern_files)
-        current_test = 0
-        
+        pcap_files = []
         for pcap_file in self.pcap_files:
-            pcap_info = self.get_pcap_info(pcap_file)
-            if not pcap_info:
+            if os.path.exists(pcap_file):
+                pcap_files.append(pcap_file)
+            else:
                 print(f"WARNING: Skipping {pcap_file} - file not found")
-                continue
-                
-            print(f"\nTesting PCAP: {pcap_file} ({pcap_info['size_mb']} MB)")
-            
-            for pattern_count, pattern_file in self.pattern_files.items():
-                current_test += 1
-                print(f"\n[{current_test}/{total_tests}] Testing {pattern_count} patterns...")
-                
-                # Load patterns
-                patterns = self.load_patterns(pattern_file)
-                if not patterns:
-                    continue
-                    
-                # Run scanner
-                result = self.run_scanner(pcap_file, patterns)
-                if not result:
-                    continue
-                    
-                # Store results
-                test_result = {
-                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                    'pcap_file': pcap_file,
-                    'pcap_size_mb': pcap_info['size_mb'],
-                    'pattern_count': pattern_count,
-                    'pattern_file': pattern_file,
-                    'patterns': patterns,
-                    'success': result['success'],
-                    'execution_time': result['execution_time'],
-                    'match_count': result['match_count'],
-                    'throughput_mbps': pcap_info['size_mb'] / result['execution_time'] if result['execution_time'] > 0 else 0,
-                    'matches_per_second': result['match_count'] / result['execution_time'] if result['execution_time'] > 0 else 0,
-                    'returncode': result['returncode'],
-                    'stderr': result['stderr']
-                }
-                
-                self.results.append(test_result)
-                
-                # Print summary
-                if result['success']:
-                    print(f"  ✓ Success: {result['execution_time']:.2f}s, {result['match_count']} matches")
-                    print(f"  ✓ Throughput: {test_result['throughput_mbps']:.2f} MB/s")
-                else:
-                    print(f"  ✗ Failed: {result['stderr']}")
-                    
+        pattern_sets = [p for p in map(self.load_patterns, self.pattern_files.values()) if p]
+        
+        matrix = BenchmarkMatrix(pcap_files, pattern_sets, [BackendSpec(CommandBackend.name, self.scanner_path)])
+        self.runner = BenchmarkRunner(self.store, warmup=self.warmup, repeats=self.repeats,
+                                      max_repeats=self.max_repeats, resume=self.resume)
+        self.stats = self.runner.run(matrix.scenarios())
         return True
         
+    def results(self):
+        """Successful stored runs behind the statistics of this benchmark"""
+        return [r for s in self.stats
+                for r in self.store.rows(s.scenario, s.fingerprint, s.code_version, STATUS_OK)]
+        
     def save_results(self):
         """Save benchmark results to files"""
-        if not self.results:
+        results = self.results()
+        if not results:
             print("No results to save")
             return
             
         # Save CSV
         csv_file = self.results_dir / "cuda_scanner_benchmark.csv"
-        with open(csv_file, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=[
-                'timestamp', 'pcap_file', 'pcap_size_mb', 'pattern_count', 
-                'pattern_file', 'success', 'execution_time', 'match_count',
-                'throughput_mbps', 'matches_per_second', 'returncode'
-            ])
-            writer.writeheader()
-            for result in self.results:
-                writer.writerow({k: v for k, v in result.items() if k in writer.fieldnames})
+        self.store.export(str(csv_file), results)
                 
         # Save JSON
         json_file = self.results_dir / "cuda_scanner_benchmark.json"
-        with open(json_file, 'w') as f:
-            json.dump(self.results, f, indent=2)
+        self.store.export(str(json_file), results)
             
         print(f"\nResults saved to:")
         print(f"  CSV: {csv_file}")
         print(f"  JSON: {json_file}")
+        print(f"  Store: {self.store.path}")
         
-    def print_summary(self):
-        """Print benchmark summary"""
-        if not self.results:
-            print("No results to summarize")
-            return
-            
-        print("\n" + "=" * 60)
-        print("CUDA SCANNER BENCHMARK SUMMARY")
-        print("=" * 60)
-        
-        # Group by pattern count
-        by_patterns = {}
-        for result in self.results:
-            if result['success']:
-                pattern_count = result['pattern_count']
-                if pattern_count not in by_patterns:
-                    by_patterns[pattern_count] = []
-                by_patterns[pattern_count].append(result)
-                
-        for pattern_count in sorted(by_patterns.keys()):
-            results = by_patterns[pattern_count]
-            print(f"\n{pattern_count} Pattern(s):")
-            print(f"  Tests: {len(results)}")
-            
-            if results:
-                avg_time = sum(r['execution_time'] for r in results) / len(results)
-                avg_throughput = sum(r['throughput_mbps'] for r in results) / len(results)
-                total_matches = sum(r['match_count'] for r in results)
-                
-                print(f"  Avg Time: {avg_time:.2f}s")
-                print(f"  Avg Throughput: {avg_throughput:.2f} MB/s")
-                print(f"  Total Matches: {total_matches}")
-                
-                # Show per-file results
-                for result in results:
-                    print(f"    {os.path.basename(result['pcap_file'])}: "
-                          f"{result['execution_time']:.2f}s, "
-                          f"{result['throughput_mbps']:.2f} MB/s, "
-                          f"{result['match_count']} matches")
+    def print_summary(self, baseline=None, threshold=DEFAULT_REGRESSION_THRESHOLD, report=None):
+        """Print benchmark summary; returns the comparisons against `baseline`"""
+        comparisons = []
+        if baseline:
+            comparisons = compare(self.stats, self.store.baseline(baseline), threshold)
+            self.stats, comparisons = self.runner.confirm(self.stats, comparisons, threshold)
+        print_summary(self.stats, comparisons)
+        if report:
+            write_report(report, self.stats, comparisons, self.store, title="CUDA Scanner Benchmark Report")
+            print(f"\nReport written to {report}")
+        return comparisons
 
 def main():
     parser = argparse.ArgumentParser(description='CUDA PCAP Scanner Benchmark')
@@ -266,10 +134,28 @@ def main():
                        help='Directory to save results')
     parser.add_argument('--timeout', type=int, default=300,
                        help='Timeout for each test in seconds')
+    parser.add_argument('--warmup', type=int, default=0,
+                       help='Untimed runs per test')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                       help='Timed runs per test, at least')
+    parser.add_argument('--max-repeats', type=int, default=DEFAULT_MAX_REPEATS,
+                       help='Timed runs per test, at most')
+    parser.add_argument('--baseline',
+                       help='Compare against this saved baseline and flag regressions')
+    parser.add_argument('--save-baseline', metavar='NAME',
+                       help="Save this run's statistics as baseline NAME")
+    parser.add_argument('--regression-threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                       help='Median throughput drop that counts as a regression')
+    parser.add_argument('--report',
+                       help='Write an .html or .md report with throughput charts')
+    parser.add_argument('--no-resume', action='store_true',
+                       help='Run every test again, even if stored')
     
     args = parser.parse_args()
+    CommandBackend.timeout = args.timeout
     
-    benchmark = CUDABenchmark(args.scanner, args.results_dir)
+    benchmark = CUDABenchmark(args.scanner, args.results_dir, args.warmup, args.repeats, args.max_repeats,
+                              not args.no_resume)
     
     print("Starting CUDA PCAP Scanner Benchmark...")
     print(f"Scanner: {args.scanner}")
@@ -280,8 +166,16 @@ def main():
     
     if success:
         benchmark.save_results()
-        benchmark.print_summary()
+        comparisons = benchmark.print_summary(args.baseline, args.regression_threshold, args.report)
+        if args.save_baseline:
+            benchmark.store.save_baseline(args.save_baseline, benchmark.stats)
+            print(f"Saved as baseline '{args.save_baseline}'")
         print("\nBenchmark completed successfully!")
+        if args.baseline and all(c.missing for c in comparisons):
+            print(f"No test of this run is in baseline '{args.baseline}': nothing was compared")
+            sys.exit(1)
+        if any(c.regression for c in comparisons):
+            sys.exit(2)
     else:
         print("\nBenchmark failed!")
         sys.exit(1)
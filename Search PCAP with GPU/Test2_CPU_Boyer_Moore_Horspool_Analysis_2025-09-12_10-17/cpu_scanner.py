@@ -11,14 +11,23 @@ import time
 import argparse
 import csv
 import json
+from bisect import bisect_right
 from pathlib import Path
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 import numpy as np
 import pandas as pd
-from scapy.all import rdpcap, IP, TCP, UDP
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 
+# Shared capture reader lives in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcap_reader import CaptureReader, load_packet_views
+from pcap_index import load_index, gather_ranges, flow_metadata, flow_labels
+from match_sink import MatchSink, open_sink, SINK_FORMATS, FORMAT_AGGREGATE
+from match_store import MatchStore, packet_source
+from anchor_prefilter import AnchorPrefilter, capture_byte_counts, non_overlapping
+
 # Try to import CuPy for GPU acceleration (not used in this implementation)
 try:
     import cupy as cp
@@ -30,6 +39,7 @@ except ImportError:
 
 @dataclass
 class Match:
+    __slots__ = ("packet_id", "offset", "pattern_id")
     packet_id: int
     offset: int
     pattern_id: int
@@ -59,6 +69,10 @@ class BoyerMooreHorspool:
     
     def find_all_matches(self, text: bytes, packet_id: int, pattern_id: int) -> List[Match]:
         """Find all occurrences of pattern in text"""
+        return [Match(packet_id, offset, pattern_id) for offset in self.find_offsets(text)]
+    
+    def find_offsets(self, text: bytes) -> List[int]:
+        """Return the start offset of every (non-overlapping) occurrence of pattern in text"""
         matches = []
         text_len = len(text)
         pattern_len = self.pattern_len
@@ -75,7 +89,7 @@ class BoyerMooreHorspool:
                 
             if j < 0:
                 # Match found
-                matches.append(Match(packet_id, i, pattern_id))
+                matches.append(i)
                 i += pattern_len  # Skip by pattern length
             else:
                 # Use bad character rule to skip
@@ -97,43 +111,226 @@ class CPUScannerImplementation:
         self.patterns.append(pattern)
         self.bmh_matchers.append(BoyerMooreHorspool(pattern))
         
-    def scan_packets(self, packets_data: List[bytes]) -> List[Match]:
-        """Scan packets for all patterns"""
-        all_matches = []
-        
+    def stream_packets(self, packets_data: List[memoryview], sink: MatchSink,
+                       batch_packets: int = 4096) -> int:
+        """Scan packets for all patterns, handing matches to sink every batch_packets packets"""
+        packet_ids, offsets, pattern_ids = [], [], []
+        count = 0
         for packet_id, packet_data in enumerate(packets_data):
             for pattern_id, matcher in enumerate(self.bmh_matchers):
-                matches = matcher.find_all_matches(packet_data, packet_id, pattern_id)
-                all_matches.extend(matches)
-                
-        return all_matches
+                hits = matcher.find_offsets(packet_data)
+                if hits:
+                    packet_ids.extend([packet_id] * len(hits))
+                    offsets.extend(hits)
+                    pattern_ids.extend([pattern_id] * len(hits))
+            if (packet_id + 1) % batch_packets == 0 or packet_id + 1 == len(packets_data):
+                sink.write(np.array(packet_ids, dtype=np.int64), np.array(offsets, dtype=np.uint32),
+                           np.array(pattern_ids, dtype=np.uint16))
+                count += len(packet_ids)
+                packet_ids, offsets, pattern_ids = [], [], []
+        return count
+
+ALGORITHM_FIND = "find"     # C-level bytes.find over the concatenated packet buffer (default)
+ALGORITHM_BMH = "bmh"       # pure-Python Boyer-Moore-Horspool per packet (reference)
+
+MatchArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]   # (packet_ids, offsets, pattern_ids)
+
+class ConcatenatedFinder:
+    """Searches all packets at once with CPython's C-level bytes.find
+    
+    Packets are packed back to back into one buffer. Each pattern is searched over
+    the whole buffer, hits are mapped back to packets with np.searchsorted on the
+    packet end offsets, and hits that straddle a packet boundary are dropped. Matches
+    are non-overlapping within a packet, exactly as BoyerMooreHorspool.find_offsets.
+    
+    With an AnchorPrefilter, the anchored patterns are found by rare-byte candidate
+    confirmation instead (see ../anchor_prefilter.py); only the rest use bytes.find.
+    """
+    
+    def __init__(self, buffer: bytearray, lengths: np.ndarray):
+        self.buffer = buffer
+        self.ends = np.cumsum(lengths, dtype=np.int64)
+        self.starts = self.ends - lengths
+        self._ends_list = self.ends.tolist()
+        
+    @classmethod
+    def from_capture(cls, reader: CaptureReader, data_offsets: np.ndarray, lengths: np.ndarray) -> "ConcatenatedFinder":
+        """Pack the given packets of a mapped capture into a new concatenated buffer"""
+        buffer = bytearray(int(np.sum(lengths, dtype=np.int64)))
+        src = np.frombuffer(reader.buffer, dtype=np.uint8)
+        try:
+            gather_ranges(src, data_offsets, lengths, np.frombuffer(buffer, dtype=np.uint8))
+        finally:
+            del src
+        return cls(buffer, lengths)
+        
+    def find_hits(self, pattern: bytes) -> np.ndarray:
+        """Buffer positions of every in-packet occurrence of pattern"""
+        m = len(pattern)
+        hits = []
+        if m == 0 or not self._ends_list:
+            return np.array(hits, dtype=np.int64)
+        find = self.buffer.find
+        ends = self._ends_list
+        bound = -1      # end of the packet containing the last hit
+        pos = find(pattern)
+        while pos >= 0:
+            if pos >= bound:
+                bound = ends[bisect_right(ends, pos)]
+            if pos + m <= bound:
+                hits.append(pos)
+                pos = find(pattern, pos + m)
+            else:
+                pos = find(pattern, bound)     # straddles into the next packet: restart there
+        return np.array(hits, dtype=np.int64)
+        
+    def anchored_hits(self, prefilter: AnchorPrefilter) -> Dict[int, np.ndarray]:
+        """Buffer positions of the non-overlapping occurrences of every anchored pattern"""
+        packets, offsets, pattern_ids = prefilter.scan(np.frombuffer(self.buffer, dtype=np.uint8),
+                                                       self.starts, self.ends - self.starts)
+        order = np.lexsort((offsets, pattern_ids, packets))
+        packets, offsets, pattern_ids = packets[order], offsets[order], pattern_ids[order]
+        keep = non_overlapping(packets, offsets, pattern_ids, prefilter.pattern_lengths)
+        positions = self.starts[packets[keep]] + offsets[keep]
+        pattern_ids = pattern_ids[keep]
+        order = np.argsort(pattern_ids, kind="stable")
+        positions, pattern_ids = positions[order], pattern_ids[order]
+        firsts = np.searchsorted(pattern_ids, prefilter.anchored)
+        lasts = np.searchsorted(pattern_ids, prefilter.anchored, side="right")
+        return {pid: positions[lo:hi] for pid, lo, hi in zip(prefilter.anchored.tolist(), firsts.tolist(), lasts.tolist())}
+        
+    def all_hits(self, patterns: List[bytes], prefilter: Optional[AnchorPrefilter] = None) -> List[np.ndarray]:
+        """find_hits for every pattern, with the anchored ones taken from the prefilter"""
+        anchored = self.anchored_hits(prefilter) if prefilter is not None else {}
+        return [anchored[i] if i in anchored else self.find_hits(p) for i, p in enumerate(patterns)]
+        
+    def scan(self, patterns: List[bytes], prefilter: Optional[AnchorPrefilter] = None) -> MatchArrays:
+        """Search every pattern; matches are ordered by packet, then pattern, then offset"""
+        hits = self.all_hits(patterns, prefilter)
+        positions = np.concatenate(hits) if hits else np.empty(0, dtype=np.int64)
+        pattern_ids = np.repeat(np.arange(len(hits), dtype=np.uint16), [len(h) for h in hits])
+        packet_ids = np.searchsorted(self.ends, positions, side="right")
+        order = np.lexsort((positions, pattern_ids, packet_ids))
+        packet_ids = packet_ids[order]
+        offsets = (positions[order] - self.starts[packet_ids]).astype(np.uint32)
+        return packet_ids.astype(np.int64), offsets, pattern_ids[order]
+        
+    def stream(self, patterns: List[bytes], sink: MatchSink, prefilter: Optional[AnchorPrefilter] = None) -> int:
+        """Search every pattern, handing each pattern's matches to sink as soon as they are found"""
+        count = 0
+        anchored = self.anchored_hits(prefilter) if prefilter is not None else {}
+        for pattern_id, pattern in enumerate(patterns):
+            positions = anchored[pattern_id] if pattern_id in anchored else self.find_hits(pattern)
+            packet_ids = np.searchsorted(self.ends, positions, side="right")
+            sink.write(packet_ids, (positions - self.starts[packet_ids]).astype(np.uint32),
+                       np.full(len(positions), pattern_id, dtype=np.uint16))
+            count += len(positions)
+        return count
+
+# Per-process state for ParallelScanEngine workers: each worker maps a capture once
+# and keeps its matchers, so only offset tables and match arrays cross processes.
+_worker_readers: Dict[str, CaptureReader] = {}
+_worker_matchers: Dict[Tuple[str, ...], List[BoyerMooreHorspool]] = {}
+
+def _worker_ready(_: int) -> int:
+    return os.getpid()
+
+def _scan_shard(pcap_file: str, patterns: Tuple[str, ...], first_packet: int,
+                data_offsets: np.ndarray, lengths: np.ndarray, algorithm: str,
+                prefilter: Optional[AnchorPrefilter] = None) -> MatchArrays:
+    """Worker: scan one shard of the packet table, returning (packet, offset, pattern) arrays"""
+    reader = _worker_readers.get(pcap_file)
+    if reader is None:
+        reader = _worker_readers[pcap_file] = CaptureReader(pcap_file)
+    if algorithm == ALGORITHM_FIND:
+        finder = ConcatenatedFinder.from_capture(reader, data_offsets, lengths)
+        packet_ids, offsets, pattern_ids = finder.scan([p.encode('utf-8') for p in patterns], prefilter)
+        return packet_ids + first_packet, offsets, pattern_ids
+    
+    matchers = _worker_matchers.get(patterns)
+    if matchers is None:
+        matchers = _worker_matchers[patterns] = [BoyerMooreHorspool(p) for p in patterns]
+    
+    view = reader.buffer
+    packet_ids, offsets, pattern_ids = [], [], []
+    for i, (data_off, length) in enumerate(zip(data_offsets.tolist(), lengths.tolist())):
+        packet_data = view[data_off:data_off + length]
+        for pattern_id, matcher in enumerate(matchers):
+            hits = matcher.find_offsets(packet_data)
+            if hits:
+                packet_ids.extend([first_packet + i] * len(hits))
+                offsets.extend(hits)
+                pattern_ids.extend([pattern_id] * len(hits))
+    return (np.array(packet_ids, dtype=np.int64), np.array(offsets, dtype=np.uint32),
+            np.array(pattern_ids, dtype=np.uint16))
+
+class ParallelScanEngine:
+    """Multi-process scanner: shards the packet offsets table across a process pool
+    
+    Workers memory-map the capture themselves (see _scan_shard), so packet bytes are
+    never pickled. Shards are balanced by packet bytes and their match arrays are
+    concatenated in shard order, giving the same ordering as stream_packets.
+    """
+    
+    def __init__(self, workers: int = 0, shards_per_worker: int = 4, algorithm: str = ALGORITHM_FIND):
+        self.algorithm = algorithm
+        self.prefilter = None       # AnchorPrefilter for the current capture and patterns (find only)
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.shards_per_worker = shards_per_worker
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        # Start every worker now so process start-up is not timed as scan time
+        list(self.executor.map(_worker_ready, range(self.workers)))
+        
+    def shard_bounds(self, lengths: np.ndarray) -> np.ndarray:
+        """Packet index boundaries that split the capture into shards of similar byte size"""
+        n_shards = max(1, min(len(lengths), self.workers * self.shards_per_worker))
+        ends = np.cumsum(lengths, dtype=np.int64)
+        targets = ends[-1] * np.arange(1, n_shards, dtype=np.int64) // n_shards
+        inner = np.searchsorted(ends, targets, side="right")
+        return np.unique(np.concatenate([[0], inner, [len(lengths)]]))
+        
+    def scan_file(self, pcap_file: str, patterns: List[str],
+                  data_offsets: np.ndarray, lengths: np.ndarray) -> MatchArrays:
+        """Scan every packet for every pattern; returns (packet_ids, offsets, pattern_ids)"""
+        if len(lengths) == 0:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint16))
+        parts = [f.result() for f in self._submit(pcap_file, patterns, data_offsets, lengths)]
+        return tuple(np.concatenate([part[k] for part in parts]) for k in range(3))
+        
+    def stream_file(self, pcap_file: str, patterns: List[str],
+                    data_offsets: np.ndarray, lengths: np.ndarray, sink: MatchSink) -> int:
+        """Like scan_file, but each shard's matches go to sink (in shard order) as soon as they arrive"""
+        count = 0
+        for future in self._submit(pcap_file, patterns, data_offsets, lengths):
+            packet_ids, offsets, pattern_ids = future.result()
+            sink.write(packet_ids, offsets, pattern_ids)
+            count += len(packet_ids)
+        return count
+        
+    def _submit(self, pcap_file: str, patterns: List[str], data_offsets: np.ndarray, lengths: np.ndarray):
+        if len(lengths) == 0:
+            return []
+        bounds = self.shard_bounds(lengths)
+        pattern_key = tuple(patterns)
+        return [self.executor.submit(_scan_shard, pcap_file, pattern_key, int(lo),
+                                     data_offsets[lo:hi], lengths[lo:hi], self.algorithm, self.prefilter)
+                for lo, hi in zip(bounds[:-1], bounds[1:])]
+        
+    def shutdown(self):
+        self.executor.shutdown()
 
 class PCAPLoader:
     """Loads PCAP files and extracts packet data"""
     
     @staticmethod
-    def load_pcap(pcap_file: str) -> Tuple[List[bytes], List[int], List[int]]:
-        """Load PCAP file and return packet data, offsets, and lengths"""
+    def load_pcap(pcap_file: str) -> Tuple[List[memoryview], List[int], List[int]]:
+        """Load PCAP file and return packet data, offsets, and lengths
+        
+        Packet data are zero-copy memoryviews over the memory-mapped capture,
+        so no packet is dissected or copied before the search starts.
+        """
         try:
-            packets = rdpcap(pcap_file)
-            
-            packet_data = []
-            offsets = []
-            lengths = []
-            
-            current_offset = 0
-            
-            for packet in packets:
-                # Get raw packet bytes
-                raw_bytes = bytes(packet)
-                
-                packet_data.append(raw_bytes)
-                offsets.append(current_offset)
-                lengths.append(len(raw_bytes))
-                
-                current_offset += len(raw_bytes)
-                
-            return packet_data, offsets, lengths
+            return load_packet_views(pcap_file)
             
         except Exception as e:
             print(f"Error loading PCAP file {pcap_file}: {e}")
@@ -142,9 +339,25 @@ class PCAPLoader:
 class CPUBenchmarkImplementation:
     """Benchmark implementation for CPU scanner approach"""
     
-    def __init__(self, results_dir="results"):
+    def __init__(self, results_dir="results", workers=1, algorithm=ALGORITHM_FIND, match_format=None,
+                 save_matches=0, prefilter=False):
         self.results_dir = Path(results_dir)
         self.results_dir.mkdir(exist_ok=True)
+        self.algorithm = algorithm
+        
+        # Rare-byte anchor prefilter in front of bytes.find (find algorithm only)
+        self.prefilter = prefilter
+        
+        # With a match format every test streams its matches to a file in results_dir
+        # instead of keeping them in memory
+        self.match_format = match_format
+        
+        # First save_matches matches of every test are saved (with context) by save_results
+        self.save_matches = save_matches
+        self.saved_matches = []     # (pcap_file, pattern_count, MatchStore)
+        
+        # workers > 1 (or 0 = all cores) uses the multi-process engine
+        self.engine = ParallelScanEngine(workers, algorithm=algorithm) if workers != 1 else None
         
         # Test PCAP files
         self.pcap_files = [
@@ -190,13 +403,39 @@ class CPUBenchmarkImplementation:
         except FileNotFoundError:
             return None
             
-    def run_scanner_simulation(self, pcap_file: str, patterns: List[str]) -> Dict[str, Any]:
-        """Run scanner simulation with given patterns"""
+    def open_match_sink(self, pcap_file: str, pattern_count: int, patterns: List[str]) -> Optional[MatchSink]:
+        """Sink for one test's matches, or None when matches are kept in memory"""
+        if not self.match_format:
+            return None
+        stem = f"matches_{Path(pcap_file).stem}_{pattern_count}p"
+        encoded = [p.encode('utf-8') for p in patterns]
+        if self.match_format == FORMAT_AGGREGATE:
+            index = self.load_index(pcap_file)
+            if index is None:
+                return open_sink(str(self.results_dir / f"{stem}.json"), encoded, FORMAT_AGGREGATE)
+            with CaptureReader(pcap_file) as reader:
+                src = np.frombuffer(reader.buffer, dtype=np.uint8)
+                try:
+                    flow_metadata(src, index)
+                finally:
+                    del src
+            return open_sink(str(self.results_dir / f"{stem}.json"), encoded, FORMAT_AGGREGATE, index.flow_ids,
+                             flow_namer=lambda keys: flow_labels(pcap_file, index, keys))
+        return open_sink(str(self.results_dir / f"{stem}.{self.match_format}"), encoded, self.match_format)
+        
+    def run_scanner_simulation(self, pcap_file: str, patterns: List[str],
+                               sink: Optional[MatchSink] = None) -> Dict[str, Any]:
+        """Run scanner simulation with given patterns; matches go to sink when one is given"""
         if not patterns:
             return None
             
         print(f"Running CPU scanner on {pcap_file} with {len(patterns)} patterns...")
         
+        if self.engine:
+            return self.run_parallel_scan(pcap_file, patterns, sink)
+        if self.algorithm == ALGORITHM_FIND:
+            return self.run_find_scan(pcap_file, patterns, sink)
+            
         # Load PCAP data
         packet_data, offsets, lengths = PCAPLoader.load_pcap(pcap_file)
         if not packet_data:
@@ -212,9 +451,10 @@ class CPUBenchmarkImplementation:
         for pattern in patterns:
             scanner.add_pattern(pattern)
             
-        # Run simulation
+        # Run simulation; without a sink matches are kept in a compact MatchStore
+        matches = MatchStore([p.encode('utf-8') for p in patterns]) if sink is None else None
         start_time = time.time()
-        matches = scanner.scan_packets(packet_data)
+        match_count = scanner.stream_packets(packet_data, sink if sink is not None else matches)
         end_time = time.time()
         
         execution_time = end_time - start_time
@@ -222,12 +462,99 @@ class CPUBenchmarkImplementation:
         return {
             'success': True,
             'execution_time': execution_time,
-            'match_count': len(matches),
+            'match_count': match_count,
             'matches': matches,
             'packet_count': len(packet_data),
             'total_bytes': sum(lengths)
         }
         
+    def load_index(self, pcap_file: str):
+        """Packet index for pcap_file, or None (with a message) if it cannot be loaded"""
+        try:
+            index = load_index(pcap_file)
+        except Exception as e:
+            print(f"Error loading PCAP file {pcap_file}: {e}")
+            return None
+        return index if len(index) else None
+        
+    def run_find_scan(self, pcap_file: str, patterns: List[str], sink: Optional[MatchSink] = None) -> Dict[str, Any]:
+        """Run the scan with ConcatenatedFinder; packing the buffer is not timed"""
+        index = self.load_index(pcap_file)
+        if index is None:
+            return {
+                'success': False,
+                'execution_time': 0,
+                'match_count': 0,
+                'error': 'Failed to load PCAP file'
+            }
+        with CaptureReader(pcap_file) as reader:
+            finder = ConcatenatedFinder.from_capture(reader, index.data_offsets, index.lengths)
+        prefilter = self.build_prefilter(pcap_file, patterns, index)
+            
+        start_time = time.time()
+        if sink is not None:
+            match_count = finder.stream([p.encode('utf-8') for p in patterns], sink, prefilter)
+            matches = None
+        else:
+            encoded = [p.encode('utf-8') for p in patterns]
+            matches = MatchStore.from_arrays(encoded, *finder.scan(encoded, prefilter))
+            match_count = len(matches)
+        end_time = time.time()
+        
+        return {
+            'success': True,
+            'execution_time': end_time - start_time,
+            'match_count': match_count,
+            'matches': matches,
+            'packet_count': len(index),
+            'total_bytes': index.total_bytes
+        }
+        
+    def build_prefilter(self, pcap_file: str, patterns: List[str], index) -> Optional[AnchorPrefilter]:
+        """Anchor prefilter from the capture's byte frequencies, or None when disabled (not timed)"""
+        if not self.prefilter or self.algorithm != ALGORITHM_FIND:
+            return None
+        with CaptureReader(pcap_file) as reader:
+            src = np.frombuffer(reader.buffer, dtype=np.uint8)
+            try:
+                counts = capture_byte_counts(src, index.data_offsets, index.lengths)
+            finally:
+                del src
+        prefilter = AnchorPrefilter([p.encode('utf-8') for p in patterns], counts)
+        print(f"  Prefilter: {prefilter.describe()}")
+        return prefilter
+        
+    def run_parallel_scan(self, pcap_file: str, patterns: List[str], sink: Optional[MatchSink] = None) -> Dict[str, Any]:
+        """Run the scan on the multi-process engine; only the packet offsets table is loaded here"""
+        index = self.load_index(pcap_file)
+        if index is None:
+            return {
+                'success': False,
+                'execution_time': 0,
+                'match_count': 0,
+                'error': 'Failed to load PCAP file'
+            }
+        self.engine.prefilter = self.build_prefilter(pcap_file, patterns, index)
+            
+        start_time = time.time()
+        if sink is not None:
+            match_count = self.engine.stream_file(pcap_file, patterns, index.data_offsets, index.lengths, sink)
+            matches = None
+        else:
+            matches = MatchStore.from_arrays([p.encode('utf-8') for p in patterns],
+                                             *self.engine.scan_file(pcap_file, patterns, index.data_offsets, index.lengths))
+            match_count = len(matches)
+        end_time = time.time()
+        
+        return {
+            'success': True,
+            'execution_time': end_time - start_time,
+            'match_count': match_count,
+            'matches': matches,
+            'packet_count': len(index),
+            'total_bytes': index.total_bytes
+        }
+        
     def run_benchmark(self):
         """Run complete benchmark suite"""
         print("CPU PCAP Scanner Implementation Benchmark")
@@ -254,7 +581,12 @@ class CPUBenchmarkImplementation:
                     continue
                     
                 # Run scanner simulation
-                result = self.run_scanner_simulation(pcap_file, patterns)
+                sink = self.open_match_sink(pcap_file, pattern_count, patterns)
+                try:
+                    result = self.run_scanner_simulation(pcap_file, patterns, sink)
+                finally:
+                    if sink is not None:
+                        sink.close()
                 if not result:
                     continue
                     
@@ -283,6 +615,10 @@ class CPUBenchmarkImplementation:
                     print(f"  ✓ Success: {result['execution_time']:.2f}s, {result['match_count']} matches")
                     print(f"  ✓ Throughput: {test_result['throughput_mbps']:.2f} MB/s")
                     print(f"  ✓ Packets: {result.get('packet_count', 0):,}")
+                    if sink is not None:
+                        print(f"  ✓ Matches: {sink.path}")
+                    if self.save_matches and result.get('matches') is not None:
+                        self.saved_matches.append((pcap_file, pattern_count, result['matches'].head(self.save_matches)))
                 else:
                     print(f"  ✗ Failed: {result.get('error', 'Unknown error')}")
                     
@@ -315,6 +651,35 @@ class CPUBenchmarkImplementation:
         print(f"  CSV: {csv_file}")
         print(f"  JSON: {json_file}")
         
+        if self.saved_matches:
+            self.save_match_samples()
+            
+    def save_match_samples(self):
+        """Save the kept matches of every test, with context bytes read from the capture"""
+        records = []
+        for pcap_file, pattern_count, store in self.saved_matches:
+            index = self.load_index(pcap_file)
+            if index is None:
+                continue
+            with CaptureReader(pcap_file) as reader:
+                packets = packet_source(reader, index)
+                for record in store.to_records(packets):
+                    records.append({'pcap_file': pcap_file, 'pattern_count': pattern_count, **record})
+        if not records:
+            return
+            
+        csv_file = self.results_dir / "cpu_scanner_matches.csv"
+        with open(csv_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+            
+        json_file = self.results_dir / "cpu_scanner_matches.json"
+        with open(json_file, 'w') as f:
+            json.dump(records, f, indent=2)
+            
+        print(f"  Matches: {csv_file}, {json_file} ({len(records)} rows)")
+        
     def print_summary(self):
         """Print benchmark summary"""
         if not self.results:
@@ -362,23 +727,49 @@ def main():
     parser = argparse.ArgumentParser(description='CPU PCAP Scanner Implementation Benchmark')
     parser.add_argument('--results-dir', default='results',
                        help='Directory to save results')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Scanner processes (1 = single process, 0 = all cores)')
+    parser.add_argument('--algorithm', choices=[ALGORITHM_FIND, ALGORITHM_BMH], default=ALGORITHM_FIND,
+                       help='find: C-level bytes.find over the concatenated buffer; bmh: pure-Python reference')
+    parser.add_argument('--match-format', choices=SINK_FORMATS,
+                       help='Stream matches to results_dir/matches_<capture>_<n>p.<format> '
+                            '(aggregate: per-pattern and per-flow counts only, as .json)')
+    
+    parser.add_argument('--save-matches', type=int, default=0,
+                       help='Save the first N matches of every test, with context, next to the results')
+    parser.add_argument('--prefilter', action='store_true',
+                       help='Find patterns with a rare 2-4 byte anchor by candidate confirmation '
+                            '(find algorithm only); the rest still use bytes.find')
     
     args = parser.parse_args()
+    if args.prefilter and args.algorithm != ALGORITHM_FIND:
+        parser.error('--prefilter needs --algorithm find')
     
-    benchmark = CPUBenchmarkImplementation(args.results_dir)
+    benchmark = CPUBenchmarkImplementation(args.results_dir, args.workers, args.algorithm, args.match_format,
+                                           args.save_matches, args.prefilter)
     
     print("Starting CPU PCAP Scanner Implementation...")
     print(f"GPU Available: {GPU_AVAILABLE} (not used)")
     print(f"Results: {args.results_dir}")
+    print(f"Algorithm: {args.algorithm}" + (" + anchor prefilter" if args.prefilter else ""))
+    print(f"Workers: {benchmark.engine.workers if benchmark.engine else 1}")
     
-    success = benchmark.run_benchmark()
+    try:
+        success = benchmark.run_benchmark()
+    finally:
+        if benchmark.engine:
+            benchmark.engine.shutdown()
     
     if success:
         benchmark.save_results()
         benchmark.print_summary()
         print("\nSimulation completed successfully!")
-        print("\nNote: This is a CPU implementation of the Boyer-Moore-Horspool algorithm.")
-        print("The implementation processes patterns sequentially on CPU.")
+        if args.algorithm == ALGORITHM_BMH:
+            print("\nNote: This is a CPU implementation of the Boyer-Moore-Horspool algorithm.")
+            print("The implementation processes patterns sequentially on CPU.")
+        else:
+            print("\nNote: Patterns were searched with bytes.find over the concatenated packet buffer.")
+            print("Use --algorithm bmh for the pure-Python Boyer-Moore-Horspool reference.")
     else:
         print("\nSimulation failed!")
         sys.exit(1)
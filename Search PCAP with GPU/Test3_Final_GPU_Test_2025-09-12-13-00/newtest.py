@@ -3,154 +3,135 @@
 # Adaptive algorithms:
 #  - <=16 patterns: BMH on GPU (one pass per pattern; fast for few patterns)
 #  - >=17 patterns: PFAC (failureless Aho–Corasick) on GPU (fast for many patterns)
+# Without CuPy or a CUDA device the same driver runs on the CPU backend (../cpu_search.py).
 #
-# Requires: Python 3.9+, numpy, cupy-cuda13x, NVIDIA GPU with CUDA 13.x runtime.
+# Requires: Python 3.9+, numpy; for the GPU backend cupy-cuda13x and an NVIDIA GPU with CUDA 13.x runtime.
 
-import argparse, mmap, os, struct, sys, csv, time
-from typing import Tuple, List, Dict
+import argparse, glob, os, sys, csv, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Tuple, List, Dict, Optional
 import numpy as np
-import cupy as cp
 from datetime import datetime
 
+try:
+    import cupy as cp
+    CUPY_AVAILABLE = True
+except ImportError:
+    cp = None
+    CUPY_AVAILABLE = False
+
+# Shared capture reader lives in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcap_reader import CaptureReader, detect_format
+from pcap_index import PacketIndex, load_index, gather_ranges, flow_labels, flow_metadata
+from index_cache import IndexCache, DEFAULT_CACHE_DIR, DEFAULT_BUDGET_MB
+from automaton_cache import AutomatonCache, load_pfac, DEFAULT_CACHE_DIR as DEFAULT_AUTOMATON_DIR
+from patterns import compile_pattern, literal_only
+from match_sink import MatchSink, AggregateSink, open_sink, SINK_FORMATS, FORMAT_AGGREGATE
+from packet_filter import PacketFilter, ScanRanges
+from cpu_search import CPUSearch, ALGORITHM_BMH, ALGORITHM_PFAC, drain_matches
+from anchor_prefilter import AnchorPrefilter, capture_byte_counts, DEFAULT_MAX_CANDIDATE_RATE
+from pipeline import ScanPipeline, ReporterSink, search_stage, DEFAULT_DEPTH, DEFAULT_BATCH_MB
+from tuning import (TuningProfile, WorkloadShape, Strategy, TuningEntry, default_strategy, host_backend_id,
+                    candidate_strategies, sample_ranges, calibrate, DEFAULT_PROFILE_DIR, DEFAULT_SAMPLE_MB,
+                    DEFAULT_REPEATS)
+from benchmark_harness import ScanBackend, PatternSet, PreparedCapture, register_backend
+
 # ============================== Capture loaders ==============================
 
-PCAP_GLOBAL_HDR = struct.Struct("<IHHIIII")   # magic, vmaj, vmin, thiszone, sigfigs, snaplen, linktype
-PCAP_REC_HDR    = struct.Struct("<IIII")      # ts_sec, ts_usec, incl_len, orig_len
-
-def _load_pcap(mm: mmap.mmap) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    fsize = mm.size()
-    if fsize < PCAP_GLOBAL_HDR.size:
-        raise ValueError("PCAP too small")
-    magic = struct.unpack_from("<I", mm, 0)[0]
-    if magic == 0xa1b2c3d4:
-        fmt = "<IIII"
-    elif magic == 0xd4c3b2a1:
-        fmt = ">IIII"
-    else:
-        raise ValueError("Not a classic PCAP (magic mismatch)")
-
-    pos = PCAP_GLOBAL_HDR.size
-    chunks, offsets, lengths = [], [], []
-    total = 0
-    while pos + PCAP_REC_HDR.size <= fsize:
-        ts_sec, ts_usec, incl_len, orig_len = struct.unpack_from(fmt, mm, pos)
-        pos += PCAP_REC_HDR.size
-        if incl_len == 0 or pos + incl_len > fsize: break
-        offsets.append(total)
-        lengths.append(incl_len)
-        chunks.append(mm[pos:pos+incl_len])
-        total += incl_len
-        pos += incl_len
-    if not lengths:
-        raise ValueError("No packets in PCAP")
-    return (np.frombuffer(b"".join(chunks), dtype=np.uint8).copy(),
-            np.asarray(offsets, dtype=np.uint32),
-            np.asarray(lengths, dtype=np.uint32))
-
-def _u32(mem, off, le=True):
-    return struct.unpack_from("<I" if le else ">I", mem, off)[0]
-
-def _load_pcapng(mm: mmap.mmap) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    fsize = mm.size()
-    if fsize < 12:
-        raise ValueError("PCAPNG too small")
-
-    pos = 0
-    chunks, offsets, lengths = [], [], []
-    total = 0
-    le = True
-
-    while pos + 12 <= fsize:
-        raw_btype = _u32(mm, pos, le=True)
-        raw_blen  = _u32(mm, pos+4, le=True)
-        if raw_blen < 12 or pos + raw_blen > fsize:
-            break
-
-        if raw_btype == 0x0A0D0D0A:  # SHB
-            bom = struct.unpack_from("<I", mm, pos+12)[0]
-            le = (bom == 0x1A2B3C4D) or (bom not in (0x1A2B3C4D, 0x4D3C2B1A))
-            pos += raw_blen
-            continue
-
-        btype = _u32(mm, pos, le)
-        blen  = _u32(mm, pos+4, le)
-        if blen < 12 or pos + blen > fsize:
-            break
-
-        if btype == 0x00000001:  # IDB
-            pos += blen
-            continue
-        elif btype == 0x00000006:  # EPB
-            captured_len = _u32(mm, pos+20, le)
-            data_off = pos + 28
-            data_end = data_off + captured_len
-            if data_end <= pos + blen - 4:
-                chunks.append(mm[data_off:data_end])
-                offsets.append(total)
-                lengths.append(captured_len)
-                total += captured_len
-            pos += blen
-            continue
-        elif btype == 0x00000003:  # SPB
-            body_len = blen - 16
-            if body_len > 0 and (pos + 12 + 4 + body_len) <= pos + blen - 4:
-                data_off = pos + 12 + 4
-                data_end = data_off + body_len
-                chunks.append(mm[data_off:data_end])
-                offsets.append(total)
-                lengths.append(body_len)
-                total += body_len
-            pos += blen
-            continue
-        else:
-            pos += blen
+def iter_capture_batches(path: str, batch_bytes: int, index: Optional[PacketIndex] = None,
+                         ranges: Optional[ScanRanges] = None
+                         ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (bigbuf, offsets, lengths, packet_ids, range_offsets) batches of at most batch_bytes.
 
-    if not lengths:
-        raise ValueError("No packets in PCAPNG")
-    return (np.frombuffer(b"".join(chunks), dtype=np.uint8).copy(),
-            np.asarray(offsets, dtype=np.uint32),
-            np.asarray(lengths, dtype=np.uint32))
+    Record boundaries come from the packet index (see pcap_index.py), so there is no
+    per-record Python loop: batch limits are found with searchsorted over the running
+    length total and each batch is packed with one vectorized gather.
 
-def load_capture_concatenate(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    size = os.path.getsize(path)
-    if size < 12:
-        raise ValueError("File too small")
-    with open(path, "rb") as f:
-        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    By default every packet is packed whole. `ranges` (see ../packet_filter.py) packs
+    only the selected byte ranges instead, e.g. the payloads of filtered packets;
+    packet_ids are the capture-wide ids of the packed ranges and range_offsets their
+    offsets within those packets.
+
+    The yielded arrays are views into buffers that are reused for the next batch,
+    so peak memory follows batch_bytes instead of the capture size. Consume (or
+    copy) a batch before advancing the iterator. Pass `index` to reuse one obtained
+    elsewhere (e.g. from the shared IndexCache); otherwise the `.pidx` sidecar is used.
+    """
+    if ranges is None:
+        if index is None:
+            index = load_index(path)
+        if len(index) == 0:
+            raise ValueError(f"No packets in {index.format.upper()}")
+        ranges = ScanRanges.whole_packets(index)
+    if len(ranges) == 0:
+        return
+    starts = ranges.starts
+    lengths = ranges.lengths
+    ends = np.cumsum(lengths, dtype=np.int64)   # packed end of each range
+    with CaptureReader(path) as reader:
+        src = np.frombuffer(reader.buffer, dtype=np.uint8)
         try:
-            magic = mm[:4]
-            if magic == b"\x0a\x0d\x0d\x0a":
-                return _load_pcapng(mm)
-            if magic in (b"\xd4\xc3\xb2\xa1", b"\xa1\xb2\xc3\xd4"):
-                return _load_pcap(mm)
-            if struct.unpack_from("<I", mm, 0)[0] == 0x0A0D0D0A:
-                return _load_pcapng(mm)
-            raise ValueError("Unknown capture format")
+            buf = np.empty(max(1, min(batch_bytes, int(ends[-1]))), dtype=np.uint8)
+            offsets = np.empty(0, dtype=np.uint32)
+            first = 0
+            while first < len(lengths):
+                base = int(ends[first - 1]) if first else 0
+                last = max(first + 1, int(np.searchsorted(ends, base + batch_bytes, side="right")))
+                used = int(ends[last - 1]) - base
+                n = last - first
+                if used > len(buf):
+                    buf = np.empty(used, dtype=np.uint8)    # jumbo record larger than a batch
+                if n > len(offsets):
+                    offsets = np.empty(max(n, 2 * len(offsets)), dtype=np.uint32)
+                gather_ranges(src, starts[first:last], lengths[first:last], buf)
+                np.subtract(ends[first:last] - base, lengths[first:last], out=offsets[:n], casting="unsafe")
+                yield (buf[:used], offsets[:n], lengths[first:last],
+                       ranges.packet_ids[first:last], ranges.range_offsets[first:last])
+                reader.drop_pages(int(starts[first]), int(starts[last - 1]))
+                first = last
         finally:
-            mm.close()
+            del src
+
+def load_capture_concatenate(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    batches = iter_capture_batches(path, os.path.getsize(path))
+    try:
+        bigbuf, offsets, lengths, _, _ = next(batches)
+    finally:
+        batches.close()
+    return bigbuf, offsets, lengths
 
 # ============================== Pattern prep ==============================
 
 MAX_PAT_LEN = 512
+# Fallback cutovers, used when the host's tuning profile has no close workload (see ../tuning.py)
 BMH_MAX_PATTERNS = 16
 DEFAULT_LARGE_PKT_THRESHOLD = 2048
 DEFAULT_TILE_BYTES = 8192
+DEFAULT_MAX_MATCHES = 2_000_000
 BLOCK_SIZE = 256
+BACKEND_AUTO, BACKEND_GPU, BACKEND_CPU = "auto", "gpu", "cpu"
 
-def unescape(s: str) -> bytes:
-    out = bytearray(); i = 0
-    while i < len(s):
-        if s[i] == "\\" and i + 1 < len(s):
-            n = s[i+1]
-            if n == "x" and i + 3 < len(s):
-                out.append(int(s[i+2:i+4], 16)); i += 4
-            elif n == "n": out.append(0x0A); i += 2
-            elif n == "r": out.append(0x0D); i += 2
-            elif n == "t": out.append(0x09); i += 2
-            else: out.append(ord(n)); i += 2
-        else:
-            out.append(ord(s[i])); i += 1
-    return bytes(out)
+def gpu_available() -> bool:
+    """True when CuPy is installed and can see at least one CUDA device"""
+    if not CUPY_AVAILABLE:
+        return False
+    try:
+        return cp.cuda.runtime.getDeviceCount() > 0
+    except cp.cuda.runtime.CUDARuntimeError:
+        return False
+
+def pinned_buffer(nbytes: int) -> np.ndarray:
+    """Page-locked host buffer, so batch uploads run at full PCIe speed"""
+    mem = cp.cuda.alloc_pinned_memory(nbytes)
+    return np.frombuffer(mem, dtype=np.uint8, count=nbytes)
+
+def backend_id(backend_name: str, workers: int) -> str:
+    """Tuning profile key for this host and backend"""
+    if backend_name == BACKEND_GPU:
+        device = cp.cuda.runtime.getDeviceProperties(cp.cuda.Device().id)["name"]
+        return host_backend_id(BACKEND_GPU, device.decode() if isinstance(device, bytes) else str(device))
+    return host_backend_id(BACKEND_CPU, f"{workers if workers > 0 else os.cpu_count() or 1}w")
 
 def make_badchar_table(pat: bytes) -> np.ndarray:
     m = len(pat)
@@ -167,6 +148,7 @@ void bmh_small(const unsigned char* __restrict__ bigbuf,
                const unsigned int* __restrict__ offsets,
                const unsigned int* __restrict__ lengths,
                const int num_packets,
+               const unsigned int large_threshold,
                const unsigned char* __restrict__ pat,
                const int m,
                const unsigned char* __restrict__ badchar, // 256 bytes
@@ -179,11 +161,17 @@ void bmh_small(const unsigned char* __restrict__ bigbuf,
     if (pkt >= num_packets) return;
     unsigned int start = offsets[pkt];
     unsigned int n = lengths[pkt];
+    if (n >= large_threshold) return;     // scanned by bmh_large
     if (m == 0 || n < (unsigned)m) return;
 
-    // Each thread owns a moving window with BMH skips
-    unsigned int i = threadIdx.x;
-    while (i <= n - (unsigned)m) {
+    // Each thread owns a contiguous run of alignments and walks it with BMH skips.
+    // The bad-character shift never passes an occurrence (also after a hit), so every
+    // occurrence, overlapping ones included, is reported once.
+    unsigned int positions = n - (unsigned)m + 1;
+    unsigned int span = (positions + blockDim.x - 1) / blockDim.x;
+    unsigned int i = threadIdx.x * span;
+    unsigned int stop = min(i + span, positions);
+    while (i < stop) {
         unsigned char last = bigbuf[start + i + m - 1];
         int j = m - 1;
         // compare backward
@@ -196,12 +184,10 @@ void bmh_small(const unsigned char* __restrict__ bigbuf,
                 out_entries[base + 1] = i;
                 out_entries[base + 2] = pat_id;
             }
-            i += m;
-        } else {
-            unsigned int shift = badchar[last];
-            if (shift < 1) shift = 1;
-            i += shift;
         }
+        unsigned int shift = badchar[last];
+        if (shift < 1) shift = 1;
+        i += shift;
     }
 }
 '''.strip()
@@ -243,10 +229,13 @@ void bmh_large(const unsigned char* __restrict__ bigbuf,
         }
         __syncthreads();
 
-        int max_start = (int)tl - m;
-        if (max_start >= 0) {
-            unsigned int i = threadIdx.x;
-            while ((int)i <= max_start) {
+        // Alignments starting in this tile; the overlap lets them run into the next one
+        if (copy_len >= (unsigned)m) {
+            unsigned int positions = min(tl, copy_len - (unsigned)m + 1);
+            unsigned int span = (positions + blockDim.x - 1) / blockDim.x;
+            unsigned int i = threadIdx.x * span;
+            unsigned int stop = min(i + span, positions);
+            while (i < stop) {
                 unsigned char last = smem[i + m - 1];
                 int j = m - 1;
                 while (j >= 0 && pat[j] == smem[i + j]) { --j; }
@@ -258,12 +247,10 @@ void bmh_large(const unsigned char* __restrict__ bigbuf,
                         out_entries[base3 + 1] = base + i;
                         out_entries[base3 + 2] = pat_id;
                     }
-                    i += m;
-                } else {
-                    unsigned int shift = badchar[last];
-                    if (shift < 1) shift = 1;
-                    i += shift;
                 }
+                unsigned int shift = badchar[last];
+                if (shift < 1) shift = 1;
+                i += shift;
             }
         }
         __syncthreads();
@@ -278,6 +265,7 @@ void pfac_small(const unsigned char* __restrict__ bigbuf,
                 const unsigned int* __restrict__ offsets,
                 const unsigned int* __restrict__ lengths,
                 const int num_packets,
+                const unsigned int large_threshold,
                 const int* __restrict__ goto_tbl, // [states*256]
                 const int num_states,
                 const int* __restrict__ out_index,
@@ -292,6 +280,7 @@ void pfac_small(const unsigned char* __restrict__ bigbuf,
     if (pkt >= num_packets) return;
     unsigned int start = offsets[pkt];
     unsigned int n = lengths[pkt];
+    if (n >= large_threshold) return;     // scanned by pfac_large
 
     for (unsigned int s = threadIdx.x; s < n; s += blockDim.x) {
         int state = 0;
@@ -351,8 +340,11 @@ void pfac_large(const unsigned char* __restrict__ bigbuf,
     unsigned int base = 0;
     while (base < n) {
         unsigned int tl = (n - base > TILE_BYTES) ? TILE_BYTES : (n - base);
+        // walks starting in this tile may run max_steps - 1 bytes into the next one
+        unsigned int copy_len = tl + (unsigned)(max_steps > 0 ? max_steps - 1 : 0);
+        if (copy_len > n - base) copy_len = n - base;
 
-        for (unsigned int t = threadIdx.x; t < tl; t += blockDim.x) {
+        for (unsigned int t = threadIdx.x; t < copy_len; t += blockDim.x) {
             smem[t] = bigbuf[start + base + t];
         }
         __syncthreads();
@@ -361,7 +353,7 @@ void pfac_large(const unsigned char* __restrict__ bigbuf,
             int state = 0;
             int steps = 0;
             unsigned int i = s;
-            while (i < tl && steps < max_steps) {
+            while (i < copy_len && steps < max_steps) {
                 unsigned char c = smem[i];
                 int nxt = goto_tbl[state * 256 + c];
                 if (nxt < 0) break;
@@ -397,210 +389,693 @@ def build_kernels(tile_bytes: int):
     pfac_large = cp.RawKernel(_pfac_large_src % {"TILE_BYTES": str(tile_bytes)}, "pfac_large", options=("--std=c++14",))
     return bmh_small, bmh_large, pfac_small, pfac_large
 
-# ============================== PFAC builder (host) ==============================
+# ============================== GPU search ==============================
+
+class GPUSearch:
+    """Compiled kernels, pattern tables and device buffers reused across capture batches."""
 
-class PFAC:
-    def __init__(self, patterns: List[bytes]):
+    def __init__(self, patterns: List[bytes], algorithm: str, tile_bytes: int, large_threshold: int, max_matches: int,
+                 automaton_cache: Optional[AutomatonCache] = None, sink: Optional[MatchSink] = None,
+                 prefilter: Optional[AnchorPrefilter] = None):
         self.patterns = patterns
-        self.next: List[Dict[int,int]] = [dict()]
-        self.out: List[List[int]] = [[]]
-        for pid, pat in enumerate(patterns):
-            node = 0
-            for b in pat:
-                node = self.next[node].setdefault(b, len(self.next))
-                if node == len(self.out):
-                    self.next.append(dict())
-                    self.out.append([])
-            self.out[node].append(pid)
-
-        # failure links
-        fail = [0]*len(self.next)
-        from collections import deque
-        q = deque()
-        for b, v in self.next[0].items():
-            fail[v] = 0
-            q.append(v)
-        while q:
-            r = q.popleft()
-            for b, s in self.next[r].items():
-                q.append(s)
-                f = fail[r]
-                while f and (b not in self.next[f]):
-                    f = fail[f]
-                fail[s] = self.next[f].get(b, 0)
-                if self.out[fail[s]]:
-                    self.out[s].extend(self.out[fail[s]])
-
-        num_states = len(self.next)
-        self.max_pat_len = max((len(p) for p in patterns), default=0)
-
-        goto = np.full((num_states, 256), -1, dtype=np.int32)
-        for state, trans in enumerate(self.next):
-            for b, s in trans.items():
-                goto[state, b] = s
-
-        out_counts = np.array([len(lst) for lst in self.out], dtype=np.int32)
-        out_index = np.zeros(len(self.out), dtype=np.int32)
-        total_out = int(out_counts.sum())
-        flat = np.zeros(total_out, dtype=np.int32)
-        k = 0
-        for i, lst in enumerate(self.out):
-            out_index[i] = k
-            if lst:
-                flat[k:k+len(lst)] = np.array(lst, dtype=np.int32)
-                k += len(lst)
-
-        self.goto = goto
-        self.out_index = out_index
-        self.out_counts = out_counts
-        self.flat_out = flat
+        self.pattern_lengths = np.array([len(p) for p in patterns], dtype=np.int64)
+        self.sink = sink
+        self.tile_bytes = tile_bytes
+        self.large_threshold = large_threshold
+        self.bmh_small, self.bmh_large, self.pfac_small, self.pfac_large = build_kernels(tile_bytes)
+
+        # Anchored patterns are confirmed on the host (see ../anchor_prefilter.py); kernels get the rest
+        self.prefilter = prefilter
+        self.search_ids = prefilter.residual if prefilter is not None else np.arange(len(patterns))
+        search_patterns = [patterns[i] for i in self.search_ids.tolist()]
+        if algorithm == ALGORITHM_BMH and not literal_only(search_patterns):
+            raise ValueError("BMH needs literal patterns; use PFAC for wildcard, class or nocase patterns")
+
+        self.algorithm = algorithm
+        if algorithm == ALGORITHM_BMH:
+            self.bmh_tables = [(cp.asarray(np.frombuffer(p, dtype=np.uint8)),
+                                cp.asarray(make_badchar_table(p).astype(np.uint8))) for p in search_patterns]
+        elif search_patterns:
+            pf = load_pfac(search_patterns, automaton_cache)   # memory-mapped when precompiled
+            self.num_states = pf.goto.shape[0]
+            self.goto_d = cp.asarray(pf.goto, dtype=cp.int32).ravel()
+            self.out_index_d = cp.asarray(pf.out_index, dtype=cp.int32)
+            self.out_counts_d = cp.asarray(pf.out_counts, dtype=cp.int32)
+            # outputs hold original pattern ids, so kernels report them directly
+            self.flat_out_d = cp.asarray(self.search_ids[np.asarray(pf.flat_out)], dtype=cp.int32)
+            self.max_steps = np.int32(pf.max_pat_len)
+        self.has_automaton = bool(search_patterns)
+
+        self.out_cap = int(max_matches)     # initial size; grown on overflow while streaming to a sink
+        self.out_entries_d = cp.empty((self.out_cap, 3), dtype=cp.uint32)  # packet, offset/end, pattern
+        self.out_count_d = cp.zeros((1,), dtype=cp.uint64)
+        self.bigbuf_d = cp.empty((0,), dtype=cp.uint8)
+        self.offsets_d = cp.empty((0,), dtype=cp.uint32)
+        self.lengths_d = cp.empty((0,), dtype=cp.uint32)
+        self.num_packets = 0
+        self.host_batch = None
+        self.packet_ids = None
+        self.range_offsets = None
+        self.packet_ids_d = None
+        self.large_idx_d = None
+        self.num_large = 0
+        self.set_sink(sink)
+
+    def set_sink(self, sink: Optional[MatchSink]):
+        """Send the matches of later batches to `sink` (one backend scanning several captures)"""
+        self.sink = sink
+        flow_keys = sink.flow_keys if isinstance(sink, AggregateSink) else None
+        self.flow_keys_d = cp.asarray(flow_keys) if flow_keys is not None else None
+
+    def upload(self, bigbuf_h: np.ndarray, offsets_h: np.ndarray, lengths_h: np.ndarray,
+               packet_ids: Optional[np.ndarray] = None, range_offsets: Optional[np.ndarray] = None):
+        """Copy one batch to the device, growing the resident buffers only when a batch outgrows them.
+
+        packet_ids are the capture-wide ids of the batch's packets and range_offsets the
+        offsets of the scanned ranges within them (see iter_capture_batches); both are
+        used for reported matches and default to packets 0..n-1 scanned whole.
+        """
+        n_bytes, n_pkts = len(bigbuf_h), len(lengths_h)
+        if n_bytes > self.bigbuf_d.size:
+            self.bigbuf_d = cp.empty((n_bytes,), dtype=cp.uint8)
+        if n_pkts > self.offsets_d.size:
+            self.offsets_d = cp.empty((n_pkts,), dtype=cp.uint32)
+            self.lengths_d = cp.empty((n_pkts,), dtype=cp.uint32)
+        self.bigbuf_d[:n_bytes].set(bigbuf_h)
+        self.offsets_d[:n_pkts].set(offsets_h)
+        self.lengths_d[:n_pkts].set(lengths_h)
+        self.num_packets = n_pkts
+        if self.prefilter is not None:
+            self.host_batch = (bigbuf_h, offsets_h, lengths_h)    # prefilter runs on the host copy
+        self.packet_ids = np.arange(n_pkts, dtype=np.int64) if packet_ids is None else packet_ids
+        self.range_offsets = range_offsets
+        if self.flow_keys_d is not None:
+            self.packet_ids_d = cp.asarray(self.packet_ids)
+
+        large_idx = np.where(lengths_h >= self.large_threshold)[0].astype(np.int32)
+        self.num_large = len(large_idx)
+        self.large_idx_d = cp.asarray(large_idx, dtype=cp.int32) if self.num_large else None
+
+    def _grow_output(self, count: int):
+        self.out_cap = max(count, 2 * self.out_cap)
+        self.out_entries_d = cp.empty((self.out_cap, 3), dtype=cp.uint32)
+
+    def _run_pass(self, launch) -> int:
+        """Run one kernel pass and return its exact match count.
+
+        The kernels count every match but only store the first out_cap of them, so when
+        matches are being streamed a pass that overflows is re-run with a larger buffer.
+        """
+        while True:
+            self.out_count_d.fill(0)
+            launch()
+            cp.cuda.Device().synchronize()
+            count = int(self.out_count_d.get()[0])
+            if self.sink is None or count <= self.out_cap:
+                return count
+            self._grow_output(count)
+
+    def _drain(self, count: int, end_offsets: bool):
+        """Hand the stored matches of the last pass to the sink"""
+        if self.sink is None or count == 0:
+            return
+        entries_d = self.out_entries_d[:count]
+        if isinstance(self.sink, AggregateSink):
+            # Counted on the device: individual matches never reach the host
+            self.sink.add_counts(cp.bincount(entries_d[:, 2].astype(cp.int32), minlength=len(self.patterns)).get())
+            if self.flow_keys_d is not None:
+                keys = self.flow_keys_d[self.packet_ids_d[entries_d[:, 0].astype(cp.int64)]]
+                uniq, counts = cp.unique(keys, return_counts=True)
+                self.sink.add_flow_counts(uniq.get(), counts.get())
+            return
+        entries = entries_d.get()
+        packets, offsets, pids = entries[:, 0].astype(np.int64), entries[:, 1].astype(np.int64), entries[:, 2]
+        if end_offsets:
+            offsets -= self.pattern_lengths[pids]     # PFAC reports 1-based end offsets
+        if self.range_offsets is not None:
+            offsets += self.range_offsets[packets]    # offsets stay relative to the frame start
+        order = np.lexsort((offsets, pids, packets))
+        self.sink.write(self.packet_ids[packets[order]], offsets[order], pids[order])
+
+    def search(self) -> int:
+        """Scan the uploaded batch, stream its matches to the sink (if any) and return the match count."""
+        threads = BLOCK_SIZE
+        blocks_small = max(1, self.num_packets)
+        blocks_large = max(1, self.num_large)
+        bigbuf_d, offsets_d, lengths_d = self.bigbuf_d, self.offsets_d, self.lengths_d
+        total_matches = 0
+
+        if self.algorithm == ALGORITHM_BMH:
+            # Few-patterns: BMH per needle
+            for pid, (pat_d, badchar_d) in zip(self.search_ids.tolist(), self.bmh_tables):
+                p = self.patterns[pid]
+                m = np.int32(len(p))
+
+                def launch():
+                    # small packets path
+                    self.bmh_small((blocks_small,), (threads,),
+                                   (bigbuf_d, offsets_d, lengths_d, np.int32(self.num_packets),
+                                    np.uint32(self.large_threshold), pat_d, m, badchar_d, np.uint32(pid),
+                                    self.out_entries_d.ravel(), self.out_count_d, np.uint32(self.out_cap)))
+
+                    # large packets path
+                    if self.num_large:
+                        shared_mem = self.tile_bytes + (len(p) - 1)
+                        self.bmh_large((blocks_large,), (threads,),
+                                       (bigbuf_d, offsets_d, lengths_d,
+                                        self.large_idx_d, np.int32(self.num_large),
+                                        pat_d, m, badchar_d, np.uint32(pid),
+                                        self.out_entries_d.ravel(), self.out_count_d, np.uint32(self.out_cap)),
+                                       shared_mem=shared_mem)
+
+                count = self._run_pass(launch)
+                self._drain(count, end_offsets=False)
+                total_matches += count
+
+        elif self.has_automaton:
+            # Many-patterns: PFAC
+            def launch():
+                # small packets
+                self.pfac_small((blocks_small,), (threads,),
+                                (bigbuf_d, offsets_d, lengths_d, np.int32(self.num_packets),
+                                 np.uint32(self.large_threshold), self.goto_d, np.int32(self.num_states),
+                                 self.out_index_d, self.out_counts_d, self.flat_out_d,
+                                 self.max_steps,
+                                 self.out_entries_d.ravel(), self.out_count_d, np.uint32(self.out_cap)))
+
+                # large packets
+                if self.num_large:
+                    self.pfac_large((blocks_large,), (threads,),
+                                    (bigbuf_d, offsets_d, lengths_d,
+                                     self.large_idx_d, np.int32(self.num_large),
+                                     self.goto_d, np.int32(self.num_states),
+                                     self.out_index_d, self.out_counts_d, self.flat_out_d,
+                                     self.max_steps,
+                                     self.out_entries_d.ravel(), self.out_count_d, np.uint32(self.out_cap)),
+                                    shared_mem=self.tile_bytes + int(self.max_steps) - 1)
+
+            total_matches = self._run_pass(launch)
+            self._drain(total_matches, end_offsets=True)
+
+        if self.prefilter is not None and self.num_packets:
+            packets, offsets, pids = self.prefilter.scan(*self.host_batch)
+            drain_matches(self.sink, len(self.patterns), self.packet_ids, self.range_offsets, packets, offsets, pids)
+            total_matches += len(packets)
+
+        return total_matches
+
+# ============================== Benchmark plugins ==============================
+
+class CuPyBackend(ScanBackend):
+    """GPUSearch as a ../benchmark_harness.py plugin: the whole capture is uploaded once, untimed"""
+    algorithm = ALGORITHM_BMH
+
+    def __init__(self, pattern_set: PatternSet, workers: int = 1, option: str = ""):
+        super().__init__(pattern_set, workers, option)
+        self.search = GPUSearch(self.patterns, self.algorithm, DEFAULT_TILE_BYTES, DEFAULT_LARGE_PKT_THRESHOLD,
+                                DEFAULT_MAX_MATCHES)
+
+    @classmethod
+    def available(cls, option: str = "") -> Optional[str]:
+        return None if gpu_available() else "CuPy missing or no CUDA device"
+
+    @classmethod
+    def environment(cls, option: str = "") -> Dict:
+        device = cp.cuda.runtime.getDeviceProperties(cp.cuda.Device().id)["name"]
+        return {"gpu": device.decode() if isinstance(device, bytes) else str(device), "cupy": cp.__version__,
+                "cuda_runtime": cp.cuda.runtime.runtimeGetVersion(), "kernels": cls.algorithm}
+
+    def prepare(self, capture: PreparedCapture):
+        buf, offsets, lengths = capture.packed()
+        self.search.upload(buf, offsets, lengths, capture.ranges.packet_ids, capture.ranges.range_offsets)
+
+    def run(self) -> int:
+        return self.search.search()
+
+    def close(self):
+        self.search = None
+
+
+@register_backend
+class CuPyBMHBackend(CuPyBackend):
+    name = "cupy-bmh"
+    description = "GPU BMH kernels (one pass per pattern)"
+    algorithm = ALGORITHM_BMH
+
+
+@register_backend
+class CuPyPFACBackend(CuPyBackend):
+    name = "cupy-pfac"
+    description = "GPU failureless Aho-Corasick (PFAC) kernels"
+    algorithm = ALGORITHM_PFAC
+
+# ============================== Capture preparation ==============================
+
+def prepare_capture(path: str, index_cache: Optional[IndexCache], packet_filter: PacketFilter,
+                    want_byte_counts: bool) -> Tuple[PacketIndex, Optional[ScanRanges], Optional[np.ndarray]]:
+    """Packet index (from the cache when possible), the filtered ranges (None = every packet
+    whole) and, if asked, the byte histogram of the bytes to be scanned"""
+    index = index_cache.get(path) if index_cache else None
+    if index is None:
+        index = load_index(path)
+    # Filters are evaluated over the header index: only selected ranges are packed and uploaded
+    ranges = None
+    # The anchor prefilter picks its anchors from byte frequencies of the bytes to be scanned
+    byte_counts = None
+    if packet_filter.active or want_byte_counts:
+        with CaptureReader(path) as reader:
+            src = np.frombuffer(reader.buffer, dtype=np.uint8)
+            try:
+                if packet_filter.active:
+                    if not index.has_flow_metadata:
+                        flow_metadata(src, index)
+                    ranges = packet_filter.select(index, src)
+                if want_byte_counts:
+                    scanned = ranges if ranges is not None else ScanRanges.whole_packets(index)
+                    byte_counts = capture_byte_counts(src, scanned.starts, scanned.lengths)
+            finally:
+                del src
+    return index, ranges, byte_counts
+
+# ============================== Calibration ==============================
+
+def run_calibration(path: str, index: PacketIndex, ranges: ScanRanges, patterns: List[bytes],
+                    make_backend, profile: TuningProfile, sample_mb: int, repeats: int) -> Strategy:
+    """Time the candidate strategies on a sample of the capture and store the winner in `profile`"""
+    shape = WorkloadShape.measure(patterns, ranges.lengths)
+    sample = sample_ranges(ranges, sample_mb * 1024 * 1024)
+    candidates = candidate_strategies(len(patterns), sample.lengths, literal_only(patterns))
+    print(f"Calibrating {len(candidates)} strategies on {sample.total_bytes / (1024 * 1024):.1f} MB "
+          f"({len(sample):,} packets) for {shape.describe()}")
+    batches = iter_capture_batches(path, sample.total_bytes, index, sample)
+    try:
+        bigbuf, offsets, lengths, _, _ = next(batches)
+        results = calibrate(make_backend, (bigbuf, offsets, lengths), candidates, repeats)
+    finally:
+        batches.close()
+    best, mb_per_s = results[0]
+    profile.add(TuningEntry(shape, best, mb_per_s, time.time()))
+    profile.save()
+    print(f"Best: {best.describe()} at {mb_per_s:.1f} MB/s; saved to {profile.path}")
+    return best
+
+# ============================== Directory mode ==============================
+
+def is_capture(path: str) -> bool:
+    """True if the file starts with a PCAP or PCAPNG magic"""
+    try:
+        with open(path, 'rb') as f:
+            detect_format(f.read(12))
+    except (OSError, ValueError):
+        return False
+    return True
+
+def find_captures(directory: str, pattern: str) -> List[str]:
+    """Capture files under `directory` matching the glob `pattern` (** recurses), sorted by name
+
+    Files that do not start with a capture magic are skipped, so sidecars that match the
+    glob too (.pidx indexes, generator .manifest.csv/.manifest.json) are never scanned.
+    """
+    matches = glob.glob(os.path.join(directory, pattern), recursive=True)
+    return sorted(p for p in matches if os.path.isfile(p) and is_capture(p))
+
+def run_directory(captures: List[str], names: List[str], backend, sink: Optional[MatchSink], patterns: List[bytes],
+                  index_cache: Optional[IndexCache], packet_filter: PacketFilter, batch_bytes: int, depth: int,
+                  memory_bytes: int, allocate=None) -> Tuple[List[Dict], float, int]:
+    """Scan many captures with one backend (compiled patterns, warm workers or device buffers).
+
+    Every capture gets its own pipeline; up to memory_bytes of host batch buffers worth
+    of them run at once, so one capture's paging and packing overlap another's search.
+    Searches take turns on the shared backend, each sending its matches to its
+    capture's view of the shared sink (rows tagged with the file, see match_sink.py).
+    Returns per-capture results in capture order, the wall time and the concurrency.
+    """
+    concurrency = max(1, min(len(captures), memory_bytes // ((depth + 2) * batch_bytes)))
+    search_lock = threading.Lock()
+    prepare_lock = threading.Lock()         # the index cache is not thread-safe
+    run_search = search_stage(backend)
+
+    def scan_one(file_id: int) -> Dict:
+        path = captures[file_id]
+        load_start = time.time()
+        with prepare_lock:
+            index, ranges, _ = prepare_capture(path, index_cache, packet_filter, False)
+        setup_time = time.time() - load_start
+        if isinstance(sink, AggregateSink):
+            file_sink = AggregateSink(patterns, index.flow_ids,
+                                      flow_namer=lambda keys: flow_labels(path, index, keys))
+        else:
+            file_sink = sink.for_file(file_id) if sink is not None else None
+
+        def search(batch) -> int:
+            with search_lock:
+                backend.set_sink(file_sink)
+                return run_search(batch)
+
+        pipe = ScanPipeline(path, ranges if ranges is not None else ScanRanges.whole_packets(index),
+                            batch_bytes, search, None, depth, allocate)
+        matches = pipe.run()
+        if isinstance(sink, AggregateSink):
+            with search_lock:
+                sink.merge(file_sink)
+        reader_stats, packer_stats, search_stats = pipe.stats
+        file_mb = pipe.total_bytes / (1024 * 1024)
+        return {'pcap_file': names[file_id], 'file_size_mb': file_mb,
+                'load_time': setup_time + reader_stats.busy + packer_stats.busy, 'search_time': search_stats.busy,
+                'total_time': setup_time + pipe.wall,
+                'throughput_mbps': file_mb / search_stats.busy if search_stats.busy > 0 else 0,
+                'num_matches': matches, 'num_packets': pipe.num_packets}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="capture") as pool:
+        results = list(pool.map(scan_one, range(len(captures))))
+    return results, time.perf_counter() - start, concurrency
+
+RESULT_FIELDS = ['pcap_file', 'backend', 'file_size_mb', 'num_patterns', 'load_time',
+                 'search_time', 'total_time', 'throughput_mbps', 'num_matches', 'num_packets']
+
+def results_csv_header(path: str) -> Optional[List[str]]:
+    """Header of an existing results CSV (None for a new or empty file)
+
+    Raises ValueError when the file has columns that are not result fields, since
+    appending to it would put values under the wrong headings.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, newline='') as csvfile:
+        header = next(csv.reader(csvfile), [])
+    unknown = [c for c in header if c not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"{path} has columns that are not newtest results ({', '.join(unknown)}); "
+                         f"use another --csv-output file")
+    return header
+
+def append_results_csv(path: str, rows: List[Dict]):
+    """Append result rows to the benchmark CSV (header written when the file is new)
+
+    A file written with fewer columns (e.g. before the backend column) is first rewritten
+    with the current header, its old rows left blank in the new columns.
+    """
+    header = results_csv_header(path)
+    if header is not None and header != RESULT_FIELDS:
+        with open(path, newline='') as csvfile:
+            old_rows = list(csv.DictReader(csvfile))
+        tmp = path + ".tmp"
+        with open(tmp, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=RESULT_FIELDS, restval='')
+            writer.writeheader()
+            writer.writerows(old_rows)
+        os.replace(tmp, path)
+    with open(path, 'a', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=RESULT_FIELDS)
+        if header is None:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def run_directory_mode(args, captures: List[str], patterns: List[bytes], sink: Optional[MatchSink], backend,
+                       backend_name: str, strategy: Strategy, strategy_source: str, packet_filter: PacketFilter,
+                       index_cache: Optional[IndexCache], setup_time: float):
+    """--dir: scan every capture with the one backend, then report per file and in total"""
+    names = [os.path.relpath(p, args.dir) for p in captures]
+    if sink is not None and not isinstance(sink, AggregateSink):
+        sink = ReporterSink(sink, 4 * args.pipeline_depth)
+    batch_bytes = (args.batch_mb or DEFAULT_BATCH_MB) * 1024 * 1024
+    try:
+        results, wall, concurrency = run_directory(
+            captures, names, backend, sink, patterns, index_cache, packet_filter, batch_bytes,
+            args.pipeline_depth, args.memory_mb * 1024 * 1024,
+            pinned_buffer if backend_name == BACKEND_GPU else None)
+    finally:
+        if isinstance(backend, CPUSearch):
+            backend.close()
+        if sink is not None:
+            sink.close()
+    for r in results:
+        r['backend'] = f"{backend_name}/{strategy.algorithm}"
+        r['num_patterns'] = len(patterns)
+
+    total_mb = sum(r['file_size_mb'] for r in results)
+    total_matches = sum(r['num_matches'] for r in results)
+    if args.csv_output:
+        append_results_csv(args.csv_output, results)
+        print(f"Results for {len(results)} capture(s) written to {args.csv_output}")
+        return
+    for r in results:
+        print(f"{r['pcap_file']}: {r['file_size_mb']:.2f} MB, {r['num_packets']:,} packets, "
+              f"{r['num_matches']:,} matches, search {r['search_time']:.3f}s")
+    print(f"Captures: {len(results)} in {args.dir} ({args.glob}), {concurrency} at a time")
+    print(f"Size: {total_mb:.2f} MB")
+    print(f"Patterns: {len(patterns)}")
+    print(f"Backend: {backend_name}, {strategy.describe()} [{strategy_source}]")
+    print(f"Setup time (first capture, patterns): {setup_time:.3f}s")
+    print(f"Wall time: {wall:.3f}s")
+    print(f"Throughput: {total_mb / wall if wall > 0 else 0:.2f} MB/s")
+    print(f"Matches: {total_matches:,}")
+    if isinstance(sink, AggregateSink):
+        for pid, (p, count) in enumerate(zip(patterns, sink.pattern_counts)):
+            print(f"  pattern {pid} {p!r}: {int(count):,}")
+        for _, name, count in sink.top_flows():
+            print(f"  flow {name}: {count:,}")
+    if sink is not None and args.match_output:
+        print(f"Matches written to {args.match_output}")
+    if index_cache:
+        print(index_cache.format_stats())
 
 # ============================== Driver ==============================
 
 def main():
     ap = argparse.ArgumentParser(description="GPU-accelerated PCAP/PCAPNG grep (CuPy; adaptive BMH/PFAC).")
-    ap.add_argument("capture", help="Path to .pcap or .pcapng")
-    ap.add_argument("-s", "--string", action="append", required=True, help="Search string; supports \\xNN escapes")
-    ap.add_argument("--large-threshold", type=int, default=DEFAULT_LARGE_PKT_THRESHOLD, help="Bytes to treat as 'large'")
-    ap.add_argument("--tile-bytes", type=int, default=DEFAULT_TILE_BYTES, help="Shared-memory tile size")
-    ap.add_argument("--max-matches", type=int, default=2_000_000, help="Cap total reported matches")
+    ap.add_argument("capture", nargs="?", help="Path to .pcap or .pcapng (or use --dir)")
+    ap.add_argument("--dir", help="Scan every capture in this directory, compiling the patterns once")
+    ap.add_argument("--glob", default="*.pcap*", help="File name pattern for --dir (** recurses; default %(default)s)")
+    ap.add_argument("--memory-mb", type=int, default=1024,
+                    help="--dir mode: host batch buffer budget; decides how many captures are scanned at once")
+    ap.add_argument("-s", "--string", action="append", required=True,
+                    help="Search pattern; supports \\xNN escapes, a (?i) nocase prefix and a (?w) prefix that "
+                         "enables ?? wildcards and [a-z] byte classes")
+    ap.add_argument("--nocase", action="store_true", help="Match every pattern case-insensitively")
+    ap.add_argument("--wildcards", action="store_true",
+                    help="Read ?? and [...] in every pattern as wildcards and byte classes (as if prefixed with (?w))")
+    ap.add_argument("--algorithm", choices=("auto", "bmh", "pfac"), default="auto",
+                    help=f"Search algorithm (auto: from the tuning profile, else BMH up to {BMH_MAX_PATTERNS} patterns)")
+    ap.add_argument("--large-threshold", type=int,
+                    help=f"Bytes to treat as 'large' (default: from the tuning profile, else {DEFAULT_LARGE_PKT_THRESHOLD})")
+    ap.add_argument("--tile-bytes", type=int,
+                    help=f"Shared-memory tile size (default: from the tuning profile, else {DEFAULT_TILE_BYTES})")
+    ap.add_argument("--calibrate", action="store_true",
+                    help="Benchmark the candidate strategies on a sample of the capture, save the winner to the "
+                         "tuning profile and exit")
+    ap.add_argument("--sample-mb", type=int, default=DEFAULT_SAMPLE_MB, help="Capture sample size for --calibrate")
+    ap.add_argument("--tuning-dir", default=DEFAULT_PROFILE_DIR, help="Directory of the per-host tuning profiles")
+    ap.add_argument("--no-tuning", action="store_true", help="Ignore the tuning profile and use the fixed cutovers")
+    ap.add_argument("--max-matches", type=int, default=DEFAULT_MAX_MATCHES,
+                    help="Initial device match buffer (rows); grown on overflow when matches are streamed")
+    ap.add_argument("--batch-mb", type=int, default=0,
+                    help=f"Scan in windows of N MB of packet bytes (0 = load whole capture; {DEFAULT_BATCH_MB} with --pipeline)")
+    ap.add_argument("--pipeline", action="store_true",
+                    help="Overlap paging-in, packing, searching and match writing in separate stages (see ../pipeline.py)")
+    ap.add_argument("--pipeline-depth", type=int, default=DEFAULT_DEPTH, help="Batches queued between pipeline stages")
+    ap.add_argument("--index-cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the shared packet index cache")
+    ap.add_argument("--index-cache-mb", type=int, default=DEFAULT_BUDGET_MB,
+                    help="Index cache size budget in MB, LRU-evicted (0 = no cache, use a .pidx sidecar)")
+    ap.add_argument("--automaton-cache-dir", default=DEFAULT_AUTOMATON_DIR,
+                    help="Directory of compiled PFAC automata (see ../automaton_cache.py)")
+    ap.add_argument("--no-automaton-cache", action="store_true", help="Always build the PFAC automaton in memory")
+    ap.add_argument("--match-output", help="Stream every match to this file (.csv, .jsonl or .parquet; .json = aggregate)")
+    ap.add_argument("--match-format", choices=SINK_FORMATS, help="Match output format (default: from --match-output extension)")
+    ap.add_argument("--aggregate-only", action="store_true",
+                    help="Only count matches per pattern and per flow (5-tuple); no individual matches are kept")
+    ap.add_argument("--payload-only", action="store_true",
+                    help="Scan only L4 payloads (no link/IP/TCP/UDP header bytes)")
+    ap.add_argument("--proto", help="Only scan packets of these IP protocols, e.g. tcp,udp or 47")
+    ap.add_argument("--port", help="Only scan packets with a source or destination port in this list, e.g. 80,443,8000-8080")
+    ap.add_argument("--src-net", help="Only scan packets from these networks, e.g. 10.0.0.0/8,2001:db8::/32")
+    ap.add_argument("--prefilter", action="store_true",
+                    help="Find patterns with a rare 2-4 byte anchor by candidate confirmation; only the rest "
+                         "goes through BMH/PFAC")
+    ap.add_argument("--prefilter-rate", type=float, default=DEFAULT_MAX_CANDIDATE_RATE,
+                    help="Prefilter budget: expected anchor candidates per scanned byte (default %(default).4f)")
+    ap.add_argument("--backend", choices=(BACKEND_AUTO, BACKEND_GPU, BACKEND_CPU), default=BACKEND_AUTO,
+                    help="Search backend (auto: GPU when CuPy sees a CUDA device, otherwise CPU)")
+    ap.add_argument("--workers", type=int, default=0, help="CPU backend worker processes (0 = one per core)")
     ap.add_argument("--csv-output", help="Output results to CSV file")
     ap.add_argument("--comprehensive-test", action="store_true", help="Run comprehensive test across all PCAP files")
     args = ap.parse_args()
+    if (args.capture is None) == (args.dir is None):
+        ap.error("give either a capture file or --dir")
+    if args.dir is not None:
+        captures = find_captures(args.dir, args.glob)
+        if not captures:
+            ap.error(f"no files matching {args.glob!r} in {args.dir}")
+        if args.calibrate:
+            ap.error("--calibrate takes a single capture")
+    else:
+        captures = [args.capture]
+    if args.csv_output:
+        try:
+            results_csv_header(args.csv_output)
+        except ValueError as e:
+            ap.error(str(e))
 
-    # Ensure CUDA runtime is present via CuPy
-    try:
-        _ = cp.cuda.runtime.getDevice()
-    except cp.cuda.runtime.CUDARuntimeError as e:
-        print("CuPy cannot access CUDA. Ensure CUDA 13.x is installed and install CuPy built for CUDA 13: pip install cupy-cuda13x")
-        raise
+    # GPU when CuPy can reach a CUDA device; the CPU backend reports the same matches
+    backend_name = args.backend
+    if backend_name != BACKEND_CPU and not gpu_available():
+        if backend_name == BACKEND_GPU:
+            print("CuPy cannot access CUDA. Ensure CUDA 13.x is installed and install CuPy built for CUDA 13: pip install cupy-cuda13x")
+            sys.exit(1)
+        print("No usable CUDA device (or CuPy missing): using the CPU backend")
+        backend_name = BACKEND_CPU
+    elif backend_name == BACKEND_AUTO:
+        backend_name = BACKEND_GPU
 
-    patterns = [unescape(s) for s in args.string]
+    try:
+        patterns = [compile_pattern(s, args.nocase, args.wildcards) for s in args.string]
+    except ValueError as e:
+        ap.error(str(e))
     patterns = [p for p in patterns if p]
     if not patterns:
         print("No non-empty patterns.")
         sys.exit(1)
+    # Wildcards, byte classes and nocase live in the automaton's transitions; BMH only takes literals
+    literal = literal_only(patterns)
+    if not literal and args.algorithm == "bmh":
+        ap.error("--algorithm bmh needs literal patterns (no ??, [...] or nocase)")
     if any(len(p) > MAX_PAT_LEN for p in patterns):
         print(f"One or more patterns exceed MAX_PAT_LEN={MAX_PAT_LEN}. Reduce length or adjust constant.")
         sys.exit(1)
 
-    # Start timing
-    load_start = time.time()
-    bigbuf_h, offsets_h, lengths_h = load_capture_concatenate(args.capture)
-    load_time = time.time() - load_start
-    num_packets = len(lengths_h)
-    total_bytes = len(bigbuf_h)
-
-    # Move capture to GPU
-    bigbuf_d = cp.asarray(bigbuf_h, dtype=cp.uint8)
-    offsets_d = cp.asarray(offsets_h, dtype=cp.uint32)
-    lengths_d = cp.asarray(lengths_h, dtype=cp.uint32)
-
-    # Large index list
-    large_idx = np.where(lengths_h >= args.large_threshold)[0].astype(np.int32)
-    large_idx_d = cp.asarray(large_idx, dtype=cp.int32) if len(large_idx) else None
-
-    # Output buffers
-    out_cap = int(args.max_matches)
-    out_entries_d = cp.empty((out_cap, 3), dtype=cp.uint32)  # packet, offset/end, pattern
-    out_count_d = cp.zeros((1,), dtype=cp.uint64)
-
-    # Kernels
-    bmh_small, bmh_large, pfac_small, pfac_large = build_kernels(args.tile_bytes)
-
-    threads = BLOCK_SIZE
-    blocks_small = max(1, num_packets)
-    blocks_large = max(1, len(large_idx))
-
-    # Start search timing
-    search_start = time.time()
+    if args.match_format and args.match_format != FORMAT_AGGREGATE and not args.match_output:
+        ap.error("--match-format needs --match-output")
+    try:
+        packet_filter = PacketFilter.parse(args.proto, args.port, args.src_net, args.payload_only)
+    except ValueError as e:
+        ap.error(str(e))
+
+    load_time = 0.0
+    search_time = 0.0
     total_matches = 0
+    num_packets = 0
+    total_bytes = 0
+
+    # Warm runs find the capture's packet tables in the cache and go straight to searching
+    load_start = time.time()
+    index_cache = IndexCache(args.index_cache_dir, args.index_cache_mb) if args.index_cache_mb > 0 else None
+    # In --dir mode the first capture stands in for all of them (workload shape, prefilter anchors)
+    index, ranges, byte_counts = prepare_capture(captures[0], index_cache, packet_filter, args.prefilter)
+    load_time += time.time() - load_start
 
-    if len(patterns) <= BMH_MAX_PATTERNS:
-        # Few-patterns: BMH per needle
-        for pid, p in enumerate(patterns):
-            pat_d = cp.asarray(np.frombuffer(p, dtype=np.uint8))
-            m = np.int32(len(p))
-            badchar_d = cp.asarray(make_badchar_table(p).astype(np.uint8))
-            out_count_d.fill(0)
-
-            # small packets path
-            bmh_small((blocks_small,), (threads,),
-                      (bigbuf_d, offsets_d, lengths_d, np.int32(num_packets),
-                       pat_d, m, badchar_d, np.uint32(pid),
-                       out_entries_d.ravel(), out_count_d, np.uint32(out_cap)))
-
-            # large packets path
-            if len(large_idx):
-                shared_mem = args.tile_bytes + (len(p) - 1)
-                bmh_large((blocks_large,), (threads,),
-                          (bigbuf_d, offsets_d, lengths_d,
-                    large_idx_d, np.int32(len(large_idx)),
-                           pat_d, m, badchar_d, np.uint32(pid),
-                           out_entries_d.ravel(), out_count_d, np.uint32(out_cap)),
-                          shared_mem=shared_mem)
+    sink = None
+    if args.aggregate_only or args.match_format == FORMAT_AGGREGATE:
+        # Per-flow counts need the cached flow metadata (not available with --index-cache-mb 0)
+        try:
+            sink = open_sink(args.match_output, patterns, FORMAT_AGGREGATE, index.flow_ids,
+                             flow_namer=lambda keys: flow_labels(captures[0], index, keys))
+        except ValueError as e:
+            ap.error(str(e))
+    elif args.match_output:
+        # One result stream for all captures of --dir, every row tagged with its file
+        names = [os.path.relpath(p, args.dir) for p in captures] if args.dir is not None else None
+        sink = open_sink(args.match_output, patterns, args.match_format, files=names)
 
-            cp.cuda.Device().synchronize()
+    automaton_cache = None if args.no_automaton_cache else AutomatonCache(args.automaton_cache_dir)
 
-            count = int(out_count_d.get()[0])
-            count = min(count, out_cap)
-            total_matches += count
-            # Remove individual match printing
-            # if count:
-            #     entries = out_entries_d.get()[:count]
-            #     order = np.lexsort((entries[:,2], entries[:,1], entries[:,0]))
-            #     for row in entries[order]:
-            #         print(f"packet={int(row[0])} offset={int(row[1])} pattern={int(row[2])}")
+    def make_prefilter(strategy: Strategy) -> Optional[AnchorPrefilter]:
+        if byte_counts is None:
+            return None
+        # BMH costs one pass per pattern, so anchoring some of them pays; PFAC costs the same per byte
+        return AnchorPrefilter(patterns, byte_counts, args.prefilter_rate, partial=strategy.algorithm == ALGORITHM_BMH)
 
+    def make_backend(strategy: Strategy, sink: Optional[MatchSink] = None):
+        prefilter = make_prefilter(strategy)
+        if backend_name == BACKEND_GPU:
+            return GPUSearch(patterns, strategy.algorithm, strategy.tile_bytes, strategy.large_threshold,
+                             args.max_matches, automaton_cache, sink, prefilter)
+        return CPUSearch(patterns, strategy.algorithm, strategy.tile_bytes, strategy.large_threshold,
+                         automaton_cache, sink, args.workers, prefilter)
+
+    # Strategy: the host's tuning profile for this workload, else the fixed cutovers; explicit options win
+    profile = TuningProfile.load(backend_id(backend_name, args.workers), args.tuning_dir)
+    if args.calibrate:
+        if sink is not None:
+            sink.close()
+        run_calibration(args.capture, index, ranges if ranges is not None else ScanRanges.whole_packets(index),
+                        patterns, make_backend, profile, args.sample_mb, DEFAULT_REPEATS)
+        return
+    shape = WorkloadShape.measure(patterns, ranges.lengths if ranges is not None else index.lengths)
+    strategy = None if args.no_tuning else profile.best(shape)
+    strategy_source = "tuning profile" if strategy else "defaults"
+    if strategy is None:
+        strategy = default_strategy(len(patterns), BMH_MAX_PATTERNS, DEFAULT_LARGE_PKT_THRESHOLD, DEFAULT_TILE_BYTES)
+    if args.algorithm != "auto":
+        strategy.algorithm = ALGORITHM_BMH if args.algorithm == "bmh" else ALGORITHM_PFAC
+    if not literal and strategy.algorithm == ALGORITHM_BMH:
+        strategy.algorithm = ALGORITHM_PFAC
+        strategy_source += " (PFAC for wildcard/class patterns)"
+    if args.large_threshold is not None:
+        strategy.large_threshold = args.large_threshold
+    if args.tile_bytes is not None:
+        strategy.tile_bytes = args.tile_bytes
+    if args.algorithm != "auto" or args.large_threshold is not None or args.tile_bytes is not None:
+        strategy_source += " + options"
+    if args.dir is not None:
+        compile_start = time.time()
+        backend = make_backend(strategy)
+        load_time += time.time() - compile_start
+        run_directory_mode(args, captures, patterns, sink, backend, backend_name, strategy,
+                           strategy_source, packet_filter, index_cache, load_time)
+        return
+    pipe = None
+    if args.pipeline:
+        # Row sinks are written by the reporter thread; aggregate sinks only count, inline
+        if sink is not None and not isinstance(sink, AggregateSink):
+            sink = ReporterSink(sink, 4 * args.pipeline_depth)
+        backend = make_backend(strategy, sink)
+        batch_bytes = (args.batch_mb or DEFAULT_BATCH_MB) * 1024 * 1024
+        pipe = ScanPipeline(args.capture, ranges if ranges is not None else ScanRanges.whole_packets(index),
+                            batch_bytes, search_stage(backend), sink if isinstance(sink, ReporterSink) else None,
+                            args.pipeline_depth, pinned_buffer if backend_name == BACKEND_GPU else None)
+        try:
+            total_matches = pipe.run()
+        finally:
+            if isinstance(backend, CPUSearch):
+                backend.close()
+            if sink is not None:
+                sink.close()
+        reader_stats, packer_stats, search_stats = pipe.stats
+        setup_time = load_time
+        load_time += reader_stats.busy + packer_stats.busy
+        search_time = search_stats.busy
+        num_packets, total_bytes = pipe.num_packets, pipe.total_bytes
     else:
-        # Many-patterns: PFAC
-        pf = PFAC(patterns)
-        goto_d = cp.asarray(pf.goto, dtype=cp.int32).ravel()
-        out_index_d = cp.asarray(pf.out_index, dtype=cp.int32)
-        out_counts_d = cp.asarray(pf.out_counts, dtype=cp.int32)
-        flat_out_d = cp.asarray(pf.flat_out, dtype=cp.int32)
-        max_steps = np.int32(pf.max_pat_len)
-        out_count_d.fill(0)
-
-        # small packets
-        pfac_small((blocks_small,), (threads,),
-                   (bigbuf_d, offsets_d, lengths_d, np.int32(num_packets),
-                    goto_d, np.int32(pf.goto.shape[0]),
-                    out_index_d, out_counts_d, flat_out_d,
-                max_steps,
-                    out_entries_d.ravel(), out_count_d, np.uint32(out_cap)))
-
-        # large packets
-        if len(large_idx):
-            pfac_large((blocks_large,), (threads,),
-                       (bigbuf_d, offsets_d, lengths_d,
-                large_idx_d, np.int32(len(large_idx)),
-                        goto_d, np.int32(pf.goto.shape[0]),
-                        out_index_d, out_counts_d, flat_out_d,
-                max_steps,
-                        out_entries_d.ravel(), out_count_d, np.uint32(out_cap)),
-                       shared_mem=args.tile_bytes)
-
-        cp.cuda.Device().synchronize()
-
-        count = int(out_count_d.get()[0])
-        total_matches = min(count, out_cap)
-        # Remove individual match printing
-        # if count:
-        #     entries = out_entries_d.get()[:count]
-        #     # Convert PFAC end offsets (1-based) to start offsets using pattern lengths
-        #     pat_lens = np.array([len(p) for p in patterns], dtype=np.int32)
-        #     start_offsets = entries[:,1] - pat_lens[entries[:,2]]
-        #     order = np.lexsort((entries[:,2], start_offsets, entries[:,0]))
-        #     for row in entries[order]:
-        #         pid = int(row[2])
-        #         end_off = int(row[1])
-        #         start_off = end_off - int(pat_lens[pid])
-        #         print(f"packet={int(row[0])} offset={start_off} pattern={pid}")
-
-    # End search timing
-    search_time = time.time() - search_start
-    
+        backend = make_backend(strategy, sink)
+        batch_bytes = args.batch_mb * 1024 * 1024 if args.batch_mb > 0 else os.path.getsize(args.capture)
+        batches = iter_capture_batches(args.capture, batch_bytes, index, ranges)
+        try:
+            while True:
+                # Start timing
+                load_start = time.time()
+                batch = next(batches, None)
+                load_time += time.time() - load_start
+                if batch is None:
+                    break
+                bigbuf_h, offsets_h, lengths_h, packet_ids, range_offsets = batch
+                num_packets += len(lengths_h)
+                total_bytes += len(bigbuf_h)
+
+                # Move batch to the device (GPU memory, or the CPU workers' shared buffer)
+                backend.upload(bigbuf_h, offsets_h, lengths_h, packet_ids, range_offsets)
+
+                # Start search timing (includes handing matches to the sink)
+                search_start = time.time()
+                total_matches += backend.search()
+                search_time += time.time() - search_start
+        finally:
+            batches.close()
+            if isinstance(backend, CPUSearch):
+                backend.close()
+            if sink is not None:
+                sink.close()
+
     # Calculate throughput (excluding load time)
     file_size_mb = total_bytes / (1024 * 1024)
     throughput = file_size_mb / search_time if search_time > 0 else 0
@@ -608,11 +1083,12 @@ def main():
     # Prepare results
     results = {
         'pcap_file': os.path.basename(args.capture),
+        'backend': f"{backend_name}/{strategy.algorithm}",
         'file_size_mb': file_size_mb,
         'num_patterns': len(patterns),
         'load_time': load_time,
         'search_time': search_time,
-        'total_time': load_time + search_time,
+        'total_time': load_time + search_time if pipe is None else setup_time + pipe.wall,
         'throughput_mbps': throughput,
         'num_matches': total_matches,
         'num_packets': num_packets
@@ -621,24 +1097,34 @@ def main():
     # Output results
     if args.csv_output:
         # Write to CSV
-        file_exists = os.path.exists(args.csv_output)
-        with open(args.csv_output, 'a', newline='') as csvfile:
-            fieldnames = ['pcap_file', 'file_size_mb', 'num_patterns', 'load_time', 
-                         'search_time', 'total_time', 'throughput_mbps', 'num_matches', 'num_packets']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(results)
+        append_results_csv(args.csv_output, [results])
         print(f"Results written to {args.csv_output}")
     else:
         # Print summary
         print(f"File: {results['pcap_file']}")
         print(f"Size: {results['file_size_mb']:.2f} MB")
+        if ranges is not None:
+            print(f"Scanned: {num_packets:,} of {len(index):,} packets, "
+                  f"{total_bytes / max(1, index.total_bytes):.1%} of packet bytes ({packet_filter.describe()})")
         print(f"Patterns: {results['num_patterns']}")
+        print(f"Backend: {backend_name}, {strategy.describe()} [{strategy_source}]")
+        if byte_counts is not None:
+            print(f"Prefilter: {backend.prefilter.describe()}")
         print(f"Load time: {results['load_time']:.3f}s")
+        if pipe is not None:
+            print(f"Pipeline: {pipe.describe()}")
         print(f"Search time: {results['search_time']:.3f}s")
         print(f"Throughput: {results['throughput_mbps']:.2f} MB/s")
         print(f"Matches: {results['num_matches']:,}")
+        if isinstance(sink, AggregateSink):
+            for pid, (p, count) in enumerate(zip(patterns, sink.pattern_counts)):
+                print(f"  pattern {pid} {p!r}: {int(count):,}")
+            for _, name, count in sink.top_flows():
+                print(f"  flow {name}: {count:,}")
+        if sink is not None and args.match_output:
+            print(f"Matches written to {args.match_output}")
+        if index_cache:
+            print(index_cache.format_stats())
 
 if __name__ == "__main__":
     main()
@@ -1,104 +1,160 @@
 #!/usr/bin/env python3
 """
 Comprehensive GPU PCAP Test Runner
-Runs newtest.py across all PCAP files and pattern combinations
+Runs every capture x pattern set x backend x worker count through the shared benchmark
+harness (../benchmark_harness.py): warmup, then timed runs until the median is known
+to +-5%, results kept in a SQLite store keyed by environment, and an interrupted run
+resumes where it stopped. Results can be compared against a saved baseline (exit
+status 2 on a regression that a rerun reproduces) and written as an HTML/Markdown report with charts.
+
+Usage:
+    python run_comprehensive_test.py                                   # default captures and pattern sets
+    python run_comprehensive_test.py --capture a.pcap --backend cpu-bmh --backend cpu-automaton --workers 1 4
+    python run_comprehensive_test.py --backend command:gpupcapgrep.exe --pattern-file ../Test2*/test_patterns_7.txt
+    python run_comprehensive_test.py --save-baseline main                # remember these numbers
+    python run_comprehensive_test.py --baseline main --report report.html  # later: compare and report
+    python run_comprehensive_test.py --list-backends
 """
 
-import subprocess
+import argparse
 import os
 import sys
-from datetime import datetime
+
+import newtest                      # registers the cupy-bmh / cupy-pfac plugins (and puts .. on sys.path)
+from benchmark_harness import (BackendSpec, BenchmarkMatrix, BenchmarkRunner, PatternSet, ResultStore, compare,
+                               list_backends, print_summary, DEFAULT_CI_TARGET, DEFAULT_MAX_REPEATS,
+                               DEFAULT_MAX_SECONDS, DEFAULT_REGRESSION_THRESHOLD, DEFAULT_REPEATS, DEFAULT_WARMUP)
+from benchmark_report import write_report
+
+# Define test patterns
+PATTERN_SETS = [
+    PatternSet("patterns_1", ["password"]),
+    PatternSet("patterns_7", ["password", "GET", "POST", "HTTP", "HTTPS", "User-Agent", "Authorization"]),
+    PatternSet("patterns_14", ["password", "GET", "POST", "HTTP", "HTTPS", "User-Agent", "Authorization",
+                               "admin", "login", "session", "token", "malware", "virus", "exploit", "vulnerability"]),
+]
+
+# Define PCAP files to test
+PCAP_FILES = [
+    "PCAP Files/synthetic_50mb.pcapng",
+    "PCAP Files/synthetic_100mb.pcapng",
+    "PCAP Files/synthetic_200mb.pcapng",
+    "PCAP Files/synthetic_500mb.pcapng",
+    "PCAP Files/synthetic_1000mb.pcapng",
+    "PCAP Files/synthetic_large_50mb.pcapng",
+    "PCAP Files/synthetic_large_100mb.pcapng",
+    "PCAP Files/synthetic_large_200mb.pcapng",
+    "PCAP Files/synthetic_large_500mb.pcapng",
+    "PCAP Files/synthetic_large_1000mb.pcapng",
+]
+
+DEFAULT_STORE = "gpu_test_results.sqlite"
+
+
+def default_backends():
+    """The GPU kernels when CuPy sees a device, otherwise their CPU counterparts"""
+    if newtest.gpu_available():
+        return ["cupy-bmh", "cupy-pfac"]
+    return ["cpu-bmh", "cpu-automaton"]
+
 
 def run_comprehensive_test():
-    """Run comprehensive test across all PCAP files and pattern counts"""
-    
-    # Define test patterns
-    patterns_1 = ["password"]
-    patterns_7 = ["password", "GET", "POST", "HTTP", "HTTPS", "User-Agent", "Authorization"]
-    patterns_14 = ["password", "GET", "POST", "HTTP", "HTTPS", "User-Agent", "Authorization", 
-                   "admin", "login", "session", "token", "malware", "virus", "exploit", "vulnerability"]
-    
-    # Define PCAP files to test
-    pcap_files = [
-        "PCAP Files/synthetic_50mb.pcapng",
-        "PCAP Files/synthetic_100mb.pcapng", 
-        "PCAP Files/synthetic_200mb.pcapng",
-        "PCAP Files/synthetic_500mb.pcapng",
-        "PCAP Files/synthetic_1000mb.pcapng",
-        "PCAP Files/synthetic_large_50mb.pcapng",
-        "PCAP Files/synthetic_large_100mb.pcapng",
-        "PCAP Files/synthetic_large_200mb.pcapng", 
-        "PCAP Files/synthetic_large_500mb.pcapng",
-        "PCAP Files/synthetic_large_1000mb.pcapng"
-    ]
-    
+    """Run comprehensive test across all PCAP files, pattern sets and backends"""
+    ap = argparse.ArgumentParser(description="Benchmark scanner backends over captures and pattern sets")
+    ap.add_argument("--capture", action="append", help="Capture to test (repeatable; default: the PCAP Files set)")
+    ap.add_argument("--pattern-file", action="append",
+                    help="Pattern set file, one pattern per line (repeatable; default: 1, 7 and 14 patterns)")
+    ap.add_argument("--backend", action="append",
+                    help="Backend plugin, name or name:option (repeatable; see --list-backends; "
+                         "default: cupy-bmh and cupy-pfac, or cpu-bmh and cpu-automaton without a GPU)")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1],
+                    help="Worker counts for backends that use them (0 = one per core)")
+    ap.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="Untimed runs per scenario")
+    ap.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Timed runs per scenario, at least")
+    ap.add_argument("--max-repeats", type=int, default=DEFAULT_MAX_REPEATS, help="Timed runs per scenario, at most")
+    ap.add_argument("--ci-target", type=float, default=DEFAULT_CI_TARGET,
+                    help="Repeat until the 95%% CI of the median is within +- this fraction (default %(default)s)")
+    ap.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+                    help="Timed-run budget per scenario once --repeats runs are done (default %(default)ss)")
+    ap.add_argument("--baseline", help="Compare against this saved baseline and flag regressions")
+    ap.add_argument("--save-baseline", metavar="NAME", help="Save this run's statistics as baseline NAME")
+    ap.add_argument("--regression-threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                    help="Median throughput drop that counts as a regression (default %(default)s)")
+    ap.add_argument("--report", help="Write an .html or .md report with throughput charts")
+    ap.add_argument("--store", default=DEFAULT_STORE, help="SQLite result store (default %(default)s)")
+    ap.add_argument("--export", help="Also write every stored run to this .csv, .json or .parquet file")
+    ap.add_argument("--no-resume", action="store_true", help="Run every scenario again, even if stored")
+    ap.add_argument("--list-backends", action="store_true", help="List the backend plugins and exit")
+    args = ap.parse_args()
+
+    if args.report and os.path.splitext(args.report)[1].lower() not in (".html", ".htm", ".md"):
+        ap.error("--report must end in .html or .md")
+
+    if args.list_backends:
+        print("Backends:")
+        list_backends()
+        return 0
+
     # Check which files actually exist
     existing_files = []
-    for pcap_file in pcap_files:
+    for pcap_file in args.capture or PCAP_FILES:
         if os.path.exists(pcap_file):
             existing_files.append(pcap_file)
         else:
             print(f"Warning: {pcap_file} not found, skipping...")
-    
     if not existing_files:
         print("No PCAP files found!")
-        return
-    
-    # Create results CSV
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    csv_filename = f"gpu_test_results_{timestamp}.csv"
-    
-    print(f"Starting comprehensive GPU PCAP tests...")
-    print(f"Results will be saved to: {csv_filename}")
-    print(f"Testing {len(existing_files)} PCAP files with 1, 7, and 14 patterns each")
+        return 1
+
+    pattern_sets = [PatternSet.from_file(p) for p in args.pattern_file] if args.pattern_file else PATTERN_SETS
+    try:
+        matrix = BenchmarkMatrix(existing_files, pattern_sets,
+                                 [BackendSpec.parse(b) for b in args.backend or default_backends()], args.workers)
+    except ValueError as e:
+        ap.error(str(e))
+    scenarios = matrix.scenarios()
+
+    print("Starting comprehensive PCAP scanner tests...")
+    print(f"Results store: {args.store}")
+    print(f"{len(existing_files)} capture(s) x {len(pattern_sets)} pattern set(s) x "
+          f"{', '.join(b.label for b in matrix.backends)} = {len(scenarios)} scenario(s), "
+          f"{args.warmup} warmup + {args.repeats}-{max(args.repeats, args.max_repeats)} timed run(s) each")
     print("=" * 80)
-    
-    total_tests = len(existing_files) * 3
-    current_test = 0
-    
-    for pcap_file in existing_files:
-        for patterns, pattern_count in [(patterns_1, 1), (patterns_7, 7), (patterns_14, 14)]:
-            current_test += 1
-            print(f"[{current_test}/{total_tests}] Testing {os.path.basename(pcap_file)} with {pattern_count} patterns...")
-            
-            # Build command
-            cmd = ["python", "newtest.py", pcap_file, "--csv-output", csv_filename]
-            for pattern in patterns:
-                cmd.extend(["-s", pattern])
-            
+
+    store = ResultStore(args.store)
+    try:
+        if args.baseline and args.baseline not in store.baseline_names():
+            print(f"No baseline {args.baseline!r} in {args.store} (have: {', '.join(store.baseline_names()) or 'none'})")
+            return 1
+        runner = BenchmarkRunner(store, warmup=args.warmup, repeats=args.repeats, max_repeats=args.max_repeats,
+                                 ci_target=args.ci_target, max_seconds=args.max_seconds, resume=not args.no_resume)
+        stats = runner.run(scenarios)
+        comparisons = []
+        if args.baseline:
+            comparisons = compare(stats, store.baseline(args.baseline), args.regression_threshold)
+            stats, comparisons = runner.confirm(stats, comparisons, args.regression_threshold)
+        print("=" * 80)
+        print_summary(stats, comparisons)
+        if args.save_baseline:
+            store.save_baseline(args.save_baseline, stats)
+            print(f"\nSaved {len(stats)} scenario(s) as baseline {args.save_baseline!r}")
+        if args.report:
+            write_report(args.report, stats, comparisons, store)
+            print(f"\nReport written to {args.report}")
+        if args.export:
             try:
-                # Run the test
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-                
-                if result.returncode == 0:
-                    print(f"  ✓ Success")
-                else:
-                    print(f"  ✗ Error: {result.stderr}")
-                    
-            except subprocess.TimeoutExpired:
-                print(f"  ✗ Timeout after 5 minutes")
-            except Exception as e:
-                print(f"  ✗ Exception: {e}")
-    
-    print("=" * 80)
-    print(f"Testing completed! Results saved to {csv_filename}")
-    
-    # Show summary
-    if os.path.exists(csv_filename):
-        import pandas as pd
-        try:
-            df = pd.read_csv(csv_filename)
-            successful_tests = df[df['throughput_mbps'] > 0]
-            if len(successful_tests) > 0:
-                avg_throughput = successful_tests['throughput_mbps'].mean()
-                max_throughput = successful_tests['throughput_mbps'].max()
-                total_matches = successful_tests['num_matches'].sum()
-                
-                print(f"Average throughput: {avg_throughput:.2f} MB/s")
-                print(f"Maximum throughput: {max_throughput:.2f} MB/s")
-                print(f"Total matches found: {total_matches:,}")
-        except ImportError:
-            print("Install pandas to see summary statistics: pip install pandas")
+                store.export(args.export)
+            except (RuntimeError, ValueError) as e:
+                print(f"Export failed: {e}")
+                return 1
+            print(f"\nAll stored runs exported to {args.export}")
+    finally:
+        store.close()
+    if args.baseline and all(c.missing for c in comparisons):
+        print(f"\nNo scenario of this run is in baseline {args.baseline!r} (other captures, patterns, backends "
+              f"or hardware): nothing was compared")
+        return 1
+    return 2 if any(c.regression for c in comparisons) else 0
 
 if __name__ == "__main__":
-    run_comprehensive_test()
+    sys.exit(run_comprehensive_test())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Array-Backed Aho-Corasick Automaton
+
+This module compiles a pattern set into a dense DFA for the CPU scanners. Unlike the
+failureless PFAC table used on the GPU, failure transitions are folded into the goto
+matrix, so every byte costs exactly one table lookup regardless of how many patterns
+are loaded.
+
+Key Features:
+- `delta`: int32[num_states, 256] DFA with failure links resolved at build time, stored
+  premultiplied (next_state * 256) so a cached table is scanned straight from its mmap
+- Flat output arrays (`out_index`, `out_counts`, `flat_out`) in the same layout as PFAC
+- Accepting states numbered last, so a match test is a single comparison
+- Batched scan over an (offsets, lengths, buffer) triple: all packets advance one byte
+  per NumPy step, with long packets split into overlapping lanes
+- Wildcard, byte-class and nocase patterns (patterns.BytePattern) are compiled by subset
+  construction over byte classes: bytes that no pattern position tells apart share one
+  transition, so a nocase pattern costs no more states than its literal form
+
+The host-side builder for the GPU's failureless PFAC tables lives here as well, so both
+automata can be built (and cached, see automaton_cache.py) without a GPU.
+
+Usage:
+    dfa = AhoCorasickDFA([b"GET /", b"password", b"\\x90\\x90\\x90\\x90"])
+    packet_ids, offsets, pattern_ids = dfa.scan(bigbuf, offsets, lengths)
+"""
+
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from patterns import literal_only, position_masks
+
+# Lanes are at most this long (plus pattern overlap) unless the batch is small;
+# more lanes mean wider NumPy steps and fewer of them.
+MIN_LANES = 16384
+MIN_LANE_BYTES = 256
+STEP_BLOCK = 64                 # bytes per lane gathered and transposed at a time
+MAX_CLASS_STATES = 1 << 20      # subset construction limit for wildcard/class patterns
+
+MatchArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]   # (packet_ids, offsets, pattern_ids)
+
+
+class AhoCorasickDFA:
+    """Dense Aho-Corasick DFA over bytes with flat output tables"""
+
+    def __init__(self, patterns: List[bytes]):
+        if any(len(p) == 0 for p in patterns):
+            raise ValueError("Empty patterns are not supported")
+        self.patterns = patterns
+        self.pattern_lengths = np.array([len(p) for p in patterns], dtype=np.int32)
+        self.max_pat_len = max((len(p) for p in patterns), default=0)
+
+        if literal_only(patterns):
+            goto, out = _literal_dfa(patterns)
+        else:
+            goto, out = build_class_automaton(patterns, restart=True)
+        num_states = len(goto)
+
+        # Renumber so that accepting states come last (root stays 0)
+        accepting = np.array([bool(lst) for lst in out])
+        order = np.concatenate([np.flatnonzero(~accepting), np.flatnonzero(accepting)])
+        new_id = np.empty(num_states, dtype=np.int32)
+        new_id[order] = np.arange(num_states, dtype=np.int32)
+        goto = new_id[goto[order]]
+        self.first_accepting = int(num_states - accepting.sum())
+        out = [out[i] for i in order]
+
+        self.out_counts = np.array([len(lst) for lst in out], dtype=np.int32)
+        self.out_index = np.zeros(num_states, dtype=np.int32)
+        np.cumsum(self.out_counts[:-1], out=self.out_index[1:])
+        self.flat_out = np.array([pid for lst in out for pid in lst], dtype=np.int32)
+
+        # Premultiplied for scanning: entries are next_state * 256, so the next lookup
+        # index is just entry + byte (int32 keeps the table cache-friendlier). This is the
+        # only copy of the transitions; goto is derived from it on request.
+        if num_states >= (1 << 23):
+            raise ValueError(f"Automaton too large ({num_states} states)")
+        goto *= 256
+        self.delta = goto
+        self._delta = goto.ravel()
+
+    @classmethod
+    def from_arrays(cls, patterns: List[bytes], arrays: Dict[str, np.ndarray]) -> "AhoCorasickDFA":
+        """Rebuild from the tables returned by arrays() (e.g. a memory-mapped cache entry)"""
+        dfa = cls.__new__(cls)
+        dfa.patterns = patterns
+        dfa.pattern_lengths = np.array([len(p) for p in patterns], dtype=np.int32)
+        dfa.max_pat_len = max((len(p) for p in patterns), default=0)
+        dfa.delta = arrays["delta"]
+        dfa.out_index = arrays["out_index"]
+        dfa.out_counts = arrays["out_counts"]
+        dfa.flat_out = arrays["flat_out"]
+        dfa.first_accepting = int(arrays["first_accepting"])
+        dfa._delta = dfa.delta.reshape(-1)          # a view: the mmap'd table is not copied
+        return dfa
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"delta": self.delta, "out_index": self.out_index, "out_counts": self.out_counts,
+                "flat_out": self.flat_out, "first_accepting": np.int32(self.first_accepting)}
+
+    @property
+    def goto(self) -> np.ndarray:
+        """int32[num_states, 256] next-state table (a new array; scanning uses delta)"""
+        return self.delta // 256
+
+    @property
+    def num_states(self) -> int:
+        return len(self.delta)
+
+    def scan(self, buffer: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> MatchArrays:
+        """Find every (possibly overlapping) occurrence of every pattern in every packet.
+
+        `buffer` is uint8; packet i is buffer[offsets[i]:offsets[i] + lengths[i]].
+        Returns (packet_ids, start offsets within the packet, pattern_ids) sorted by
+        packet, offset and pattern.
+        """
+        buffer = np.asarray(buffer, dtype=np.uint8)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        if self.max_pat_len == 0 or len(lengths) == 0:
+            return empty
+
+        lane_pkt, lane_start, lane_len, lane_own = self._lanes(offsets, lengths)
+        order = np.argsort(-lane_len, kind="stable")
+        lane_pkt, lane_start, lane_len, lane_own = (lane_pkt[order], lane_start[order],
+                                                    lane_len[order], lane_own[order])
+        # Lanes sorted by length descending: the lanes still running at step j are a prefix
+        running = np.searchsorted(-lane_len, -np.arange(int(lane_len[0]) if len(lane_len) else 0), side="left")
+
+        delta = self._delta
+        threshold = self.first_accepting * 256
+        state = np.zeros(len(lane_len), dtype=np.int32)
+        index = np.empty(len(lane_len), dtype=np.int32)
+        steps_per_block = np.arange(STEP_BLOCK, dtype=np.int64)
+        if len(buffer) < STEP_BLOCK:
+            buffer = np.concatenate([buffer, np.zeros(STEP_BLOCK, dtype=np.uint8)])
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, STEP_BLOCK)
+        last_window = len(windows) - 1
+        hit_lane, hit_step, hit_state = [], [], []
+        for j0 in range(0, len(running), STEP_BLOCK):
+            # Gather the next STEP_BLOCK bytes of every running lane and transpose them,
+            # so each step below reads one contiguous row instead of scattered bytes.
+            n0 = int(running[j0])
+            src = lane_start[:n0] + j0
+            rows = windows[np.minimum(src, last_window)]
+            tail = np.flatnonzero(src > last_window)     # lanes ending within a block of the buffer end
+            if len(tail):
+                rows[tail] = buffer[np.minimum(src[tail, None] + steps_per_block, len(buffer) - 1)]
+            block = np.ascontiguousarray(rows.T)
+            for jj, n in enumerate(running[j0:j0 + STEP_BLOCK].tolist()):
+                cur = state[:n]
+                np.add(cur, block[jj, :n], out=index[:n])
+                np.take(delta, index[:n], out=cur)
+                hits = np.flatnonzero(cur >= threshold)
+                if len(hits):
+                    hit_lane.append(hits)
+                    hit_step.append(np.full(len(hits), j0 + jj, dtype=np.int64))
+                    hit_state.append(cur[hits] >> 8)
+        if not hit_lane:
+            return empty
+
+        lanes = np.concatenate(hit_lane)
+        steps = np.concatenate(hit_step)
+        states = np.concatenate(hit_state)
+        keep = steps >= lane_own[lanes]             # match ends inside the lane's own region
+        lanes, steps, states = lanes[keep], steps[keep], states[keep]
+
+        # Expand every accepting state into its pattern ids
+        counts = self.out_counts[states]
+        pattern_ids = self.flat_out[np.repeat(self.out_index[states], counts)
+                                    + _ramp(counts)]
+        lanes = np.repeat(lanes, counts)
+        end = lane_start[lanes] - offsets[lane_pkt[lanes]] + np.repeat(steps, counts)
+        starts = end - self.pattern_lengths[pattern_ids] + 1
+        packet_ids = lane_pkt[lanes]
+        order = np.lexsort((pattern_ids, starts, packet_ids))
+        return packet_ids[order], starts[order], pattern_ids[order]
+
+    def scan_bytes(self, data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """Occurrences in a single buffer as (start offsets, pattern_ids)"""
+        buf = np.frombuffer(data, dtype=np.uint8)
+        _, starts, pattern_ids = self.scan(buf, np.zeros(1, dtype=np.int64), np.array([len(buf)]))
+        return starts, pattern_ids
+
+    def _lanes(self, offsets: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """Split packets into lanes of similar length.
+
+        A lane owns packet bytes [own_from, own_to) but starts scanning up to
+        max_pat_len - 1 bytes earlier, so every match ending in its own region is seen
+        from a root state. Returns (packet id, buffer start, scan length, index of the
+        first owned byte within the lane) per lane.
+        """
+        total = int(lengths.sum())
+        lane_bytes = max(MIN_LANE_BYTES, 4 * self.max_pat_len, total // MIN_LANES)
+        per_pkt = np.maximum(1, -(-lengths // lane_bytes))
+        pkt = np.repeat(np.arange(len(lengths), dtype=np.int64), per_pkt)
+        k = _ramp(per_pkt)
+        own_from = k * lane_bytes
+        own_to = np.minimum(own_from + lane_bytes, lengths[pkt])
+        scan_from = np.maximum(0, own_from - (self.max_pat_len - 1))
+        return pkt, offsets[pkt] + scan_from, own_to - scan_from, own_from - scan_from
+
+
+class PFAC:
+    """Failureless Aho-Corasick tables for the GPU kernels (goto is -1 where the trie has no edge)
+
+    Each (start, pattern) occurrence is reported exactly once, by the walk from its start.
+    """
+
+    def __init__(self, patterns: List[bytes]):
+        self.patterns = patterns
+        self.max_pat_len = max((len(p) for p in patterns), default=0)
+
+        # No failure links: every start position walks the trie on its own, so a state
+        # reports only the patterns ending exactly there. Folding in the outputs of
+        # failure states would report suffix patterns again from earlier starts.
+        if not literal_only(patterns):
+            goto, self.out = build_class_automaton(patterns, restart=False)
+        else:
+            self.next: List[Dict[int,int]] = [dict()]
+            self.out: List[List[int]] = [[]]
+            for pid, pat in enumerate(patterns):
+                node = 0
+                for b in pat:
+                    node = self.next[node].setdefault(b, len(self.next))
+                    if node == len(self.out):
+                        self.next.append(dict())
+                        self.out.append([])
+                self.out[node].append(pid)
+
+            goto = np.full((len(self.next), 256), -1, dtype=np.int32)
+            for state, trans in enumerate(self.next):
+                for b, s in trans.items():
+                    goto[state, b] = s
+
+        out_counts = np.array([len(lst) for lst in self.out], dtype=np.int32)
+        out_index = np.zeros(len(self.out), dtype=np.int32)
+        total_out = int(out_counts.sum())
+        flat = np.zeros(total_out, dtype=np.int32)
+        k = 0
+        for i, lst in enumerate(self.out):
+            out_index[i] = k
+            if lst:
+                flat[k:k+len(lst)] = np.array(lst, dtype=np.int32)
+                k += len(lst)
+
+        self.goto = goto
+        self.out_index = out_index
+        self.out_counts = out_counts
+        self.flat_out = flat
+
+    @classmethod
+    def from_arrays(cls, patterns: List[bytes], arrays: Dict[str, np.ndarray]) -> "PFAC":
+        """Rebuild from the tables returned by arrays() (e.g. a memory-mapped cache entry)"""
+        pf = cls.__new__(cls)
+        pf.patterns = patterns
+        pf.max_pat_len = max((len(p) for p in patterns), default=0)
+        pf.goto = arrays["goto"]
+        pf.out_index = arrays["out_index"]
+        pf.out_counts = arrays["out_counts"]
+        pf.flat_out = arrays["flat_out"]
+        return pf
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"goto": self.goto, "out_index": self.out_index,
+                "out_counts": self.out_counts, "flat_out": self.flat_out}
+
+
+def _literal_dfa(patterns: List[bytes]) -> Tuple[np.ndarray, List[List[int]]]:
+    """Aho-Corasick goto matrix (failure links folded in) and outputs for literal patterns"""
+    # Trie
+    children: List[Dict[int, int]] = [dict()]
+    out: List[List[int]] = [[]]
+    for pid, pat in enumerate(patterns):
+        node = 0
+        for b in pat:
+            nxt = children[node].get(b)
+            if nxt is None:
+                nxt = children[node][b] = len(children)
+                children.append(dict())
+                out.append([])
+            node = nxt
+        out[node].append(pid)
+
+    # BFS: each row starts as a copy of its failure state's row (already complete,
+    # since failure states are shallower), then the trie edges are overlaid.
+    num_states = len(children)
+    goto = np.zeros((num_states, 256), dtype=np.int32)
+    fail = [0] * num_states
+    for b, s in children[0].items():
+        goto[0, b] = s
+    q = deque(children[0].values())
+    while q:
+        r = q.popleft()
+        goto[r] = goto[fail[r]]
+        for b, s in children[r].items():
+            fail[s] = goto[fail[r], b]
+            goto[r, b] = s
+            out[s].extend(out[fail[s]])
+            q.append(s)
+    return goto, out
+
+
+def build_class_automaton(patterns: List[bytes], restart: bool) -> Tuple[np.ndarray, List[List[int]]]:
+    """Goto matrix and outputs for patterns with per-position byte sets.
+
+    The patterns form a trie over byte sets, whose edges may overlap (a wildcard edge
+    next to a literal one), so the automaton is built by subset construction: a state is
+    the set of trie nodes reachable by the input so far. Bytes are first grouped into
+    classes that every pattern position either fully accepts or fully rejects; the
+    construction runs per class and the final matrix maps all 256 bytes through the
+    class table. With `restart` the root is in every state (Aho-Corasick: a match may
+    start at any byte); without it the walk ends (-1) when no node is left (PFAC).
+    """
+    masks = [position_masks(p) for p in patterns]
+    distinct, mask_ids = np.unique(np.concatenate(masks), axis=0, return_inverse=True)
+    _, byte_class = np.unique(distinct.T, axis=0, return_inverse=True)
+    byte_class = byte_class.ravel()
+    num_classes = int(byte_class.max()) + 1
+    class_sets = [np.unique(byte_class[d]).tolist() for d in distinct]
+
+    # Trie over distinct byte sets
+    children: List[Dict[int, int]] = [dict()]
+    out: List[List[int]] = [[]]
+    k = 0
+    for pid, m in enumerate(masks):
+        node = 0
+        for mid in mask_ids.ravel()[k:k + len(m)].tolist():
+            node = children[node].setdefault(mid, len(children))
+            if node == len(out):
+                children.append(dict())
+                out.append([])
+        k += len(m)
+        out[node].append(pid)
+
+    # Per node: byte class -> child nodes
+    moves: List[Dict[int, List[int]]] = []
+    for edges in children:
+        mv: Dict[int, List[int]] = {}
+        for mid, child in edges.items():
+            for c in class_sets[mid]:
+                mv.setdefault(c, []).append(child)
+        moves.append(mv)
+
+    states = [(0,)]
+    state_ids = {(0,): 0}
+    rows, state_out = [], []
+    base = np.zeros(num_classes, dtype=np.int32) if restart else np.full(num_classes, -1, dtype=np.int32)
+    i = 0
+    while i < len(states):
+        nodes = states[i]
+        targets: Dict[int, set] = {}
+        for n in nodes:
+            if restart and n == 0 and i > 0:
+                continue                    # the root's moves are already in the start row
+            for c, nxt in moves[n].items():
+                targets.setdefault(c, set()).update(nxt)
+        row = base.copy()
+        for c, nxt in targets.items():
+            if restart:
+                nxt.add(0)
+                nxt.update(moves[0].get(c, ()))
+            key = tuple(sorted(nxt))
+            sid = state_ids.get(key)
+            if sid is None:
+                sid = state_ids[key] = len(states)
+                states.append(key)
+                if len(states) > MAX_CLASS_STATES:
+                    raise ValueError(f"Automaton too large (over {MAX_CLASS_STATES} states); "
+                                     "split the wildcard patterns into smaller sets")
+            row[c] = sid
+        rows.append(row)
+        state_out.append(sorted(pid for n in nodes for pid in out[n]))
+        if restart and i == 0:
+            base = row
+        i += 1
+    goto = np.array(rows, dtype=np.int32)[:, byte_class]
+    return np.ascontiguousarray(goto), state_out
+
+
+def _ramp(counts: np.ndarray) -> np.ndarray:
+    """[0..counts[0]), [0..counts[1]), ... concatenated"""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    return np.arange(total, dtype=np.int64) - np.repeat(starts, counts)
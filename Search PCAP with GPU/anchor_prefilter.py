@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Rare-Byte Anchor Prefilter
+
+Automaton matchers (PFAC, the Aho-Corasick DFA) touch every byte of every packet. Most
+signatures, however, contain a byte that is rare in real traffic. This module picks for
+each pattern its rarest 2-4 byte window (the anchor), using byte frequencies measured on
+the capture itself, finds the positions of the anchors' rarest bytes with one vectorized
+table lookup over the packed buffer, and confirms only those candidates by exact
+comparison. Patterns whose anchors are too common to pay off are left to the automaton.
+
+Key Features:
+- One pass over the buffer for all anchored patterns (a 256-entry lookup table marks
+  every anchor byte); candidates are then grouped by byte value
+- Anchors are chosen by the product of their byte frequencies (add-one smoothed), and
+  the candidate budget (expected candidates per buffer byte) decides which patterns are
+  anchored at all
+- All-or-nothing mode for automaton matchers, whose per-byte cost does not shrink with
+  fewer patterns: a partial split would only add the prefilter's pass
+- Exact confirmation is vectorized: anchor bytes first, then the rest of the pattern,
+  dropping candidates as soon as one byte differs
+- Reports every occurrence, like the GPU kernels; `non_overlapping` reduces that to the
+  leftmost non-overlapping matches used by cpu_scanner.py
+- Wildcard, class and nocase patterns (patterns.BytePattern) are always left to the
+  automaton
+
+Usage:
+    counts = capture_byte_counts(src, index.data_offsets, index.lengths)
+    prefilter = AnchorPrefilter(patterns, counts)
+    packets, offsets, pattern_ids = prefilter.scan(bigbuf, offsets, lengths)
+    residual = [patterns[i] for i in prefilter.residual]      # for the automaton
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+from patterns import is_literal
+from pcap_index import gather_ranges
+
+ANCHOR_MIN_LEN = 2
+ANCHOR_MAX_LEN = 4
+DEFAULT_MAX_CANDIDATE_RATE = 1 / 32     # expected anchor-byte hits per buffer byte, all anchors together
+DEFAULT_SAMPLE_BYTES = 4 * 1024 * 1024
+SAMPLE_RUNS = 64
+
+MatchArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]   # (packet index, offset, pattern id)
+
+
+def capture_byte_counts(src: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+                        sample_bytes: int = DEFAULT_SAMPLE_BYTES) -> np.ndarray:
+    """Byte histogram (int64[256]) of about sample_bytes of the given ranges, sampled across the capture"""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total > sample_bytes:
+        # SAMPLE_RUNS evenly spaced runs of consecutive ranges
+        ends = np.cumsum(lengths)
+        run = max(1, sample_bytes // SAMPLE_RUNS)
+        firsts = np.searchsorted(ends, np.linspace(0, total - run, SAMPLE_RUNS).astype(np.int64), side="right")
+        lasts = np.searchsorted(ends, ends[firsts] - lengths[firsts] + run, side="right")
+        sel = np.unique(np.concatenate([np.arange(f, max(f + 1, l)) for f, l in zip(firsts, lasts)]))
+        sel = sel[sel < len(lengths)]
+        starts, lengths = starts[sel], lengths[sel]
+    buf = np.empty(int(lengths.sum()), dtype=np.uint8)
+    gather_ranges(src, starts, lengths, buf)
+    return np.bincount(buf, minlength=256).astype(np.int64)
+
+
+def non_overlapping(packets: np.ndarray, offsets: np.ndarray, pattern_ids: np.ndarray,
+                    pattern_lengths: np.ndarray) -> np.ndarray:
+    """Mask keeping the leftmost non-overlapping occurrences per (packet, pattern).
+
+    Input must be sorted by packet, pattern, then offset.
+    """
+    keep = np.ones(len(offsets), dtype=bool)
+    if len(offsets) < 2:
+        return keep
+    m = pattern_lengths[pattern_ids]
+    same = (packets[1:] == packets[:-1]) & (pattern_ids[1:] == pattern_ids[:-1])
+    clash = same & (offsets[1:] < offsets[:-1] + m[:-1])
+    if not clash.any():
+        return keep
+    # Greedy walk, only over the groups that contain overlaps (self-overlapping patterns)
+    group_start = np.flatnonzero(np.concatenate([[True], ~same]))
+    group_end = np.append(group_start[1:], len(offsets))
+    bad = np.unique(np.searchsorted(group_start, np.flatnonzero(clash), side="right") - 1)
+    for g in bad.tolist():
+        lo, hi = int(group_start[g]), int(group_end[g])
+        length = int(m[lo])
+        next_free = -1
+        for i, off in enumerate(offsets[lo:hi].tolist(), lo):
+            if off < next_free:
+                keep[i] = False
+            else:
+                next_free = off + length
+    return keep
+
+
+class AnchorPrefilter:
+    """Anchors for the patterns that are cheap to find by a rare byte; the rest is residual"""
+
+    def __init__(self, patterns: List[bytes], byte_counts: np.ndarray,
+                 max_candidate_rate: float = DEFAULT_MAX_CANDIDATE_RATE, partial: bool = True):
+        self.patterns = patterns
+        counts = np.asarray(byte_counts, dtype=np.float64) + 1.0
+        self.byte_freq = counts / counts.sum()
+        self.pattern_lengths = np.array([len(p) for p in patterns], dtype=np.int64)
+
+        # Rarest window per pattern, and the rarest byte inside it (the one scanned for)
+        self.anchors = []           # (start, length) of the anchor within the pattern
+        scan_pos, scan_byte, score = [], [], []
+        for p in patterns:
+            if not is_literal(p):
+                self.anchors.append((0, 0))
+                scan_pos.append(0)
+                scan_byte.append(0)
+                score.append(np.inf)
+                continue
+            freq = self.byte_freq[np.frombuffer(p, dtype=np.uint8)]
+            best = None
+            for length in range(min(ANCHOR_MIN_LEN, len(p)), min(ANCHOR_MAX_LEN, len(p)) + 1):
+                for start in range(len(p) - length + 1):
+                    est = float(np.prod(freq[start:start + length]))
+                    if best is None or est < best[0]:
+                        best = (est, start, length)
+            _, start, length = best
+            k = start + int(np.argmin(freq[start:start + length]))
+            self.anchors.append((start, length))
+            scan_pos.append(k)
+            scan_byte.append(p[k])
+            score.append(freq[k])
+        self.scan_pos = np.array(scan_pos, dtype=np.int64)
+        self.scan_byte = np.array(scan_byte, dtype=np.uint8)
+
+        # Admit scan bytes from the rarest up while the expected candidates fit the budget
+        selected = np.zeros(256, dtype=bool)
+        rate = 0.0
+        for i in np.argsort(score, kind="stable").tolist():
+            b = scan_byte[i]
+            if score[i] == np.inf:
+                break                       # only non-literal patterns are left
+            if selected[b]:
+                continue
+            if rate + self.byte_freq[b] > max_candidate_rate:
+                break
+            selected[b] = True
+            rate += self.byte_freq[b]
+        anchored = selected[self.scan_byte] & np.isfinite(score) if len(patterns) else np.zeros(0, dtype=bool)
+        if not partial and not anchored.all():
+            selected[:] = False
+            anchored[:] = False
+            rate = 0.0
+        self.byte_table = selected
+        self.expected_rate = rate
+        self.anchored = np.flatnonzero(anchored)
+        self.residual = np.flatnonzero(~anchored)
+
+    def describe(self) -> str:
+        return (f"{len(self.anchored)} of {len(self.patterns)} pattern(s) anchored on "
+                f"{int(self.byte_table.sum())} byte value(s), ~{self.expected_rate:.2%} candidate rate")
+
+    def scan(self, buf: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> MatchArrays:
+        """Every occurrence of every anchored pattern inside the packets buf[offsets[i]:+lengths[i]]"""
+        empty = np.empty(0, dtype=np.int64)
+        if not len(self.anchored) or not len(lengths):
+            return empty, empty, empty
+        offsets = np.asarray(offsets, dtype=np.int64)
+        ends = offsets + np.asarray(lengths, dtype=np.int64)
+        view = buf[:int(ends[-1])] if len(buf) > ends[-1] else buf
+
+        pos = np.flatnonzero(self.byte_table[view])
+        values = view[pos]
+        order = np.argsort(values, kind="stable")
+        pos, values = pos[order], values[order]
+        bounds = np.searchsorted(values, np.arange(257))
+
+        out_pkt, out_off, out_pid = [], [], []
+        for pid in self.anchored.tolist():
+            b = int(self.scan_byte[pid])
+            cand = pos[bounds[b]:bounds[b + 1]] - self.scan_pos[pid]
+            if not len(cand):
+                continue
+            p = self.patterns[pid]
+            m = len(p)
+            cand = cand[(cand >= 0) & (cand + m <= len(view))]
+            a_start, a_len = self.anchors[pid]
+            k = int(self.scan_pos[pid])
+            order_j = [j for j in range(a_start, a_start + a_len) if j != k]
+            order_j += [j for j in range(m) if j < a_start or j >= a_start + a_len]
+            for j in order_j:
+                if not len(cand):
+                    break
+                cand = cand[view[cand + j] == p[j]]
+            if not len(cand):
+                continue
+            # Only confirmed occurrences are mapped to packets; drop those crossing a packet end
+            pkt = np.searchsorted(ends, cand, side="right")
+            inside = (cand >= offsets[pkt]) & (cand + m <= ends[pkt])
+            cand, pkt = cand[inside], pkt[inside]
+            out_pkt.append(pkt)
+            out_off.append(cand - offsets[pkt])
+            out_pid.append(np.full(len(cand), pid, dtype=np.int64))
+        if not out_pkt:
+            return empty, empty, empty
+        return np.concatenate(out_pkt), np.concatenate(out_off), np.concatenate(out_pid)
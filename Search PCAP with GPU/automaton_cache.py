@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Compiled Automaton Cache
+
+Building a PFAC or Aho-Corasick automaton for thousands of signatures takes seconds of
+pure Python before any byte is scanned. This module stores the built tables (PFAC goto
+or premultiplied DFA delta, out_index, out_counts, flat_out) as an uncompressed `.npz`
+keyed by a hash of the pattern list, and memory-maps the arrays straight out of the
+archive on later runs.
+
+Key Features:
+- Key = SHA-256 over the automaton kind, cache format version and the ordered,
+  length-prefixed pattern bytes (pattern ids are list positions, so order matters);
+  wildcard/class patterns contribute their packed per-position byte sets
+- Zero-parse loads: every array is an np.memmap into the stored zip member
+- Precompile CLI for rule packs, so sensors never build automata at scan time
+
+Usage:
+    cache = AutomatonCache()
+    pfac = load_pfac(patterns, cache)          # built once, memory-mapped afterwards
+
+    python automaton_cache.py rules/emerging.txt rules/custom.txt --kind all
+"""
+
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import time
+import zipfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from aho_corasick import AhoCorasickDFA, PFAC
+from patterns import is_literal, load_rule_pack
+
+CACHE_VERSION = 3                   # 2: PFAC states no longer inherit failure-state outputs
+                                    # 3: DFA entries store the premultiplied delta table, not goto
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pcap_automata")
+KIND_PFAC = "pfac"
+KIND_DFA = "dfa"
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")     # signature ... file name length, extra length
+
+
+def pattern_set_key(kind: str, patterns: List[bytes]) -> str:
+    h = hashlib.sha256(f"{kind}\0{CACHE_VERSION}\0{len(patterns)}\0".encode())
+    for p in patterns:
+        if is_literal(p):
+            h.update(struct.pack("<I", len(p)))
+            h.update(p)
+        else:
+            h.update(struct.pack("<I", len(p) | 0x80000000))
+            h.update(np.packbits(p.masks).tobytes())
+    return h.hexdigest()
+
+
+def _mmap_npz(path: str) -> Dict[str, np.ndarray]:
+    """Memory-map every member of an uncompressed .npz instead of reading it"""
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith(".npy"):
+                raise ValueError(f"{path}: {info.filename} cannot be memory-mapped")
+            f.seek(info.header_offset)
+            sig, name_len, extra_len = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+            if sig != b"PK\x03\x04":
+                raise ValueError(f"{path}: corrupt zip member {info.filename}")
+            f.seek(info.header_offset + ZIP_LOCAL_HEADER.size + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-4]
+            if dtype.hasobject:
+                raise ValueError(f"{path}: object array {name}")
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(),
+                                         shape=shape, order="F" if fortran else "C")
+    return arrays
+
+
+class AutomatonCache:
+    """Directory of compiled automata, one memory-mappable .npz per (kind, pattern list)"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, kind: str, patterns: List[bytes]) -> str:
+        return os.path.join(self.cache_dir, f"{kind}-{pattern_set_key(kind, patterns)[:32]}.npz")
+
+    def load(self, kind: str, patterns: List[bytes]) -> Optional[Dict[str, np.ndarray]]:
+        """Memory-mapped tables for this pattern list, or None if not cached"""
+        path = self.entry_path(kind, patterns)
+        try:
+            arrays = _mmap_npz(path)
+            if int(arrays.pop("cache_version")) != CACHE_VERSION or int(arrays.pop("num_patterns")) != len(patterns):
+                raise ValueError(f"{path}: stale entry")
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def store(self, kind: str, patterns: List[bytes], arrays: Dict[str, np.ndarray]) -> str:
+        """Write the tables atomically; returns the entry path"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.entry_path(kind, patterns)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            np.savez(f, cache_version=np.int64(CACHE_VERSION), num_patterns=np.int64(len(patterns)),
+                     **arrays)
+        os.replace(tmp, path)
+        return path
+
+
+def _load_or_build(cls, kind: str, patterns: List[bytes], cache: Optional[AutomatonCache]):
+    if cache is not None:
+        arrays = cache.load(kind, patterns)
+        if arrays is not None:
+            return cls.from_arrays(patterns, arrays)
+    automaton = cls(patterns)
+    if cache is not None:
+        try:
+            cache.store(kind, patterns, automaton.arrays())
+        except OSError:
+            pass                        # read-only cache directory: keep the in-memory build
+    return automaton
+
+
+def load_pfac(patterns: List[bytes], cache: Optional[AutomatonCache] = None) -> PFAC:
+    """PFAC tables for `patterns`, from the cache when possible"""
+    return _load_or_build(PFAC, KIND_PFAC, patterns, cache)
+
+
+def load_dfa(patterns: List[bytes], cache: Optional[AutomatonCache] = None) -> AhoCorasickDFA:
+    """Aho-Corasick DFA for `patterns`, from the cache when possible"""
+    return _load_or_build(AhoCorasickDFA, KIND_DFA, patterns, cache)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Precompile rule packs into the automaton cache")
+    ap.add_argument("rule_packs", nargs="+", help="Pattern files (one pattern per line, see patterns.py for the syntax, # comments)")
+    ap.add_argument("--kind", choices=[KIND_PFAC, KIND_DFA, "all"], default="all",
+                    help="pfac: GPU tables for newtest.py; dfa: CPU Aho-Corasick DFA")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Automaton cache directory")
+    ap.add_argument("--force", action="store_true", help="Rebuild entries that are already cached")
+    args = ap.parse_args()
+
+    cache = AutomatonCache(args.cache_dir)
+    builders = {KIND_PFAC: PFAC, KIND_DFA: AhoCorasickDFA}
+    kinds = list(builders) if args.kind == "all" else [args.kind]
+    for pack in args.rule_packs:
+        patterns = load_rule_pack(pack)
+        if not patterns or any(len(p) == 0 for p in patterns):
+            print(f"{pack}: skipped (no patterns or an empty pattern)")
+            continue
+        for kind in kinds:
+            path = cache.entry_path(kind, patterns)
+            if os.path.exists(path) and not args.force:
+                print(f"{pack}: {kind} already cached ({path})")
+                continue
+            start = time.time()
+            automaton = builders[kind](patterns)
+            build_time = time.time() - start
+            cache.store(kind, patterns, automaton.arrays())
+            print(f"{pack}: {kind} {len(patterns)} patterns, {len(automaton.out_counts):,} states, "
+                  f"built in {build_time:.2f}s -> {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,922 @@
+#!/usr/bin/env python3
+"""
+Scanner Benchmark Harness
+
+The test folders each grew their own benchmark loop: run_comprehensive_test.py shells
+out to newtest.py per capture and pattern count, cpu_benchmark.py times an external
+scanner, and each writes its own CSV and prints its own averages. This module is the
+one loop they share. A scenario is one cell of the matrix capture x pattern set x
+backend x workers; scanner backends are plugins with an untimed prepare step (index,
+pack, build tables) and a timed run step (the search itself).
+
+Key Features:
+- Backend plugins registered by name: python-bmh (pure-Python reference), cpu-bmh and
+  cpu-automaton (cpu_search.py, multiprocessing when workers > 1), command:<exe> (an
+  external scanner printing one line per match); newtest.py adds cupy-bmh and cupy-pfac
+- Warmup runs, then timed runs (perf_counter_ns) until the distribution-free 95%
+  confidence interval of the median run time is within +-ci_target of it, bounded by
+  a minimum and maximum repeat count and a time budget; the capture is packed once and
+  shared by every scenario that scans it
+- Per-scenario statistics (median and p95 throughput, CI of the median) are stored
+  next to the runs; named baselines freeze them, and a later run is compared against
+  its baseline: a median drop beyond the threshold with non-overlapping CIs is a
+  regression once a fresh rerun of the scenario reproduces it
+- SQLite result store: one row per timed run, keyed by scenario (capture content,
+  pattern digest, backend, workers - not the path, so a moved or regenerated capture
+  keeps its history) and by an environment fingerprint (CPU, memory, OS, Python/NumPy,
+  plus what the backend reports, e.g. the GPU model), so numbers from different
+  hardware never mix
+- Resumable: runs already stored for this environment and code version count, so a
+  restarted benchmark only adds the runs still missing; failed runs are recorded and
+  retried on the next start
+- Export to CSV, JSON or Parquet (pyarrow), and a summary that flags backends
+  disagreeing on the match count of the same capture and pattern set
+
+Usage:
+    store = ResultStore("results.sqlite")
+    matrix = BenchmarkMatrix(["a.pcap"], [PatternSet("p7", ["GET", "POST"])],
+                             [BackendSpec.parse("cpu-bmh"), BackendSpec.parse("python-bmh")], [1, 4])
+    runner = BenchmarkRunner(store, warmup=1, repeats=3, ci_target=0.05)
+    stats = runner.run(matrix.scenarios())
+    stats, comparisons = runner.confirm(stats, compare(stats, store.baseline("main")))
+    print_summary(stats, comparisons)
+    store.save_baseline("main", stats)
+"""
+
+import csv
+import hashlib
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from cpu_search import CPUSearch, ALGORITHM_BMH, ALGORITHM_PFAC
+from packet_filter import ScanRanges
+from patterns import compile_pattern, is_literal
+from pcap_index import load_index, gather_ranges
+from pcap_reader import CaptureReader
+from traffic_profile import SUMMARY_SUFFIX
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+STORE_VERSION = 2
+DEFAULT_WARMUP = 1
+DEFAULT_REPEATS = 3                 # timed runs at least
+DEFAULT_MAX_REPEATS = 30            # timed runs at most
+DEFAULT_MAX_SECONDS = 60.0          # timed-run budget per scenario, once `repeats` runs are done
+DEFAULT_CI_TARGET = 0.05            # stop when the median's CI is within +-5% of it
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_REGRESSION_THRESHOLD = 0.15    # back-to-back sessions of unchanged code drift by ~10%
+DEFAULT_TILE_BYTES = 8192           # same cutovers as newtest.py's fallback strategy
+DEFAULT_LARGE_THRESHOLD = 2048
+MAX_PACKED_BYTES = 1 << 32          # uint32 offsets, like the GPU batches
+HASH_BLOCK_BYTES = 1 << 22
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+RUN_FIELDS = ("scenario", "fingerprint", "code_version", "capture", "capture_bytes", "packets", "scanned_bytes",
+              "pattern_set", "pattern_count", "backend", "workers", "repeat", "seconds", "matches",
+              "throughput_mbps", "status", "error", "timestamp", "nanoseconds")
+
+
+# ============================== Scenario parts ==============================
+
+class PatternSet:
+    """A named list of pattern texts (patterns.py syntax), compiled once"""
+
+    def __init__(self, name: str, texts: Sequence[str]):
+        self.name = name
+        self.texts = list(texts)
+        self.patterns = [compile_pattern(t) for t in self.texts]
+
+    @classmethod
+    def from_file(cls, path: str, name: Optional[str] = None) -> "PatternSet":
+        """One pattern per line; blank lines and # comments are skipped"""
+        with open(path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f]
+        texts = [t for t in texts if t and not t.startswith("#")]
+        return cls(name or os.path.splitext(os.path.basename(path))[0], texts)
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256("\n".join(self.texts).encode("utf-8")).hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+@dataclass(frozen=True)
+class BackendSpec:
+    """Backend plugin name plus its option, written "name" or "name:option" """
+    name: str
+    option: str = ""
+
+    @classmethod
+    def parse(cls, text: str) -> "BackendSpec":
+        name, _, option = text.partition(":")
+        return cls(name, option)
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}:{self.option}" if self.option else self.name
+
+
+class PreparedCapture:
+    """A capture's index, and its packets packed into one buffer on first use"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.index = load_index(path)
+        self.ranges = ScanRanges.whole_packets(self.index)
+        self._packed = None
+
+    @property
+    def packets(self) -> int:
+        return len(self.ranges)
+
+    @property
+    def scanned_bytes(self) -> int:
+        return self.ranges.total_bytes
+
+    def packed(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(buffer, uint32 offsets, lengths) of every packet, headers included"""
+        if self._packed is None:
+            total = self.scanned_bytes
+            if total >= MAX_PACKED_BYTES:
+                raise ValueError(f"{self.path}: {total:,} packet bytes do not fit one 4 GiB batch")
+            buf = np.empty(total, dtype=np.uint8)
+            with CaptureReader(self.path) as reader:
+                src = np.frombuffer(reader.buffer, dtype=np.uint8)
+                gather_ranges(src, self.ranges.starts, self.ranges.lengths, buf)
+                del src
+            lengths = self.ranges.lengths
+            offsets = (np.cumsum(lengths, dtype=np.int64) - lengths).astype(np.uint32)
+            self._packed = (buf, offsets, lengths)
+        return self._packed
+
+
+# ============================== Backend plugins ==============================
+
+class ScanBackend:
+    """Plugin interface: prepare() is untimed, run() is the timed search and returns the match count"""
+    name = ""
+    description = ""
+    supports_workers = False
+
+    def __init__(self, pattern_set: PatternSet, workers: int = 1, option: str = ""):
+        self.pattern_set = pattern_set
+        self.patterns = pattern_set.patterns
+        self.workers = workers
+        self.option = option
+
+    @classmethod
+    def available(cls, option: str = "") -> Optional[str]:
+        """None when the backend can run here, otherwise the reason it cannot"""
+        return None
+
+    @classmethod
+    def environment(cls, option: str = "") -> Dict:
+        """Backend-specific environment details that belong in the fingerprint"""
+        return {}
+
+    def prepare(self, capture: PreparedCapture):
+        raise NotImplementedError
+
+    def run(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+BACKENDS: Dict[str, Type[ScanBackend]] = {}
+
+
+def register_backend(cls: Type[ScanBackend]) -> Type[ScanBackend]:
+    """Class decorator adding a ScanBackend to BACKENDS under its name"""
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def bmh_count(data: bytes, pat: bytes, shift: Dict[int, int]) -> int:
+    """Occurrences of pat in data (overlapping ones included), Horspool's algorithm"""
+    m = len(pat)
+    last = m - 1
+    count = 0
+    i = 0
+    end = len(data) - m
+    while i <= end:
+        j = last
+        while j >= 0 and data[i + j] == pat[j]:
+            j -= 1
+        if j < 0:
+            count += 1
+        i += shift.get(data[i + last], m)
+    return count
+
+
+@register_backend
+class PythonBMHBackend(ScanBackend):
+    name = "python-bmh"
+    description = "pure-Python Boyer-Moore-Horspool, one packet and pattern at a time (reference)"
+
+    def __init__(self, pattern_set: PatternSet, workers: int = 1, option: str = ""):
+        super().__init__(pattern_set, workers, option)
+        if not all(is_literal(p) for p in self.patterns):
+            raise ValueError("python-bmh needs literal patterns")
+        self.tables = [(bytes(p), {c: len(p) - 1 - i for i, c in enumerate(p[:-1])}) for p in self.patterns]
+        self.packets: List[bytes] = []
+
+    def prepare(self, capture: PreparedCapture):
+        buf, offsets, lengths = capture.packed()
+        data = buf.tobytes()
+        self.packets = [data[o:o + n] for o, n in zip(offsets.tolist(), lengths.tolist())]
+
+    def run(self) -> int:
+        total = 0
+        for pat, shift in self.tables:
+            if not pat:
+                continue
+            for pkt in self.packets:
+                total += bmh_count(pkt, pat, shift)
+        return total
+
+    def close(self):
+        self.packets = []
+
+
+class CPUSearchBackend(ScanBackend):
+    """cpu_search.CPUSearch with one algorithm; workers > 1 scan in a process pool"""
+    supports_workers = True
+    algorithm = ALGORITHM_BMH
+
+    def __init__(self, pattern_set: PatternSet, workers: int = 1, option: str = ""):
+        super().__init__(pattern_set, workers, option)
+        self.search = CPUSearch(self.patterns, self.algorithm, DEFAULT_TILE_BYTES, DEFAULT_LARGE_THRESHOLD,
+                                workers=workers)
+
+    def prepare(self, capture: PreparedCapture):
+        buf, offsets, lengths = capture.packed()
+        self.search.upload(buf, offsets, lengths, capture.ranges.packet_ids, capture.ranges.range_offsets)
+
+    def run(self) -> int:
+        return self.search.search()
+
+    def close(self):
+        self.search.close()
+
+
+@register_backend
+class CPUBMHBackend(CPUSearchBackend):
+    name = "cpu-bmh"
+    description = "NumPy BMH (bytes.find sweeps), multiprocessing with workers > 1"
+    algorithm = ALGORITHM_BMH
+
+
+@register_backend
+class CPUAutomatonBackend(CPUSearchBackend):
+    name = "cpu-automaton"
+    description = "Aho-Corasick DFA (PFAC outputs), multiprocessing with workers > 1"
+    algorithm = ALGORITHM_PFAC
+
+
+@register_backend
+class CommandBackend(ScanBackend):
+    name = "command"
+    description = "external scanner: command:<exe> runs `<exe> capture -s p ...`, one stdout line per match"
+    timeout = 300
+
+    @classmethod
+    def available(cls, option: str = "") -> Optional[str]:
+        if not option:
+            return "give the scanner executable as command:<path>"
+        if not os.path.exists(option):
+            return f"scanner executable {option!r} not found"
+        return None
+
+    @classmethod
+    def environment(cls, option: str = "") -> Dict:
+        return {"command": os.path.basename(option)}
+
+    def prepare(self, capture: PreparedCapture):
+        self.cmd = [self.option, capture.path]
+        for text in self.pattern_set.texts:
+            self.cmd.extend(["-s", text])
+
+    def run(self) -> int:
+        result = subprocess.run(self.cmd, capture_output=True, text=True, timeout=self.timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"exit code {result.returncode}: {result.stderr.strip()}")
+        return sum(1 for line in result.stdout.splitlines() if line.strip())
+
+
+# ============================== Environment ==============================
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _memory_bytes() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def environment_info(backend: Type[ScanBackend], option: str = "") -> Dict:
+    """What a benchmark number depends on besides the code: machine, runtimes, backend details"""
+    return {"host": platform.node(), "os": f"{platform.system()} {platform.release()}",
+            "machine": platform.machine(), "cpu": _cpu_model(), "logical_cpus": os.cpu_count() or 1,
+            "memory_bytes": _memory_bytes(), "python": platform.python_version(), "numpy": np.__version__,
+            "backend": backend.environment(option)}
+
+
+def fingerprint(info: Dict) -> str:
+    """Hash of the environment without its host name: identical machines (CI runners) share results"""
+    ident = {k: v for k, v in info.items() if k != "host"}
+    return hashlib.sha256(json.dumps(ident, sort_keys=True).encode()).hexdigest()[:16]
+
+
+_capture_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def capture_digest(path: str) -> str:
+    """SHA-256 of a capture's content, taken from its generator summary (traffic_profile.py)
+    when that describes a file of this size, otherwise hashed here; computed once per file state"""
+    st = os.stat(path)
+    state = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if state not in _capture_digests:
+        digest = None
+        try:
+            with open(path + SUMMARY_SUFFIX, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+            if summary.get("bytes") == st.st_size:
+                digest = summary.get("sha256")
+        except (OSError, ValueError):
+            pass
+        if not digest:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+        _capture_digests[state] = digest
+    return _capture_digests[state]
+
+
+def code_version() -> str:
+    """Short git commit of this tree; with local changes "-dirty." plus a hash of the diff, so
+    every edited state is its own version; "unknown" outside git"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                             text=True, timeout=10)
+        if rev.returncode != 0:
+            return "unknown"
+        diff = subprocess.run(["git", "diff", "HEAD", "--", "."], cwd=here, capture_output=True, timeout=30).stdout
+        dirty = f"-dirty.{hashlib.sha256(diff).hexdigest()[:8]}" if diff else ""
+        return rev.stdout.strip() + dirty
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+
+
+# ============================== Statistics ==============================
+
+def median_ci(values: Sequence[float], confidence: float = DEFAULT_CONFIDENCE) -> Optional[Tuple[float, float]]:
+    """Distribution-free confidence interval of the median, from order statistics.
+
+    The interval [x_(k), x_(n-k+1)] covers the median with probability 1 - 2 P(Binom(n, 1/2) < k);
+    k is the largest rank keeping that at or above `confidence`. None when even [min, max]
+    falls short (fewer than 6 samples at 95%).
+    """
+    xs = sorted(values)
+    n = len(xs)
+    alpha = (1.0 - confidence) / 2
+    tail, k = 0.0, 0
+    while k < n // 2:
+        tail += math.comb(n, k) / 2 ** n            # P(Binom(n, 1/2) <= k)
+        if tail > alpha:
+            break
+        k += 1
+    if k == 0:
+        return None
+    return xs[k - 1], xs[n - k]
+
+
+def converged(values: Sequence[float], ci_target: float, confidence: float = DEFAULT_CONFIDENCE) -> bool:
+    """True when the median's confidence interval is within +-ci_target of the median"""
+    ci = median_ci(values, confidence)
+    if ci is None:
+        return False
+    mid = float(np.median(values))
+    return mid > 0 and (ci[1] - ci[0]) / 2 <= ci_target * mid
+
+
+@dataclass
+class ScenarioStats:
+    """Timed runs of one scenario in one environment and code version, reduced to robust statistics.
+
+    Throughputs are the capture size over a run time: p95_mbps comes from the 95th
+    percentile run time, so it is the rate 95% of runs reach or beat.
+    """
+    scenario: str
+    fingerprint: str
+    code_version: str
+    capture: str
+    capture_bytes: int
+    pattern_set: str
+    pattern_count: int
+    backend: str
+    workers: int
+    runs: int
+    median_seconds: float
+    p95_seconds: float
+    median_mbps: float
+    p95_mbps: float
+    ci_low_mbps: Optional[float]
+    ci_high_mbps: Optional[float]
+    converged: bool
+    matches: List[int]
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], ci_target: float = DEFAULT_CI_TARGET,
+                  confidence: float = DEFAULT_CONFIDENCE) -> "ScenarioStats":
+        first = rows[0]
+        seconds = [r["nanoseconds"] / 1e9 if r["nanoseconds"] is not None else r["seconds"] for r in rows]
+        mb = first["capture_bytes"] / (1024 * 1024)
+        rate = lambda s: mb / s if s > 0 else 0.0
+        median_s = float(np.median(seconds))
+        p95_s = float(np.percentile(seconds, 95))
+        ci = median_ci(seconds, confidence)
+        return cls(scenario=first["scenario"], fingerprint=first["fingerprint"], code_version=first["code_version"],
+                   capture=first["capture"], capture_bytes=first["capture_bytes"], pattern_set=first["pattern_set"],
+                   pattern_count=first["pattern_count"], backend=first["backend"], workers=first["workers"],
+                   runs=len(rows), median_seconds=median_s, p95_seconds=p95_s, median_mbps=rate(median_s),
+                   p95_mbps=rate(p95_s), ci_low_mbps=rate(ci[1]) if ci else None,
+                   ci_high_mbps=rate(ci[0]) if ci else None, converged=converged(seconds, ci_target, confidence),
+                   matches=sorted({r["matches"] for r in rows}))
+
+    def to_row(self) -> Dict:
+        row = asdict(self)
+        row["converged"] = int(self.converged)
+        row["matches"] = ",".join(str(m) for m in self.matches)
+        return row
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "ScenarioStats":
+        row = {f.name: row[f.name] for f in fields(cls)}
+        row["converged"] = bool(row["converged"])
+        row["matches"] = [int(m) for m in row["matches"].split(",") if m]
+        return cls(**row)
+
+
+@dataclass
+class Comparison:
+    """A scenario's median throughput against the same scenario and environment in a baseline"""
+    stats: ScenarioStats
+    baseline: Optional[ScenarioStats]       # None: the baseline has no such scenario
+    change: Optional[float]     # relative change of the median throughput (-0.1 = 10% slower)
+    regression: bool
+    improvement: bool
+    inconclusive: bool          # beyond the threshold, but the CIs overlap or a side has none
+    reproduced: Optional[bool] = None       # set by BenchmarkRunner.confirm() for rerun regressions
+
+    @property
+    def missing(self) -> bool:
+        return self.baseline is None
+
+    @property
+    def verdict(self) -> str:
+        if self.missing:
+            return "not in baseline"
+        if self.reproduced is False:
+            return "not reproduced"
+        return ("REGRESSION" if self.regression else "improved" if self.improvement
+                else "inconclusive" if self.inconclusive else "")
+
+    def describe(self) -> str:
+        if self.missing:
+            return self.verdict
+        return f"{self.change:+.1%} vs {self.baseline.code_version} {self.verdict}".rstrip()
+
+
+def compare(current: Sequence[ScenarioStats], baseline: Dict[Tuple[str, str], ScenarioStats],
+            threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[Comparison]:
+    """Regressions (and improvements) beyond `threshold` whose confidence intervals do not overlap.
+
+    Scenarios without a baseline entry for the same environment come back as `missing`
+    comparisons; other changes beyond the threshold (overlapping CIs, or too few runs for
+    one) are inconclusive.
+    """
+    out = []
+    for s in current:
+        base = baseline.get((s.scenario, s.fingerprint))
+        if base is None or base.median_mbps <= 0:
+            out.append(Comparison(s, None, None, False, False, False))
+            continue
+        change = s.median_mbps / base.median_mbps - 1.0
+        beyond = abs(change) > threshold
+        if None in (s.ci_low_mbps, s.ci_high_mbps, base.ci_low_mbps, base.ci_high_mbps):
+            out.append(Comparison(s, base, change, False, False, inconclusive=beyond))
+            continue
+        regression = beyond and change < 0 and s.ci_high_mbps < base.ci_low_mbps
+        improvement = beyond and change > 0 and s.ci_low_mbps > base.ci_high_mbps
+        out.append(Comparison(s, base, change, regression, improvement,
+                              inconclusive=beyond and not (regression or improvement)))
+    return out
+
+
+# ============================== Result store ==============================
+
+class ResultStore:
+    """SQLite file of timed runs, their per-scenario statistics and named baselines"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        stats_columns = """
+                scenario TEXT NOT NULL, fingerprint TEXT NOT NULL, code_version TEXT NOT NULL, capture TEXT,
+                capture_bytes INTEGER, pattern_set TEXT, pattern_count INTEGER, backend TEXT, workers INTEGER,
+                runs INTEGER, median_seconds REAL, p95_seconds REAL, median_mbps REAL, p95_mbps REAL,
+                ci_low_mbps REAL, ci_high_mbps REAL, converged INTEGER, matches TEXT"""
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS environments (
+                fingerprint TEXT PRIMARY KEY, info TEXT NOT NULL, first_seen TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, scenario TEXT NOT NULL, fingerprint TEXT NOT NULL,
+                code_version TEXT, capture TEXT, capture_bytes INTEGER, packets INTEGER, scanned_bytes INTEGER,
+                pattern_set TEXT, pattern_count INTEGER, backend TEXT, workers INTEGER, repeat INTEGER,
+                seconds REAL, matches INTEGER, throughput_mbps REAL, status TEXT NOT NULL, error TEXT,
+                timestamp TEXT NOT NULL, nanoseconds INTEGER);
+            CREATE INDEX IF NOT EXISTS runs_scenario ON runs (scenario, fingerprint);
+            CREATE TABLE IF NOT EXISTS summaries ({stats_columns}, updated TEXT NOT NULL,
+                PRIMARY KEY (scenario, fingerprint, code_version));
+            CREATE TABLE IF NOT EXISTS baselines (name TEXT NOT NULL, {stats_columns}, created TEXT NOT NULL,
+                PRIMARY KEY (name, scenario, fingerprint));
+        """)
+        # Stores written before run times were kept in nanoseconds
+        if "nanoseconds" not in [c[1] for c in self.db.execute("PRAGMA table_info(runs)")]:
+            self.db.execute("ALTER TABLE runs ADD COLUMN nanoseconds INTEGER")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(STORE_VERSION),))
+        self.db.commit()
+
+    def add_environment(self, info: Dict) -> str:
+        fp = fingerprint(info)
+        self.db.execute("INSERT OR IGNORE INTO environments VALUES (?, ?, ?)",
+                        (fp, json.dumps(info, sort_keys=True), datetime.now().isoformat(timespec="seconds")))
+        return fp
+
+    def environment(self, fp: str) -> Optional[Dict]:
+        row = self.db.execute("SELECT info FROM environments WHERE fingerprint = ?", (fp,)).fetchone()
+        return json.loads(row["info"]) if row else None
+
+    def add_run(self, **fields):
+        fields.setdefault("timestamp", datetime.now().isoformat(timespec="seconds"))
+        names = [f for f in RUN_FIELDS if f in fields]
+        self.db.execute(f"INSERT INTO runs ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                        [fields[f] for f in names])
+
+    def rows(self, scenario: Optional[str] = None, fp: Optional[str] = None, version: Optional[str] = None,
+             status: Optional[str] = None) -> List[Dict]:
+        query, args = "SELECT * FROM runs", []
+        clauses = []
+        for column, value in (("scenario", scenario), ("fingerprint", fp), ("code_version", version),
+                              ("status", status)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return [dict(r) for r in self.db.execute(query + " ORDER BY id", args)]
+
+    def timings(self, scenario: str, fp: str, version: str) -> List[int]:
+        """Nanoseconds of the successful runs already stored for this scenario, environment and code"""
+        return [r["nanoseconds"] if r["nanoseconds"] is not None else int(r["seconds"] * 1e9)
+                for r in self.rows(scenario, fp, version, STATUS_OK)]
+
+    def update_summary(self, stats: ScenarioStats):
+        row = stats.to_row()
+        row["updated"] = datetime.now().isoformat(timespec="seconds")
+        self.db.execute(f"INSERT OR REPLACE INTO summaries ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                        list(row.values()))
+
+    def summaries(self, keys: Optional[Sequence[Tuple[str, str, str]]] = None) -> List[ScenarioStats]:
+        """Stored statistics, of the given (scenario, fingerprint, code version) keys or of all of them"""
+        if keys is None:
+            return [ScenarioStats.from_row(dict(r)) for r in self.db.execute("SELECT * FROM summaries")]
+        out = []
+        for key in dict.fromkeys(keys):
+            row = self.db.execute("SELECT * FROM summaries WHERE scenario = ? AND fingerprint = ? "
+                                  "AND code_version = ?", key).fetchone()
+            if row is not None:
+                out.append(ScenarioStats.from_row(dict(row)))
+        return out
+
+    def save_baseline(self, name: str, stats: Sequence[ScenarioStats]):
+        """Record these statistics as baseline `name` (replacing its entries for the same scenarios)"""
+        created = datetime.now().isoformat(timespec="seconds")
+        for s in stats:
+            row = dict(name=name, **s.to_row(), created=created)
+            self.db.execute(f"INSERT OR REPLACE INTO baselines ({', '.join(row)}) VALUES "
+                            f"({', '.join('?' * len(row))})", list(row.values()))
+        self.db.commit()
+
+    def baseline(self, name: str) -> Dict[Tuple[str, str], ScenarioStats]:
+        """Baseline `name` by (scenario, fingerprint); empty if there is no such baseline"""
+        rows = self.db.execute("SELECT * FROM baselines WHERE name = ?", (name,))
+        return {(r["scenario"], r["fingerprint"]): ScenarioStats.from_row(dict(r)) for r in rows}
+
+    def baseline_names(self) -> List[str]:
+        return [r[0] for r in self.db.execute("SELECT DISTINCT name FROM baselines ORDER BY name")]
+
+    def commit(self):
+        self.db.commit()
+
+    def export(self, path: str, rows: Optional[List[Dict]] = None):
+        """Write runs (all of them by default) to .csv, .json or .parquet"""
+        rows = self.rows() if rows is None else rows
+        fields = ("id",) + RUN_FIELDS
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".csv":
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+        elif ext == ".json":
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, indent=2)
+        elif ext == ".parquet":
+            if not PARQUET_AVAILABLE:
+                raise RuntimeError("Parquet export requires pyarrow: pip install pyarrow")
+            pq.write_table(pa.Table.from_pylist(rows), path)
+        else:
+            raise ValueError(f"unknown export format {ext!r} (use .csv, .json or .parquet)")
+
+    def close(self):
+        self.db.close()
+
+
+# ============================== Matrix and runner ==============================
+
+@dataclass
+class Scenario:
+    capture: str
+    pattern_set: PatternSet
+    backend: BackendSpec
+    workers: int
+
+    @property
+    def key(self) -> str:
+        """Stable id: the same capture content (wherever it lives), patterns, backend and workers"""
+        ident = [capture_digest(self.capture), os.path.getsize(self.capture), self.pattern_set.digest,
+                 self.backend.label, self.workers]
+        return hashlib.sha256(json.dumps(ident).encode()).hexdigest()[:24]
+
+    def describe(self) -> str:
+        return (f"{os.path.basename(self.capture)} | {self.pattern_set.name} ({len(self.pattern_set)}) | "
+                f"{self.backend.label} x{self.workers}")
+
+
+class BenchmarkMatrix:
+    """capture x pattern set x backend x workers; worker counts > 1 only for backends that use them"""
+
+    def __init__(self, captures: Sequence[str], pattern_sets: Sequence[PatternSet],
+                 backends: Sequence[BackendSpec], workers: Sequence[int] = (1,)):
+        for spec in backends:
+            if spec.name not in BACKENDS:
+                raise ValueError(f"unknown backend {spec.name!r} (known: {', '.join(sorted(BACKENDS))})")
+        self.captures = list(captures)
+        self.pattern_sets = list(pattern_sets)
+        self.backends = list(backends)
+        self.workers = list(workers)
+
+    def scenarios(self) -> List[Scenario]:
+        out = []
+        for capture in self.captures:               # capture-major: each capture is packed once
+            for pattern_set in self.pattern_sets:
+                for spec in self.backends:
+                    counts = self.workers if BACKENDS[spec.name].supports_workers else [1]
+                    for workers in dict.fromkeys(counts):
+                        out.append(Scenario(capture, pattern_set, spec, workers))
+        return out
+
+
+class BenchmarkRunner:
+    """Runs scenarios into a ResultStore until their median is known well enough.
+
+    Each scenario gets at least `repeats` timed runs, then more until the confidence
+    interval of the median run time is within +-ci_target, max_repeats runs are stored,
+    or the timed runs have used max_seconds. Stored runs of the same scenario,
+    environment and code version count towards all three (resume). confirm() measures
+    the scenarios flagged as regressions once more before they count.
+    """
+
+    def __init__(self, store: ResultStore, warmup: int = DEFAULT_WARMUP, repeats: int = DEFAULT_REPEATS,
+                 max_repeats: int = DEFAULT_MAX_REPEATS, ci_target: float = DEFAULT_CI_TARGET,
+                 max_seconds: float = DEFAULT_MAX_SECONDS, resume: bool = True, log: Callable[[str], None] = print):
+        self.store = store
+        self.warmup = warmup
+        self.repeats = repeats
+        self.max_repeats = max(repeats, max_repeats)
+        self.ci_target = ci_target
+        self.max_seconds = max_seconds
+        self.resume = resume
+        self.log = log
+        self.version = code_version()
+        # Without resume, statistics only cover runs made from now on
+        self.first_run = 0 if resume else (store.db.execute("SELECT MAX(id) FROM runs").fetchone()[0] or 0) + 1
+        self.completed: List[Tuple[str, str, str]] = []    # (scenario key, fingerprint, code version)
+        self.scenarios: Dict[str, Scenario] = {}
+
+    def run(self, scenarios: Sequence[Scenario]) -> List[ScenarioStats]:
+        total = len(scenarios)
+        done = 0
+        for path, group in groupby(scenarios, key=lambda s: s.capture):
+            group = list(group)
+            try:
+                capture = PreparedCapture(path)
+            except (OSError, ValueError) as e:
+                self.log(f"{path}: skipped ({e})")
+                done += len(group)
+                continue
+            for scenario in group:
+                done += 1
+                self.log(f"[{done}/{total}] {scenario.describe()}")
+                self._run_scenario(scenario, capture)
+            del capture
+        return self.store.summaries(self.completed)
+
+    def confirm(self, stats: Sequence[ScenarioStats], comparisons: Sequence[Comparison],
+                threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> Tuple[List[ScenarioStats], List[Comparison]]:
+        """Measure every scenario flagged as a regression again, in a fresh batch of runs.
+
+        The CI of the median covers the noise within one batch, not the drift between
+        sessions (clock boost, thermal state, background load), so a regression only
+        stands when the rerun shows it against the same baseline entry too. Returns the
+        statistics and comparisons, with the rerun's in place of the first batch's.
+        """
+        rerun_stats: Dict[Tuple[str, str], ScenarioStats] = {}
+        out = []
+        for c in comparisons:
+            scenario = self.scenarios.get(c.stats.scenario)
+            if not c.regression or scenario is None:
+                out.append(c)
+                continue
+            self.log(f"Re-measuring {scenario.describe()} ({c.change:+.1%} vs baseline)")
+            rerun = self._remeasure(scenario)
+            if rerun is None:
+                out.append(c)
+                continue
+            again = compare([rerun], {(c.baseline.scenario, c.baseline.fingerprint): c.baseline}, threshold)[0]
+            again.reproduced = again.regression
+            rerun_stats[(rerun.scenario, rerun.fingerprint)] = rerun
+            out.append(again)
+        return [rerun_stats.get((s.scenario, s.fingerprint), s) for s in stats], out
+
+    def _remeasure(self, scenario: "Scenario") -> Optional[ScenarioStats]:
+        """Statistics of a new batch of runs of `scenario`, ignoring the ones already stored"""
+        saved = self.first_run, self.resume
+        self.first_run = (self.store.db.execute("SELECT MAX(id) FROM runs").fetchone()[0] or 0) + 1
+        self.resume = False
+        try:
+            return self._run_scenario(scenario, PreparedCapture(scenario.capture))
+        except (OSError, ValueError) as e:
+            self.log(f"  skipped: {e}")
+            return None
+        finally:
+            self.first_run, self.resume = saved
+
+    def _enough(self, timings: List[int], spent_ns: int) -> bool:
+        if len(timings) < self.repeats:
+            return False
+        return (len(timings) >= self.max_repeats or spent_ns >= self.max_seconds * 1e9
+                or converged(timings, self.ci_target))
+
+    def _run_scenario(self, scenario: Scenario, capture: PreparedCapture) -> Optional[ScenarioStats]:
+        spec = scenario.backend
+        cls = BACKENDS[spec.name]
+        reason = cls.available(spec.option)
+        if reason is not None:
+            self.log(f"  skipped: {reason}")
+            return None
+        fp = self.store.add_environment(environment_info(cls, spec.option))
+        key = scenario.key
+        self.scenarios[key] = scenario
+        timings = self.store.timings(key, fp, self.version) if self.resume else []
+        if timings and self._enough(timings, sum(timings)):
+            self.log(f"  already done ({len(timings)} run(s) stored)")
+            return self._finish(key, fp, scenario.capture)
+        common = dict(scenario=key, fingerprint=fp, code_version=self.version, capture=scenario.capture,
+                      capture_bytes=capture.size, packets=capture.packets, scanned_bytes=capture.scanned_bytes,
+                      pattern_set=scenario.pattern_set.name, pattern_count=len(scenario.pattern_set),
+                      backend=spec.label, workers=scenario.workers)
+        backend = None
+        repeat = len(timings)
+        spent = sum(timings)
+        try:
+            backend = cls(scenario.pattern_set, scenario.workers, spec.option)
+            backend.prepare(capture)
+            for _ in range(self.warmup):
+                backend.run()
+            while not self._enough(timings, spent):
+                start = time.perf_counter_ns()
+                matches = backend.run()
+                ns = time.perf_counter_ns() - start
+                timings.append(ns)
+                spent += ns
+                seconds = ns / 1e9
+                mbps = capture.size / (1024 * 1024) / seconds if seconds > 0 else 0.0
+                self.store.add_run(repeat=repeat, seconds=seconds, nanoseconds=ns, matches=matches,
+                                   throughput_mbps=mbps, status=STATUS_OK, **common)
+                self.log(f"  run {repeat + 1}: {seconds:.4f}s, {mbps:.2f} MB/s, {matches:,} matches")
+                repeat += 1
+        except Exception as e:
+            self.store.add_run(repeat=repeat, status=STATUS_ERROR, error=f"{type(e).__name__}: {e}", **common)
+            self.log(f"  failed: {type(e).__name__}: {e}")
+        finally:
+            if backend is not None:
+                backend.close()
+            self.store.commit()
+        return self._finish(key, fp, scenario.capture) if timings else None
+
+    def _finish(self, key: str, fp: str, capture: str) -> ScenarioStats:
+        """Recompute the scenario's statistics from the stored runs of this code version"""
+        rows = [r for r in self.store.rows(key, fp, self.version, STATUS_OK) if r["id"] >= self.first_run]
+        stats = ScenarioStats.from_rows(rows, self.ci_target)
+        stats.capture = capture                 # runs stored under another path of the same content
+        self.store.update_summary(stats)
+        self.store.commit()
+        self.completed.append((key, fp, self.version))
+        ci = "" if stats.ci_low_mbps is None else \
+            f", {DEFAULT_CONFIDENCE:.0%} CI {stats.ci_low_mbps:.2f}-{stats.ci_high_mbps:.2f}"
+        self.log(f"  median {stats.median_mbps:.2f} MB/s, p95 {stats.p95_mbps:.2f} MB/s over {stats.runs} run(s){ci}"
+                 + ("" if stats.converged else " (not converged)"))
+        return stats
+
+
+# ============================== Summary ==============================
+
+def print_summary(stats: Sequence[ScenarioStats], comparisons: Sequence[Comparison] = ()):
+    """Table per capture and pattern set; flags backends that disagree on the match count and,
+    given comparisons against a baseline, changes beyond its threshold"""
+    if not stats:
+        print("No results to summarize")
+        return
+    by_scenario = {(c.stats.scenario, c.stats.fingerprint): c for c in comparisons}
+    print("\n" + "=" * 100)
+    print(f"BENCHMARK SUMMARY (median and p95 throughput, {DEFAULT_CONFIDENCE:.0%} CI of the median)")
+    print("=" * 100)
+    key = lambda s: (s.capture, s.pattern_count, s.pattern_set)
+    for (capture, _, pattern_set), group in groupby(sorted(stats, key=key), key=key):
+        group = list(group)
+        print(f"\n{os.path.basename(capture)} ({group[0].capture_bytes / (1024 * 1024):.1f} MB), "
+              f"{pattern_set} ({group[0].pattern_count} patterns)")
+        for s in sorted(group, key=lambda s: -s.median_mbps):
+            ci = "n/a" if s.ci_low_mbps is None else f"{s.ci_low_mbps:.2f}-{s.ci_high_mbps:.2f}"
+            matches = "/".join(f"{m:,}" for m in s.matches)
+            line = (f"  {s.backend:<24} x{s.workers:<3} {s.median_mbps:>10.2f} MB/s  p95 {s.p95_mbps:>10.2f}  "
+                    f"CI {ci:>19}  {matches:>12} matches  ({s.runs} runs{'' if s.converged else ', not converged'})")
+            c = by_scenario.get((s.scenario, s.fingerprint))
+            if c is not None:
+                line += f"  {c.describe()}"
+            print(line)
+        counts = {m for s in group for m in s.matches}
+        if len(counts) > 1:
+            print(f"  ! match counts differ between runs/backends: {sorted(counts)}")
+    regressions = [c for c in comparisons if c.regression]
+    missing = [c for c in comparisons if c.missing]
+    if comparisons:
+        print(f"\n{len(regressions)} regression(s) in {len(comparisons) - len(missing)} compared scenario(s)"
+              + (f", {len(missing)} scenario(s) not in the baseline" if missing else ""))
+
+
+def list_backends():
+    for name, cls in sorted(BACKENDS.items()):
+        reason = cls.available()
+        state = "available" if reason is None else f"unavailable: {reason}"
+        print(f"  {name:<16} {cls.description} [{state}]")
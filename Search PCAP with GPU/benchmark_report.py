@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Benchmark Report
+
+Turns the per-scenario statistics of benchmark_harness.py into a report like the
+hand-made ones in the Test1/Test3 folders: throughput against capture size (one chart
+per pattern set) and against pattern count (one chart per capture), one series per
+backend and worker count, with the confidence interval of each median as a whisker.
+
+Key Features:
+- HTML (one self-contained file, charts inline) or Markdown (charts written as .svg
+  files next to it), chosen by the output extension
+- Charts are plain SVG built here, so no plotting library is needed
+- Results table with median and p95 throughput, CI, run count and match counts;
+  baseline comparisons with regressions highlighted; the environments the numbers
+  come from (host, CPU, GPU)
+
+Usage:
+    stats = runner.run(matrix.scenarios())
+    comparisons = compare(stats, store.baseline("main"))
+    write_report("report.html", stats, comparisons, store)
+"""
+
+import html
+import math
+import os
+from itertools import groupby
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from benchmark_harness import Comparison, ResultStore, ScenarioStats, DEFAULT_CONFIDENCE
+
+CHART_WIDTH = 640
+CHART_HEIGHT = 360
+MARGIN = (48, 160, 48, 64)          # top, right (legend), bottom, left
+COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f",
+          "#bcbd22", "#17becf")
+
+Point = Tuple[float, float, Optional[float], Optional[float]]     # x, y, CI low, CI high
+
+
+def nice_ticks(lo: float, hi: float, count: int = 5) -> List[float]:
+    """About `count` round tick values (1, 2 or 5 times a power of ten apart) covering [lo, hi]"""
+    if hi <= lo:
+        hi = lo + 1.0
+    raw = (hi - lo) / count
+    power = 10 ** math.floor(math.log10(raw))
+    step = next(m * power for m in (1, 2, 5, 10) if m * power >= raw)
+    first = math.floor(lo / step) * step
+    return [first + i * step for i in range(int(math.ceil((hi - first) / step)) + 1)]
+
+
+def _fmt(v: float) -> str:
+    return f"{v:,.0f}" if abs(v) >= 100 else f"{v:g}"
+
+
+def svg_chart(title: str, x_label: str, y_label: str, series: Dict[str, List[Point]],
+              colors: Optional[Dict[str, str]] = None) -> str:
+    """Scatter chart with CI whiskers; points of a series are joined when its x values are distinct"""
+    top, right, bottom, left = MARGIN
+    w, h = CHART_WIDTH - left - right, CHART_HEIGHT - top - bottom
+    points = [p for pts in series.values() for p in pts]
+    xs = [p[0] for p in points]
+    ys = [v for p in points for v in (p[1], p[2], p[3]) if v is not None]
+    x_ticks = nice_ticks(min(xs + [0.0]), max(xs))
+    y_ticks = nice_ticks(0.0, max(ys + [0.0]))
+    x0, x1, y1 = x_ticks[0], x_ticks[-1], y_ticks[-1]
+    sx = lambda x: left + (x - x0) / (x1 - x0) * w
+    sy = lambda y: top + h - y / y1 * h
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{CHART_WIDTH}" height="{CHART_HEIGHT}" '
+           f'font-family="sans-serif" font-size="11">',
+           f'<rect width="{CHART_WIDTH}" height="{CHART_HEIGHT}" fill="white"/>',
+           f'<text x="{left + w / 2}" y="{top / 2 + 4}" text-anchor="middle" font-size="14">{html.escape(title)}</text>']
+    for t in y_ticks:
+        out.append(f'<line x1="{left}" x2="{left + w}" y1="{sy(t):.1f}" y2="{sy(t):.1f}" stroke="#ddd"/>')
+        out.append(f'<text x="{left - 6}" y="{sy(t) + 4:.1f}" text-anchor="end">{_fmt(t)}</text>')
+    for t in x_ticks:
+        out.append(f'<line x1="{sx(t):.1f}" x2="{sx(t):.1f}" y1="{top}" y2="{top + h}" stroke="#eee"/>')
+        out.append(f'<text x="{sx(t):.1f}" y="{top + h + 16}" text-anchor="middle">{_fmt(t)}</text>')
+    out.append(f'<rect x="{left}" y="{top}" width="{w}" height="{h}" fill="none" stroke="#888"/>')
+    out.append(f'<text x="{left + w / 2}" y="{CHART_HEIGHT - 12}" text-anchor="middle">{html.escape(x_label)}</text>')
+    out.append(f'<text transform="translate(14 {top + h / 2}) rotate(-90)" text-anchor="middle">'
+               f'{html.escape(y_label)}</text>')
+
+    for i, (name, pts) in enumerate(series.items()):
+        color = colors[name] if colors else COLORS[i % len(COLORS)]
+        pts = sorted(pts)
+        if len({p[0] for p in pts}) == len(pts) > 1:
+            path = " ".join(f"{sx(x):.1f},{sy(y):.1f}" for x, y, _, _ in pts)
+            out.append(f'<polyline points="{path}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+        for x, y, lo, hi in pts:
+            if lo is not None and hi is not None:
+                out.append(f'<line x1="{sx(x):.1f}" x2="{sx(x):.1f}" y1="{sy(lo):.1f}" y2="{sy(hi):.1f}" '
+                           f'stroke="{color}"/>')
+            out.append(f'<circle cx="{sx(x):.1f}" cy="{sy(y):.1f}" r="3.5" fill="{color}">'
+                       f'<title>{html.escape(name)}: {y:,.2f}</title></circle>')
+        ly = top + 12 + i * 16
+        out.append(f'<rect x="{left + w + 12}" y="{ly - 8}" width="10" height="10" fill="{color}"/>')
+        out.append(f'<text x="{left + w + 28}" y="{ly + 1}">{html.escape(name)}</text>')
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def _backend_name(s: ScenarioStats) -> str:
+    return s.backend if s.workers == 1 else f"{s.backend} x{s.workers}"
+
+
+def charts(stats: Sequence[ScenarioStats]) -> List[Tuple[str, str]]:
+    """(title, svg) pairs: throughput vs capture size per pattern set, vs pattern count per capture"""
+    # A backend measured in several environments gets one series per environment
+    envs: Dict[str, set] = {}
+    for s in stats:
+        envs.setdefault(_backend_name(s), set()).add(s.fingerprint)
+    series_name = lambda s: _backend_name(s) + (f" @{s.fingerprint[:6]}" if len(envs[_backend_name(s)]) > 1 else "")
+    names = sorted({series_name(s) for s in stats})
+    colors = {name: COLORS[i % len(COLORS)] for i, name in enumerate(names)}     # same color in every chart
+    point = lambda s, x: (x, s.median_mbps, s.ci_low_mbps, s.ci_high_mbps)
+    ordered = lambda series: {name: series[name] for name in names if name in series}
+    out = []
+    by_set = lambda s: (s.pattern_count, s.pattern_set)
+    for (count, name), group in groupby(sorted(stats, key=by_set), key=by_set):
+        series: Dict[str, List[Point]] = {}
+        for s in group:
+            series.setdefault(series_name(s), []).append(point(s, s.capture_bytes / (1024 * 1024)))
+        title = f"Throughput vs capture size: {name} ({count} patterns)"
+        out.append((title, svg_chart(title, "Capture size (MB)", "Median throughput (MB/s)", ordered(series), colors)))
+    by_capture = lambda s: (s.capture_bytes, s.capture)
+    for (_, capture), group in groupby(sorted(stats, key=by_capture), key=by_capture):
+        group = list(group)
+        if len({s.pattern_count for s in group}) < 2:
+            continue
+        series = {}
+        for s in group:
+            series.setdefault(series_name(s), []).append(point(s, s.pattern_count))
+        title = f"Throughput vs pattern count: {os.path.basename(capture)}"
+        out.append((title, svg_chart(title, "Patterns", "Median throughput (MB/s)", ordered(series), colors)))
+    return out
+
+
+def _results_table(stats: Sequence[ScenarioStats], comparisons: Sequence[Comparison]) -> Tuple[List[str], List[List[str]]]:
+    by_scenario = {(c.stats.scenario, c.stats.fingerprint): c for c in comparisons}
+    header = ["Capture", "MB", "Pattern set", "Patterns", "Backend", "Workers", "Median MB/s", "p95 MB/s",
+              f"{DEFAULT_CONFIDENCE:.0%} CI MB/s", "Runs", "Matches", "vs baseline"]
+    rows = []
+    for s in sorted(stats, key=lambda s: (s.capture, s.pattern_count, -s.median_mbps)):
+        ci = "n/a" if s.ci_low_mbps is None else f"{s.ci_low_mbps:,.2f} - {s.ci_high_mbps:,.2f}"
+        c = by_scenario.get((s.scenario, s.fingerprint))
+        change = ""
+        if c is not None:
+            change = c.verdict if c.missing else f"{c.change:+.1%} {c.verdict}".rstrip()
+        rows.append([os.path.basename(s.capture), f"{s.capture_bytes / (1024 * 1024):,.1f}", s.pattern_set,
+                     str(s.pattern_count), s.backend, str(s.workers), f"{s.median_mbps:,.2f}", f"{s.p95_mbps:,.2f}",
+                     ci, f"{s.runs}" + ("" if s.converged else " (not converged)"),
+                     "/".join(f"{m:,}" for m in s.matches), change])
+    return header, rows
+
+
+def _environments(stats: Sequence[ScenarioStats], store: Optional[ResultStore]) -> List[str]:
+    lines = []
+    for fp in dict.fromkeys(s.fingerprint for s in stats):
+        info = store.environment(fp) if store is not None else None
+        if not info:
+            lines.append(fp)
+            continue
+        backend = ", ".join(f"{k} {v}" for k, v in sorted(info.get("backend", {}).items()))
+        lines.append(f"{fp}: {info['host']}, {info['cpu']} ({info['logical_cpus']} CPUs, "
+                     f"{info['memory_bytes'] / 1024 ** 3:.0f} GB), {info['os']}, Python {info['python']}, "
+                     f"NumPy {info['numpy']}" + (f"; {backend}" if backend else ""))
+    return lines
+
+
+def write_report(path: str, stats: Sequence[ScenarioStats], comparisons: Sequence[Comparison] = (),
+                 store: Optional[ResultStore] = None, title: str = "Scanner Benchmark Report"):
+    """Write an .html or .md report of `stats` (and of `comparisons` against a baseline)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".html", ".htm", ".md"):
+        raise ValueError(f"unknown report format {ext!r} (use .html or .md)")
+    header, rows = _results_table(stats, comparisons)
+    regressions = [c for c in comparisons if c.regression]
+    missing = [c for c in comparisons if c.missing]
+    versions = ", ".join(sorted({s.code_version for s in stats}))
+    verdict = (f"{len(regressions)} regression(s) in {len(comparisons) - len(missing)} scenario(s) compared with "
+               f"the baseline" + (f", {len(missing)} not in the baseline" if missing else "") if comparisons else "")
+    environments = _environments(stats, store)
+    figures = charts(stats)
+
+    if ext == ".md":
+        chart_dir = os.path.splitext(path)[0] + "_charts"
+        os.makedirs(chart_dir, exist_ok=True)
+        out = [f"# {title}", "", f"Code version: {versions}", ""]
+        if verdict:
+            out += [f"**{verdict}**", ""]
+        out += ["## Throughput", ""]
+        for i, (caption, svg) in enumerate(figures, 1):
+            name = f"chart_{i:02d}.svg"
+            with open(os.path.join(chart_dir, name), "w", encoding="utf-8") as f:
+                f.write(svg)
+            out += [f"![{caption}]({os.path.basename(chart_dir)}/{name})", ""]
+        out += ["## Results", "", "| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+        out += ["| " + " | ".join(r) + " |" for r in rows]
+        out += ["", "## Environments", ""] + [f"- {line}" for line in environments]
+        text = "\n".join(out) + "\n"
+    else:
+        esc = html.escape
+        out = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'>", f"<title>{esc(title)}</title>",
+               "<style>body{font-family:sans-serif;margin:24px} table{border-collapse:collapse;font-size:13px}"
+               "td,th{border:1px solid #ccc;padding:4px 8px;text-align:right} td:nth-child(-n+5){text-align:left}"
+               "tr.regression{background:#fdd} tr.improved{background:#dfd} figure{display:inline-block;margin:8px}"
+               "</style></head><body>", f"<h1>{esc(title)}</h1>", f"<p>Code version: {esc(versions)}</p>"]
+        if verdict:
+            out.append(f"<p><strong>{esc(verdict)}</strong></p>")
+        out.append("<h2>Throughput</h2>")
+        out += [f"<figure>{svg}</figure>" for _, svg in figures]
+        out.append("<h2>Results</h2><table><tr>" + "".join(f"<th>{esc(h)}</th>" for h in header) + "</tr>")
+        for r in rows:
+            cls = " class='regression'" if "REGRESSION" in r[-1] else " class='improved'" if "improved" in r[-1] else ""
+            out.append(f"<tr{cls}>" + "".join(f"<td>{esc(v)}</td>" for v in r) + "</tr>")
+        out.append("</table><h2>Environments</h2><ul>" + "".join(f"<li>{esc(e)}</li>" for e in environments)
+                   + "</ul></body></html>")
+        text = "\n".join(out) + "\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
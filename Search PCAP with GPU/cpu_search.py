@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+CPU Search Backend
+
+A NumPy/multiprocessing stand-in for newtest.py's GPUSearch, used when CuPy or a CUDA
+device is missing. It has the same entry points (upload a packed batch, search it, stream
+the matches to a sink) and the same strategy: BMH for few patterns, an Aho-Corasick
+automaton for many, and packets at or above `large_threshold` cut into `tile_bytes`
+tiles (with pattern-length overlap) that are scheduled independently, like the GPU's
+large-packet kernels.
+
+Both backends report every occurrence of every pattern exactly once, as
+(packet, start offset, pattern), so their match sets are identical.
+
+Key Features:
+- "Device" memory is a shared-memory segment that worker processes attach to once;
+  only piece tables and match arrays cross process boundaries
+- BMH pass: one bytes.find sweep per pattern over a contiguous run of packets, with
+  hits mapped back to packets by searchsorted (no per-packet Python loop)
+- PFAC pass: the dense Aho-Corasick DFA from aho_corasick.py (same outputs as the GPU's
+  failureless tables), batched over all pieces of a work unit
+- workers=1 scans in-process, straight from the host batch (no copy)
+- Optional rare-byte anchor prefilter (anchor_prefilter.py): anchored patterns are found
+  by candidate confirmation, only the residual patterns go through BMH/PFAC
+
+Usage:
+    backend = CPUSearch(patterns, "BMH", tile_bytes=8192, large_threshold=2048, sink=sink)
+    backend.upload(bigbuf, offsets, lengths, packet_ids, range_offsets)
+    count = backend.search()
+    backend.close()
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from aho_corasick import AhoCorasickDFA
+from anchor_prefilter import AnchorPrefilter
+from automaton_cache import AutomatonCache, load_dfa
+from match_sink import MatchSink, AggregateSink
+from patterns import literal_only
+
+ALGORITHM_BMH = "BMH"
+ALGORITHM_PFAC = "PFAC"
+
+MIN_UNIT_BYTES = 4 * 1024 * 1024     # smallest work unit handed to a worker
+UNITS_PER_WORKER = 4
+
+MatchArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]   # (batch packet index, offset, pattern id)
+
+
+def split_pieces(lengths: np.ndarray, large_threshold: int, tile_bytes: int) -> Tuple[np.ndarray, ...]:
+    """Small packets stay whole; large ones are cut into tile_bytes tiles.
+
+    Returns (packet index, start within the packet, owned bytes) per piece, in buffer
+    order. A piece owns the match starts in [start, start + owned); reading may run
+    up to max_pattern_len - 1 bytes past it.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    tiles = np.where(lengths >= large_threshold, np.maximum(1, -(-lengths // tile_bytes)), 1)
+    pkt = np.repeat(np.arange(len(lengths), dtype=np.int64), tiles)
+    first = np.cumsum(tiles) - tiles
+    k = np.arange(len(pkt), dtype=np.int64) - np.repeat(first, tiles)
+    size = np.where(lengths[pkt] >= large_threshold, tile_bytes, lengths[pkt])
+    start = k * size
+    return pkt, start, np.minimum(size, lengths[pkt] - start)
+
+
+def unit_bounds(owned: np.ndarray, workers: int) -> np.ndarray:
+    """Piece index boundaries grouping pieces into work units of similar byte size"""
+    ends = np.cumsum(owned, dtype=np.int64)
+    total = int(ends[-1]) if len(ends) else 0
+    n_units = max(1, min(len(owned), workers * UNITS_PER_WORKER, total // MIN_UNIT_BYTES or 1))
+    inner = np.searchsorted(ends, total * np.arange(1, n_units, dtype=np.int64) // n_units, side="right")
+    return np.unique(np.concatenate([[0], inner, [len(owned)]]))
+
+
+def scan_bmh(buf: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, pieces: Tuple[np.ndarray, ...],
+             patterns: List[bytes]) -> MatchArrays:
+    """Every occurrence of every pattern that starts in one of the pieces (a contiguous run)"""
+    pkt, start, owned = pieces
+    lo = int(offsets[pkt[0]] + start[0])
+    hi = int(offsets[pkt[-1]] + start[-1] + owned[-1])       # match starts are < hi
+    ends = offsets.astype(np.int64) + lengths
+    max_len = max(len(p) for p in patterns)
+    data = bytes(buf[lo:min(len(buf), hi + max_len - 1)])
+    out_pkt, out_off, out_pid = [], [], []
+    for pid, pat in enumerate(patterns):
+        hits = []
+        find = data.find
+        i = find(pat)
+        while 0 <= i < hi - lo:
+            hits.append(i)
+            i = find(pat, i + 1)
+        if not hits:
+            continue
+        pos = np.array(hits, dtype=np.int64) + lo
+        p = np.searchsorted(offsets, pos, side="right") - 1
+        keep = pos + len(pat) <= ends[p]                    # the match must not cross the packet end
+        out_pkt.append(p[keep])
+        out_off.append(pos[keep] - offsets[p[keep]])
+        out_pid.append(np.full(int(keep.sum()), pid, dtype=np.int64))
+    if not out_pkt:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(out_pkt), np.concatenate(out_off), np.concatenate(out_pid)
+
+
+def scan_dfa(buf: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, pieces: Tuple[np.ndarray, ...],
+             dfa: AhoCorasickDFA) -> MatchArrays:
+    """Every occurrence starting in one of the pieces, with the Aho-Corasick DFA"""
+    pkt, start, owned = pieces
+    readable = np.minimum(owned + dfa.max_pat_len - 1, lengths[pkt] - start)
+    piece_ids, offs, pids = dfa.scan(buf, offsets[pkt] + start, readable)
+    keep = offs < owned[piece_ids]
+    piece_ids, offs, pids = piece_ids[keep], offs[keep], pids[keep]
+    return pkt[piece_ids], start[piece_ids] + offs, pids.astype(np.int64)
+
+
+def drain_matches(sink: Optional[MatchSink], num_patterns: int, packet_ids: np.ndarray,
+                  range_offsets: Optional[np.ndarray], packets: np.ndarray, offsets: np.ndarray, pids: np.ndarray):
+    """Hand host-side matches of one batch (batch packet index, offset in range, pattern id) to a sink.
+
+    Rows are written ordered by packet, pattern and offset, with capture-wide packet ids
+    and offsets relative to the frame start; an AggregateSink only receives counts.
+    """
+    if sink is None or len(packets) == 0:
+        return
+    if isinstance(sink, AggregateSink):
+        sink.add_counts(np.bincount(pids, minlength=num_patterns))
+        if sink.flow_keys is not None:
+            keys, counts = np.unique(sink.flow_keys[packet_ids[packets]], return_counts=True)
+            sink.add_flow_counts(keys, counts)
+        return
+    if range_offsets is not None:
+        offsets = offsets + range_offsets[packets]    # offsets stay relative to the frame start
+    order = np.lexsort((offsets, pids, packets))
+    sink.write(packet_ids[packets[order]], offsets[order], pids[order])
+
+
+# Per-process state of the pool workers: attached shared memory and the pattern matchers
+_worker = {}
+
+
+def _worker_init(patterns: List[bytes], algorithm: str, dfa: Optional[AhoCorasickDFA]):
+    _worker.update(patterns=patterns, algorithm=algorithm, dfa=dfa, shm=None)
+
+
+def _worker_scan(shm_name: str, n_bytes: int, offsets: np.ndarray, lengths: np.ndarray,
+                 pieces: Tuple[np.ndarray, ...]) -> MatchArrays:
+    shm = _worker["shm"]
+    if shm is None or shm.name != shm_name:
+        if shm is not None:
+            shm.close()
+        shm = _worker["shm"] = shared_memory.SharedMemory(name=shm_name)
+    buf = np.ndarray((n_bytes,), dtype=np.uint8, buffer=shm.buf)
+    try:
+        if _worker["algorithm"] == ALGORITHM_BMH:
+            return scan_bmh(buf, offsets, lengths, pieces, _worker["patterns"])
+        return scan_dfa(buf, offsets, lengths, pieces, _worker["dfa"])
+    finally:
+        del buf
+
+
+class CPUSearch:
+    """Pattern tables, worker pool and shared batch buffer reused across capture batches"""
+
+    def __init__(self, patterns: List[bytes], algorithm: str, tile_bytes: int, large_threshold: int,
+                 automaton_cache: Optional[AutomatonCache] = None, sink: Optional[MatchSink] = None,
+                 workers: int = 0, prefilter: Optional[AnchorPrefilter] = None):
+        self.patterns = patterns
+        self.algorithm = algorithm
+        self.tile_bytes = tile_bytes
+        self.large_threshold = large_threshold
+        self.sink = sink
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.prefilter = prefilter
+        # Patterns left to BMH/PFAC (all of them without a prefilter), by original pattern id
+        self.search_ids = prefilter.residual if prefilter is not None else np.arange(len(patterns))
+        self.search_patterns = [patterns[i] for i in self.search_ids.tolist()]
+        if algorithm == ALGORITHM_BMH and not literal_only(self.search_patterns):
+            raise ValueError("BMH needs literal patterns; use PFAC for wildcard, class or nocase patterns")
+        # The DFA reports the same (start, pattern) set as the GPU's failureless PFAC tables
+        self.dfa = None
+        if algorithm == ALGORITHM_PFAC and self.search_patterns:
+            self.dfa = load_dfa(self.search_patterns, automaton_cache)
+        self.executor = None
+        self.shm = None
+        if self.workers > 1 and self.search_patterns:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_worker_init,
+                                                initargs=(self.search_patterns, algorithm, self.dfa))
+        self.bigbuf = np.empty(0, dtype=np.uint8)
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.num_packets = 0
+        self.num_large = 0
+        self.packet_ids = None
+        self.range_offsets = None
+
+    def set_sink(self, sink: Optional[MatchSink]):
+        """Send the matches of later batches to `sink` (one backend scanning several captures)"""
+        self.sink = sink
+
+    def upload(self, bigbuf_h: np.ndarray, offsets_h: np.ndarray, lengths_h: np.ndarray,
+               packet_ids: Optional[np.ndarray] = None, range_offsets: Optional[np.ndarray] = None):
+        """Make one batch visible to the workers (same arguments as GPUSearch.upload)"""
+        n_bytes = len(bigbuf_h)
+        if self.executor is None:
+            self.bigbuf = bigbuf_h                      # scanned in-process before the next batch
+        else:
+            if self.shm is None or self.shm.size < n_bytes:
+                self._release()
+                self.shm = shared_memory.SharedMemory(create=True, size=max(1, n_bytes))
+            self.bigbuf = np.ndarray((n_bytes,), dtype=np.uint8, buffer=self.shm.buf)
+            self.bigbuf[:] = bigbuf_h
+        self.offsets = np.asarray(offsets_h, dtype=np.int64)
+        self.lengths = np.asarray(lengths_h, dtype=np.int64)
+        self.num_packets = len(lengths_h)
+        self.num_large = int(np.count_nonzero(self.lengths >= self.large_threshold))
+        self.packet_ids = np.arange(self.num_packets, dtype=np.int64) if packet_ids is None else packet_ids
+        self.range_offsets = range_offsets
+
+    def search(self) -> int:
+        """Scan the uploaded batch, stream its matches to the sink (if any) and return the match count"""
+        if self.num_packets == 0:
+            return 0
+        parts = []
+        if self.search_patterns:
+            pieces = split_pieces(self.lengths, self.large_threshold, self.tile_bytes)
+            bounds = unit_bounds(pieces[2], self.workers)
+            units = [tuple(a[lo:hi] for a in pieces) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+            if self.executor is None:
+                parts = [self._scan_local(unit) for unit in units]
+            else:
+                futures = [self.executor.submit(_worker_scan, self.shm.name, len(self.bigbuf),
+                                                self.offsets, self.lengths, unit) for unit in units]
+                parts = [f.result() for f in futures]
+            parts = [(pkt, off, self.search_ids[pid]) for pkt, off, pid in parts]
+        if self.prefilter is not None:
+            parts.append(self.prefilter.scan(self.bigbuf, self.offsets, self.lengths))
+        if not parts:
+            return 0
+        packets, offsets, pids = (np.concatenate([part[k] for part in parts]) for k in range(3))
+        drain_matches(self.sink, len(self.patterns), self.packet_ids, self.range_offsets, packets, offsets, pids)
+        return len(packets)
+
+    def _scan_local(self, unit: Tuple[np.ndarray, ...]) -> MatchArrays:
+        if self.algorithm == ALGORITHM_BMH:
+            return scan_bmh(self.bigbuf, self.offsets, self.lengths, unit, self.search_patterns)
+        return scan_dfa(self.bigbuf, self.offsets, self.lengths, unit, self.dfa)
+
+    def _release(self):
+        if self.shm is not None:
+            self.bigbuf = np.empty(0, dtype=np.uint8)
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        """Stop the workers and free the shared batch buffer"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self._release()
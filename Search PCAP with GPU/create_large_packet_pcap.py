@@ -4,6 +4,10 @@ Create Large Packet Size PCAP
 
 This script creates a synthetic PCAP file with larger average packet sizes
 to test if GPU performance improves with fewer, larger packets.
+
+With --seed every flow draws from its own seeded random stream and timestamps start
+at a fixed time, so the same seed and options give a byte-identical file on any
+number of CPU cores.
 """
 
 import os
@@ -17,6 +21,8 @@ from scapy.layers.inet import IP, TCP
 from scapy.layers.l2 import Ether
 import argparse
 
+from traffic_profile import DEFAULT_START_TIME_US
+
 def generate_large_packet_flow(flow_id: int, num_packets: int, target_size_mb: float) -> List[Packet]:
     """Generate a single TCP flow with large packet sizes"""
     packets = []
@@ -82,12 +88,14 @@ def generate_large_packet_flow(flow_id: int, num_packets: int, target_size_mb: f
 
 def generate_worker(args):
     """Worker function for multiprocessing"""
-    flow_id, num_flows_per_worker, packets_per_flow, target_size_mb = args
+    first_flow, last_flow, packets_per_flow, target_size_mb, seed = args
     
     all_packets = []
-    for flow in range(num_flows_per_worker):
+    for flow in range(first_flow, last_flow):
+        if seed is not None:
+            random.seed(f"{seed}:{flow}")
         packets = generate_large_packet_flow(
-            flow_id * num_flows_per_worker + flow,
+            flow,
             packets_per_flow,
             target_size_mb
         )
@@ -96,26 +104,27 @@ def generate_worker(args):
     return all_packets
 
 def create_large_packet_pcap(output_file: str, target_size_mb: float = 500, 
-                           num_flows: int = 1000, packets_per_flow: int = 50):
+                           num_flows: int = 1000, packets_per_flow: int = 50, seed: int = None):
     """Create a PCAP file with large packet sizes"""
     
     print(f"Creating large packet PCAP: {output_file}")
     print(f"Target size: {target_size_mb} MB")
     print(f"Flows: {num_flows}")
     print(f"Packets per flow: {packets_per_flow}")
+    print(f"Seed: {seed if seed is not None else 'random'}")
     
     # Calculate target size per flow
     target_size_per_flow = target_size_mb / num_flows
     
     # Use multiprocessing
     num_workers = multiprocessing.cpu_count()
-    flows_per_worker = num_flows // num_workers
     
-    print(f"Using {num_workers} workers, {flows_per_worker} flows per worker")
+    print(f"Using {num_workers} workers, ~{num_flows // num_workers} flows per worker")
     
-    # Prepare arguments for workers
+    # Prepare arguments for workers: consecutive flow ranges, so the file does not depend on the worker count
     worker_args = [
-        (i, flows_per_worker, packets_per_flow, target_size_per_flow)
+        (i * num_flows // num_workers, (i + 1) * num_flows // num_workers, packets_per_flow,
+         target_size_per_flow, seed)
         for i in range(num_workers)
     ]
     
@@ -136,7 +145,7 @@ def create_large_packet_pcap(output_file: str, target_size_mb: float = 500,
     
     # Add timestamps
     print("Adding timestamps...")
-    base_time = time.time()
+    base_time = time.time() if seed is None else DEFAULT_START_TIME_US / 1_000_000
     for i, packet in enumerate(all_packets):
         packet.time = base_time + (i * 0.001)  # 1ms between packets
     
@@ -166,6 +175,8 @@ def main():
                        help="Number of flows")
     parser.add_argument("--packets-per-flow", "-p", type=int, default=50,
                        help="Packets per flow")
+    parser.add_argument("--seed", type=int, default=None,
+                       help="Random seed for a byte-identical file (default: random)")
     
     args = parser.parse_args()
     
@@ -177,7 +188,8 @@ def main():
         args.output,
         args.size,
         args.flows,
-        args.packets_per_flow
+        args.packets_per_flow,
+        args.seed
     )
 
 if __name__ == "__main__":
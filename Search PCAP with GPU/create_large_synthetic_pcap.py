@@ -6,6 +6,14 @@ A high-performance tool for generating realistic PCAP files with diverse network
 patterns. Uses multi-threading to leverage all available CPU cores for fast generation.
 
 Features:
+- Fast engine (default): worker processes build ordered chunks of capture records from
+  header templates (see pcap_writer.py), streamed to disk with constant memory
+- Scapy engine (--engine scapy): the original per-packet scapy objects and wrpcap
+- Reproducible output (--seed): the same seed, size and options give a byte-identical file
+- Traffic profiles (--profile): flow count, size distribution, protocol mix and pattern
+  injection rates from a YAML/JSON file, with a manifest of every injected pattern
+  (see traffic_profile.py); --flows and --size-histogram override the profile's flow
+  count and frame size mix (IMIX, Zipf flow sizes and capture histograms live there)
 - Multi-threaded packet generation using all CPU cores
 - Realistic network traffic patterns (HTTP, HTTPS, SSH, FTP, DNS, etc.)
 - Configurable file sizes and output locations
@@ -16,6 +24,9 @@ Features:
 Usage:
     python create_large_synthetic_pcap.py --size 500 --output large_test.pcapng
     python create_large_synthetic_pcap.py --size 1000 --patterns web,security
+    python create_large_synthetic_pcap.py --size 100 --engine scapy
+    python create_large_synthetic_pcap.py --size 500 --profile traffic_profiles/web_mixed.yaml --seed 7
+    python create_large_synthetic_pcap.py --size 2000 --profile traffic_profiles/imix_zipf.yaml --flows 5000000
     python create_large_synthetic_pcap.py --help
 """
 
@@ -29,11 +40,19 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from multiprocessing import cpu_count
 from pathlib import Path
 import math
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict
 
-from scapy.all import wrpcap, IP, TCP, Raw
+import numpy as np
 from colorama import init, Fore, Style
 
+from packet_headers import IP_PROTO_TCP
+from pcap_writer import PacketFields, PcapWriter, RecordBuilder, format_for_output, ipv4_int, iter_chunks
+from traffic_profile import DEFAULT_START_TIME_US, SizeDistribution, TrafficProfile, generate_capture
+
+ENGINE_FAST = "fast"
+ENGINE_SCAPY = "scapy"
+CHUNK_MESSAGES = 16384      # pattern messages per record chunk (a few MB of records)
+
 # Initialize colorama for colored output
 init(autoreset=True)
 
@@ -198,14 +217,14 @@ class FlowGenerator:
             ("192.168.1.111", "10.0.0.12", 1521), # Oracle
         ]
     
-    def get_random_flow(self) -> Tuple[str, str, int]:
+    def get_random_flow(self, rng: random.Random = random) -> Tuple[str, str, int]:
         """Get a random network flow"""
-        return random.choice(self.flows)
+        return rng.choice(self.flows)
 
 
 def generate_packet_batch(batch_id: int, batch_size: int, patterns: List[bytes], 
                          flow_generator: FlowGenerator, base_time: float, 
-                         start_packet_id: int) -> Tuple[int, List]:
+                         start_packet_id: int, seed: Optional[int] = None) -> Tuple[int, List]:
     """
     Generate a batch of packets in parallel
     
@@ -216,28 +235,32 @@ def generate_packet_batch(batch_id: int, batch_size: int, patterns: List[bytes],
         flow_generator: Flow generator instance
         base_time: Base timestamp for packet timing
         start_packet_id: Starting packet ID for this batch
+        seed: Makes the batch reproducible (its random stream depends on seed and batch_id only)
     
     Returns:
         Tuple of (batch_id, list_of_packets)
     """
     packets = []
+    rng = random.Random(f"{seed}:{batch_id}") if seed is not None else random
     
+    from scapy.all import IP, TCP, Raw     # only the scapy engine builds packet objects
+
     for i in range(batch_size):
         # Select random flow
-        src_ip, dst_ip, dst_port = flow_generator.get_random_flow()
-        src_port = random.randint(50000, 60000)
+        src_ip, dst_ip, dst_port = flow_generator.get_random_flow(rng)
+        src_port = rng.randint(50000, 60000)
         
         # Choose a pattern
-        pattern = random.choice(patterns)
+        pattern = rng.choice(patterns)
         
         # Split pattern into packets to simulate real TCP behavior
-        packet_size = random.randint(100, 1500)
+        packet_size = rng.randint(100, 1500)
         if len(pattern) > packet_size:
             chunks = [pattern[i:i+packet_size] for i in range(0, len(pattern), packet_size)]
         else:
             chunks = [pattern]
         
-        seq_num = random.randint(1000, 10000)
+        seq_num = rng.randint(1000, 10000)
         
         for chunk in chunks:
             packet = IP(src=src_ip, dst=dst_ip) / \
@@ -252,11 +275,66 @@ def generate_packet_batch(batch_id: int, batch_size: int, patterns: List[bytes],
     return batch_id, packets
 
 
+_chunk_worker = {}
+
+
+def _chunk_init(patterns: List[bytes], flows: List[Tuple[str, str, int]], fmt: str, seed: int, base_time_us: int):
+    """Per-process state of the fast engine: pattern blob, flow table, record builder, seed"""
+    lengths = np.array([len(p) for p in patterns], dtype=np.int64)
+    _chunk_worker.update(
+        blob=np.frombuffer(b"".join(patterns), dtype=np.uint8) if lengths.sum() else np.zeros(1, dtype=np.uint8),
+        starts=np.cumsum(lengths) - lengths, lengths=lengths,
+        src_ips=np.array([ipv4_int(src) for src, _, _ in flows], dtype=np.int64),
+        dst_ips=np.array([ipv4_int(dst) for _, dst, _ in flows], dtype=np.int64),
+        dst_ports=np.array([port for _, _, port in flows], dtype=np.int64),
+        builder=RecordBuilder(fmt), seed=seed, base_time_us=base_time_us)
+
+
+def generate_record_chunk(chunk_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the capture records of messages chunk_id * CHUNK_MESSAGES onwards
+
+    Same traffic model as generate_packet_batch: per message a random flow, source
+    port, pattern and packet size; patterns longer than the packet size are split into
+    consecutive TCP segments; message i is timestamped base_time + i * 1 ms. Chunks
+    only depend on (seed, chunk_id), so any worker can build any chunk.
+
+    Returns:
+        Tuple of (record bytes, end offset of every record)
+    """
+    w = _chunk_worker
+    rng = np.random.default_rng([w["seed"], chunk_id])
+    m = CHUNK_MESSAGES
+    flow_ids = rng.integers(0, len(w["dst_ports"]), m)
+    src_ports = rng.integers(50000, 60001, m)
+    pattern_ids = rng.integers(0, len(w["lengths"]), m)
+    packet_size = rng.integers(100, 1501, m)
+    first_seq = rng.integers(1000, 10001, m)
+
+    # One segment per packet_size bytes of the pattern (an empty pattern still sends one packet)
+    msg_len = w["lengths"][pattern_ids]
+    segments = np.maximum(1, -(-msg_len // packet_size))
+    msg = np.repeat(np.arange(m), segments)
+    rank = np.arange(len(msg)) - np.repeat(np.cumsum(segments) - segments, segments)
+    offset = rank * packet_size[msg]
+    seg_len = np.minimum(packet_size[msg], msg_len[msg] - offset)
+
+    first_packet = chunk_id * m
+    flows = flow_ids[msg]
+    fields = PacketFields(protocols=np.full(len(msg), IP_PROTO_TCP), src_ips=w["src_ips"][flows],
+                          dst_ips=w["dst_ips"][flows], src_ports=src_ports[msg], dst_ports=w["dst_ports"][flows],
+                          timestamps_us=w["base_time_us"] + (first_packet + msg) * 1000,
+                          payload_starts=w["starts"][pattern_ids[msg]] + offset, payload_lengths=seg_len,
+                          seqs=first_seq[msg] + offset, ip_ids=first_packet + np.arange(len(msg)))
+    return w["builder"].build(fields, w["blob"])
+
+
 class SyntheticPCAPGenerator:
     """Main class for generating synthetic PCAP files"""
     
     def __init__(self, size_mb: int, output_file: str, pattern_categories: List[str], 
-                 num_threads: int = None):
+                 num_threads: int = None, engine: str = ENGINE_FAST, seed: Optional[int] = None,
+                 profile: Optional[str] = None, flows: Optional[int] = None, size_histogram: Optional[str] = None):
         """
         Initialize the PCAP generator
         
@@ -264,12 +342,29 @@ class SyntheticPCAPGenerator:
             size_mb: Target file size in MB
             output_file: Output file path
             pattern_categories: List of pattern categories to use
-            num_threads: Number of threads to use (default: all CPU cores)
+            num_threads: Number of threads (scapy engine) or processes (fast engine) to use (default: all CPU cores)
+            engine: ENGINE_FAST (template records) or ENGINE_SCAPY (scapy packets and wrpcap)
+            seed: Random seed; with a seed, timestamps start at a fixed time and the output is reproducible
+            profile: Traffic profile (YAML/JSON) to generate instead of the pattern library traffic
+            flows: Overrides the profile's flow count
+            size_histogram: Capture whose frame size histogram replaces the profile's size mix
         """
         self.size_mb = size_mb
         self.output_file = output_file
         self.pattern_categories = pattern_categories
         self.num_threads = num_threads or cpu_count()
+        self.engine = engine
+        self.seed = seed
+        self.profile = TrafficProfile.load(profile) if profile else None
+        if (flows or size_histogram) and self.profile is None:
+            raise ValueError("--flows and --size-histogram apply to a traffic profile (--profile)")
+        if flows:
+            self.profile.flows = flows
+        if size_histogram:
+            self.profile.packet_sizes = SizeDistribution.from_spec({"distribution": "histogram",
+                                                                    "capture": size_histogram})
+        if self.profile is not None:
+            self.profile.validate()
         
         self.pattern_library = PatternLibrary()
         self.flow_generator = FlowGenerator()
@@ -289,11 +384,93 @@ class SyntheticPCAPGenerator:
         """
         print(f"{Fore.CYAN}🔧 Creating {self.size_mb}MB synthetic PCAP file{Style.RESET_ALL}")
         print(f"   Output: {self.output_file}")
-        print(f"   Patterns: {', '.join(self.pattern_categories) if self.pattern_categories else 'all'}")
+        if self.profile is not None:
+            print(f"   Profile: {self.profile.name} ({self.profile.flows:,} {self.profile.flow_sizes.kind} flows, "
+                  f"{self.profile.packet_sizes.kind} sizes, {len(self.profile.injections)} injected pattern(s))")
+        else:
+            print(f"   Patterns: {', '.join(self.pattern_categories) if self.pattern_categories else 'all'}")
+            print(f"   Engine: {self.engine}")
+        print(f"   Seed: {self.seed if self.seed is not None else 'random'}")
         print(f"   Threads: {self.num_threads}")
         print("=" * 60)
         
-        base_time = time.time()
+        # Ensure output directory exists
+        output_path = Path(self.output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        if self.profile is not None:
+            return self._generate_profile(output_path)
+        if self.engine == ENGINE_FAST:
+            return self._generate_fast(output_path)
+        return self._generate_scapy(output_path)
+    
+    def _generate_fast(self, output_path: Path) -> str:
+        """Stream template-built record chunks from worker processes to disk, in order"""
+        target_bytes = self.size_mb * 1024 * 1024
+        fmt = format_for_output(str(output_path))
+        seed = random.getrandbits(63) if self.seed is None else self.seed
+        base_time_us = int(time.time() * 1_000_000) if self.seed is None else DEFAULT_START_TIME_US
+        initargs = (self.patterns, self.flow_generator.flows, fmt, seed, base_time_us)
+        print(f"Target size: {self.size_mb} MB ({target_bytes:,} bytes), {fmt}")
+        print(f"Chunk size: {CHUNK_MESSAGES:,} messages")
+        print(f"Generating records in {self.num_threads} process(es)...")
+        
+        start = time.time()
+        num_packets = 0
+        chunks = iter_chunks(generate_record_chunk, self.num_threads, _chunk_init, initargs)
+        try:
+            with PcapWriter(str(output_path), fmt) as writer:
+                for chunk_id, (records, ends) in enumerate(chunks, 1):
+                    # The last chunk is cut at the first record boundary past the target
+                    remaining = target_bytes - writer.bytes_written
+                    count = min(len(ends), int(np.searchsorted(ends, remaining)) + 1)
+                    writer.write(records[:int(ends[count - 1])])
+                    num_packets += count
+                    if writer.bytes_written >= target_bytes:
+                        break
+                    if chunk_id % 16 == 0:
+                        progress = writer.bytes_written / target_bytes * 100
+                        print(f"   Written {writer.bytes_written / 1024 / 1024:,.0f} MB ({progress:.1f}%) - {num_packets:,} packets")
+        finally:
+            chunks.close()
+        elapsed = time.time() - start
+        
+        final_size = output_path.stat().st_size
+        print(f"\n{Fore.GREEN}✅ PCAP file created successfully!{Style.RESET_ALL}")
+        print(f"   File: {output_path}")
+        print(f"   Packets: {num_packets:,}")
+        print(f"   File size: {final_size / 1024 / 1024:.1f} MB")
+        print(f"   Generation time: {elapsed:.2f}s ({final_size / 1024 / 1024 / elapsed:.1f} MB/s)")
+        print(f"   Average packet size: {final_size / num_packets:.0f} bytes")
+        
+        return str(output_path)
+    
+    def _generate_profile(self, output_path: Path) -> str:
+        """Profile traffic (traffic_profile.py) plus its injection manifest"""
+        seed = random.getrandbits(63) if self.seed is None else self.seed
+        target_bytes = self.size_mb * 1024 * 1024
+        print(f"Target size: {self.size_mb} MB ({target_bytes:,} bytes)")
+        print(f"Generating records in {self.num_threads} process(es)...")
+        
+        result = generate_capture(self.profile, str(output_path), target_bytes, seed, self.num_threads)
+        
+        print(f"\n{Fore.GREEN}✅ PCAP file created successfully!{Style.RESET_ALL}")
+        print(f"   File: {output_path}")
+        print(f"   Packets: {result.num_packets:,}")
+        print(f"   File size: {result.num_bytes / 1024 / 1024:.1f} MB")
+        print(f"   Generation time: {result.seconds:.2f}s ({result.num_bytes / 1024 / 1024 / result.seconds:.1f} MB/s)")
+        print(f"   Injected patterns: {result.injections:,} ({result.split_injections:,} split across segments)")
+        print(f"   Seed: {seed}")
+        print(f"   SHA-256: {result.sha256}")
+        print(f"   Manifest: {result.manifest_path}")
+        print(f"   Summary: {result.summary_path}")
+        
+        return str(output_path)
+    
+    def _generate_scapy(self, output_path: Path) -> str:
+        """Original engine: scapy packet objects in a thread pool, sorted, then wrpcap"""
+        from scapy.all import wrpcap
+        base_time = time.time() if self.seed is None else DEFAULT_START_TIME_US / 1_000_000
         target_bytes = self.size_mb * 1024 * 1024
         estimated_packets = target_bytes // 1000  # Rough estimate: 1KB per packet
         
@@ -307,7 +484,8 @@ class SyntheticPCAPGenerator:
         print(f"Number of batches: {num_batches}")
         print(f"Generating packets in parallel...")
         
-        all_packets = []
+        batches = {}
+        num_packets = 0
         completed_batches = 0
         
         # Use ThreadPoolExecutor for parallel packet generation
@@ -323,28 +501,29 @@ class SyntheticPCAPGenerator:
                     self.patterns, 
                     self.flow_generator, 
                     base_time, 
-                    start_packet_id
+                    start_packet_id,
+                    self.seed
                 )
                 futures.append(future)
             
             # Collect results as they complete
             for future in as_completed(futures):
                 batch_id, packets = future.result()
-                all_packets.extend(packets)
+                batches[batch_id] = packets
+                num_packets += len(packets)
                 completed_batches += 1
                 
                 # Progress update
                 progress = (completed_batches / num_batches) * 100
-                print(f"   Completed batch {completed_batches}/{num_batches} ({progress:.1f}%) - {len(all_packets):,} packets")
+                print(f"   Completed batch {completed_batches}/{num_batches} ({progress:.1f}%) - {num_packets:,} packets")
+        
+        # Batch order first, so packets with equal timestamps keep a fixed order
+        all_packets = [p for batch_id in sorted(batches) for p in batches[batch_id]]
         
         # Sort packets by timestamp to maintain chronological order
         print(f"\n📊 Sorting packets by timestamp...")
         all_packets.sort(key=lambda p: p.time)
         
-        # Ensure output directory exists
-        output_path = Path(self.output_file)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
         # Save the PCAP file
         print(f"\n💾 Writing PCAP file...")
         write_start = time.time()
@@ -381,6 +560,15 @@ Examples:
   # Generate 2GB PCAP with custom output location
   python create_large_synthetic_pcap.py --size 2000 --output /path/to/large_test.pcapng
   
+  # Reproducible capture from a traffic profile, with an injection manifest
+  python create_large_synthetic_pcap.py --size 500 --profile traffic_profiles/web_mixed.yaml --seed 7
+  
+  # IMIX frames over 5 million Zipf-sized flows
+  python create_large_synthetic_pcap.py --size 2000 --profile traffic_profiles/imix_zipf.yaml --flows 5000000
+  
+  # Frame sizes measured on a real capture
+  python create_large_synthetic_pcap.py --size 500 --profile traffic_profiles/web_mixed.yaml --size-histogram real.pcap
+  
   # List available pattern categories
   python create_large_synthetic_pcap.py --list-patterns
         """
@@ -411,7 +599,43 @@ Examples:
         '--threads', '-t',
         type=int,
         default=None,
-        help='Number of threads to use (default: all CPU cores)'
+        help='Number of threads (scapy engine) or worker processes (fast engine) to use (default: all CPU cores)'
+    )
+    
+    parser.add_argument(
+        '--engine', '-e',
+        choices=[ENGINE_FAST, ENGINE_SCAPY],
+        default=ENGINE_FAST,
+        help='fast: template records streamed from worker processes; scapy: scapy packets and wrpcap (default: fast)'
+    )
+    
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed: the same seed, size and options give a byte-identical file (default: random)'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        help='Traffic profile (YAML/JSON) of flows, sizes, protocols and injected patterns; '
+             'writes <output>.manifest.csv/.json (see traffic_profile.py)'
+    )
+    
+    parser.add_argument(
+        '--flows',
+        type=int,
+        default=None,
+        help="With --profile: number of concurrent flows (overrides the profile's flow count)"
+    )
+    
+    parser.add_argument(
+        '--size-histogram',
+        type=str,
+        default=None,
+        help="With --profile: take frame sizes from this capture's size histogram (its packet index)"
     )
     
     parser.add_argument(
@@ -464,7 +688,12 @@ def main():
             size_mb=args.size,
             output_file=output_file,
             pattern_categories=pattern_categories,
-            num_threads=args.threads
+            num_threads=args.threads,
+            engine=args.engine,
+            seed=args.seed,
+            profile=args.profile,
+            flows=args.flows,
+            size_histogram=args.size_histogram
         )
         
         output_path = generator.generate()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Persistent Capture Index Cache
+
+This module keeps packet indexes (see pcap_index.py) in a shared on-disk cache so that
+running the same capture through a scanner many times only parses it once. Entries
+are keyed by the capture's identity (real path, size, mtime and inode) and hold the
+packet offset/length tables plus per-record link type, IP protocol and L4 ports.
+
+Key Features:
+- One `.pidx` file per capture identity; a modified or replaced capture gets a new key
+- LRU eviction under a size budget (entry mtime is bumped on every hit)
+- Hit/miss/eviction counters, both for this process and persisted across runs
+
+Usage:
+    cache = IndexCache()                      # ~/.cache/pcap_index, 1 GB budget
+    index = cache.get("capture.pcapng")       # warm runs load the cached tables
+    print(cache.format_stats())
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pcap_reader import CaptureReader
+from pcap_index import PacketIndex, SIDECAR_SUFFIX, build_index, flow_metadata
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pcap_index")
+DEFAULT_BUDGET_MB = 1024
+STATS_FILE = "stats.json"
+
+
+def capture_key(path: str) -> str:
+    """Hash of (real path, size, mtime, inode) identifying one version of a capture"""
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    ident = f"{real}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}"
+    return hashlib.sha1(ident.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+class IndexCache:
+    """On-disk cache of packet indexes with LRU eviction under a byte budget"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, budget_mb: int = DEFAULT_BUDGET_MB):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, path: str) -> str:
+        name = os.path.basename(path)
+        return os.path.join(self.cache_dir, f"{name}.{capture_key(path)[:20]}{SIDECAR_SUFFIX}")
+
+    def get(self, path: str) -> PacketIndex:
+        """Return the index (with flow metadata) for `path`, building and storing it on a miss"""
+        entry = self.entry_path(path)
+        try:
+            index = PacketIndex.load(entry)
+            if index.matches_file(path) and index.has_flow_metadata:
+                self.hits += 1
+                self._touch(entry)
+                self._record("hits")
+                return index
+        except (OSError, ValueError, KeyError):
+            pass                        # absent, stale or unreadable entry: rebuild it
+        self.misses += 1
+        index = build_index(path)
+        with CaptureReader(path) as reader:
+            src = np.frombuffer(reader.buffer, dtype=np.uint8)
+            try:
+                flow_metadata(src, index)
+            finally:
+                del src
+        self._store(entry, index)
+        self._record("misses")
+        return index
+
+    def _store(self, entry: str, index: PacketIndex):
+        try:
+            index.save(entry)
+        except OSError:
+            return                      # unwritable cache: index stays in memory
+        if os.path.getsize(entry) > self.budget_bytes:
+            os.remove(entry)            # larger than the whole budget: never cacheable
+            return
+        self.evict(keep=entry)
+
+    def _touch(self, entry: str):
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """(last use, size, path) of every cache entry, least recently used first"""
+        out = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(SIDECAR_SUFFIX):
+                continue
+            full = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(full)
+            except FileNotFoundError:
+                continue                # removed by a concurrent run
+            out.append((st.st_mtime, st.st_size, full))
+        out.sort()
+        return out
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Delete least recently used entries until the cache fits its budget"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, full in entries:
+            if total <= self.budget_bytes:
+                break
+            if full == keep:
+                continue
+            try:
+                os.remove(full)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self.evictions += removed
+        if removed:
+            self._record("evictions", removed)
+        return removed
+
+    def _stats_path(self) -> str:
+        return os.path.join(self.cache_dir, STATS_FILE)
+
+    def _load_totals(self) -> Dict[str, int]:
+        try:
+            with open(self._stats_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, counter: str, amount: int = 1):
+        totals = self._load_totals()
+        totals[counter] = int(totals.get(counter, 0)) + amount
+        tmp = f"{self._stats_path()}.tmp{os.getpid()}"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(totals, f)
+            os.replace(tmp, self._stats_path())
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for this process plus lifetime totals and current cache size"""
+        totals = self._load_totals()
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "total_hits": int(totals.get("hits", 0)),
+            "total_misses": int(totals.get("misses", 0)),
+            "total_evictions": int(totals.get("evictions", 0)),
+            "entries": len(entries),
+            "size_bytes": sum(size for _, size, _ in entries),
+            "budget_bytes": self.budget_bytes,
+        }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        lookups = s["total_hits"] + s["total_misses"]
+        rate = 100.0 * s["total_hits"] / lookups if lookups else 0.0
+        return (f"Index cache: {s['hits']} hit(s), {s['misses']} miss(es) this run; "
+                f"lifetime hit rate {rate:.1f}% ({s['total_hits']}/{lookups}); "
+                f"{s['entries']} entries, {s['size_bytes'] / (1024 * 1024):.1f}/"
+                f"{s['budget_bytes'] / (1024 * 1024):.0f} MB")
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Streaming Match Sinks
+
+Scanners hand their matches to a sink batch by batch instead of collecting them in
+one list or one fixed-size array. Row sinks buffer a bounded number of matches and
+flush them to CSV, JSON Lines or Parquet as the scan progresses; the aggregate sink
+only keeps per-pattern and per-flow counters, so high hit-rate patterns cost neither
+memory nor output space.
+
+Key Features:
+- Matches arrive as (packet_ids, offsets, pattern_ids) arrays, the shape every scanner
+  in this repo already produces; nothing is converted to per-match Python objects
+- Memory is bounded by `flush_rows`, whatever the number of matches
+- Per-pattern counts are kept by every sink, so summaries never need the rows back
+- Multi-capture scans share one row sink: with `files` every row gains a leading
+  `file` column, and `for_file(i)` hands each capture a view that tags its rows
+- Parquet output is optional (requires pyarrow)
+
+Usage:
+    with open_sink("matches.jsonl", patterns) as sink:
+        for batch in batches:
+            sink.write(packet_ids, offsets, pattern_ids)
+    print(sink.total)
+
+    sink = AggregateSink(patterns, flow_keys=index.flow_ids, path="summary.json",
+                         flow_namer=lambda keys: flow_labels("a.pcap", index, keys))
+
+    merged = open_sink("matches.csv", patterns, files=["a.pcap", "b.pcap"])
+    merged.for_file(1).write(packet_ids, offsets, pattern_ids)      # rows of b.pcap
+"""
+
+import csv
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from patterns import pattern_name
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+FORMAT_PARQUET = "parquet"
+FORMAT_AGGREGATE = "aggregate"
+SINK_FORMATS = (FORMAT_CSV, FORMAT_JSONL, FORMAT_PARQUET, FORMAT_AGGREGATE)
+
+DEFAULT_FLUSH_ROWS = 1 << 20
+FIELDS = ("packet_id", "offset", "pattern_id")
+FILE_FIELD = "file"
+
+_EXTENSIONS = {".csv": FORMAT_CSV, ".jsonl": FORMAT_JSONL, ".ndjson": FORMAT_JSONL,
+               ".parquet": FORMAT_PARQUET, ".json": FORMAT_AGGREGATE}
+
+
+def format_for_path(path: str) -> str:
+    """Sink format implied by a file extension"""
+    fmt = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"{path}: unknown match output extension (use .csv, .jsonl, .parquet or .json)")
+    return fmt
+
+
+class MatchSink:
+    """Base sink: counts matches per pattern and buffers rows until `flush_rows` is reached"""
+
+    def __init__(self, patterns: List[bytes], flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 files: Optional[List[str]] = None):
+        self.patterns = patterns
+        self.flush_rows = flush_rows
+        self.files = files
+        self.pattern_counts = np.zeros(len(patterns), dtype=np.int64)
+        self._pending: List[Tuple[np.ndarray, ...]] = []
+        self._pending_rows = 0
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return ((FILE_FIELD,) + FIELDS) if self.files is not None else FIELDS
+
+    @property
+    def total(self) -> int:
+        return int(self.pattern_counts.sum())
+
+    def write(self, packet_ids: np.ndarray, offsets: np.ndarray, pattern_ids: np.ndarray, file_id: int = 0):
+        """Accept one batch of matches; arrays may be reused by the caller afterwards.
+
+        `file_id` indexes `files` and is only recorded when the sink was opened with them.
+        """
+        if len(pattern_ids) == 0:
+            return
+        self.pattern_counts += np.bincount(pattern_ids, minlength=len(self.patterns))
+        part = (np.array(packet_ids, dtype=np.int64), np.array(offsets, dtype=np.int64),
+                np.array(pattern_ids, dtype=np.int64))
+        if self.files is not None:
+            part += (np.full(len(pattern_ids), file_id, dtype=np.int64),)
+        self._pending.append(part)
+        self._pending_rows += len(pattern_ids)
+        if self._pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        columns = tuple(np.concatenate([part[k] for part in self._pending]) for k in range(len(self._pending[0])))
+        self._pending = []
+        self._pending_rows = 0
+        self._write_rows(*columns)
+
+    def _write_rows(self, packet_ids: np.ndarray, offsets: np.ndarray, pattern_ids: np.ndarray,
+                    file_ids: Optional[np.ndarray] = None):
+        raise NotImplementedError
+
+    def for_file(self, file_id: int) -> "FileSink":
+        """View of this sink that tags every row with file `file_id`"""
+        if self.files is None:
+            raise ValueError("sink was not opened with a file list")
+        return FileSink(self, file_id)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CSVMatchSink(MatchSink):
+    """packet_id,offset,pattern_id rows"""
+
+    def __init__(self, path: str, patterns: List[bytes], flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 files: Optional[List[str]] = None):
+        super().__init__(patterns, flush_rows, files)
+        self.path = path
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.fields)
+
+    def _write_rows(self, packet_ids, offsets, pattern_ids, file_ids=None):
+        columns = [packet_ids.tolist(), offsets.tolist(), pattern_ids.tolist()]
+        if file_ids is not None:
+            columns.insert(0, [self.files[i] for i in file_ids.tolist()])
+        self._writer.writerows(zip(*columns))
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class JSONLMatchSink(MatchSink):
+    """One {"packet_id", "offset", "pattern_id"} object per line"""
+
+    def __init__(self, path: str, patterns: List[bytes], flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 files: Optional[List[str]] = None):
+        super().__init__(patterns, flush_rows, files)
+        self.path = path
+        self._file = open(path, "w")
+
+    def _write_rows(self, packet_ids, offsets, pattern_ids, file_ids=None):
+        if file_ids is None:
+            self._file.writelines(
+                f'{{"packet_id": {p}, "offset": {o}, "pattern_id": {i}}}\n'
+                for p, o, i in zip(packet_ids.tolist(), offsets.tolist(), pattern_ids.tolist()))
+            return
+        names = [json.dumps(f) for f in self.files]
+        self._file.writelines(
+            f'{{"file": {names[f]}, "packet_id": {p}, "offset": {o}, "pattern_id": {i}}}\n'
+            for f, p, o, i in zip(file_ids.tolist(), packet_ids.tolist(), offsets.tolist(), pattern_ids.tolist()))
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class ParquetMatchSink(MatchSink):
+    """Columnar output; each flush becomes one Parquet row group"""
+
+    def __init__(self, path: str, patterns: List[bytes], flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 files: Optional[List[str]] = None):
+        if not PARQUET_AVAILABLE:
+            raise RuntimeError("Parquet match output requires pyarrow: pip install pyarrow")
+        super().__init__(patterns, flush_rows, files)
+        self.path = path
+        fields = [("packet_id", pa.uint64()), ("offset", pa.uint32()), ("pattern_id", pa.uint16())]
+        if files is not None:
+            fields.insert(0, (FILE_FIELD, pa.dictionary(pa.int32(), pa.string())))
+            self._file_names = pa.array(files, type=pa.string())
+        self._schema = pa.schema(fields)
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def _write_rows(self, packet_ids, offsets, pattern_ids, file_ids=None):
+        columns = [pa.array(packet_ids.astype(np.uint64)), pa.array(offsets.astype(np.uint32)),
+                   pa.array(pattern_ids.astype(np.uint16))]
+        if file_ids is not None:
+            columns.insert(0, pa.DictionaryArray.from_arrays(pa.array(file_ids.astype(np.int32)), self._file_names))
+        self._writer.write_table(pa.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+class AggregateSink(MatchSink):
+    """Per-pattern and per-flow match counts only; individual matches are never stored
+
+    `flow_keys` maps a packet id to its flow ID (one entry per packet in the capture,
+    e.g. PacketIndex.flow_ids: the 5-tuple hash of packet_headers.decode_headers).
+    Without it only per-pattern counts are kept. `flow_namer` turns flow IDs into
+    readable names ("tcp 10.0.0.1:40000-10.0.0.2:80", see pcap_index.flow_labels); it
+    is only asked about flows that are reported. The summary is written as JSON to
+    `path` on close, if given.
+    """
+
+    def __init__(self, patterns: List[bytes], flow_keys: Optional[np.ndarray] = None, path: Optional[str] = None,
+                 flow_namer: Optional[Callable[[List[int]], Dict[int, str]]] = None):
+        if path and format_for_path(path) != FORMAT_AGGREGATE:
+            raise ValueError(f"{path}: aggregate counts are written as JSON, use a .json path")
+        super().__init__(patterns)
+        self.flow_keys = flow_keys
+        self.path = path
+        self.flow_namer = flow_namer
+        self.flow_counts: Dict[int, int] = {}
+        self.flow_names: Dict[int, str] = {}
+
+    def write(self, packet_ids, offsets, pattern_ids):
+        if len(pattern_ids) == 0:
+            return
+        self.pattern_counts += np.bincount(pattern_ids, minlength=len(self.patterns))
+        if self.flow_keys is not None:
+            keys, counts = np.unique(self.flow_keys[packet_ids], return_counts=True)
+            self.add_flow_counts(keys, counts)
+
+    def add_counts(self, pattern_counts: np.ndarray):
+        """Merge per-pattern counts computed elsewhere (e.g. on the GPU)"""
+        self.pattern_counts += pattern_counts
+
+    def add_flow_counts(self, keys: np.ndarray, counts: np.ndarray):
+        flow_counts = self.flow_counts
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            flow_counts[key] = flow_counts.get(key, 0) + count
+
+    def merge(self, other: "AggregateSink"):
+        """Add another sink's counts (and the names of its flows) to this one"""
+        self.add_counts(other.pattern_counts)
+        if other.flow_counts:
+            keys = list(other.flow_counts)
+            self.flow_names.update(other.name_flows(keys))
+            self.add_flow_counts(np.array(keys, dtype=np.uint64), np.array(list(other.flow_counts.values())))
+
+    def name_flows(self, keys: List[int]) -> Dict[int, str]:
+        """Name of each flow ID; the ID in hex when the namer does not know it"""
+        missing = [k for k in keys if k not in self.flow_names]
+        if missing and self.flow_namer is not None:
+            self.flow_names.update(self.flow_namer(missing))
+        return {k: self.flow_names.get(k, f"{k:016x}") for k in keys}
+
+    def top_flows(self, n: int = 10) -> List[Tuple[int, str, int]]:
+        """(flow ID, flow name, match count) of the n flows with the most matches"""
+        top = sorted(self.flow_counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+        names = self.name_flows([k for k, _ in top])
+        return [(k, names[k], c) for k, c in top]
+
+    def summary(self) -> Dict:
+        return {
+            "total_matches": self.total,
+            "patterns": [{"pattern_id": i, "pattern": pattern_name(p), "count": int(c)}
+                         for i, (p, c) in enumerate(zip(self.patterns, self.pattern_counts))],
+            "flows": [{"flow_id": f"{k:016x}", "flow": name, "count": c}
+                      for k, name, c in self.top_flows(len(self.flow_counts))],
+        }
+
+    def close(self):
+        if self.path:
+            with open(self.path, "w") as f:
+                json.dump(self.summary(), f, indent=2)
+
+
+class FileSink(MatchSink):
+    """One capture's view of a shared multi-file row sink: rows go to `parent` tagged with `file_id`.
+
+    Keeps the capture's own per-pattern counts; closing it leaves the parent open.
+    """
+
+    def __init__(self, parent: MatchSink, file_id: int):
+        super().__init__(parent.patterns, parent.flush_rows)
+        self.parent = parent
+        self.file_id = file_id
+
+    def write(self, packet_ids, offsets, pattern_ids, file_id: int = 0):
+        if len(pattern_ids) == 0:
+            return
+        self.pattern_counts += np.bincount(pattern_ids, minlength=len(self.patterns))
+        self.parent.write(packet_ids, offsets, pattern_ids, self.file_id)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_sink(path: str, patterns: List[bytes], fmt: Optional[str] = None,
+              flow_keys: Optional[np.ndarray] = None, flush_rows: int = DEFAULT_FLUSH_ROWS,
+              files: Optional[List[str]] = None,
+              flow_namer: Optional[Callable[[List[int]], Dict[int, str]]] = None) -> MatchSink:
+    """Create the sink for `fmt` (default: inferred from the extension of `path`).
+
+    `files` (row formats only) adds the leading file column for multi-capture scans;
+    `flow_keys` and `flow_namer` are for the aggregate format (see AggregateSink).
+    """
+    fmt = fmt or format_for_path(path)
+    if fmt == FORMAT_CSV:
+        return CSVMatchSink(path, patterns, flush_rows, files)
+    if fmt == FORMAT_JSONL:
+        return JSONLMatchSink(path, patterns, flush_rows, files)
+    if fmt == FORMAT_PARQUET:
+        return ParquetMatchSink(path, patterns, flush_rows, files)
+    if fmt == FORMAT_AGGREGATE:
+        return AggregateSink(patterns, flow_keys, path, flow_namer)
+    raise ValueError(f"Unknown match sink format: {fmt}")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Compact Match Store
+
+Keeps matches in one growable NumPy structured array instead of one Python object
+per hit. A row is 14 bytes (packet_id u32, offset u32, pattern_id u16, flow_id u32),
+against several hundred bytes for a dataclass carrying a context string. Context
+bytes are not stored at all: they are sliced out of the packet source (normally the
+memory-mapped capture) only for the rows that are actually reported.
+
+Key Features:
+- Usable anywhere a match sink is expected (see match_sink.py): `write` appends a batch
+- Per-packet flow ids are filled in on append when a packet -> flow table is given
+- Lazy context extraction and dict-row conversion for the csv/json/pandas writers
+
+Usage:
+    store = MatchStore(patterns, packet_flow_ids=flow_ids)
+    store.write(packet_ids, offsets, pattern_ids)
+    with CaptureReader(path) as reader:
+        rows = list(store.to_records(packet_source(reader, index)))
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from match_sink import MatchSink
+from patterns import pattern_name
+
+MATCH_DTYPE = np.dtype([("packet_id", "<u4"), ("offset", "<u4"), ("pattern_id", "<u2"), ("flow_id", "<u4")])
+NO_FLOW = 0xFFFFFFFF
+CONTEXT_BYTES = 20
+
+# Packet id -> packet bytes (memoryview, bytes or bytearray)
+PacketSource = Callable[[int], Sequence[int]]
+
+
+def packet_source(reader, index) -> PacketSource:
+    """Packet bytes by packet id, as zero-copy views into a CaptureReader's mapping"""
+    data_offsets = index.data_offsets
+    lengths = index.lengths
+
+    def packet(packet_id: int):
+        return reader.packet(int(data_offsets[packet_id]), int(lengths[packet_id]))
+    return packet
+
+
+class MatchStore(MatchSink):
+    """Matches as rows of a MATCH_DTYPE structured array"""
+
+    def __init__(self, patterns: List[bytes], packet_flow_ids: Optional[np.ndarray] = None, capacity: int = 1024):
+        super().__init__(patterns)
+        self.packet_flow_ids = packet_flow_ids
+        self._rows = np.empty(capacity, dtype=MATCH_DTYPE)
+        self._size = 0
+
+    @classmethod
+    def from_arrays(cls, patterns: List[bytes], packet_ids: np.ndarray, offsets: np.ndarray,
+                    pattern_ids: np.ndarray, packet_flow_ids: Optional[np.ndarray] = None) -> "MatchStore":
+        store = cls(patterns, packet_flow_ids, capacity=max(1, len(packet_ids)))
+        store.write(packet_ids, offsets, pattern_ids)
+        return store
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matches(self) -> np.ndarray:
+        """The stored rows (a view; valid until the next append)"""
+        return self._rows[:self._size]
+
+    def write(self, packet_ids, offsets, pattern_ids):
+        flow_ids = None
+        if self.packet_flow_ids is not None and len(packet_ids):
+            flow_ids = self.packet_flow_ids[np.asarray(packet_ids, dtype=np.int64)]
+        self.append(packet_ids, offsets, pattern_ids, flow_ids)
+
+    def append(self, packet_ids, offsets, pattern_ids, flow_ids=None):
+        """Append one batch; flow_ids defaults to NO_FLOW"""
+        n = len(pattern_ids)
+        if n == 0:
+            return
+        self.pattern_counts += np.bincount(pattern_ids, minlength=len(self.patterns))
+        end = self._size + n
+        if end > len(self._rows):
+            grown = np.empty(max(end, 2 * len(self._rows)), dtype=MATCH_DTYPE)
+            grown[:self._size] = self._rows[:self._size]
+            self._rows = grown
+        rows = self._rows[self._size:end]
+        rows["packet_id"] = packet_ids
+        rows["offset"] = offsets
+        rows["pattern_id"] = pattern_ids
+        rows["flow_id"] = NO_FLOW if flow_ids is None else flow_ids
+        self._size = end
+
+    def flush(self):
+        pass                            # rows are already in memory
+
+    def head(self, n: int) -> "MatchStore":
+        """A copy holding the first n rows"""
+        store = MatchStore(self.patterns, self.packet_flow_ids, capacity=max(1, min(n, self._size)))
+        rows = self.matches[:n]
+        store.append(rows["packet_id"], rows["offset"], rows["pattern_id"], rows["flow_id"])
+        return store
+
+    def context(self, i: int, packets: PacketSource, radius: int = CONTEXT_BYTES) -> bytes:
+        """Bytes around match i: `radius` bytes either side of the matched pattern"""
+        row = self._rows[i]
+        data = packets(int(row["packet_id"]))
+        start = max(0, int(row["offset"]) - radius)
+        end = min(len(data), int(row["offset"]) + len(self.patterns[int(row["pattern_id"])]) + radius)
+        return bytes(data[start:end])
+
+    def to_records(self, packets: Optional[PacketSource] = None, flow_names: Optional[Sequence[str]] = None,
+                   radius: int = CONTEXT_BYTES) -> Iterator[Dict]:
+        """Yield one dict per match for csv.DictWriter / json / pandas.
+
+        A `context` column (hex) is added when `packets` is given, and flow ids are
+        replaced by names when `flow_names` is given.
+        """
+        rows = self.matches
+        columns = [rows[name].tolist() for name in ("packet_id", "offset", "pattern_id", "flow_id")]
+        for i, (packet_id, offset, pattern_id, flow_id) in enumerate(zip(*columns)):
+            record = {
+                "packet_id": packet_id,
+                "offset": offset,
+                "pattern_id": pattern_id,
+                "pattern": pattern_name(self.patterns[pattern_id]),
+                "flow_id": None if flow_id == NO_FLOW else (flow_names[flow_id] if flow_names is not None else flow_id),
+            }
+            if packets is not None:
+                record["context"] = self.context(i, packets, radius).hex()
+            yield record
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Search Pattern Parsing
+
+Shared helpers for turning command-line strings and rule-pack files into the raw byte
+patterns the scanners search for.
+
+Pattern syntax:
+- Plain characters match themselves
+- \\xNN matches the byte 0xNN; \\n, \\r and \\t are the usual control bytes
+- A backslash before any other character matches that character literally
+- A leading (?i) makes the pattern case-insensitive (nocase), as does nocase=True
+- A leading (?w) turns on wildcards and byte classes, as does wildcards=True:
+  - ?? matches any single byte (a lone ? is literal; write \\?\\? for two question marks)
+  - [...] matches one byte out of a class: characters, escapes and ranges (a-z,
+    \\x00-\\x1f), negated by a leading ^ (write \\[ for a literal bracket)
+  Without it ?? and [...] are plain characters, so existing literal rule packs
+  ("[INFO] login", "index.php??") keep meaning what they say
+- The prefixes combine in either order, e.g. (?i)(?w)pass[0-9]
+
+Patterns that are plain byte strings compile to `bytes`, so literal-only pattern sets
+keep every literal fast path (BMH, anchors). Wildcards, classes and nocase compile to a
+BytePattern: a per-position set of accepted bytes that the automaton builders turn into
+shared transitions instead of expanding variants.
+
+Rule packs are text files with one pattern per line; blank lines and lines starting
+with '#' are ignored.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+NOCASE_PREFIX = "(?i)"
+WILDCARD_PREFIX = "(?w)"
+
+
+def unescape(s: str) -> bytes:
+    out = bytearray(); i = 0
+    while i < len(s):
+        if s[i] == "\\" and i + 1 < len(s):
+            n = s[i+1]
+            if n == "x" and i + 3 < len(s):
+                out.append(int(s[i+2:i+4], 16)); i += 4
+            elif n == "n": out.append(0x0A); i += 2
+            elif n == "r": out.append(0x0D); i += 2
+            elif n == "t": out.append(0x09); i += 2
+            else: out.append(ord(n)); i += 2
+        else:
+            out.append(ord(s[i])); i += 1
+    return bytes(out)
+
+
+class BytePattern(bytes):
+    """A pattern with a set of accepted bytes per position.
+
+    The bytes value is one representative byte per position (the smallest accepted),
+    so len() is the match length; `masks` (bool[len, 256]) holds the real byte sets
+    and `source` the pattern text for reports.
+    """
+
+    def __new__(cls, masks: np.ndarray, source: str):
+        masks = np.asarray(masks, dtype=bool)
+        self = super().__new__(cls, bytes(np.argmax(masks, axis=1).astype(np.uint8)))
+        self.masks = masks
+        self.source = source
+        return self
+
+    def __reduce__(self):
+        return BytePattern, (self.masks, self.source)
+
+    def __repr__(self) -> str:
+        return f"BytePattern({self.source!r})"
+
+
+def _escape_byte(s: str, i: int) -> Tuple[int, int]:
+    """Byte value of the (possibly escaped) character at s[i], and the index after it"""
+    if s[i] == "\\" and i + 1 < len(s):
+        n = s[i+1]
+        if n == "x" and i + 3 < len(s):
+            return int(s[i+2:i+4], 16), i + 4
+        return {"n": 0x0A, "r": 0x0D, "t": 0x09}.get(n, ord(n)), i + 2
+    return ord(s[i]), i + 1
+
+
+def _byte_class(s: str, i: int) -> Tuple[np.ndarray, int]:
+    """Mask of the class starting after the '[' at s[i - 1], and the index after its ']'"""
+    mask = np.zeros(256, dtype=bool)
+    negate = i < len(s) and s[i] == "^"
+    i += negate
+    while i < len(s) and s[i] != "]":
+        lo, i = _escape_byte(s, i)
+        hi = lo
+        if i + 1 < len(s) and s[i] == "-" and s[i+1] != "]":
+            hi, i = _escape_byte(s, i + 1)
+        if hi < lo:
+            raise ValueError(f"Invalid byte range in pattern: {s!r}")
+        mask[lo:hi + 1] = True
+    if i >= len(s):
+        raise ValueError(f"Unterminated byte class in pattern: {s!r}")
+    return ~mask if negate else mask, i + 1
+
+
+def fold_case(mask: np.ndarray) -> np.ndarray:
+    """Mask extended so that each ASCII letter accepts both cases"""
+    mask = mask.copy()
+    upper, lower = mask[0x41:0x5B].copy(), mask[0x61:0x7B].copy()
+    mask[0x41:0x5B] |= lower
+    mask[0x61:0x7B] |= upper
+    return mask
+
+
+def compile_pattern(s: str, nocase: bool = False, wildcards: bool = False) -> bytes:
+    """Pattern text -> bytes (plain literal) or BytePattern (wildcards, classes, nocase)"""
+    while s.startswith((NOCASE_PREFIX, WILDCARD_PREFIX)):
+        if s.startswith(NOCASE_PREFIX):
+            s, nocase = s[len(NOCASE_PREFIX):], True
+        else:
+            s, wildcards = s[len(WILDCARD_PREFIX):], True
+    masks = []
+    i = 0
+    while i < len(s):
+        mask = np.zeros(256, dtype=bool)
+        if wildcards and s.startswith("??", i):
+            mask[:] = True
+            i += 2
+        elif wildcards and s[i] == "[":
+            mask, i = _byte_class(s, i + 1)
+        else:
+            b, i = _escape_byte(s, i)
+            mask[b] = True
+        masks.append(fold_case(mask) if nocase else mask)
+    if not masks:
+        return b""
+    masks = np.array(masks)
+    if (masks.sum(axis=1) == 1).all():
+        return bytes(np.argmax(masks, axis=1).astype(np.uint8))
+    return BytePattern(masks, NOCASE_PREFIX * nocase + WILDCARD_PREFIX * wildcards + s)
+
+
+def is_literal(pattern: bytes) -> bool:
+    """True for plain byte strings (every position accepts exactly one byte)"""
+    return not isinstance(pattern, BytePattern)
+
+
+def position_masks(pattern: bytes) -> np.ndarray:
+    """bool[len, 256] accepted bytes per position, for literals and BytePatterns alike"""
+    if isinstance(pattern, BytePattern):
+        return pattern.masks
+    masks = np.zeros((len(pattern), 256), dtype=bool)
+    masks[np.arange(len(pattern)), np.frombuffer(pattern, dtype=np.uint8)] = True
+    return masks
+
+
+def pattern_name(pattern: bytes) -> str:
+    """Display form: the source text of a BytePattern, the latin-1 text of a literal"""
+    if isinstance(pattern, BytePattern):
+        return pattern.source
+    return pattern.decode("latin-1")
+
+
+def literal_only(patterns: Sequence[bytes]) -> bool:
+    return all(is_literal(p) for p in patterns)
+
+
+def load_rule_pack(path: str) -> List[bytes]:
+    """Read a rule pack file into a list of byte patterns (order is preserved)"""
+    patterns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(compile_pattern(line))
+    return patterns
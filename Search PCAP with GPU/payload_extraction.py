@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Array-Based Payload Extraction
+
+This module turns a capture into the payload list the scanners consume without
+dissecting packets one by one: headers are decoded for the whole packet index with
+packet_headers.decode_headers, UDP payloads are packed straight out of the memory-mapped
+capture with one vectorized gather, and only TCP segments go through the stream
+reassembler (fed with integers and memoryviews, never per-packet header objects).
+
+The result is a PayloadBatch of flat arrays - (offset, length, flow_id) per payload into
+one packed buffer - in capture order.
+
+Key Features:
+- No scapy, no per-packet FlowKey/string allocation; flow names are built once per flow
+- TCP stream reassembly with carry-over (see tcp_reassembly.py), optional
+- Dense per-payload flow indices for MatchStore rows plus the packed 64-bit flow IDs
+- Payloads are zero-copy memoryviews into the packed buffer
+
+Usage:
+    batch = extract_payloads("capture.pcap", max_pattern_len=32)
+    for i in range(len(batch)):
+        scan(batch[i], carry_len=batch.carry_lengths[i])
+    print(batch.flow_names[batch.flow_index[0]])
+"""
+
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from pcap_index import load_index, gather_ranges
+from pcap_reader import CaptureReader
+from packet_headers import decode_headers, flow_name, IP_PROTO_TCP, IP_PROTO_UDP
+from tcp_reassembly import StreamReassembler, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_FLOWS
+
+TCP_CONTROL_FLAGS = 0x07       # FIN, SYN, RST: the only flags the reassembler looks at
+
+
+@dataclass
+class PayloadBatch:
+    """Packed payloads; entry i is buffer[offsets[i]:offsets[i] + lengths[i]]"""
+    buffer: np.ndarray          # uint8, all payloads back to back
+    offsets: np.ndarray         # int64 start of each payload in `buffer`
+    lengths: np.ndarray         # uint32
+    flow_ids: np.ndarray        # uint64 packed flow ID (packet_headers.decode_headers)
+    flow_index: np.ndarray      # uint32 dense flow number, indexes flow_names
+    flow_names: List[str]       # "src:port-dst:port", one per distinct flow
+    carry_lengths: np.ndarray   # uint32 leading bytes repeated from the flow's previous chunk
+    stream_offsets: np.ndarray  # int64 stream position of each payload's first byte (0 if taken as is)
+    timestamps: np.ndarray      # float64 capture time (seconds)
+    packet_count: int           # packets in the capture
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        start = int(self.offsets[i])
+        return self.buffer.data[start:start + int(self.lengths[i])]
+
+    @property
+    def scanned_bytes(self) -> int:
+        """Payload bytes excluding carry-over (each stream byte counted once)"""
+        return int(self.lengths.sum(dtype=np.int64) - self.carry_lengths.sum(dtype=np.int64))
+
+
+def extract_payloads(path: str, max_pattern_len: int, reassemble: bool = True, include_udp: bool = True,
+                     idle_timeout: float = DEFAULT_IDLE_TIMEOUT, max_flows: int = DEFAULT_MAX_FLOWS) -> PayloadBatch:
+    """Extract TCP (and UDP) payloads from a capture as a PayloadBatch.
+
+    With `reassemble`, TCP segments are turned into stream chunks carrying the flow's
+    last (max_pattern_len - 1) bytes; otherwise every segment is taken as is, like UDP.
+    """
+    index = load_index(path)
+    with CaptureReader(path) as reader:
+        src = np.frombuffer(reader.buffer, dtype=np.uint8)
+        try:
+            return _extract(src, index, max_pattern_len, reassemble, include_udp, idle_timeout, max_flows)
+        finally:
+            del src                 # release the buffer export before the mapping closes
+
+
+def _extract(src, index, max_pattern_len, reassemble, include_udp, idle_timeout, max_flows) -> PayloadBatch:
+    headers = decode_headers(src, index.data_offsets, index.lengths, index.linktypes)
+    starts = index.data_offsets.astype(np.int64) + headers.payload_offsets
+    lengths = headers.payload_lengths
+    timestamps = index.ts_sec + index.ts_usec * 1e-6
+    has_data = headers.has_ports & (lengths > 0)
+
+    tcp = headers.has_ports & (headers.ip_protos == IP_PROTO_TCP)
+    direct = (headers.ip_protos == IP_PROTO_UDP) & has_data if include_udp else np.zeros(len(index), dtype=bool)
+    if not reassemble:
+        direct |= tcp & has_data
+    direct = np.flatnonzero(direct)
+
+    # Payloads taken as is: gathered from the capture, no carry-over
+    direct_total = int(lengths[direct].sum(dtype=np.int64))
+    parts: List[bytes] = []
+    keys, flows, carries, positions, times = [], [], [], [], []
+    if reassemble:
+        reassembler = StreamReassembler(max_pattern_len, idle_timeout, max_flows)
+        view = src.data
+        segments = np.flatnonzero(tcp)
+
+        def add_chunks(key, chunks):
+            for chunk in chunks:
+                parts.append(chunk.data)
+                keys.append(key)
+                flows.append(chunk.flow_key)
+                carries.append(chunk.carry_len)
+                positions.append(chunk.stream_offset)
+                times.append(chunk.timestamp)
+
+        columns = (segments.tolist(), headers.flow_ids[segments].tolist(), headers.tcp_seqs[segments].tolist(),
+                   (headers.tcp_flags[segments] & TCP_CONTROL_FLAGS).tolist(), starts[segments].tolist(),
+                   lengths[segments].tolist(), timestamps[segments].tolist())
+        for i, flow_id, seq, flags, start, length, ts in zip(*columns):
+            chunks = reassembler.add_segment(flow_id, seq, view[start:start + length], ts, flags)
+            if chunks:
+                add_chunks(i, chunks)
+        add_chunks(len(index), reassembler.flush())     # streams still open at the end of the capture
+
+    stream_bytes = b"".join(parts)
+    buffer = np.empty(direct_total + len(stream_bytes), dtype=np.uint8)
+    gather_ranges(src, starts[direct], lengths[direct], buffer)
+    buffer[direct_total:] = np.frombuffer(stream_bytes, dtype=np.uint8)
+
+    chunk_lengths = np.fromiter((len(p) for p in parts), dtype=np.int64, count=len(parts))
+    all_lengths = np.concatenate([lengths[direct].astype(np.int64), chunk_lengths])
+    offsets = np.zeros(len(all_lengths), dtype=np.int64)
+    np.cumsum(all_lengths[:-1], out=offsets[1:])
+
+    # Capture order: a chunk sorts at the packet that completed it
+    order = np.argsort(np.concatenate([direct, np.array(keys, dtype=np.int64)]), kind="stable")
+    flow_ids = np.concatenate([headers.flow_ids[direct], np.array(flows, dtype=np.uint64)])[order]
+
+    # Dense flow numbering; names come from the first packet of each flow
+    distinct, flow_index = np.unique(flow_ids, return_inverse=True)
+    first = np.unique(headers.flow_ids, return_index=True)
+    representative = first[1][np.searchsorted(first[0], distinct)]
+    flow_names = [flow_name(src, index.data_offsets[i], headers, i) for i in representative.tolist()]
+
+    return PayloadBatch(
+        buffer=buffer,
+        offsets=offsets[order],
+        lengths=all_lengths[order].astype(np.uint32),
+        flow_ids=flow_ids,
+        flow_index=flow_index.astype(np.uint32),
+        flow_names=flow_names,
+        carry_lengths=np.concatenate([np.zeros(len(direct), dtype=np.uint32),
+                                      np.array(carries, dtype=np.uint32)])[order],
+        stream_offsets=np.concatenate([np.zeros(len(direct), dtype=np.int64),
+                                       np.array(positions, dtype=np.int64)])[order],
+        timestamps=np.concatenate([timestamps[direct], np.array(times, dtype=np.float64)])[order],
+        packet_count=len(index),
+    )
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Vectorized PCAP/PCAPNG Packet Indexer
+
+This module builds a packet index (file data offsets, captured lengths, timestamps and
+link types) for a capture without a per-record Python loop, and persists it next to the
+capture as a `.pidx` sidecar so repeated scans skip indexing entirely.
+
+How it works:
+- The record area is cut into many segments. Each segment finds a plausible record
+  boundary near its start by validating candidate headers with NumPy.
+- All segments then walk their record chains in lockstep: one NumPy gather per step
+  advances every chain by one record, so the step count is records-per-segment rather
+  than records-per-file.
+- Chains are stitched in order: a segment is accepted only if the previous (verified)
+  chain ends exactly where it started. Any segment that fails this check is re-walked
+  with a small pure-Python loop from the verified position, so the result is always
+  identical to a sequential walk.
+
+Usage:
+    index = load_index("capture.pcapng")       # builds and writes capture.pcapng.pidx once
+    for off, length in zip(index.data_offsets, index.lengths):
+        ...
+"""
+
+import math
+import os
+import struct
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pcap_reader import (
+    CaptureReader, FORMAT_PCAP, LINKTYPE_ETHERNET,
+    MAX_RECORD_BYTES, PCAP_GLOBAL_HDR_SIZE, PCAP_REC_HDR_SIZE, PCAP_MAGIC_NSEC, PCAP_MAGIC_NSEC_SWAPPED,
+    PCAP_MAGIC_USEC_SWAPPED, PCAPNG_SHB, PCAPNG_IDB, PCAPNG_SPB, PCAPNG_EPB, PCAPNG_BOM,
+    _idb_ticks_per_second,
+)
+from packet_headers import decode_headers, flow_name, IP_PROTO_SCTP, IP_PROTO_TCP, IP_PROTO_UDP
+
+INDEX_VERSION = 1
+SIDECAR_SUFFIX = ".pidx"
+
+# Captures with fewer (estimated) records are indexed with the sequential walker;
+# the lockstep machinery only pays off once there are many records per segment.
+MIN_VECTORIZED_RECORDS = 100_000
+SAMPLE_RECORDS = 512
+MAX_SEGMENTS = 16384
+MAX_SYNC_WINDOW = 1 << 20
+SYNC_BATCH_POSITIONS = 1 << 22
+GATHER_CHUNK_BYTES = 32 * 1024 * 1024
+
+FLOW_FIELDS = ("ip_protos", "src_ports", "dst_ports", "l3_offsets", "payload_offsets", "payload_lengths", "flow_ids")
+PROTO_NAMES = {IP_PROTO_TCP: "tcp", IP_PROTO_UDP: "udp", IP_PROTO_SCTP: "sctp"}
+
+PCAPNG_KNOWN_BLOCKS = (PCAPNG_IDB, 0x00000002, PCAPNG_SPB, 0x00000004, 0x00000005,
+                       PCAPNG_EPB, 0x0000000A, 0x00000BAD, 0x40000BAD)
+
+
+@dataclass
+class PacketIndex:
+    """Per-packet arrays describing where every packet lives in a capture file"""
+    file_size: int
+    mtime_ns: int
+    format: str
+    data_offsets: np.ndarray   # uint64 file offset of the first captured byte
+    lengths: np.ndarray        # uint32 captured length
+    ts_sec: np.ndarray         # uint32
+    ts_usec: np.ndarray        # uint32
+    linktypes: np.ndarray      # uint16
+    # Optional per-record header metadata (see flow_metadata); None when not computed
+    ip_protos: Optional[np.ndarray] = None   # uint8, IP_PROTO_NONE for non-IP packets
+    src_ports: Optional[np.ndarray] = None   # uint16, 0 when there is no TCP/UDP/SCTP header
+    dst_ports: Optional[np.ndarray] = None   # uint16
+    l3_offsets: Optional[np.ndarray] = None  # int16 start of the IP header within the packet, -1 without IP
+    payload_offsets: Optional[np.ndarray] = None   # uint16 start of the L4 payload within the packet
+    payload_lengths: Optional[np.ndarray] = None   # uint32 payload bytes (0 without IP)
+    flow_ids: Optional[np.ndarray] = None    # uint64 directional 5-tuple flow ID (0 without IP)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def has_flow_metadata(self) -> bool:
+        return all(getattr(self, name) is not None for name in FLOW_FIELDS)
+
+    @property
+    def total_bytes(self) -> int:
+        return int(self.lengths.sum(dtype=np.uint64))
+
+    def matches_file(self, path: str) -> bool:
+        """True if the index was built from the capture currently at `path`"""
+        st = os.stat(path)
+        return st.st_size == self.file_size and st.st_mtime_ns == self.mtime_ns
+
+    def save(self, path: str):
+        """Write the index atomically as an uncompressed .npz archive"""
+        tmp = f"{path}.tmp{os.getpid()}"
+        arrays = dict(data_offsets=self.data_offsets, lengths=self.lengths,
+                      ts_sec=self.ts_sec, ts_usec=self.ts_usec, linktypes=self.linktypes)
+        if self.has_flow_metadata:
+            arrays.update({name: getattr(self, name) for name in FLOW_FIELDS})
+        with open(tmp, "wb") as f:
+            np.savez(f, version=np.int64(INDEX_VERSION), file_size=np.int64(self.file_size),
+                     mtime_ns=np.int64(self.mtime_ns), format=np.array(self.format), **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PacketIndex":
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version in {path}")
+            meta = {k: z[k] for k in FLOW_FIELDS if k in z.files}
+            return cls(file_size=int(z["file_size"]), mtime_ns=int(z["mtime_ns"]),
+                       format=str(z["format"]), data_offsets=z["data_offsets"],
+                       lengths=z["lengths"], ts_sec=z["ts_sec"], ts_usec=z["ts_usec"],
+                       linktypes=z["linktypes"], **meta)
+
+
+# ============================== Helpers ==============================
+
+def _u32_at(u8: np.ndarray, pos: np.ndarray, big_endian: bool = False) -> np.ndarray:
+    """Gather unaligned 32-bit integers at byte positions `pos`"""
+    # A byte-strided uint32 view makes every offset a valid element: one gather per word
+    words = np.ndarray((len(u8) - 3,), dtype=">u4" if big_endian else "<u4", buffer=u8, strides=(1,))
+    return words[pos].astype(np.uint32)
+
+
+def _segment_bounds(first: int, fsize: int, avg_record: float) -> np.ndarray:
+    """Split [first, fsize) into roughly sqrt(records) segments (balances sync vs. step cost)"""
+    body = fsize - first
+    k = int(min(MAX_SEGMENTS, max(1, math.isqrt(max(1, int(body / avg_record))))))
+    return first + (body * np.arange(k + 1, dtype=np.int64)) // k
+
+
+def _sync_segments(seg_lo: np.ndarray, seg_hi: np.ndarray, plausible, hdr_size: int, fsize: int,
+                   align: int, window: int) -> np.ndarray:
+    """Find the first plausible record boundary in each [seg_lo, seg_hi), or -1.
+
+    `plausible(q)` returns (ok, next_pos) for candidate positions; a candidate is taken
+    when it and the record it points to both look valid. All segments are probed at
+    once; segments without a hit are re-probed further on with a 4x larger window.
+    """
+    found = np.full(len(seg_lo), -1, dtype=np.int64)
+    lo = seg_lo + (-seg_lo) % align
+    limit = np.minimum(seg_hi, fsize - hdr_size + 1)
+    pending = np.flatnonzero(lo < limit)
+    while len(pending) and window <= MAX_SYNC_WINDOW:
+        steps = np.arange(0, window, align, dtype=np.int64)
+        rows = max(1, SYNC_BATCH_POSITIONS // len(steps))
+        still = []
+        for c in range(0, len(pending), rows):
+            idx = pending[c:c + rows]
+            q = lo[idx, None] + steps
+            valid = q < limit[idx, None]
+            ok, n1 = plausible(np.where(valid, q, lo[idx, None]).ravel())
+            ok &= valid.ravel()
+            cand = np.flatnonzero(ok)
+            n1c = n1[cand]
+            ok2 = n1c == fsize
+            inside = n1c + hdr_size <= fsize
+            if inside.any():
+                ok2[inside] = plausible(n1c[inside])[0]
+            ok[cand] = ok2
+            ok = ok.reshape(q.shape)
+            hit = ok.any(axis=1)
+            first = ok.argmax(axis=1)
+            found[idx[hit]] = q[hit, first[hit]]
+            lo[idx] += window
+            still.append(idx[~hit & (lo[idx] < limit[idx])])
+        pending = np.concatenate(still)
+        window *= 4
+    return found
+
+
+def _sync_window(avg_record: float) -> int:
+    """Initial probe window: a few average records, rounded up to a power of two"""
+    return 1 << max(8, int(math.ceil(math.log2(4 * avg_record))))
+
+
+def _lockstep(starts: np.ndarray, ends: np.ndarray, step) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Advance every chain one record per iteration until it leaves its segment.
+
+    `step(p)` returns (ok, record_len, next_pos) for an array of record positions.
+    Returns (segment ids, positions, record lengths) of every visited record plus the
+    per-segment stop position, which is negative-encoded (-(pos + 1)) when the chain
+    stopped on an invalid record rather than by crossing its segment end.
+    """
+    k = len(starts)
+    pos = starts.astype(np.int64).copy()
+    stop = np.empty(k, dtype=np.int64)
+    active = np.flatnonzero((pos >= 0) & (pos < ends))
+    stop[pos < 0] = -1
+    stop[(pos >= 0) & (pos >= ends)] = pos[(pos >= 0) & (pos >= ends)]
+    seg_parts, pos_parts, len_parts = [], [], []
+    while len(active):
+        p = pos[active]
+        ok, rec_len, nxt = step(p)
+        bad = active[~ok]
+        stop[bad] = -(pos[bad] + 1)
+        good = active[ok]
+        seg_parts.append(good)
+        pos_parts.append(p[ok])
+        len_parts.append(rec_len[ok])
+        pos[good] = nxt[ok]
+        crossed = pos[good] >= ends[good]
+        stop[good[crossed]] = pos[good[crossed]]
+        active = good[~crossed]
+    if not seg_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, stop
+    return (np.concatenate(seg_parts), np.concatenate(pos_parts),
+            np.concatenate(len_parts).astype(np.int64), stop)
+
+
+def _stitch(bounds: np.ndarray, starts: np.ndarray, stop: np.ndarray, seg: np.ndarray,
+            pos: np.ndarray, rec_len: np.ndarray, walk_range) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Keep records from chains that continue a verified chain; re-walk the rest sequentially.
+
+    Returns the record positions, their lengths and the position where the data ended.
+    """
+    k = len(starts)
+    accepted = np.zeros(k, dtype=bool)
+    extra_pos: List[int] = []
+    extra_len: List[int] = []
+    cur = int(starts[0])
+    for i in range(k):
+        if cur >= bounds[i + 1]:
+            continue                    # a single record spans this whole segment
+        if cur == starts[i]:
+            accepted[i] = True
+            s = int(stop[i])
+            if s < 0:                   # verified chain hit an invalid record: end of data
+                cur = -s - 1
+                break
+            cur = s
+            continue
+        cur, ended = walk_range(cur, int(bounds[i + 1]), extra_pos, extra_len)
+        if ended:
+            break
+    keep = accepted[seg]
+    out_pos = np.concatenate([pos[keep], np.asarray(extra_pos, dtype=np.int64)])
+    out_len = np.concatenate([rec_len[keep], np.asarray(extra_len, dtype=np.int64)])
+    order = np.argsort(out_pos, kind="stable")
+    return out_pos[order], out_len[order], cur
+
+
+# ============================== Classic PCAP ==============================
+
+def _index_pcap(mm, u8: np.ndarray, avg_record: float) -> Tuple[np.ndarray, ...]:
+    """Vectorized index for classic PCAP (either byte order, µs or ns timestamps)"""
+    fsize = len(u8)
+    magic = struct.unpack_from("<I", mm, 0)[0]
+    big = magic in (PCAP_MAGIC_USEC_SWAPPED, PCAP_MAGIC_NSEC_SWAPPED)
+    nanos = magic in (PCAP_MAGIC_NSEC, PCAP_MAGIC_NSEC_SWAPPED)
+    endian = ">" if big else "<"
+    snaplen = struct.unpack_from(endian + "I", mm, 16)[0]
+    linktype = struct.unpack_from(endian + "I", mm, 20)[0] & 0x0FFFFFFF
+    frac_limit = 1_000_000_000 if nanos else 1_000_000
+    cap = max(snaplen, 262144)
+
+    def step(p):
+        in_file = p + PCAP_REC_HDR_SIZE <= fsize
+        q = np.where(in_file, p, 0)
+        incl = _u32_at(u8, q + 8, big).astype(np.int64)
+        nxt = p + PCAP_REC_HDR_SIZE + incl
+        ok = in_file & (incl > 0) & (incl <= MAX_RECORD_BYTES) & (nxt <= fsize)
+        return ok, incl, nxt
+
+    def plausible(q):
+        incl = _u32_at(u8, q + 8, big).astype(np.int64)
+        ok = (incl > 0) & (incl <= cap)
+        # Most random positions fail the length test; only read the rest for survivors
+        cand = np.flatnonzero(ok)
+        qc = q[cand]
+        ok[cand] = ((_u32_at(u8, qc + 12, big) >= incl[cand])
+                    & (_u32_at(u8, qc + 4, big) < frac_limit))
+        return ok, q + PCAP_REC_HDR_SIZE + incl
+
+    rec_hdr = struct.Struct(endian + "IIII")
+
+    def walk_range(pos, end, out_pos, out_len):
+        while pos < end:
+            if pos + PCAP_REC_HDR_SIZE > fsize:
+                return pos, True
+            incl = rec_hdr.unpack_from(mm, pos)[2]
+            if not 0 < incl <= MAX_RECORD_BYTES or pos + PCAP_REC_HDR_SIZE + incl > fsize:
+                return pos, True
+            out_pos.append(pos)
+            out_len.append(incl)
+            pos += PCAP_REC_HDR_SIZE + incl
+        return pos, False
+
+    bounds = _segment_bounds(PCAP_GLOBAL_HDR_SIZE, fsize, avg_record)
+    starts = _sync_segments(bounds[:-1], bounds[1:], plausible, PCAP_REC_HDR_SIZE, fsize,
+                            1, _sync_window(avg_record))
+    starts[0] = PCAP_GLOBAL_HDR_SIZE
+    seg, pos, rec_len, stop = _lockstep(starts, bounds[1:], step)
+    hdr_pos, incl, _end = _stitch(bounds, starts, stop, seg, pos, rec_len, walk_range)
+
+    ts_sec = _u32_at(u8, hdr_pos, big)
+    ts_frac = _u32_at(u8, hdr_pos + 4, big)
+    ts_usec = ts_frac // 1000 if nanos else ts_frac
+    linktypes = np.full(len(hdr_pos), linktype, dtype=np.uint16)
+    return (hdr_pos + PCAP_REC_HDR_SIZE).astype(np.uint64), incl.astype(np.uint32), ts_sec, ts_usec, linktypes
+
+
+# ============================== PCAPNG ==============================
+
+def _index_pcapng(mm, u8: np.ndarray, avg_record: float) -> Optional[Tuple[np.ndarray, ...]]:
+    """Vectorized index for single-section little-endian PCAPNG; None means use the walker"""
+    fsize = len(u8)
+    if struct.unpack_from("<I", mm, 8)[0] != PCAPNG_BOM:
+        return None
+    shb_len = struct.unpack_from("<I", mm, 4)[0]
+    if shb_len < 12 or shb_len > fsize:
+        return None
+    known = np.array(PCAPNG_KNOWN_BLOCKS, dtype=np.uint32)
+
+    def step(p):
+        in_file = p + 12 <= fsize
+        q = np.where(in_file, p, 0)
+        blen = _u32_at(u8, q + 4).astype(np.int64)
+        nxt = p + blen
+        ok = in_file & (blen >= 12) & (nxt <= fsize)
+        return ok, blen, nxt
+
+    def plausible(q):
+        btype = _u32_at(u8, q)
+        blen = _u32_at(u8, q + 4).astype(np.int64)
+        ok = np.isin(btype, known) & (blen >= 12) & (blen % 4 == 0) & (q + blen <= fsize)
+        trail = np.zeros(len(q), dtype=np.int64)
+        trail[ok] = _u32_at(u8, q[ok] + blen[ok] - 4)
+        return ok & (trail == blen), q + blen
+
+    def walk_range(pos, end, out_pos, out_len):
+        while pos < end:
+            if pos + 12 > fsize:
+                return pos, True
+            blen = struct.unpack_from("<I", mm, pos + 4)[0]
+            if blen < 12 or pos + blen > fsize:
+                return pos, True
+            out_pos.append(pos)
+            out_len.append(blen)
+            pos += blen
+        return pos, False
+
+    # Blocks are 32-bit aligned from the start of the file, so only every 4th byte is a candidate
+    bounds = _segment_bounds(shb_len, fsize, avg_record)
+    starts = _sync_segments(bounds[:-1], bounds[1:], plausible, 12, fsize, 4, _sync_window(avg_record))
+    starts[0] = shb_len
+    seg, pos, rec_len, stop = _lockstep(starts, bounds[1:], step)
+    blk_pos, blk_len, end = _stitch(bounds, starts, stop, seg, pos, rec_len, walk_range)
+
+    btype = _u32_at(u8, blk_pos)
+    if (btype == PCAPNG_SHB).any() or (end + 4 <= fsize and struct.unpack_from("<I", mm, end)[0] == PCAPNG_SHB):
+        return None                     # multiple sections: byte order and interfaces may change
+
+    # Interfaces, in the order their IDBs appear
+    is_idb = btype == PCAPNG_IDB
+    idb_pos = blk_pos[is_idb]
+    iface_link = np.array([struct.unpack_from("<H", mm, int(p) + 8)[0] for p in idb_pos] + [LINKTYPE_ETHERNET],
+                          dtype=np.uint16)
+    iface_tps = np.array([_idb_ticks_per_second(mm, int(p), int(l), "<") for p, l in zip(idb_pos, blk_len[is_idb])]
+                         + [1_000_000], dtype=np.uint64)
+    idbs_before = np.cumsum(is_idb) - is_idb
+
+    # Enhanced Packet Blocks
+    epb = np.flatnonzero(btype == PCAPNG_EPB)
+    p = blk_pos[epb]
+    cap_len = _u32_at(u8, p + 20).astype(np.int64)
+    valid = p + 28 + cap_len <= p + blk_len[epb] - 4
+    epb, p, cap_len = epb[valid], p[valid], cap_len[valid]
+    iface = _u32_at(u8, p + 8).astype(np.int64)
+    known_iface = iface < idbs_before[epb]
+    iface = np.where(known_iface, iface, len(iface_link) - 1)
+    ticks = (_u32_at(u8, p + 12).astype(np.uint64) << np.uint64(32)) | _u32_at(u8, p + 16).astype(np.uint64)
+    tps = iface_tps[iface]
+    epb_sec = (ticks // tps).astype(np.uint32)
+    epb_usec = ((ticks % tps) * np.uint64(1_000_000) // tps).astype(np.uint32)
+    epb_link = iface_link[iface]
+
+    # Simple Packet Blocks use the first interface of the section
+    spb = np.flatnonzero((btype == PCAPNG_SPB) & (blk_len > 16))
+    spb_link = np.where(idbs_before[spb] > 0, iface_link[0], LINKTYPE_ETHERNET).astype(np.uint16)
+
+    order = np.argsort(np.concatenate([epb, spb]), kind="stable")
+    data_offsets = np.concatenate([p + 28, blk_pos[spb] + 12])[order].astype(np.uint64)
+    lengths = np.concatenate([cap_len, blk_len[spb] - 16])[order].astype(np.uint32)
+    ts_sec = np.concatenate([epb_sec, np.zeros(len(spb), dtype=np.uint32)])[order]
+    ts_usec = np.concatenate([epb_usec, np.zeros(len(spb), dtype=np.uint32)])[order]
+    linktypes = np.concatenate([epb_link, spb_link])[order]
+    return data_offsets, lengths, ts_sec, ts_usec, linktypes
+
+
+# ============================== Public API ==============================
+
+def _index_sequential(reader: CaptureReader) -> Tuple[np.ndarray, ...]:
+    """Fallback: index with the reference record walker"""
+    recs = list(reader.records())
+    arr = np.array(recs, dtype=np.uint64).reshape(-1, 5)
+    return (arr[:, 0], arr[:, 1].astype(np.uint32), arr[:, 2].astype(np.uint32),
+            arr[:, 3].astype(np.uint32), arr[:, 4].astype(np.uint16))
+
+
+def build_index(path: str) -> PacketIndex:
+    """Index every packet record in a capture"""
+    st = os.stat(path)
+    with CaptureReader(path) as reader:
+        arrays = None
+        sample = list(islice(reader.records(), SAMPLE_RECORDS))
+        if len(sample) == SAMPLE_RECORDS:
+            first_off = sample[0][0]
+            avg_record = max(16.0, (sample[-1][0] + sample[-1][1] - first_off) / (SAMPLE_RECORDS - 1))
+            if reader.file_size / avg_record >= MIN_VECTORIZED_RECORDS:
+                u8 = np.frombuffer(reader.buffer, dtype=np.uint8)
+                try:
+                    if reader.format == FORMAT_PCAP:
+                        arrays = _index_pcap(reader._mm, u8, avg_record)
+                    else:
+                        arrays = _index_pcapng(reader._mm, u8, avg_record)
+                finally:
+                    del u8
+        if arrays is None:
+            arrays = _index_sequential(reader)
+        fmt = reader.format
+    data_offsets, lengths, ts_sec, ts_usec, linktypes = arrays
+    return PacketIndex(file_size=st.st_size, mtime_ns=st.st_mtime_ns, format=fmt,
+                       data_offsets=data_offsets, lengths=lengths, ts_sec=ts_sec,
+                       ts_usec=ts_usec, linktypes=linktypes)
+
+
+def sidecar_path(path: str) -> str:
+    return path + SIDECAR_SUFFIX
+
+
+def load_index(path: str, use_sidecar: bool = True) -> PacketIndex:
+    """Return the packet index for `path`, reusing (or writing) the `.pidx` sidecar"""
+    sidecar = sidecar_path(path)
+    if use_sidecar and os.path.exists(sidecar):
+        try:
+            index = PacketIndex.load(sidecar)
+            if index.matches_file(path):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass                        # stale or unreadable sidecar: rebuild it
+    index = build_index(path)
+    if use_sidecar:
+        try:
+            index.save(sidecar)
+        except OSError:
+            pass                        # read-only capture directory: index stays in memory
+    return index
+
+
+# ============================== Flow metadata ==============================
+
+def flow_metadata(src: np.ndarray, index: PacketIndex) -> PacketIndex:
+    """Fill the header metadata fields (FLOW_FIELDS) of `index` in place and return it.
+
+    `src` is the whole capture as uint8. Decoding is done by packet_headers.decode_headers:
+    IPv6 extension headers and non-first IPv4 fragments yield the protocol but no ports.
+    """
+    headers = decode_headers(src, index.data_offsets, index.lengths, index.linktypes)
+    index.ip_protos, index.src_ports, index.dst_ports = headers.ip_protos, headers.src_ports, headers.dst_ports
+    index.l3_offsets = headers.l3_offsets.astype(np.int16)
+    index.payload_offsets = headers.payload_offsets.astype(np.uint16)
+    index.payload_lengths = headers.payload_lengths
+    index.flow_ids = headers.flow_ids
+    return index
+
+
+def flow_labels(path: str, index: PacketIndex, flow_ids) -> Dict[int, str]:
+    """"proto src:port-dst:port" of each flow ID, read back from the flow's first packet in the capture"""
+    if index.flow_ids is None:
+        raise ValueError("index has no flow metadata (use IndexCache or flow_metadata)")
+    keys = np.asarray(list(flow_ids), dtype=np.uint64)
+    distinct, first = np.unique(index.flow_ids, return_index=True)
+    labels: Dict[int, str] = {}
+    if not len(keys) or not len(distinct):
+        return labels
+    pos = np.minimum(np.searchsorted(distinct, keys), len(distinct) - 1)
+    with CaptureReader(path) as reader:
+        src = np.frombuffer(reader.buffer, dtype=np.uint8)
+        try:
+            for key, p in zip(keys.tolist(), pos.tolist()):
+                if int(distinct[p]) != key:
+                    continue
+                i = int(first[p])
+                proto = int(index.ip_protos[i])
+                name = flow_name(src, index.data_offsets[i], index, i)
+                labels[key] = name if name == "non-ip" else f"{PROTO_NAMES.get(proto, proto)} {name}"
+        finally:
+            del src
+    return labels
+
+
+def gather_ranges(src: np.ndarray, starts: np.ndarray, lengths: np.ndarray, out: np.ndarray) -> int:
+    """Copy src[starts[i]:starts[i]+lengths[i]] back to back into `out`; returns bytes written.
+
+    Ranges must be ascending and non-overlapping. Runs of ranges are packed with one
+    boolean-mask gather per chunk instead of one slice assignment per packet; the mask
+    is built with np.repeat over alternating (gap, packet) run lengths.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = starts + lengths
+    n = len(starts)
+    written = 0
+    i = 0
+    while i < n:
+        j = max(i + 1, int(np.searchsorted(ends, starts[i] + GATHER_CHUNK_BYTES, side="right")))
+        s0 = int(starts[i])
+        span = int(ends[j - 1]) - s0
+        count = int(lengths[i:j].sum())
+        if j - i == 1 or count == span:
+            out[written:written + count] = src[s0:s0 + count]
+        else:
+            runs = np.empty(2 * (j - i), dtype=np.int64)
+            runs[0] = 0
+            runs[2::2] = starts[i + 1:j] - ends[i:j - 1]
+            runs[1::2] = lengths[i:j]
+            keep = np.zeros(len(runs), dtype=np.bool_)
+            keep[1::2] = True
+            out[written:written + count] = src[s0:s0 + span][np.repeat(keep, runs)]
+        written += count
+        i = j
+    return written
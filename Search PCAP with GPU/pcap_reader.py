@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Zero-Copy PCAP/PCAPNG Reader
+
+This module provides a shared capture reader for the PCAP scanners. It memory-maps
+the capture and walks the record headers directly, so packets are never dissected
+by scapy and packet bytes are never copied out of the page cache.
+
+Key Features:
+- Classic PCAP (little/big endian, microsecond and nanosecond timestamps)
+- PCAPNG (Enhanced Packet Blocks, Simple Packet Blocks, multiple sections/interfaces)
+- Packets exposed as memoryviews over the mapped file
+- Per-record file offsets so callers can build their own packet index
+
+Usage:
+    with CaptureReader("capture.pcapng") as reader:
+        for ts_sec, ts_usec, data in reader:
+            ...
+"""
+
+import mmap
+import os
+import struct
+from typing import Iterator, List, Tuple
+
+# Classic PCAP magics as read little-endian from the first four bytes
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_MAGIC_USEC_SWAPPED = 0xd4c3b2a1
+PCAP_MAGIC_NSEC_SWAPPED = 0x4d3cb2a1
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BOM = 0x1A2B3C4D
+PCAPNG_BOM_SWAPPED = 0x4D3C2B1A
+
+PCAP_GLOBAL_HDR_SIZE = 24
+PCAP_REC_HDR_SIZE = 16
+MAX_RECORD_BYTES = 1 << 26      # anything larger is treated as a corrupt length
+
+# Common link types (see https://www.tcpdump.org/linktypes.html)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+FORMAT_PCAP = "pcap"
+FORMAT_PCAPNG = "pcapng"
+
+# (data_offset, captured_length, ts_sec, ts_usec, linktype)
+Record = Tuple[int, int, int, int, int]
+
+
+def detect_format(mm) -> str:
+    """Return FORMAT_PCAP or FORMAT_PCAPNG for a mapped capture"""
+    if len(mm) < 12:
+        raise ValueError("File too small")
+    magic = struct.unpack_from("<I", mm, 0)[0]
+    if magic == PCAPNG_SHB:
+        return FORMAT_PCAPNG
+    if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC, PCAP_MAGIC_USEC_SWAPPED, PCAP_MAGIC_NSEC_SWAPPED):
+        return FORMAT_PCAP
+    raise ValueError("Unknown capture format")
+
+
+def walk_pcap(mm) -> Iterator[Record]:
+    """Walk classic PCAP records, yielding (data_off, incl_len, ts_sec, ts_usec, linktype)"""
+    fsize = len(mm)
+    if fsize < PCAP_GLOBAL_HDR_SIZE:
+        raise ValueError("PCAP too small")
+    magic = struct.unpack_from("<I", mm, 0)[0]
+    if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+        endian = "<"
+    elif magic in (PCAP_MAGIC_USEC_SWAPPED, PCAP_MAGIC_NSEC_SWAPPED):
+        endian = ">"
+    else:
+        raise ValueError("Not a classic PCAP (magic mismatch)")
+    nanos = magic in (PCAP_MAGIC_NSEC, PCAP_MAGIC_NSEC_SWAPPED)
+    linktype = struct.unpack_from(endian + "I", mm, 20)[0] & 0x0FFFFFFF
+    rec_hdr = struct.Struct(endian + "IIII")
+
+    pos = PCAP_GLOBAL_HDR_SIZE
+    while pos + PCAP_REC_HDR_SIZE <= fsize:
+        ts_sec, ts_frac, incl_len, _orig_len = rec_hdr.unpack_from(mm, pos)
+        pos += PCAP_REC_HDR_SIZE
+        if not 0 < incl_len <= MAX_RECORD_BYTES or pos + incl_len > fsize:
+            break
+        yield pos, incl_len, ts_sec, (ts_frac // 1000 if nanos else ts_frac), linktype
+        pos += incl_len
+
+
+def _idb_ticks_per_second(mm, pos: int, blen: int, endian: str) -> int:
+    """Read if_tsresol from an Interface Description Block (default: microseconds)"""
+    opt = pos + 16
+    end = pos + blen - 4
+    while opt + 4 <= end:
+        code, length = struct.unpack_from(endian + "HH", mm, opt)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            resol = mm[opt + 4]
+            if resol & 0x80:
+                return 1 << (resol & 0x7F)
+            return 10 ** resol
+        opt += 4 + ((length + 3) & ~3)
+    return 1_000_000
+
+
+def walk_pcapng(mm) -> Iterator[Record]:
+    """Walk PCAPNG blocks, yielding (data_off, captured_len, ts_sec, ts_usec, linktype) per packet"""
+    fsize = len(mm)
+    if fsize < 12:
+        raise ValueError("PCAPNG too small")
+
+    pos = 0
+    endian = "<"
+    hdr = struct.Struct("<II")
+    epb = struct.Struct("<IIII")
+    interfaces: List[Tuple[int, int]] = []  # (linktype, ticks_per_second) per section
+
+    while pos + 12 <= fsize:
+        if struct.unpack_from("<I", mm, pos)[0] == PCAPNG_SHB:
+            # Byte order is only known after reading the section's byte-order magic
+            if pos + 16 > fsize:
+                break
+            bom = struct.unpack_from("<I", mm, pos + 8)[0]
+            endian = ">" if bom == PCAPNG_BOM_SWAPPED else "<"
+            hdr = struct.Struct(endian + "II")
+            epb = struct.Struct(endian + "IIII")
+            interfaces = []
+            blen = struct.unpack_from(endian + "I", mm, pos + 4)[0]
+            if blen < 12 or pos + blen > fsize:
+                break
+            pos += blen
+            continue
+
+        btype, blen = hdr.unpack_from(mm, pos)
+        if blen < 12 or pos + blen > fsize:
+            break
+
+        if btype == PCAPNG_EPB:
+            iface, ts_high, ts_low, captured_len = epb.unpack_from(mm, pos + 8)
+            data_off = pos + 28
+            if data_off + captured_len <= pos + blen - 4:
+                linktype, tps = interfaces[iface] if iface < len(interfaces) else (LINKTYPE_ETHERNET, 1_000_000)
+                ticks = (ts_high << 32) | ts_low
+                ts_sec, rem = divmod(ticks, tps)
+                yield data_off, captured_len, ts_sec, rem * 1_000_000 // tps, linktype
+        elif btype == PCAPNG_SPB:
+            body_len = blen - 16
+            if body_len > 0:
+                linktype = interfaces[0][0] if interfaces else LINKTYPE_ETHERNET
+                yield pos + 12, body_len, 0, 0, linktype
+        elif btype == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + "H", mm, pos + 8)[0]
+            interfaces.append((linktype, _idb_ticks_per_second(mm, pos, blen, endian)))
+        pos += blen
+
+
+class CaptureReader:
+    """Memory-mapped capture reader that yields packets as zero-copy memoryviews"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file_size = os.path.getsize(path)
+        if self.file_size < 12:
+            raise ValueError("File too small")
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), length=0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._view = memoryview(self._mm)
+        self.format = detect_format(self._mm)
+
+    def records(self) -> Iterator[Record]:
+        """Yield (data_off, captured_len, ts_sec, ts_usec, linktype) for every packet"""
+        if self.format == FORMAT_PCAPNG:
+            return walk_pcapng(self._mm)
+        return walk_pcap(self._mm)
+
+    def packet(self, data_off: int, length: int) -> memoryview:
+        """Return a zero-copy view of `length` bytes at `data_off` in the mapped file"""
+        return self._view[data_off:data_off + length]
+
+    def __iter__(self) -> Iterator[Tuple[int, int, memoryview]]:
+        """Yield (ts_sec, ts_usec, data) for every packet"""
+        view = self._view
+        for data_off, length, ts_sec, ts_usec, _linktype in self.records():
+            yield ts_sec, ts_usec, view[data_off:data_off + length]
+
+    def drop_pages(self, start: int, end: int):
+        """Drop already-consumed pages in [start, end) from the resident set (no-op where unsupported)"""
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            self._mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def prefetch(self, start: int, end: int):
+        """Ask the kernel to read [start, end) ahead (no-op where unsupported)"""
+        if not hasattr(mmap, "MADV_WILLNEED"):
+            return
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            self._mm.madvise(mmap.MADV_WILLNEED, start, min(end, self.file_size) - start)
+
+    @property
+    def buffer(self) -> memoryview:
+        """The whole mapped file as a memoryview"""
+        return self._view
+
+    def close(self):
+        """Release the mapping; outstanding packet views keep the pages alive"""
+        try:
+            self._view.release()
+            self._mm.close()
+        except BufferError:
+            # Packet views handed to callers still reference the mapping; it is
+            # unmapped when the last of them is garbage collected.
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_packet_views(path: str) -> Tuple[List[memoryview], List[int], List[int]]:
+    """Load a capture as (packet views, concatenated offsets, lengths) without copying packet bytes"""
+    reader = CaptureReader(path)
+    views, offsets, lengths = [], [], []
+    total = 0
+    for data_off, length, _ts_sec, _ts_usec, _linktype in reader.records():
+        views.append(reader.packet(data_off, length))
+        offsets.append(total)
+        lengths.append(length)
+        total += length
+    reader.close()
+    return views, offsets, lengths
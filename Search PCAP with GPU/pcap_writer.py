@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Template-Based PCAP/PCAPNG Writer
+
+Building one scapy packet object per frame and handing millions of them to wrpcap
+costs far more than scanning the resulting file. This module writes capture records
+directly: each transport protocol has a precomputed Ethernet/IPv4/TCP or UDP header
+template, and a whole chunk of packets is assembled into one preallocated array with
+NumPy, patching only the per-packet fields (lengths, addresses, ports, IP ID,
+sequence number, timestamp, checksums).
+
+Key Features:
+- Classic PCAP (microsecond, little endian) and PCAPNG (SHB + IDB + Enhanced Packet
+  Blocks) output, chosen by the file extension like the readers in pcap_reader.py
+- Header fields come as per-packet arrays (PacketFields), so millions of flows need no
+  per-flow state; templates, payloads and padding are gathered into the chunk with one
+  vectorized ragged gather, no per-packet Python objects
+- TCP/UDP checksums (with pseudo-header) summed for all packets of a chunk at once over
+  16-bit word views; IPv4 header checksums follow from the template sums
+- shift_tcp_seqs moves the sequence numbers of already built records (checksums
+  updated incrementally), so chunks built independently can be stitched into
+  continuous TCP streams
+- Chunks are self-contained byte arrays with their record end offsets, so they can be
+  built in worker processes (iter_chunks), streamed to disk in order and cut at a
+  record boundary
+
+Usage:
+    fields = PacketFields(protocols, src_ips, dst_ips, src_ports, dst_ports,
+                          timestamps_us, payload_starts, payload_lengths, seqs)
+    records, ends = RecordBuilder(FORMAT_PCAP).build(fields, payload_blob)
+    with PcapWriter("out.pcap") as writer:
+        writer.write(records)
+"""
+
+import ipaddress
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from packet_headers import IP_PROTO_TCP, IP_PROTO_UDP, UDP_HEADER_SIZE
+from pcap_reader import (FORMAT_PCAP, FORMAT_PCAPNG, LINKTYPE_ETHERNET, PCAP_MAGIC_USEC, PCAP_REC_HDR_SIZE,
+                         PCAPNG_BOM, PCAPNG_EPB, PCAPNG_IDB, PCAPNG_SHB)
+
+DEFAULT_SNAPLEN = 65535
+ETH_HDR_SIZE = 14
+IPV4_HDR_SIZE = 20
+TCP_HDR_SIZE = 20
+L3_OFFSET = ETH_HDR_SIZE
+L4_OFFSET = ETH_HDR_SIZE + IPV4_HDR_SIZE
+EPB_HDR_SIZE = 28               # block type, length, interface, timestamp (2), captured and original length
+EPB_TRAILER_SIZE = 4            # repeated block length
+TCP_FLAGS_PSH_ACK = 0x18
+DEFAULT_TTL = 64
+DEFAULT_WINDOW = 8192
+SRC_MAC = bytes.fromhex("020000000001")
+DST_MAC = bytes.fromhex("020000000002")
+CHUNKS_IN_FLIGHT = 2            # per worker: bounds the memory held by finished, unwritten chunks
+
+T = TypeVar("T")
+
+
+def format_for_output(path: str) -> str:
+    """FORMAT_PCAPNG for .pcapng paths, FORMAT_PCAP otherwise"""
+    return FORMAT_PCAPNG if path.lower().endswith(".pcapng") else FORMAT_PCAP
+
+
+def file_header(fmt: str, linktype: int = LINKTYPE_ETHERNET, snaplen: int = DEFAULT_SNAPLEN) -> bytes:
+    """Global header (PCAP) or section header plus one interface block (PCAPNG)"""
+    if fmt == FORMAT_PCAP:
+        return struct.pack("<IHHiIII", PCAP_MAGIC_USEC, 2, 4, 0, 0, snaplen, linktype)
+    # SHB without options (section length unknown), IDB without options (microsecond timestamps)
+    shb = struct.pack("<IIIHHqI", PCAPNG_SHB, 28, PCAPNG_BOM, 1, 0, -1, 28)
+    idb = struct.pack("<IIHHII", PCAPNG_IDB, 20, linktype, 0, snaplen, 20)
+    return shb + idb
+
+
+def ipv4_int(ip: str) -> int:
+    return int(ipaddress.IPv4Address(ip))
+
+
+def header_lengths(protocols: np.ndarray) -> np.ndarray:
+    """Ethernet + IPv4 + TCP/UDP header bytes in front of each packet's payload"""
+    return L4_OFFSET + np.where(np.asarray(protocols) == IP_PROTO_UDP, UDP_HEADER_SIZE, TCP_HDR_SIZE)
+
+
+def ragged_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(starts[i], starts[i] + lengths[i]) for every i"""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    # +1 inside a range, a jump at each range start
+    step = np.ones(int(lengths.sum()), dtype=np.int64)
+    first = np.cumsum(lengths) - lengths
+    step[0] = starts[0]
+    step[first[1:]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+    return np.cumsum(step)
+
+
+def _put(out: np.ndarray, pos: np.ndarray, values: np.ndarray, nbytes: int, big_endian: bool):
+    """Scatter unsigned integers of nbytes bytes at byte positions `pos`"""
+    values = np.asarray(values, dtype=np.uint64)
+    for k in range(nbytes):
+        shift = 8 * (nbytes - 1 - k if big_endian else k)
+        out[pos + k] = (values >> np.uint64(shift)) & np.uint64(0xFF)
+
+
+def _get(buf: np.ndarray, pos: np.ndarray, nbytes: int) -> np.ndarray:
+    """Gather big-endian unsigned integers of nbytes bytes at byte positions `pos`"""
+    value = np.zeros(len(pos), dtype=np.int64)
+    for k in range(nbytes):
+        value = (value << 8) | buf[pos + k]
+    return value
+
+
+def _words(value: np.ndarray) -> np.ndarray:
+    """Sum of the two 16-bit halves of 32-bit values (addresses, sequence numbers)"""
+    value = np.asarray(value, dtype=np.int64)
+    return (value >> 16) + (value & 0xFFFF)
+
+
+def _fold(total: np.ndarray) -> np.ndarray:
+    """One's complement of the 16-bit end-around-carry sum"""
+    for _ in range(3):
+        total = (total & 0xFFFF) + (total >> 16)
+    return (~total & 0xFFFF).astype(np.uint16)
+
+
+def internet_checksums(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+                       initial: Optional[np.ndarray] = None) -> np.ndarray:
+    """RFC 1071 checksum of every range buf[starts[i]:+lengths[i]] (plus `initial` partial sums)"""
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = starts + np.asarray(lengths, dtype=np.int64)
+    padded = np.zeros(len(buf) + 4, dtype=np.uint8)
+    padded[:len(buf)] = buf
+    total = np.zeros(len(starts), dtype=np.int64)
+    # Ranges starting at even and at odd offsets are summed over the two big-endian word views
+    for parity in (0, 1):
+        sel = np.flatnonzero((starts & 1) == parity)
+        if not len(sel):
+            continue
+        words = padded[parity:parity + (len(padded) - parity) // 2 * 2].view(">u2")
+        bounds = np.empty(2 * len(sel), dtype=np.int64)
+        bounds[0::2] = (starts[sel] - parity) // 2
+        bounds[1::2] = (ends[sel] - parity + 1) // 2
+        sums = np.add.reduceat(words, bounds, dtype=np.uint64)[0::2].astype(np.int64)
+        # An odd-length range's last word took the following byte as its low byte
+        odd = ((ends[sel] - starts[sel]) & 1).astype(bool)
+        sums[odd] -= padded[ends[sel][odd]]
+        total[sel] = sums
+    if initial is not None:
+        total += initial
+    return _fold(total)
+
+
+@dataclass
+class PacketFields:
+    """Per-packet header fields and payload ranges of one chunk of records"""
+    protocols: np.ndarray       # IP_PROTO_TCP or IP_PROTO_UDP
+    src_ips: np.ndarray         # IPv4 addresses as integers
+    dst_ips: np.ndarray
+    src_ports: np.ndarray
+    dst_ports: np.ndarray
+    timestamps_us: np.ndarray
+    payload_starts: np.ndarray  # payload = payloads[payload_starts[i]:+payload_lengths[i]]
+    payload_lengths: np.ndarray
+    seqs: Optional[np.ndarray] = None       # TCP sequence numbers (default 0)
+    ip_ids: Optional[np.ndarray] = None     # default: packet number within the chunk
+
+
+class RecordBuilder:
+    """Capture records of Ethernet/IPv4/TCP and Ethernet/IPv4/UDP packets"""
+
+    def __init__(self, fmt: str = FORMAT_PCAP, ttl: int = DEFAULT_TTL, window: int = DEFAULT_WINDOW,
+                 tcp_flags: int = TCP_FLAGS_PSH_ACK):
+        self.fmt = fmt
+        self.record_hdr = PCAP_REC_HDR_SIZE if fmt == FORMAT_PCAP else EPB_HDR_SIZE
+        self.trailer = 0 if fmt == FORMAT_PCAP else EPB_TRAILER_SIZE
+        record = b"" if fmt == FORMAT_PCAP else struct.pack("<III", PCAPNG_EPB, 0, 0)
+        record = record.ljust(self.record_hdr, b"\x00")
+        eth = DST_MAC + SRC_MAC + b"\x08\x00"
+        templates = []
+        self.template_starts = np.zeros(256, dtype=np.int64)
+        self.ip_sums = np.zeros(256, dtype=np.int64)       # IPv4 header words without addresses, length and ID
+        for proto, l4 in ((IP_PROTO_TCP, struct.pack("!HHIIBBHHH", 0, 0, 0, 0, TCP_HDR_SIZE // 4 << 4,
+                                                     tcp_flags, window, 0, 0)),
+                          (IP_PROTO_UDP, bytes(UDP_HEADER_SIZE))):
+            ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 0, 0, 0x4000, ttl, proto, 0, bytes(4), bytes(4))
+            self.template_starts[proto] = sum(map(len, templates))
+            self.ip_sums[proto] = sum(struct.unpack("!10H", ip))
+            templates.append(record + eth + ip + l4)
+        self.template_bytes = np.frombuffer(b"".join(templates), dtype=np.uint8)
+
+    def record_lengths(self, protocols: np.ndarray, payload_lengths: np.ndarray) -> np.ndarray:
+        """Bytes each record takes in the file"""
+        frame = header_lengths(protocols) + np.asarray(payload_lengths, dtype=np.int64)
+        if self.fmt == FORMAT_PCAPNG:
+            frame = (frame + 3) & ~3                    # EPB packet data is padded to 32 bits
+        return self.record_hdr + frame + self.trailer
+
+    def frame_starts(self, fields: PacketFields, ends: np.ndarray) -> np.ndarray:
+        """Offset of each packet's first frame byte within the built records"""
+        return ends - self.record_lengths(fields.protocols, fields.payload_lengths) + self.record_hdr
+
+    def build(self, fields: PacketFields, payloads: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Records of the packets in `fields`; returns the record bytes and each record's end offset"""
+        protocols = np.asarray(fields.protocols, dtype=np.int64)
+        payload_lengths = np.asarray(fields.payload_lengths, dtype=np.int64)
+        n = len(protocols)
+        rec_lengths = self.record_lengths(protocols, payload_lengths)
+        ends = np.cumsum(rec_lengths)
+        starts = ends - rec_lengths
+        if n == 0:
+            return np.zeros(0, dtype=np.uint8), ends
+
+        # Every record is template + payload + zero padding/trailer, gathered from one source array
+        hdr = self.record_hdr + header_lengths(protocols)
+        payloads = np.asarray(payloads, dtype=np.uint8)
+        zeros_at = len(self.template_bytes) + len(payloads)
+        source = np.concatenate([self.template_bytes, payloads, np.zeros(8, dtype=np.uint8)])
+        piece_starts = np.empty((n, 3), dtype=np.int64)
+        piece_lengths = np.empty((n, 3), dtype=np.int64)
+        piece_starts[:, 0], piece_lengths[:, 0] = self.template_starts[protocols], hdr
+        piece_starts[:, 1] = len(self.template_bytes) + np.asarray(fields.payload_starts, dtype=np.int64)
+        piece_lengths[:, 1] = payload_lengths
+        piece_starts[:, 2], piece_lengths[:, 2] = zeros_at, rec_lengths - hdr - payload_lengths
+        out = source[ragged_ranges(piece_starts.ravel(), piece_lengths.ravel())]
+
+        frame_len = hdr - self.record_hdr + payload_lengths
+        ts = np.asarray(fields.timestamps_us, dtype=np.int64)
+        if self.fmt == FORMAT_PCAP:
+            _put(out, starts, ts // 1_000_000, 4, False)
+            _put(out, starts + 4, ts % 1_000_000, 4, False)
+            _put(out, starts + 8, frame_len, 4, False)
+            _put(out, starts + 12, frame_len, 4, False)
+        else:
+            _put(out, starts + 4, rec_lengths, 4, False)
+            _put(out, starts + 12, ts >> 32, 4, False)
+            _put(out, starts + 16, ts & 0xFFFFFFFF, 4, False)
+            _put(out, starts + 20, frame_len, 4, False)
+            _put(out, starts + 24, frame_len, 4, False)
+            _put(out, ends - EPB_TRAILER_SIZE, rec_lengths, 4, False)
+
+        ip = starts + self.record_hdr + L3_OFFSET
+        l4 = starts + self.record_hdr + L4_OFFSET
+        src_ips = np.asarray(fields.src_ips, dtype=np.int64)
+        dst_ips = np.asarray(fields.dst_ips, dtype=np.int64)
+        ip_len = frame_len - ETH_HDR_SIZE
+        ip_ids = np.arange(n, dtype=np.int64) if fields.ip_ids is None else np.asarray(fields.ip_ids, dtype=np.int64)
+        ip_ids = ip_ids & 0xFFFF
+        _put(out, ip + 2, ip_len, 2, True)
+        _put(out, ip + 4, ip_ids, 2, True)
+        _put(out, ip + 12, src_ips, 4, True)
+        _put(out, ip + 16, dst_ips, 4, True)
+        address_words = _words(src_ips) + _words(dst_ips)
+        _put(out, ip + 10, _fold(self.ip_sums[protocols] + ip_len + ip_ids + address_words), 2, True)
+
+        _put(out, l4, fields.src_ports, 2, True)
+        _put(out, l4 + 2, fields.dst_ports, 2, True)
+        tcp = protocols == IP_PROTO_TCP
+        udp = ~tcp
+        if fields.seqs is not None:
+            _put(out, l4[tcp] + 4, np.asarray(fields.seqs, dtype=np.int64)[tcp] & 0xFFFFFFFF, 4, True)
+        l4_len = ip_len - IPV4_HDR_SIZE
+        _put(out, l4[udp] + 4, l4_len[udp], 2, True)
+        checksums = internet_checksums(out, l4, l4_len, address_words + protocols + l4_len)
+        checksums[udp & (checksums == 0)] = 0xFFFF     # 0 means "no checksum" in UDP
+        _put(out, l4 + np.where(tcp, 16, 6), checksums, 2, True)
+        return out, ends
+
+
+def shift_tcp_seqs(records: np.ndarray, tcp_starts: np.ndarray, deltas: np.ndarray):
+    """Add deltas[i] to the sequence number of the TCP header at records[tcp_starts[i]:],
+    updating its checksum incrementally (RFC 1624)"""
+    tcp_starts = np.asarray(tcp_starts, dtype=np.int64)
+    if not len(tcp_starts):
+        return
+    old = _get(records, tcp_starts + 4, 4)
+    new = (old + np.asarray(deltas, dtype=np.int64)) & 0xFFFFFFFF
+    checksum = _get(records, tcp_starts + 16, 2)
+    # HC' = ~(~HC + ~m + m'), with m the two 16-bit words of the sequence number
+    total = (~checksum & 0xFFFF) + (0x1FFFE - _words(old)) + _words(new)
+    _put(records, tcp_starts + 4, new, 4, True)
+    _put(records, tcp_starts + 16, _fold(total), 2, True)
+
+
+def iter_chunks(build: Callable[[int], T], workers: int, initializer: Callable, initargs: tuple,
+                in_flight: int = CHUNKS_IN_FLIGHT) -> Iterator[T]:
+    """build(0), build(1), ... in order, computed by `workers` processes (in-process for 1).
+
+    At most in_flight * workers chunks are built ahead of the consumer; closing the
+    generator cancels the rest. `build` must be a module-level function whose state
+    comes from initializer(*initargs), run once per process.
+    """
+    chunk_id = 0
+    if workers <= 1:
+        initializer(*initargs)
+        while True:
+            yield build(chunk_id)
+            chunk_id += 1
+    executor = ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs)
+    try:
+        pending = deque()
+        while True:
+            while len(pending) < in_flight * workers:
+                pending.append(executor.submit(build, chunk_id))
+                chunk_id += 1
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+class PcapWriter:
+    """Streams prebuilt records to a capture file behind the matching file header"""
+
+    def __init__(self, path: str, fmt: Optional[str] = None, linktype: int = LINKTYPE_ETHERNET,
+                 snaplen: int = DEFAULT_SNAPLEN):
+        self.path = path
+        self.fmt = fmt or format_for_output(path)
+        self.header = file_header(self.fmt, linktype, snaplen)
+        self.file = open(path, "wb")
+        self.file.write(self.header)
+        self.bytes_written = len(self.header)
+
+    def write(self, records):
+        """Append records built for this writer's format (bytes or a uint8 array)"""
+        self.file.write(memoryview(records))
+        self.bytes_written += len(records)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
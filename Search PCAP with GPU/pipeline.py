@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Pipelined Capture Scanning
+
+A sequential scan spends its wall time on the sum of its stages: fault the capture
+pages in, pack the ranges into one buffer, search it, write the matches. This module
+runs the stages as threads joined by bounded queues, so while batch k is searched,
+batch k+1 is packed, batch k+2 is paged in and the matches of batch k-1 are written;
+the end-to-end time approaches that of the slowest stage.
+
+Key Features:
+- Reader: walks the memory-mapped capture ahead of the packer (MADV_WILLNEED plus one
+  touch per page), so the gather never waits on disk
+- Packer: gathers each batch into one of a fixed pool of host buffers (pinned memory
+  for GPU uploads when given an allocator); buffers return to the pool only after
+  their batch is searched, so memory stays at (depth + 2) batches
+- Search: any backend with upload()/search() (GPUSearch, CPUSearch)
+- Reporter: ReporterSink hands row-sink writes (CSV, JSON Lines, Parquet) to a
+  writer thread; aggregate sinks only count and stay inline
+- Bounded queues everywhere: a slow stage throttles the ones before it
+- Per-stage busy time and utilization (busy / wall), and the first stage error is
+  re-raised by run()
+
+Usage:
+    reporter = ReporterSink(open_sink("matches.csv", patterns))
+    backend = CPUSearch(patterns, "PFAC", 8192, 2048, sink=reporter)
+    pipe = ScanPipeline(path, ranges, 64 * 1024 * 1024, search_stage(backend), reporter)
+    total = pipe.run()
+    print(pipe.describe())
+"""
+
+import mmap
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from match_sink import MatchSink
+from packet_filter import ScanRanges
+from pcap_index import gather_ranges
+from pcap_reader import CaptureReader
+
+DEFAULT_DEPTH = 2               # batches queued between two stages
+DEFAULT_BATCH_MB = 64
+POLL_SECONDS = 0.1              # how often blocked stages look for a failure elsewhere
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Time one stage spent working, over how many items"""
+    name: str
+    busy: float = 0.0
+    items: int = 0
+
+    def utilization(self, wall: float) -> float:
+        return self.busy / wall if wall > 0 else 0.0
+
+
+@dataclass
+class PackedBatch:
+    """One packed batch: ranges first..last-1 of the scan, back to back in `buffer`"""
+    buffer: np.ndarray
+    offsets: np.ndarray
+    lengths: np.ndarray
+    packet_ids: np.ndarray
+    range_offsets: np.ndarray
+    slot: int                   # buffer pool slot, returned after the search
+
+
+class _Stop(Exception):
+    """Raised inside a stage when another stage failed"""
+
+
+class _Stage:
+    """Bounded-queue plumbing shared by the stage threads"""
+
+    def __init__(self, stop: threading.Event):
+        self.stop = stop
+
+    def put(self, q: queue.Queue, item):
+        while True:
+            if self.stop.is_set():
+                raise _Stop()
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, q: queue.Queue):
+        while True:
+            if self.stop.is_set():
+                raise _Stop()
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+
+class ReporterSink(MatchSink):
+    """Row sink front end that writes through `sink` on its own thread.
+
+    write() copies the arrays (callers may reuse them) and queues them; close() drains
+    the queue and closes the wrapped sink.
+    """
+
+    def __init__(self, sink: MatchSink, depth: int = 4 * DEFAULT_DEPTH):
+        super().__init__(sink.patterns, sink.flush_rows, sink.files)
+        self.sink = sink
+        self.stats = StageStats("reporter")
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._run, name="reporter", daemon=True)
+        self._thread.start()
+
+    def write(self, packet_ids: np.ndarray, offsets: np.ndarray, pattern_ids: np.ndarray, file_id: int = 0):
+        if len(pattern_ids) == 0:
+            return
+        if self.error is not None:
+            raise RuntimeError(f"match reporter failed: {self.error}")
+        self.pattern_counts += np.bincount(pattern_ids, minlength=len(self.patterns))
+        self._queue.put((np.array(packet_ids, dtype=np.int64), np.array(offsets, dtype=np.int64),
+                         np.array(pattern_ids, dtype=np.int64), file_id))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                continue                        # keep draining so writers never block
+            start = time.perf_counter()
+            try:
+                self.sink.write(*item)
+            except BaseException as e:
+                self.error = e
+            self.stats.busy += time.perf_counter() - start
+            self.stats.items += 1
+
+    def flush(self):
+        pass                                    # rows are written by the reporter thread
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_DONE)
+            self._thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise RuntimeError(f"match reporter failed: {self.error}")
+
+
+def search_stage(backend) -> Callable[[PackedBatch], int]:
+    """Search-stage function for a GPUSearch/CPUSearch: upload the batch, search it, return the match count"""
+    def run(batch: PackedBatch) -> int:
+        backend.upload(batch.buffer, batch.offsets, batch.lengths, batch.packet_ids, batch.range_offsets)
+        return backend.search()
+    return run
+
+
+def plan_batches(lengths: np.ndarray, batch_bytes: int) -> List[tuple]:
+    """(first, last) range indices of consecutive batches of at most batch_bytes (one range at least)"""
+    ends = np.cumsum(lengths, dtype=np.int64)
+    bounds = []
+    first = 0
+    while first < len(ends):
+        base = int(ends[first - 1]) if first else 0
+        last = max(first + 1, int(np.searchsorted(ends, base + batch_bytes, side="right")))
+        bounds.append((first, last))
+        first = last
+    return bounds
+
+
+class ScanPipeline:
+    """reader -> packer -> search (-> reporter) over the ranges of one capture"""
+
+    def __init__(self, path: str, ranges: ScanRanges, batch_bytes: int, search: Callable[[PackedBatch], int],
+                 reporter: Optional[ReporterSink] = None, depth: int = DEFAULT_DEPTH,
+                 allocate: Optional[Callable[[int], np.ndarray]] = None):
+        self.path = path
+        self.ranges = ranges
+        self.batch_bytes = batch_bytes
+        self.search = search
+        self.reporter = reporter
+        self.depth = depth
+        self.allocate = allocate or (lambda n: np.empty(n, dtype=np.uint8))
+        self.stats = [StageStats("reader"), StageStats("packer"), StageStats("search")]
+        self.wall = 0.0
+        self.num_packets = 0
+        self.total_bytes = 0
+        self.total_matches = 0
+
+    def run(self) -> int:
+        """Scan every range; returns the number of matches"""
+        ranges = self.ranges
+        bounds = plan_batches(ranges.lengths, self.batch_bytes)
+        if not bounds:
+            return 0
+        ends = np.cumsum(ranges.lengths, dtype=np.int64)
+        largest = max(int(ends[last - 1]) - (int(ends[first - 1]) if first else 0) for first, last in bounds)
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        planned: queue.Queue = queue.Queue(maxsize=self.depth)
+        packed: queue.Queue = queue.Queue(maxsize=self.depth)
+        free: queue.Queue = queue.Queue()
+        slots = [None] * min(len(bounds), self.depth + 2)
+        for slot in range(len(slots)):
+            free.put(slot)
+        reader_stats, packer_stats, search_stats = self.stats
+        stage = _Stage(stop)
+
+        with CaptureReader(self.path) as reader:
+            src = np.frombuffer(reader.buffer, dtype=np.uint8)
+
+            def read():
+                for first, last in bounds:
+                    start = time.perf_counter()
+                    lo = int(ranges.starts[first])
+                    hi = int(ranges.starts[last - 1]) + int(ranges.lengths[last - 1])
+                    reader.prefetch(lo, hi)
+                    int(src[lo:hi:mmap.PAGESIZE].sum())       # fault the pages in ahead of the packer
+                    reader_stats.busy += time.perf_counter() - start
+                    reader_stats.items += 1
+                    stage.put(planned, (first, last))
+                stage.put(planned, _DONE)
+
+            def pack():
+                while True:
+                    item = stage.get(planned)
+                    if item is _DONE:
+                        stage.put(packed, _DONE)
+                        return
+                    first, last = item
+                    slot = stage.get(free)
+                    start = time.perf_counter()
+                    if slots[slot] is None:
+                        slots[slot] = self.allocate(largest)
+                    buf = slots[slot]
+                    base = int(ends[first - 1]) if first else 0
+                    used = gather_ranges(src, ranges.starts[first:last], ranges.lengths[first:last], buf)
+                    offsets = (ends[first:last] - base - ranges.lengths[first:last]).astype(np.uint32)
+                    reader.drop_pages(int(ranges.starts[first]), int(ranges.starts[last - 1]))
+                    packer_stats.busy += time.perf_counter() - start
+                    packer_stats.items += 1
+                    stage.put(packed, PackedBatch(buf[:used], offsets, ranges.lengths[first:last],
+                                                  ranges.packet_ids[first:last], ranges.range_offsets[first:last],
+                                                  slot))
+
+            def guarded(fn):
+                def run():
+                    try:
+                        fn()
+                    except _Stop:
+                        pass
+                    except BaseException as e:
+                        errors.append(e)
+                        stop.set()
+                return run
+
+            t0 = time.perf_counter()
+            threads = [threading.Thread(target=guarded(fn), name=name, daemon=True)
+                       for name, fn in (("reader", read), ("packer", pack))]
+            for t in threads:
+                t.start()
+            try:
+                # The search stage runs on the calling thread (device contexts and worker pools live here)
+                while True:
+                    batch = stage.get(packed)
+                    if batch is _DONE:
+                        break
+                    start = time.perf_counter()
+                    self.total_matches += self.search(batch)
+                    search_stats.busy += time.perf_counter() - start
+                    search_stats.items += 1
+                    self.num_packets += len(batch.lengths)
+                    self.total_bytes += len(batch.buffer)
+                    free.put(batch.slot)
+            except _Stop:
+                pass
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                for t in threads:
+                    t.join()
+                self.wall = time.perf_counter() - t0
+                del src
+        if errors:
+            raise errors[0]
+        return self.total_matches
+
+    def all_stats(self) -> List[StageStats]:
+        return self.stats + ([self.reporter.stats] if self.reporter is not None else [])
+
+    def describe(self) -> str:
+        """Per-stage utilization, e.g. "reader 9% | packer 31% | search 97% | reporter 12%" """
+        stages = " | ".join(f"{s.name} {s.utilization(self.wall):.0%}" for s in self.all_stats())
+        busy = sum(s.busy for s in self.all_stats())
+        return f"{stages} (wall {self.wall:.3f}s, stage sum {busy:.3f}s)"
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Regex Search with Literal Prefiltering
+
+Running a regular expression over every payload costs a full backtracking scan per
+pattern and packet. Like Snort/Suricata content+pcre rules, this module first extracts
+from each regex a set of literal factors, one of which every match must contain, finds
+all factors of all patterns in one Aho-Corasick pass over the packed payloads, and runs
+the compiled regex (Python `re` on bytes) only on the payloads where one of its factors
+occurs.
+
+Key Features:
+- Factors come from the parsed regex: the longest literal run of a concatenation, a
+  required repeat's body, or one factor per branch of an alternation (any of them)
+- Zero-width assertions (\\b, ^, $) do not break a literal run; optional parts,
+  classes, wildcards and back-references do
+- Patterns without a usable factor (shorter than MIN_FACTOR_LEN, or case-insensitive)
+  fall back to running on every payload
+- Matches are reported like re.finditer (leftmost, non-overlapping, non-empty) with
+  their start and end offsets, so callers can apply reassembly carry-over rules;
+  stream_matches() applies them, including for variable-length matches cut short at
+  the end of a stream chunk and found again, longer, in the next one
+- `max_match_len` bounds the match length for reassembly overlap (unbounded
+  repeats are capped at DEFAULT_MAX_MATCH_LEN)
+
+Usage:
+    regexes = RegexSet([rb"User-Agent: [^\\r\\n]*curl", rb"(GET|POST) /admin"])
+    packet_ids, starts, ends, pattern_ids = regexes.scan(bigbuf, offsets, lengths)
+    keep = stream_matches((packet_ids, starts, ends, pattern_ids), batch.carry_lengths,
+                          batch.stream_offsets, batch.flow_index)
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aho_corasick import AhoCorasickDFA
+
+try:
+    from re import _parser as sre_parse       # Python 3.11+
+except ImportError:
+    import sre_parse
+
+MIN_FACTOR_LEN = 2              # shorter factors hit nearly every payload
+MAX_BRANCH_FACTORS = 64         # alternations with more branches are not worth prefiltering
+DEFAULT_MAX_MATCH_LEN = 1024    # assumed match length bound for unbounded repeats
+
+RegexMatches = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]   # (packet, start, end, pattern id)
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) + \
+    ((sre_parse.POSSESSIVE_REPEAT,) if hasattr(sre_parse, "POSSESSIVE_REPEAT") else ())
+
+
+def _better(a: List[bytes], b: Optional[List[bytes]]) -> bool:
+    """Is factor set `a` more selective than `b`: longer shortest literal, then fewer literals"""
+    if b is None:
+        return True
+    return (min(map(len, a)), -len(a)) > (min(map(len, b)), -len(b))
+
+
+def _required(items, ignorecase: bool) -> Optional[List[bytes]]:
+    """Best set of literals of which every match of the sequence `items` contains one"""
+    best = None
+    run = bytearray()
+
+    def consider(factors):
+        nonlocal best
+        if factors and _better(factors, best):
+            best = factors
+
+    for op, av in items:
+        if op is sre_parse.LITERAL and not ignorecase:
+            run.append(av)
+            continue
+        if op is sre_parse.AT:
+            continue                        # zero-width: the literal run goes on
+        if op in _REPEATS and not ignorecase and len(av[2]) == 1 and av[2][0][0] is sre_parse.LITERAL:
+            low, high, sub = av             # x{3}, x+: `low` copies extend the run
+            run.extend([sub[0][1]] * low)
+            if high == low:
+                continue
+        if run:
+            consider([bytes(run)])
+            run.clear()
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_ignorecase = (ignorecase or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            consider(_required(sub, sub_ignorecase))
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            consider(_required(av, ignorecase))
+        elif op is sre_parse.BRANCH:
+            alternatives = [_required(branch, ignorecase) for branch in av[1]]
+            if all(alternatives):
+                union = sorted({f for alt in alternatives for f in alt})
+                if len(union) <= MAX_BRANCH_FACTORS:
+                    consider(union)
+        elif op in _REPEATS:
+            low, _, sub = av
+            if low >= 1:
+                consider(_required(sub, ignorecase))
+    if run:
+        consider([bytes(run)])
+    return best
+
+
+def literal_factors(pattern: bytes, flags: int = 0) -> List[bytes]:
+    """Literals of which every match of `pattern` contains at least one ([] = none usable)"""
+    parsed = sre_parse.parse(pattern, flags)
+    factors = _required(list(parsed), bool(parsed.state.flags & re.IGNORECASE))
+    if not factors or min(map(len, factors)) < MIN_FACTOR_LEN:
+        return []
+    return factors
+
+
+def max_match_length(pattern: bytes, flags: int = 0, cap: int = DEFAULT_MAX_MATCH_LEN) -> int:
+    """Longest possible match of `pattern`, capped at `cap`"""
+    return min(cap, sre_parse.parse(pattern, flags).getwidth()[1])
+
+
+class RegexSet:
+    """Compiled byte regexes with their literal factors in one shared automaton"""
+
+    def __init__(self, patterns: List[bytes], flags: int = 0, max_match_cap: int = DEFAULT_MAX_MATCH_LEN):
+        self.patterns = patterns
+        self.regexes = [re.compile(p, flags) for p in patterns]
+        self.factors = [literal_factors(p, flags) for p in patterns]
+        self.max_match_len = max((max_match_length(p, flags, max_match_cap) for p in patterns), default=0)
+
+        literals, owners = [], []
+        for pid, factors in enumerate(self.factors):
+            literals.extend(factors)
+            owners.extend([pid] * len(factors))
+        self.literal_owner = np.array(owners, dtype=np.int64)
+        self.dfa = AhoCorasickDFA(literals) if literals else None
+        self.unfiltered = np.array([pid for pid, f in enumerate(self.factors) if not f], dtype=np.int64)
+
+    def describe(self) -> str:
+        filtered = len(self.patterns) - len(self.unfiltered)
+        return (f"{len(self.patterns)} regex(es), {filtered} prefiltered by "
+                f"{len(self.literal_owner)} literal factor(s)")
+
+    def candidates(self, buffer: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(packet, pattern id) pairs the regexes must run on, sorted by packet then pattern"""
+        num = len(lengths)
+        keys = [np.empty(0, dtype=np.int64)]
+        if self.dfa is not None:
+            packets, _, literal_ids = self.dfa.scan(buffer, offsets, lengths)
+            keys.append(packets * len(self.patterns) + self.literal_owner[literal_ids])
+        if len(self.unfiltered):
+            keys.append((np.arange(num, dtype=np.int64)[:, None] * len(self.patterns) + self.unfiltered).ravel())
+        keys = np.unique(np.concatenate(keys))
+        return keys // len(self.patterns), keys % len(self.patterns)
+
+    def scan(self, buffer: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> RegexMatches:
+        """Every non-empty finditer match of every regex in the packets buffer[offsets[i]:+lengths[i]].
+
+        Returns (packet_ids, start offsets, end offsets, pattern_ids) sorted by packet,
+        start and pattern.
+        """
+        buffer = np.asarray(buffer, dtype=np.uint8)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        out_pkt, out_start, out_end, out_pid = [], [], [], []
+        if len(self.patterns) and len(lengths):
+            data = buffer.data
+            for pkt, pid in zip(*(a.tolist() for a in self.candidates(buffer, offsets, lengths))):
+                start = int(offsets[pkt])
+                for m in self.regexes[pid].finditer(data[start:start + int(lengths[pkt])]):
+                    if m.end() > m.start():
+                        out_pkt.append(pkt)
+                        out_start.append(m.start())
+                        out_end.append(m.end())
+                        out_pid.append(pid)
+        packet_ids = np.array(out_pkt, dtype=np.int64)
+        starts = np.array(out_start, dtype=np.int64)
+        ends = np.array(out_end, dtype=np.int64)
+        pattern_ids = np.array(out_pid, dtype=np.int64)
+        order = np.lexsort((pattern_ids, starts, packet_ids))
+        return packet_ids[order], starts[order], ends[order], pattern_ids[order]
+
+
+def stream_matches(matches: RegexMatches, carry_lengths: np.ndarray, stream_offsets: np.ndarray,
+                   flow_index: np.ndarray) -> np.ndarray:
+    """Mask of the matches to report when the packets are reassembled stream chunks.
+
+    A chunk starts with carry_lengths[i] bytes of its flow's previous chunk, so a match
+    ending inside them was found there already. A variable-length match that ran up to
+    the previous chunk's end is found again longer, starting inside the carry-over: a
+    match is also dropped when it starts before the end of an earlier chunk's match of
+    the same pattern in the same stream (stream_offsets[i] is the stream position of
+    chunk i's first byte). A chunk without carry-over starts a new stream.
+    """
+    packet_ids, starts, ends, pattern_ids = matches
+    carry_lengths = np.asarray(carry_lengths, dtype=np.int64)
+    keep = ends > carry_lengths[packet_ids]
+    straddling = keep & (starts < carry_lengths[packet_ids])
+    if not straddling.any():
+        return keep
+    # Stream instance of every packet: flows in packet order, a new one at each chunk without carry-over
+    order = np.lexsort((np.arange(len(carry_lengths)), flow_index))
+    flows = np.asarray(flow_index)[order]
+    new_stream = carry_lengths[order] == 0
+    new_stream[1:] |= flows[1:] != flows[:-1]
+    streams = np.empty(len(order), dtype=np.int64)
+    streams[order] = np.cumsum(new_stream)
+    base = np.asarray(stream_offsets, dtype=np.int64)[packet_ids]
+    current: Dict[Tuple[int, int], Tuple[int, int]] = {}    # (stream, pattern) -> (packet, furthest end in it)
+    earlier: Dict[Tuple[int, int], int] = {}                # (stream, pattern) -> furthest end in earlier packets
+    columns = (streams[packet_ids].tolist(), pattern_ids.tolist(), packet_ids.tolist(),
+               (base + starts).tolist(), (base + ends).tolist(), straddling.tolist())
+    for i, (stream, pid, pkt, start, end, check) in enumerate(zip(*columns)):
+        key = (stream, pid)
+        last = current.get(key)
+        if last is not None and last[0] != pkt:
+            earlier[key] = max(earlier.get(key, -1), last[1])
+            last = None
+        if check and start < earlier.get(key, -1):
+            keep[i] = False
+        current[key] = (pkt, end if last is None else max(last[1], end))
+    return keep
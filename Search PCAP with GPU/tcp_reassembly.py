@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Bounded-Memory TCP Stream Reassembly
+
+This module reorders TCP segments per flow and hands the scanners contiguous stream
+bytes, so a pattern split across segments is still found. Whole streams are never
+buffered: every chunk handed out starts with the last (max_pattern_len - 1) bytes of
+the flow seen so far (the carry-over), which is exactly enough for any match that
+straddles the previous chunk's end. Matches lying entirely inside the carry-over
+were already reported with the previous chunk; `StreamChunk.is_new_match` filters them.
+
+Key Features:
+- Sequence-number ordering with 32-bit wrap-around
+- Retransmissions and overlapping segments trimmed against data already delivered
+- Out-of-order segments held until the gap closes (bounded per flow; an unfilled gap
+  is skipped and the carry-over reset so no match is reported across missing bytes)
+- Flow eviction on FIN/RST, idle timeout and a maximum flow count (LRU order)
+- Per-flow state is a few slotted fields, so millions of concurrent flows stay cheap
+
+Usage:
+    reassembler = StreamReassembler(max_pattern_len=32)
+    for flow_key, seq, payload, ts, flags in segments:
+        for chunk in reassembler.add_segment(flow_key, seq, payload, ts, flags):
+            scan(chunk.data)          # report matches with chunk.is_new_match(offset, length)
+    for chunk in reassembler.flush():
+        scan(chunk.data)
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Iterator, List, Optional
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+DEFAULT_IDLE_TIMEOUT = 120.0        # seconds of capture time without a segment
+DEFAULT_MAX_FLOWS = 1_000_000
+DEFAULT_MAX_PENDING_BYTES = 256 * 1024   # out-of-order bytes held per flow before a gap is skipped
+EXPIRE_CHECK_SEGMENTS = 4096
+
+SEQ_MOD = 1 << 32
+
+
+def seq_diff(a: int, b: int) -> int:
+    """Signed distance a - b between two 32-bit sequence numbers"""
+    return ((a - b + (1 << 31)) % SEQ_MOD) - (1 << 31)
+
+
+@dataclass
+class StreamChunk:
+    """Contiguous stream bytes for one flow, prefixed by the flow's carry-over"""
+    flow_key: Hashable
+    data: bytes
+    carry_len: int          # leading bytes of `data` already handed out in an earlier chunk
+    stream_offset: int      # stream position of data[0] (bytes since the flow's first byte)
+    timestamp: float
+
+    def is_new_match(self, offset: int, length: int) -> bool:
+        """True unless the match at data[offset:offset+length] lies inside the carry-over"""
+        return offset + length > self.carry_len
+
+
+class _FlowState:
+    __slots__ = ("next_seq", "carry", "delivered", "pending", "pending_bytes", "last_seen")
+
+    def __init__(self, next_seq: int, timestamp: float):
+        self.next_seq = next_seq
+        self.carry = b""
+        self.delivered = 0                          # stream bytes handed out so far
+        self.pending: Optional[Dict[int, bytes]] = None   # seq -> out-of-order payload
+        self.pending_bytes = 0
+        self.last_seen = timestamp
+
+
+class StreamReassembler:
+    """Per-flow TCP reassembly with sliding-window carry-over instead of stream buffers"""
+
+    def __init__(self, max_pattern_len: int, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_flows: int = DEFAULT_MAX_FLOWS, max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+        self.carry_bytes = max(0, max_pattern_len - 1)
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.max_pending_bytes = max_pending_bytes
+        self.flows: "OrderedDict[Hashable, _FlowState]" = OrderedDict()   # least recently seen first
+        self.retransmitted_bytes = 0
+        self.skipped_gap_bytes = 0
+        self.evicted_flows = 0
+        self._segments = 0
+        self._clock = 0.0
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def add_segment(self, flow_key: Hashable, seq: int, payload: bytes, timestamp: float,
+                    flags: int = 0) -> List[StreamChunk]:
+        """Feed one TCP segment; returns the chunks of stream data it makes available"""
+        chunks: List[StreamChunk] = []
+        self._clock = max(self._clock, timestamp)
+        self._segments += 1
+        if self._segments % EXPIRE_CHECK_SEGMENTS == 0:
+            chunks.extend(self.expire(self._clock))
+
+        if flags & TCP_SYN:
+            seq = (seq + 1) % SEQ_MOD       # a SYN consumes one sequence number before any data
+        flow = self.flows.get(flow_key)
+        if flow is None:
+            if not payload and not flags & TCP_SYN:
+                return chunks
+            # A flow picked up mid-stream starts at its first segment seen
+            flow = _FlowState(seq, timestamp)
+            self.flows[flow_key] = flow
+            if len(self.flows) > self.max_flows:
+                chunks.extend(self._evict(next(iter(self.flows))))
+        else:
+            self.flows.move_to_end(flow_key)
+            flow.last_seen = timestamp
+            if flags & TCP_SYN and flow.delivered == 0 and not flow.pending:
+                flow.next_seq = seq
+
+        if payload:
+            self._accept(flow, flow_key, seq, payload, timestamp, chunks)
+
+        if flags & (TCP_FIN | TCP_RST):
+            chunks.extend(self._evict(flow_key))
+        return chunks
+
+    def _accept(self, flow: _FlowState, flow_key: Hashable, seq: int, payload: bytes,
+                timestamp: float, chunks: List[StreamChunk]):
+        diff = seq_diff(seq, flow.next_seq)
+        if diff > 0:
+            # Out of order: hold it until the gap closes
+            if flow.pending is None:
+                flow.pending = {}
+            held = flow.pending.get(seq)
+            if held is None or len(held) < len(payload):
+                flow.pending_bytes += len(payload) - (len(held) if held else 0)
+                flow.pending[seq] = payload
+            if flow.pending_bytes > self.max_pending_bytes:
+                self._skip_gap(flow)
+                self._drain(flow, flow_key, timestamp, chunks, bytearray())
+            return
+        if -diff >= len(payload):
+            self.retransmitted_bytes += len(payload)
+            return
+        if diff < 0:
+            self.retransmitted_bytes += -diff
+            payload = payload[-diff:]
+        new = bytearray(payload)
+        flow.next_seq = (flow.next_seq + len(payload)) % SEQ_MOD
+        self._drain(flow, flow_key, timestamp, chunks, new)
+
+    def _drain(self, flow: _FlowState, flow_key: Hashable, timestamp: float,
+               chunks: List[StreamChunk], new: bytearray):
+        """Append held segments that have become contiguous, then emit one chunk"""
+        while flow.pending:
+            ready = [s for s in flow.pending if seq_diff(s, flow.next_seq) <= 0]
+            if not ready:
+                break
+            for s in ready:
+                data = flow.pending.pop(s)
+                flow.pending_bytes -= len(data)
+                overlap = -seq_diff(s, flow.next_seq)
+                if overlap >= len(data):
+                    self.retransmitted_bytes += len(data)
+                    continue
+                self.retransmitted_bytes += overlap
+                new += data[overlap:]
+                flow.next_seq = (flow.next_seq + len(data) - overlap) % SEQ_MOD
+        if not new:
+            return
+        carry = flow.carry
+        data = carry + bytes(new)
+        chunks.append(StreamChunk(flow_key, data, len(carry), flow.delivered - len(carry), timestamp))
+        flow.delivered += len(new)
+        flow.carry = data[-self.carry_bytes:] if self.carry_bytes else b""
+
+    def _skip_gap(self, flow: _FlowState):
+        """Give up on missing bytes: resume at the earliest held segment with no carry-over"""
+        first = min(flow.pending, key=lambda s: seq_diff(s, flow.next_seq))
+        gap = seq_diff(first, flow.next_seq)
+        self.skipped_gap_bytes += gap
+        flow.delivered += gap
+        flow.next_seq = first
+        flow.carry = b""
+
+    def _evict(self, flow_key: Hashable) -> List[StreamChunk]:
+        """Drop a flow, first handing out any held data (gaps are skipped)"""
+        flow = self.flows.pop(flow_key, None)
+        chunks: List[StreamChunk] = []
+        if flow is None:
+            return chunks
+        self.evicted_flows += 1
+        while flow.pending:
+            self._skip_gap(flow)
+            self._drain(flow, flow_key, flow.last_seen, chunks, bytearray())
+        return chunks
+
+    def expire(self, now: float) -> List[StreamChunk]:
+        """Evict flows idle for longer than idle_timeout at capture time `now`"""
+        chunks: List[StreamChunk] = []
+        cutoff = now - self.idle_timeout
+        while self.flows:
+            flow_key, flow = next(iter(self.flows.items()))
+            if flow.last_seen >= cutoff:
+                break
+            chunks.extend(self._evict(flow_key))
+        return chunks
+
+    def flush(self) -> Iterator[StreamChunk]:
+        """Evict every remaining flow (end of capture)"""
+        while self.flows:
+            yield from self._evict(next(iter(self.flows)))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+newtest.py --dir over a generated capture and the manifest sidecars written next to it
+
+Usage:
+    python -m pytest tests
+"""
+
+import glob
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from traffic_profile import MANIFEST_SUFFIX, SUMMARY_SUFFIX, TrafficProfile, generate_capture
+
+NEWTEST = glob.glob(os.path.join(ROOT, "Test3_*", "newtest.py"))[0]
+
+
+def test_dir_scan_skips_manifest_sidecars(tmp_path):
+    profile = TrafficProfile.from_dict({"flows": 20, "filler": "zeros",
+                                        "injections": [{"pattern": "s3cr3t-token", "rate": 0.2}]})
+    capture = str(tmp_path / "gen.pcap")
+    result = generate_capture(profile, capture, 200 * 1024, seed=3, log=None)
+    assert os.path.exists(capture + MANIFEST_SUFFIX) and os.path.exists(capture + SUMMARY_SUFFIX)
+
+    proc = subprocess.run([sys.executable, NEWTEST, "--dir", str(tmp_path), "-s", "s3cr3t-token",
+                           "--backend", "cpu", "--no-tuning", "--no-automaton-cache",
+                           "--index-cache-dir", str(tmp_path / "cache")],
+                          capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert re.search(r"^Captures: 1 in ", proc.stdout, re.M)
+    assert f"Matches: {result.injections:,}" in proc.stdout
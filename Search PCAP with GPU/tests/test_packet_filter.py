@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Source-network filtering on records truncated inside the IP header
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from packet_filter import PacketFilter
+from pcap_index import PacketIndex
+from pcap_reader import LINKTYPE_RAW
+
+
+def ipv4_header(src: bytes) -> bytes:
+    return bytes([0x45, 0, 0, 20, 0, 0, 0, 0, 64, 17, 0, 0]) + src + bytes([192, 168, 0, 1])
+
+
+def raw_ip_index(records) -> PacketIndex:
+    """Index over back-to-back raw IP records, each (frame bytes, captured length)"""
+    lengths = np.array([caplen for _, caplen in records], dtype=np.uint32)
+    n = len(records)
+    return PacketIndex(file_size=0, mtime_ns=0, format="pcap",
+                       data_offsets=(np.cumsum(lengths) - lengths).astype(np.uint64), lengths=lengths,
+                       ts_sec=np.zeros(n, dtype=np.uint32), ts_usec=np.zeros(n, dtype=np.uint32),
+                       linktypes=np.full(n, LINKTYPE_RAW, dtype=np.uint16),
+                       ip_protos=np.full(n, 17, dtype=np.uint8), src_ports=np.zeros(n, dtype=np.uint16),
+                       dst_ports=np.zeros(n, dtype=np.uint16), l3_offsets=np.zeros(n, dtype=np.int16),
+                       payload_offsets=np.zeros(n, dtype=np.uint16), payload_lengths=np.zeros(n, dtype=np.uint32),
+                       flow_ids=np.zeros(n, dtype=np.uint64))
+
+
+def test_truncated_source_address_does_not_match():
+    full = ipv4_header(bytes([10, 1, 2, 3]))
+    # Record 0 stops before its source address: reading on would take 45 00 00 14 from
+    # record 1 (69.0.0.20). Record 2 is cut short at the end of the capture.
+    records = [(full, 12), (full, 20), (full, 14)]
+    src = np.frombuffer(b"".join(frame[:caplen] for frame, caplen in records), dtype=np.uint8)
+    flt = PacketFilter.parse(src_net="10.0.0.0/8,69.0.0.0/8")
+    assert flt.mask(raw_ip_index(records), src).tolist() == [False, True, False]
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Pattern syntax: plain patterns stay literal, (?w) opts into wildcards and byte classes
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from patterns import compile_pattern, is_literal, pattern_name
+
+
+@pytest.mark.parametrize("text", ["[INFO] login", "GET /index.php?? HTTP", "a[b"])
+def test_plain_patterns_are_literal(text):
+    assert compile_pattern(text) == text.encode()
+
+
+def test_wildcard_prefix_enables_classes_and_wildcards():
+    p = compile_pattern("(?w)id=[0-9]??")
+    assert not is_literal(p) and len(p) == 5
+    assert p.masks[3, ord("7")] and not p.masks[3, ord("x")]
+    assert p.masks[4].all()
+    assert compile_pattern("id=[0-9]??", wildcards=True).masks.tolist() == p.masks.tolist()
+
+
+def test_prefixes_combine_in_either_order():
+    a, b = compile_pattern("(?i)(?w)pass[0-9]"), compile_pattern("(?w)(?i)pass[0-9]")
+    assert a.masks.tolist() == b.masks.tolist()
+    assert a.masks[0, ord("P")] and a.masks[4, ord("3")]
+    assert pattern_name(compile_pattern("(?i)[x]")) == "(?i)[x]"
+
+
+def test_unterminated_class_needs_the_prefix_to_fail():
+    with pytest.raises(ValueError):
+        compile_pattern("(?w)a[b")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Vectorized index versus the reference record walker on a corrupt record length
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcap_index import MIN_VECTORIZED_RECORDS, build_index
+from pcap_reader import (CaptureReader, LINKTYPE_ETHERNET, MAX_RECORD_BYTES, PCAP_GLOBAL_HDR_SIZE,
+                         PCAP_MAGIC_USEC, PCAP_REC_HDR_SIZE)
+
+
+def test_oversized_record_ends_the_index_on_every_path(tmp_path):
+    path = str(tmp_path / "oversized.pcap")
+    frame = bytes(range(64))
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", PCAP_MAGIC_USEC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        for i in range(2000):
+            f.write(struct.pack("<IIII", 1, i, len(frame), len(frame)) + frame)
+        # A length just over the limit whose bytes do fit in the (sparse) file
+        f.write(struct.pack("<IIII", 1, 2000, MAX_RECORD_BYTES + 1, MAX_RECORD_BYTES + 1))
+        f.truncate(f.tell() + MAX_RECORD_BYTES + 1)
+    record = PCAP_REC_HDR_SIZE + len(frame)
+    assert os.path.getsize(path) / record >= MIN_VECTORIZED_RECORDS     # build_index takes the vectorized path
+
+    index = build_index(path)
+    with CaptureReader(path) as reader:
+        reference = list(reader.records())
+    assert len(index) == len(reference) == 2000
+    assert index.data_offsets.tolist() == [r[0] for r in reference]
+    assert (index.lengths == len(frame)).all()
+    assert index.data_offsets[0] == PCAP_GLOBAL_HDR_SIZE + PCAP_REC_HDR_SIZE
+    assert np.array_equal(index.ts_usec, np.arange(2000))
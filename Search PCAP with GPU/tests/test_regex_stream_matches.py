@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Regex matches across TCP reassembly chunk boundaries (regex_search.stream_matches)
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from packet_headers import IP_PROTO_TCP
+from payload_extraction import extract_payloads
+from pcap_writer import PacketFields, PcapWriter, RecordBuilder, ipv4_int
+from regex_search import RegexSet, stream_matches
+
+
+def write_tcp_capture(path, segments, src_port=40000):
+    """One TCP flow, one packet per payload in `segments`, sequence numbers continuous"""
+    lengths = np.array([len(s) for s in segments], dtype=np.int64)
+    n = len(segments)
+    fields = PacketFields(protocols=np.full(n, IP_PROTO_TCP), src_ips=np.full(n, ipv4_int("10.0.0.1")),
+                          dst_ips=np.full(n, ipv4_int("10.0.0.2")), src_ports=np.full(n, src_port),
+                          dst_ports=np.full(n, 80), timestamps_us=np.arange(n, dtype=np.int64),
+                          payload_starts=np.cumsum(lengths) - lengths, payload_lengths=lengths,
+                          seqs=np.cumsum(lengths) - lengths + 1000)
+    records, _ = RecordBuilder().build(fields, np.frombuffer(b"".join(segments), dtype=np.uint8))
+    with PcapWriter(path) as writer:
+        writer.write(records)
+
+
+def scan_stream(path, patterns):
+    regexes = RegexSet(patterns)
+    batch = extract_payloads(path, regexes.max_match_len)
+    found = regexes.scan(batch.buffer, batch.offsets, batch.lengths)
+    keep = stream_matches(found, batch.carry_lengths, batch.stream_offsets, batch.flow_index)
+    packet_ids, starts, ends, pattern_ids = (a[keep] for a in found)
+    return [(int(batch.stream_offsets[p] + s), int(batch.stream_offsets[p] + e), int(i))
+            for p, s, e, i in zip(packet_ids, starts, ends, pattern_ids)]
+
+
+def test_variable_length_match_split_across_chunks_is_reported_once(tmp_path):
+    path = str(tmp_path / "split.pcap")
+    write_tcp_capture(path, [b"xxGET /aaa", b"aab"])
+    assert scan_stream(path, [rb"GET /a+"]) == [(2, 10, 0)]
+
+
+def test_matches_in_new_bytes_are_kept(tmp_path):
+    path = str(tmp_path / "two.pcap")
+    write_tcp_capture(path, [b"xxGET /aaa", b"aab GET /a x"])
+    assert scan_stream(path, [rb"GET /a+"]) == [(2, 10, 0), (14, 20, 0)]
+
+
+def test_fixed_length_match_straddling_the_boundary_is_kept(tmp_path):
+    path = str(tmp_path / "straddle.pcap")
+    write_tcp_capture(path, [b"xxGET /a", b"dmin yy"])
+    assert scan_stream(path, [rb"GET /admin", rb"GET /a+"]) == [(2, 8, 1), (2, 12, 0)]
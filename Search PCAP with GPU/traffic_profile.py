@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Profile-Driven Traffic Generation with a Ground-Truth Manifest
+
+The synthetic capture scripts draw from an unseeded `random` over a dozen fixed flows,
+so no two benchmark files are alike and nobody knows which matches a scanner should
+have found. This module generates captures from a traffic profile (YAML or JSON): flow
+count and flow size skew, frame size mix, protocol mix, filler bytes and pattern
+injection rates.
+The output only depends on the profile and the seed, and next to every capture it
+writes a manifest of exactly where each injected pattern landed.
+
+Key Features:
+- Byte-identical output for a given profile, seed, size and format, whatever the
+  number of worker processes: chunk k of the capture only depends on (seed, k)
+- Chunks are built in worker processes (pcap_writer.iter_chunks) and stitched in
+  order by the writer, which continues every flow's TCP sequence numbers across
+  chunk boundaries, so reassembling scanners see gap-free streams
+- Injections: per-packet rate per pattern (at most one injection starts in a packet);
+  `split_rate` places that share of TCP injections across the boundary between a
+  packet and the flow's next packet, like a pattern split by segmentation
+- Manifest (CSV, streamed): injection id, pattern id, packet id, frame offset and
+  length of every piece, with its part number, so recall can be checked at scale;
+  offsets count from the start of the frame, as the scanners report them
+- Summary (JSON): profile, seed, format, packet count, per-pattern injection counts
+  and the capture's SHA-256
+- Frame size mixes: fixed, uniform, weighted choice, simple IMIX (7:4:1) or the size
+  histogram of a real capture, read from its packet index (`.pidx` sidecar reused)
+- Flow sizes: uniform, or Zipf-distributed packet counts over up to millions of
+  concurrent flows (a few heavy hitters, a long tail of small flows), to put
+  production-like state pressure on the reassembly and scan engines
+
+Usage:
+    profile = TrafficProfile.load("traffic_profiles/web_mixed.yaml")
+    result = generate_capture(profile, "bench.pcap", 500 * 1024 * 1024, seed=7, workers=4)
+
+    python create_large_synthetic_pcap.py --profile traffic_profiles/web_mixed.yaml --seed 7 --size 500
+    python create_large_synthetic_pcap.py --profile traffic_profiles/imix_zipf.yaml --flows 5000000 --size 2000
+    python create_large_synthetic_pcap.py --profile traffic_profiles/web_mixed.yaml --size-histogram real.pcap
+
+Profile size and flow sections:
+    packet_sizes: {distribution: imix}
+    packet_sizes: {distribution: histogram, capture: captures/real.pcapng}   # relative to the profile
+    flow_sizes: {distribution: zipf, exponent: 1.1}
+"""
+
+import csv
+import hashlib
+import ipaddress
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from packet_headers import IP_PROTO_TCP, IP_PROTO_UDP
+from patterns import pattern_name, unescape
+from pcap_index import load_index
+from pcap_writer import (L4_OFFSET, PacketFields, PcapWriter, RecordBuilder, format_for_output, header_lengths,
+                         iter_chunks, ragged_ranges, shift_tcp_seqs)
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+CHUNK_PACKETS = 32768
+DEFAULT_START_TIME_US = 1_704_067_200_000_000     # 2024-01-01T00:00:00Z
+EPHEMERAL_PORTS = (49152, 65536)
+MAX_FRAME_BYTES = 65535
+MANIFEST_SUFFIX = ".manifest.csv"
+SUMMARY_SUFFIX = ".manifest.json"
+MANIFEST_FIELDS = ("injection", "pattern_id", "packet_id", "offset", "length", "part", "parts")
+PROTOCOLS = {"tcp": IP_PROTO_TCP, "udp": IP_PROTO_UDP}
+FILLERS = ("random", "ascii", "zeros")
+SIZE_KINDS = ("fixed", "uniform", "choice", "imix", "histogram")
+FLOW_KINDS = ("uniform", "zipf")
+IMIX_SIMPLE = ((60, 7), (590, 4), (1514, 1))      # 40/576/1500-byte IP packets in Ethernet frames (no FCS)
+FLOW_STREAM = 0xF10                 # seed stream of the flow table (chunks use their chunk id)
+
+
+def capture_size_histogram(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(frame sizes, packet counts) of a capture, from its packet index"""
+    counts = np.bincount(load_index(path).lengths)
+    values = np.flatnonzero(counts)
+    return values, counts[values]
+
+
+@dataclass
+class SizeDistribution:
+    """Frame sizes in bytes (Ethernet header to end of payload)"""
+    kind: str = "uniform"           # fixed | uniform | choice | imix | histogram
+    low: int = 100
+    high: int = 1500
+    values: List[int] = field(default_factory=list)
+    weights: List[float] = field(default_factory=list)
+    source: str = ""                # histogram: the capture it was measured on
+
+    @classmethod
+    def from_spec(cls, spec, base_dir: str = "") -> "SizeDistribution":
+        """An int (fixed size) or a mapping: {distribution: uniform, min, max},
+        {distribution: fixed, size}, {distribution: choice, values, weights},
+        {distribution: imix} or {distribution: histogram, capture} (relative to base_dir)"""
+        if isinstance(spec, int):
+            return cls("fixed", spec, spec)
+        kind = spec.get("distribution", "uniform")
+        if kind == "fixed":
+            return cls(kind, int(spec["size"]), int(spec["size"]))
+        if kind == "uniform":
+            return cls(kind, int(spec.get("min", 100)), int(spec.get("max", 1500)))
+        if kind == "choice":
+            values = [int(v) for v in spec["values"]]
+            weights = [float(w) for w in spec.get("weights", [1.0] * len(values))]
+            if len(weights) != len(values) or not values:
+                raise ValueError("choice sizes need one weight per value")
+            return cls(kind, min(values), max(values), values, weights)
+        if kind == "imix":
+            values, weights = zip(*IMIX_SIMPLE)
+            return cls(kind, min(values), max(values), list(values), [float(w) for w in weights])
+        if kind == "histogram":
+            source = os.path.join(base_dir, spec["capture"])
+            values, counts = capture_size_histogram(source)
+            if not len(values):
+                raise ValueError(f"{source} has no packets to take sizes from")
+            values = np.minimum(values, MAX_FRAME_BYTES)
+            return cls(kind, int(values.min()), int(values.max()), values.tolist(), counts.astype(float).tolist(),
+                       source)
+        raise ValueError(f"Unknown size distribution {kind!r} (expected one of {', '.join(SIZE_KINDS)})")
+
+    def sample(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        if self.values:
+            p = np.asarray(self.weights, dtype=np.float64)
+            return np.asarray(self.values, dtype=np.int64)[rng.choice(len(self.values), n, p=p / p.sum())]
+        return rng.integers(self.low, self.high + 1, n)
+
+
+@dataclass
+class FlowSizes:
+    """How the packets spread over the flows: uniformly, or Zipf (the flow of rank r gets a share of 1/r^exponent)"""
+    kind: str = "uniform"           # uniform | zipf
+    exponent: float = 1.0
+
+    @classmethod
+    def from_spec(cls, spec) -> "FlowSizes":
+        """"uniform", "zipf" or a mapping {distribution: zipf, exponent}"""
+        if isinstance(spec, str):
+            spec = {"distribution": spec}
+        kind = spec.get("distribution", "uniform")
+        if kind not in FLOW_KINDS:
+            raise ValueError(f"Unknown flow size distribution {kind!r} (expected one of {', '.join(FLOW_KINDS)})")
+        return cls(kind, float(spec.get("exponent", 1.0)))
+
+    def cdf(self, flows: int) -> Optional[np.ndarray]:
+        """Cumulative flow shares for sampling (None: uniform)"""
+        if self.kind == "uniform":
+            return None
+        shares = np.cumsum(np.arange(1, flows + 1, dtype=np.float64) ** -self.exponent)
+        return shares / shares[-1]
+
+    @staticmethod
+    def sample(rng: np.random.Generator, n: int, flows: int, cdf: Optional[np.ndarray]) -> np.ndarray:
+        if cdf is None:
+            return rng.integers(0, flows, n)
+        return np.minimum(np.searchsorted(cdf, rng.random(n), side="right"), flows - 1)
+
+
+@dataclass
+class ProtocolSpec:
+    """One transport protocol of the mix and the server ports its flows use"""
+    name: str
+    weight: float = 1.0
+    ports: List[int] = field(default_factory=lambda: [80])
+
+    @property
+    def protocol(self) -> int:
+        return PROTOCOLS[self.name]
+
+
+@dataclass
+class Injection:
+    """A pattern planted in `rate` of all packets, `split_rate` of them across two TCP segments.
+
+    Splits need the flow's next packet in the same chunk; with very many flows only part of
+    split_rate can be placed (the manifest records what was).
+    """
+    pattern: str                    # patterns.py escape syntax (\\xNN, \\r, \\n)
+    rate: float
+    split_rate: float = 0.0
+
+    @property
+    def data(self) -> bytes:
+        return unescape(self.pattern)
+
+
+@dataclass
+class TrafficProfile:
+    name: str = "default"
+    flows: int = 1000
+    packet_sizes: SizeDistribution = field(default_factory=SizeDistribution)
+    flow_sizes: FlowSizes = field(default_factory=FlowSizes)
+    protocols: List[ProtocolSpec] = field(default_factory=lambda: [ProtocolSpec("tcp", 1.0, [80, 443])])
+    clients: str = "192.168.0.0/16"
+    servers: str = "10.0.0.0/16"
+    filler: str = "random"          # random | ascii | zeros
+    packet_interval_us: int = 10
+    start_time_us: int = DEFAULT_START_TIME_US
+    injections: List[Injection] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Dict, base_dir: str = "") -> "TrafficProfile":
+        """Profile from its mapping; relative capture paths (size histograms) are resolved against base_dir"""
+        profile = cls(
+            name=str(data.get("name", "default")),
+            flows=int(data.get("flows", 1000)),
+            packet_sizes=SizeDistribution.from_spec(data.get("packet_sizes", {}), base_dir),
+            flow_sizes=FlowSizes.from_spec(data.get("flow_sizes", "uniform")),
+            protocols=[ProtocolSpec(str(p["name"]).lower(), float(p.get("weight", 1.0)),
+                                    [int(port) for port in p.get("ports", [80])])
+                       for p in data.get("protocols", [{"name": "tcp", "ports": [80, 443]}])],
+            clients=str(data.get("clients", "192.168.0.0/16")),
+            servers=str(data.get("servers", "10.0.0.0/16")),
+            filler=str(data.get("filler", "random")),
+            packet_interval_us=int(data.get("packet_interval_us", 10)),
+            start_time_us=int(data.get("start_time_us", DEFAULT_START_TIME_US)),
+            injections=[Injection(str(i["pattern"]), float(i["rate"]), float(i.get("split_rate", 0.0)))
+                        for i in data.get("injections", [])])
+        profile.validate()
+        return profile
+
+    @classmethod
+    def load(cls, path: str) -> "TrafficProfile":
+        """Read a .yaml/.yml (needs PyYAML) or .json profile"""
+        with open(path, "r", encoding="utf-8") as f:
+            if path.lower().endswith((".yaml", ".yml")):
+                if not YAML_AVAILABLE:
+                    raise RuntimeError("YAML profiles need PyYAML (pip install pyyaml); JSON profiles work without it")
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        return cls.from_dict(data or {}, os.path.dirname(os.path.abspath(path)))
+
+    def validate(self):
+        if self.flows < 1:
+            raise ValueError("a profile needs at least one flow")
+        for p in self.protocols:
+            if p.name not in PROTOCOLS:
+                raise ValueError(f"Unknown protocol {p.name!r} (expected one of {', '.join(PROTOCOLS)})")
+            if not p.ports:
+                raise ValueError(f"protocol {p.name!r} needs at least one port")
+        if self.filler not in FILLERS:
+            raise ValueError(f"Unknown filler {self.filler!r} (expected one of {', '.join(FILLERS)})")
+        if sum(i.rate for i in self.injections) > 1.0:
+            raise ValueError("injection rates are per packet and must add up to at most 1")
+        if any(not i.data for i in self.injections):
+            raise ValueError("injected patterns must not be empty")
+        if self.flow_sizes.exponent < 0:
+            raise ValueError("the Zipf exponent must not be negative")
+        if self.packet_sizes.high > MAX_FRAME_BYTES:
+            raise ValueError(f"frame sizes are limited to {MAX_FRAME_BYTES} bytes")
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class FlowTable:
+    """Per-flow header fields, drawn once from the seed"""
+    protocols: np.ndarray
+    src_ips: np.ndarray
+    dst_ips: np.ndarray
+    src_ports: np.ndarray
+    dst_ports: np.ndarray
+    isns: np.ndarray                # initial TCP sequence numbers
+
+    @classmethod
+    def generate(cls, profile: TrafficProfile, seed: int) -> "FlowTable":
+        rng = np.random.default_rng([seed, FLOW_STREAM])
+        n = profile.flows
+        weights = np.array([p.weight for p in profile.protocols], dtype=np.float64)
+        mix = rng.choice(len(profile.protocols), n, p=weights / weights.sum())
+        protocols = np.array([p.protocol for p in profile.protocols], dtype=np.int64)[mix]
+        dst_ports = np.zeros(n, dtype=np.int64)
+        for i, spec in enumerate(profile.protocols):
+            members = np.flatnonzero(mix == i)
+            dst_ports[members] = np.asarray(spec.ports, dtype=np.int64)[rng.integers(0, len(spec.ports), len(members))]
+        return cls(protocols=protocols,
+                   src_ips=_hosts(rng, profile.clients, n),
+                   dst_ips=_hosts(rng, profile.servers, n),
+                   src_ports=rng.integers(*EPHEMERAL_PORTS, n),
+                   dst_ports=dst_ports,
+                   isns=rng.integers(0, 1 << 32, n))
+
+
+def _hosts(rng: np.random.Generator, network: str, n: int) -> np.ndarray:
+    """n random host addresses of an IPv4 network (network and broadcast excluded when possible)"""
+    net = ipaddress.IPv4Network(network, strict=False)
+    base, size = int(net.network_address), net.num_addresses
+    if size <= 2:
+        return base + rng.integers(0, size, n)
+    return base + rng.integers(1, size - 1, n)
+
+
+@dataclass
+class TrafficChunk:
+    """One chunk of generated records and what the writer needs to stitch and document it"""
+    records: np.ndarray
+    ends: np.ndarray                # record end offsets
+    flow_ids: np.ndarray            # per packet
+    protocols: np.ndarray
+    payload_lengths: np.ndarray
+    tcp_starts: np.ndarray          # TCP header offsets in `records`, of the TCP packets in order
+    manifest: np.ndarray            # rows of MANIFEST_FIELDS, packet ids local to the chunk
+
+
+_profile_worker = {}
+
+
+def _profile_init(profile: TrafficProfile, seed: int, fmt: str):
+    patterns = [i.data for i in profile.injections]
+    lengths = np.array([len(p) for p in patterns], dtype=np.int64)
+    _profile_worker.update(
+        profile=profile, seed=seed, builder=RecordBuilder(fmt), flows=FlowTable.generate(profile, seed),
+        flow_cdf=profile.flow_sizes.cdf(profile.flows),
+        blob=np.frombuffer(b"".join(patterns), dtype=np.uint8) if patterns else np.zeros(0, dtype=np.uint8),
+        pattern_starts=np.cumsum(lengths) - lengths, pattern_lengths=lengths,
+        rates=np.cumsum([i.rate for i in profile.injections]),
+        split_rates=np.array([i.split_rate for i in profile.injections], dtype=np.float64))
+
+
+def build_traffic_chunk(chunk_id: int) -> TrafficChunk:
+    """Packets chunk_id * CHUNK_PACKETS onwards; TCP sequence numbers start at each flow's ISN"""
+    w = _profile_worker
+    profile, flows = w["profile"], w["flows"]
+    rng = np.random.default_rng([w["seed"], chunk_id])
+    n = CHUNK_PACKETS
+    first_packet = chunk_id * n
+    flow_ids = FlowSizes.sample(rng, n, profile.flows, w["flow_cdf"])
+    protocols = flows.protocols[flow_ids]
+    hdr = header_lengths(protocols)
+    payload_len = np.clip(profile.packet_sizes.sample(rng, n) - hdr, 0, MAX_FRAME_BYTES - hdr)
+
+    # Next packet of the same flow within the chunk (-1: none)
+    order = np.lexsort((np.arange(n), flow_ids))
+    nxt = np.full(n, -1, dtype=np.int64)
+    same = flow_ids[order[1:]] == flow_ids[order[:-1]]
+    nxt[order[:-1][same]] = order[1:][same]
+
+    # Injections: which pattern starts in each packet, and whether it is split
+    pid = np.searchsorted(w["rates"], rng.random(n), side="right") if len(w["rates"]) else np.full(n, 0)
+    has = pid < len(w["rates"])
+    pid = np.where(has, pid, 0)
+    plen = w["pattern_lengths"][pid] if len(w["rates"]) else np.zeros(n, dtype=np.int64)
+    split_draw = rng.random(n)
+    head_draw = rng.random(n)
+    place_draw = rng.random(n)
+    split = has & (protocols == IP_PROTO_TCP) & (nxt >= 0) & (plen >= 2)
+    split &= split_draw < (w["split_rates"][pid] if len(w["rates"]) else 0.0)
+    head = 1 + (head_draw * np.maximum(plen - 1, 1)).astype(np.int64)     # bytes before the boundary
+    head = np.minimum(head, np.maximum(plen - 1, 1))
+    split[split] = payload_len[nxt[split]] >= plen[split] - head[split]       # the rest fits the next packet
+
+    def carried():
+        # Bytes at the start of each packet that continue the previous packet's split pattern
+        lo = np.zeros(n, dtype=np.int64)
+        lo[nxt[split]] = plen[split] - head[split]
+        return lo
+
+    lo = carried()
+    fits = np.where(split, payload_len - lo >= head, payload_len - lo >= plen)
+    has &= fits
+    split &= fits
+    lo = carried()
+
+    # Payload bytes: filler, then the injected pieces
+    payload_starts = np.cumsum(payload_len) - payload_len
+    total = int(payload_len.sum())
+    if profile.filler == "random":
+        payload = rng.integers(0, 256, total, dtype=np.uint8)
+    elif profile.filler == "ascii":
+        payload = rng.integers(32, 127, total, dtype=np.uint8)
+    else:
+        payload = np.zeros(total, dtype=np.uint8)
+    whole = has & ~split
+    pkt_whole = np.flatnonzero(whole)
+    off_whole = lo[pkt_whole] + (place_draw[pkt_whole] * (payload_len[pkt_whole] - lo[pkt_whole]
+                                                          - plen[pkt_whole] + 1)).astype(np.int64)
+    pkt_head = np.flatnonzero(split)
+    pkt_tail = nxt[pkt_head]
+    pieces = (  # (injecting packet, packet, payload offset, pattern offset, length, part, parts)
+        (pkt_whole, pkt_whole, off_whole, np.zeros(len(pkt_whole), dtype=np.int64), plen[pkt_whole], 0, 1),
+        (pkt_head, pkt_head, payload_len[pkt_head] - head[pkt_head], np.zeros(len(pkt_head), dtype=np.int64),
+         head[pkt_head], 0, 2),
+        (pkt_head, pkt_tail, np.zeros(len(pkt_head), dtype=np.int64), head[pkt_head],
+         plen[pkt_head] - head[pkt_head], 1, 2))
+    rows = []
+    for source, packet, offset, pattern_offset, length, part, parts in pieces:
+        if not len(packet):
+            continue
+        p = pid[source]
+        payload[ragged_ranges(payload_starts[packet] + offset, length)] = \
+            w["blob"][ragged_ranges(w["pattern_starts"][p] + pattern_offset, length)]
+        rows.append(np.stack([source, p, packet, hdr[packet] + offset, length,
+                              np.full(len(packet), part), np.full(len(packet), parts)], axis=1))
+    manifest = np.concatenate(rows) if rows else np.zeros((0, len(MANIFEST_FIELDS)), dtype=np.int64)
+    manifest = manifest[np.lexsort((manifest[:, 5], manifest[:, 0]))]
+
+    # Sequence numbers continue each flow inside the chunk; the writer adds earlier chunks' bytes
+    run = np.cumsum(payload_len[order]) - payload_len[order]
+    group_start = np.concatenate([[True], ~same])
+    run -= np.maximum.accumulate(np.where(group_start, run, 0))
+    seqs = np.empty(n, dtype=np.int64)
+    seqs[order] = flows.isns[flow_ids[order]] + run
+
+    packet_ids = first_packet + np.arange(n, dtype=np.int64)
+    fields = PacketFields(protocols=protocols, src_ips=flows.src_ips[flow_ids], dst_ips=flows.dst_ips[flow_ids],
+                          src_ports=flows.src_ports[flow_ids], dst_ports=flows.dst_ports[flow_ids],
+                          timestamps_us=profile.start_time_us + packet_ids * profile.packet_interval_us,
+                          payload_starts=payload_starts, payload_lengths=payload_len, seqs=seqs, ip_ids=packet_ids)
+    builder = w["builder"]
+    records, ends = builder.build(fields, payload)
+    tcp_starts = builder.frame_starts(fields, ends)[protocols == IP_PROTO_TCP] + L4_OFFSET
+    return TrafficChunk(records, ends, flow_ids, protocols, payload_len, tcp_starts, manifest)
+
+
+@dataclass
+class GenerationResult:
+    path: str
+    fmt: str
+    num_packets: int
+    num_bytes: int
+    injections: int
+    split_injections: int
+    sha256: str
+    seconds: float
+    manifest_path: Optional[str] = None
+    summary_path: Optional[str] = None
+
+
+def generate_capture(profile: TrafficProfile, path: str, target_bytes: int, seed: int, workers: int = 1,
+                     fmt: Optional[str] = None, manifest: bool = True,
+                     log: Optional[Callable[[str], None]] = print) -> GenerationResult:
+    """Write a capture of about target_bytes (cut at a packet boundary) and, if asked, its manifest.
+
+    Packet ids in the manifest are record numbers (0-based), as in the scanners' output.
+    """
+    fmt = fmt or format_for_output(path)
+    start = time.time()
+    patterns = [i.data for i in profile.injections]
+    flow_bytes = np.zeros(profile.flows, dtype=np.int64)
+    counts = np.zeros(len(patterns), dtype=np.int64)
+    split_count = 0
+    num_packets = 0
+    digest = hashlib.sha256()
+    manifest_path = path + MANIFEST_SUFFIX if manifest else None
+    manifest_file = open(manifest_path, "w", newline="") if manifest else None
+    chunks = iter_chunks(build_traffic_chunk, workers, _profile_init, (profile, seed, fmt))
+    try:
+        if manifest_file:
+            csv.writer(manifest_file).writerow(MANIFEST_FIELDS)
+        with PcapWriter(path, fmt) as writer:
+            digest.update(writer.header)
+            for chunk_id, chunk in enumerate(chunks):
+                # The last chunk is cut at the first record boundary past the target
+                remaining = target_bytes - writer.bytes_written
+                count = min(len(chunk.ends), int(np.searchsorted(chunk.ends, remaining)) + 1)
+                # Continue every flow's sequence numbers after its bytes in earlier chunks
+                flows = chunk.flow_ids[:count]
+                tcp_flows = flows[chunk.protocols[:count] == IP_PROTO_TCP]
+                shift_tcp_seqs(chunk.records, chunk.tcp_starts[:len(tcp_flows)], flow_bytes[tcp_flows])
+                np.add.at(flow_bytes, flows, chunk.payload_lengths[:count])
+                data = chunk.records[:int(chunk.ends[count - 1])]
+                writer.write(data)
+                digest.update(data)
+
+                rows = chunk.manifest
+                # Drop injections with a piece beyond the cut, then make ids global
+                incomplete = np.unique(rows[rows[:, 2] >= count, 0])
+                rows = rows[~np.isin(rows[:, 0], incomplete)].copy()
+                rows[:, [0, 2]] += chunk_id * CHUNK_PACKETS
+                first = rows[rows[:, 5] == 0]
+                counts += np.bincount(first[:, 1], minlength=len(patterns))
+                split_count += int(np.count_nonzero(first[:, 6] > 1))
+                if manifest_file:
+                    np.savetxt(manifest_file, rows, fmt="%d", delimiter=",")
+                num_packets += count
+                if writer.bytes_written >= target_bytes:
+                    break
+                if log and (chunk_id + 1) % 32 == 0:
+                    log(f"   Written {writer.bytes_written / 1024 / 1024:,.0f} MB "
+                        f"({writer.bytes_written / target_bytes:.1%}) - {num_packets:,} packets")
+            num_bytes = writer.bytes_written
+    finally:
+        chunks.close()
+        if manifest_file:
+            manifest_file.close()
+
+    result = GenerationResult(path, fmt, num_packets, num_bytes, int(counts.sum()), split_count,
+                              digest.hexdigest(), time.time() - start, manifest_path)
+    if manifest:
+        result.summary_path = path + SUMMARY_SUFFIX
+        with open(result.summary_path, "w") as f:
+            json.dump({"capture": os.path.basename(path), "format": fmt, "seed": seed,
+                       "profile": profile.to_dict(), "packets": num_packets, "bytes": num_bytes,
+                       "sha256": result.sha256,
+                       "patterns": [{"pattern_id": i, "pattern": pattern_name(p), "injections": int(c)}
+                                    for i, (p, c) in enumerate(zip(patterns, counts))],
+                       "injections": result.injections, "split_injections": split_count,
+                       "manifest": os.path.basename(manifest_path)}, f, indent=1)
+    return result
+
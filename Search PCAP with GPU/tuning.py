@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Per-Host Search Tuning Profiles
+
+The best search strategy (BMH or PFAC, the large-packet threshold, the tile size) depends
+on the machine, on the packet size distribution and on the pattern set: the fixed
+cutovers in newtest.py are right for one GPU and one kind of capture. This module
+micro-benchmarks the candidate strategies on a sample of the actual capture and pattern
+set, and keeps the winners in a JSON profile per host and backend. Normal runs describe
+their workload with the same few numbers and take the strategy of the closest
+calibrated workload.
+
+Key Features:
+- Workload shape: pattern count, shortest and mean pattern length, mean and 90th
+  percentile scanned-range length (log2 scale, so "close" means within a factor of 2)
+- Candidate grid pruned to distinct behaviour: thresholds above the longest packet and
+  tile sizes without any large packet collapse into one candidate
+- Samples spread evenly across the capture, not just its first packets
+- Backend-agnostic: calibration only needs a factory returning an object with
+  upload()/search()/close-able resources (GPUSearch, CPUSearch)
+- Profiles are keyed by host name and backend (GPU model or CPU worker count)
+
+Usage:
+    profile = TuningProfile.load(backend_id)
+    shape = WorkloadShape.measure(patterns, ranges.lengths)
+    strategy = profile.best(shape) or default_strategy(len(patterns), 16, 2048, 8192)
+
+    python newtest.py capture.pcap -s foo -s bar --calibrate      # fills the profile
+"""
+
+import json
+import os
+import socket
+import time
+from dataclasses import dataclass, asdict, replace
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cpu_search import ALGORITHM_BMH, ALGORITHM_PFAC
+
+PROFILE_VERSION = 1
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pcap_tuning")
+
+NO_LARGE_PATH = 0xFFFFFFFF          # large_threshold that keeps every packet on the small path
+THRESHOLD_CANDIDATES = (512, 1024, 2048, 4096, 8192)
+TILE_CANDIDATES = (4096, 8192, 16384, 32768)
+BMH_CANDIDATE_MAX_PATTERNS = 256    # BMH runs one pass per pattern; beyond this it is never competitive
+MAX_SHAPE_DISTANCE = 1.0            # log2 units: every feature within a factor of 2
+DEFAULT_SAMPLE_MB = 16
+DEFAULT_REPEATS = 3
+
+
+@dataclass
+class Strategy:
+    """How to search: the algorithm and the small/large packet split"""
+    algorithm: str
+    large_threshold: int
+    tile_bytes: int
+
+    def describe(self) -> str:
+        split = "no large path" if self.large_threshold >= NO_LARGE_PATH else \
+            f"large >= {self.large_threshold} B, tiles {self.tile_bytes} B"
+        return f"{self.algorithm} ({split})"
+
+
+@dataclass
+class WorkloadShape:
+    """The workload features the best strategy depends on"""
+    num_patterns: int
+    min_pattern_len: int
+    mean_pattern_len: float
+    mean_range_len: float
+    p90_range_len: float
+
+    @classmethod
+    def measure(cls, patterns: Sequence[bytes], lengths: np.ndarray) -> "WorkloadShape":
+        pattern_lengths = np.array([len(p) for p in patterns], dtype=np.float64)
+        lengths = np.asarray(lengths, dtype=np.float64)
+        return cls(num_patterns=len(patterns),
+                   min_pattern_len=int(pattern_lengths.min()),
+                   mean_pattern_len=float(pattern_lengths.mean()),
+                   mean_range_len=float(lengths.mean()) if len(lengths) else 0.0,
+                   p90_range_len=float(np.percentile(lengths, 90)) if len(lengths) else 0.0)
+
+    def features(self) -> np.ndarray:
+        return np.log2(np.maximum(1.0, [self.num_patterns, self.min_pattern_len, self.mean_pattern_len,
+                                        self.mean_range_len, self.p90_range_len]))
+
+    def distance(self, other: "WorkloadShape") -> float:
+        return float(np.abs(self.features() - other.features()).max())
+
+    def describe(self) -> str:
+        return (f"{self.num_patterns} pattern(s) of {self.min_pattern_len}-{self.mean_pattern_len:.0f} B, "
+                f"ranges mean {self.mean_range_len:.0f} B / p90 {self.p90_range_len:.0f} B")
+
+
+@dataclass
+class TuningEntry:
+    shape: WorkloadShape
+    strategy: Strategy
+    mb_per_s: float
+    measured: float                 # time.time() of the calibration
+
+
+def default_strategy(num_patterns: int, bmh_max_patterns: int, large_threshold: int, tile_bytes: int) -> Strategy:
+    """The fixed cutovers used when no profile covers the workload"""
+    algorithm = ALGORITHM_BMH if num_patterns <= bmh_max_patterns else ALGORITHM_PFAC
+    return Strategy(algorithm, large_threshold, tile_bytes)
+
+
+def host_backend_id(backend: str, detail: str = "") -> str:
+    """Profile key: host name plus backend ("gpu-<model>" or "cpu-<workers>w")"""
+    name = f"{socket.gethostname()}-{backend}" + (f"-{detail}" if detail else "")
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+class TuningProfile:
+    """Calibrated strategies of one host and backend, persisted as JSON"""
+
+    def __init__(self, backend_id: str, profile_dir: str = DEFAULT_PROFILE_DIR,
+                 entries: Optional[List[TuningEntry]] = None):
+        self.backend_id = backend_id
+        self.path = os.path.join(profile_dir, f"{backend_id}.json")
+        self.entries = entries or []
+
+    @classmethod
+    def load(cls, backend_id: str, profile_dir: str = DEFAULT_PROFILE_DIR) -> "TuningProfile":
+        """The stored profile, or an empty one (missing, unreadable or older format)"""
+        profile = cls(backend_id, profile_dir)
+        try:
+            with open(profile.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return profile
+        if data.get("version") != PROFILE_VERSION:
+            return profile
+        for e in data.get("entries", []):
+            profile.entries.append(TuningEntry(WorkloadShape(**e["shape"]), Strategy(**e["strategy"]),
+                                               e["mb_per_s"], e["measured"]))
+        return profile
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": PROFILE_VERSION, "backend": self.backend_id,
+                       "entries": [asdict(e) for e in self.entries]}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def add(self, entry: TuningEntry):
+        """Record a calibration, replacing earlier ones of (nearly) the same workload"""
+        self.entries = [e for e in self.entries if e.shape.distance(entry.shape) > MAX_SHAPE_DISTANCE / 4]
+        self.entries.append(entry)
+
+    def best(self, shape: WorkloadShape) -> Optional[Strategy]:
+        """Strategy of the closest calibrated workload, if one is close enough"""
+        if not self.entries:
+            return None
+        distances = [e.shape.distance(shape) for e in self.entries]
+        i = int(np.argmin(distances))
+        return replace(self.entries[i].strategy) if distances[i] <= MAX_SHAPE_DISTANCE else None
+
+
+def candidate_strategies(num_patterns: int, lengths: np.ndarray, literal: bool = True) -> List[Strategy]:
+    """Distinct strategies worth timing on a sample with these range lengths (PFAC only unless `literal`)"""
+    algorithms = [ALGORITHM_PFAC]
+    if literal and num_patterns <= BMH_CANDIDATE_MAX_PATTERNS:
+        algorithms.insert(0, ALGORITHM_BMH)
+    lengths = np.asarray(lengths)
+    longest = int(lengths.max()) if len(lengths) else 0
+    splits = [(NO_LARGE_PATH, TILE_CANDIDATES[0])]
+    seen = set()
+    for threshold in THRESHOLD_CANDIDATES:
+        if threshold > longest:
+            break
+        large = int(np.count_nonzero(lengths >= threshold))
+        if large in seen:
+            continue                # same packets on the large path as a smaller threshold
+        seen.add(large)
+        splits.extend((threshold, tile) for tile in TILE_CANDIDATES if tile < longest or tile == TILE_CANDIDATES[0])
+    return [Strategy(a, t, tile) for a in algorithms for t, tile in splits]
+
+
+def sample_ranges(ranges, sample_bytes: int):
+    """Evenly spaced runs of consecutive ranges totalling about sample_bytes (ScanRanges in, ScanRanges out)"""
+    total = ranges.total_bytes
+    if total <= sample_bytes:
+        return ranges
+    ends = np.cumsum(ranges.lengths, dtype=np.int64)
+    runs = 16
+    run_bytes = sample_bytes // runs
+    picked = []
+    for start in np.linspace(0, total - run_bytes, runs, dtype=np.int64):
+        first = int(np.searchsorted(ends, start, side="right"))
+        last = max(first + 1, int(np.searchsorted(ends, start + run_bytes, side="right")))
+        picked.append(np.arange(first, min(last, len(ends))))
+    sel = np.unique(np.concatenate(picked))
+    return type(ranges)(packet_ids=ranges.packet_ids[sel], starts=ranges.starts[sel],
+                        lengths=ranges.lengths[sel], range_offsets=ranges.range_offsets[sel])
+
+
+def calibrate(make_backend: Callable[[Strategy], object], batch: Tuple[np.ndarray, np.ndarray, np.ndarray],
+              candidates: List[Strategy], repeats: int = DEFAULT_REPEATS,
+              log: Optional[Callable[[str], None]] = print) -> List[Tuple[Strategy, float]]:
+    """Time every candidate on one packed batch; returns (strategy, MB/s), fastest first.
+
+    Each candidate gets a fresh backend, one untimed warm-up search (kernel compilation,
+    worker start-up) and the best of `repeats` timed searches. All candidates must find
+    the same number of matches; a mismatch means a backend bug, not a slow strategy.
+    """
+    bigbuf, offsets, lengths = batch
+    mb = len(bigbuf) / (1024 * 1024)
+    results = []
+    expected = None
+    for strategy in candidates:
+        backend = make_backend(strategy)
+        try:
+            backend.upload(bigbuf, offsets, lengths)
+            count = backend.search()
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                backend.search()
+                best = min(best, time.perf_counter() - start)
+        finally:
+            close = getattr(backend, "close", None)
+            if close is not None:
+                close()
+        if expected is None:
+            expected = count
+        elif count != expected:
+            raise RuntimeError(f"{strategy.describe()} found {count} matches, expected {expected}")
+        results.append((strategy, mb / best if best > 0 else float("inf")))
+        if log:
+            log(f"  {strategy.describe():<40} {results[-1][1]:10.1f} MB/s")
+    results.sort(key=lambda r: -r[1])
+    return results